@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'biblioteca.settings')
+# Bajo ASGI las lecturas de la API usan las vistas asíncronas (gestion/vistas_async.py)
+os.environ.setdefault('API_ASINCRONA', 'True')
 
 application = get_asgi_application()
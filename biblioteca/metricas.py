@@ -0,0 +1,334 @@
+import atexit
+import logging
+import os
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from rest_framework import status
+from rest_framework.decorators import api_view, permission_classes, renderer_classes
+from rest_framework.permissions import BasePermission
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.response import Response
+
+logger = logging.getLogger(__name__)
+
+# Métricas por vista para producción: peticiones, latencia, consultas y tiempo de base
+# de datos, y tamaño de las respuestas, agrupadas por nombre de ruta, método y código
+# - MetricasMiddleware (biblioteca/middleware.py) mide cada petición y suma en memoria
+#   del proceso; un hilo de cada proceso vuelca lo acumulado cada INTERVALO segundos en
+#   un archivo SQLite local compartido por todos los workers del servidor
+# - El archivo guarda totales que solo crecen: cada volcado suma sus incrementos con un
+#   UPSERT, así que no importa cuántos procesos haya ni que se reinicien
+# - /metricas/ lee el archivo y lo devuelve en formato de texto de Prometheus (solo
+#   administradores; Prometheus puede autenticarse con usuario y contraseña o con JWT)
+
+# Límites del histograma de latencia, en segundos (los de prometheus_client)
+LIMITES = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Columnas de cada fila acumulada: totales y luego una cubeta por límite más +Inf
+SERIES = ('peticiones', 'segundos', 'consultas', 'db_segundos', 'bytes') + tuple(
+    f'le={limite}' for limite in LIMITES
+) + ('le=+Inf',)
+_BYTES = SERIES.index('bytes')
+_PRIMERA_CUBETA = SERIES.index(f'le={LIMITES[0]}')
+
+# Métodos con etiqueta propia; cualquier otro cuenta como OTRO para no multiplicar series
+METODOS = ('GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS')
+
+# Consultas y segundos de base de datos de la petición en curso
+# Es una variable de contexto, así que sigue a la petición también por los hilos de
+# sync_to_async de las vistas asíncronas
+_medicion = ContextVar('medicion_metricas', default=None)
+
+
+def _medir_consulta(execute, sql, params, many, context):
+    medicion = _medicion.get()
+    if medicion is None:
+        return execute(sql, params, many, context)
+    inicio = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        medicion[0] += 1
+        medicion[1] += time.perf_counter() - inicio
+
+
+def _instalar_en(connection, **kwargs):
+    # Al principio de la lista: connection.execute_wrapper() quita siempre el último
+    if _medir_consulta not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _medir_consulta)
+
+
+def instalar():
+    # Cada hilo tiene sus propias conexiones; las que se abran después se instrumentan
+    # al conectarse y las que ya existen en este hilo se instrumentan ahora
+    connection_created.connect(_instalar_en, dispatch_uid='metricas_consultas')
+    for connection in connections.all(initialized_only=True):
+        _instalar_en(connection)
+
+
+def iniciar():
+    # Empieza a contar las consultas de la petición; devuelve lo que necesita terminar()
+    medicion = [0, 0.0]
+    return medicion, _medicion.set(medicion), time.perf_counter()
+
+
+def terminar(estado):
+    medicion, token, inicio = estado
+    _medicion.reset(token)
+    return time.perf_counter() - inicio, medicion[0], medicion[1]
+
+
+def clave(request, response):
+    match = request.resolver_match
+    metodo = request.method if request.method in METODOS else 'OTRO'
+    return (match.view_name if match else 'sin_ruta', metodo, str(response.status_code))
+
+
+class Registro:
+    # Acumulado en memoria de un proceso, pendiente de volcar en el archivo compartido
+
+    def __init__(self, archivo, intervalo):
+        self.archivo = str(archivo)
+        self.intervalo = intervalo
+        self._pendiente = {}
+        self._lock = threading.Lock()
+        self._pid = None
+        atexit.register(self.volcar)
+
+    def _asegurar_hilo(self):
+        # Los hilos no sobreviven al fork de los workers: cada proceso arranca el suyo
+        # con su primera petición
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            threading.Thread(target=self._volcar_periodicamente, name='metricas', daemon=True).start()
+
+    def _volcar_periodicamente(self):
+        while True:
+            time.sleep(self.intervalo)
+            self.volcar()
+
+    def _fila(self, clave):
+        fila = self._pendiente.get(clave)
+        if fila is None:
+            fila = self._pendiente[clave] = [0] * len(SERIES)
+        return fila
+
+    def sumar(self, clave, segundos, consultas, db_segundos, tamano=0):
+        self._asegurar_hilo()
+        cubeta = _PRIMERA_CUBETA + bisect_left(LIMITES, segundos)
+        with self._lock:
+            fila = self._fila(clave)
+            fila[0] += 1
+            fila[1] += segundos
+            fila[2] += consultas
+            fila[3] += db_segundos
+            fila[_BYTES] += tamano
+            fila[cubeta] += 1
+
+    def sumar_flujo(self, clave, tamano, consultas, db_segundos):
+        with self._lock:
+            fila = self._fila(clave)
+            fila[2] += consultas
+            fila[3] += db_segundos
+            fila[_BYTES] += tamano
+
+    def _conectar(self):
+        # El directorio del archivo (var/ por defecto) se crea con el primer volcado
+        try:
+            os.makedirs(os.path.dirname(self.archivo) or '.', exist_ok=True)
+        except OSError as error:
+            raise sqlite3.OperationalError(str(error)) from error
+        conexion = sqlite3.connect(self.archivo, timeout=1)
+        conexion.execute('PRAGMA journal_mode=WAL')
+        conexion.execute('PRAGMA synchronous=NORMAL')
+        conexion.execute(
+            'CREATE TABLE IF NOT EXISTS metricas ('
+            'vista TEXT, metodo TEXT, codigo TEXT, serie TEXT, valor REAL, '
+            'PRIMARY KEY (vista, metodo, codigo, serie)) WITHOUT ROWID'
+        )
+        return conexion
+
+    def volcar(self):
+        with self._lock:
+            pendiente, self._pendiente = self._pendiente, {}
+        if not pendiente:
+            return
+        valores = [
+            (*clave, serie, valor)
+            for clave, fila in pendiente.items()
+            for serie, valor in zip(SERIES, fila) if valor
+        ]
+        try:
+            conexion = self._conectar()
+            try:
+                with conexion:
+                    conexion.executemany(
+                        'INSERT INTO metricas (vista, metodo, codigo, serie, valor) VALUES (?, ?, ?, ?, ?) '
+                        'ON CONFLICT (vista, metodo, codigo, serie) DO UPDATE SET valor = valor + excluded.valor',
+                        valores,
+                    )
+            finally:
+                conexion.close()
+        except sqlite3.Error as error:
+            # Las métricas nunca rompen una petición: lo pendiente se reintenta en el próximo volcado
+            logger.warning('No se pudieron guardar las métricas en %s: %s', self.archivo, error)
+            with self._lock:
+                for clave, fila in pendiente.items():
+                    actual = self._fila(clave)
+                    for i, valor in enumerate(fila):
+                        actual[i] += valor
+
+    def leer(self):
+        # Totales de todos los procesos, incluido lo pendiente de este
+        # None si el archivo no se puede leer: /metricas/ responde 503 y Prometheus marca
+        # la lectura como fallida en lugar de ver todas las series a cero
+        self.volcar()
+        try:
+            conexion = self._conectar()
+            try:
+                filas = conexion.execute('SELECT vista, metodo, codigo, serie, valor FROM metricas').fetchall()
+            finally:
+                conexion.close()
+        except sqlite3.Error as error:
+            logger.warning('No se pudieron leer las métricas de %s: %s', self.archivo, error)
+            return None
+        totales = {}
+        for vista, metodo, codigo, serie, valor in filas:
+            totales.setdefault((vista, metodo, codigo), dict.fromkeys(SERIES, 0))[serie] = valor
+        return totales
+
+
+registro = Registro(settings.METRICAS['ARCHIVO'], settings.METRICAS['INTERVALO'])
+
+
+def contar_flujo(response, clave):
+    # Las respuestas en streaming (exportaciones) generan el contenido y hacen sus
+    # consultas después de salir del middleware: cada trozo se genera con la medición
+    # activa, y bytes, consultas y tiempo de base de datos se suman al terminar el envío
+    medicion = [0, 0.0]
+
+    def flujo(contenido):
+        iterador, tamano = iter(contenido), 0
+        try:
+            while True:
+                token = _medicion.set(medicion)
+                try:
+                    parte = next(iterador)
+                except StopIteration:
+                    return
+                finally:
+                    _medicion.reset(token)
+                tamano += len(parte)
+                yield parte
+        finally:
+            registro.sumar_flujo(clave, tamano, *medicion)
+
+    async def aflujo(contenido):
+        iterador, tamano = aiter(contenido), 0
+        try:
+            while True:
+                token = _medicion.set(medicion)
+                try:
+                    parte = await anext(iterador)
+                except StopAsyncIteration:
+                    return
+                finally:
+                    _medicion.reset(token)
+                tamano += len(parte)
+                yield parte
+        finally:
+            registro.sumar_flujo(clave, tamano, *medicion)
+
+    envolver = aflujo if response.is_async else flujo
+    response.streaming_content = envolver(response.streaming_content)
+
+
+def tamano_respuesta(response, clave):
+    # Devuelve el tamaño ya conocido; si la respuesta es un flujo sin Content-Length
+    # devuelve 0 y sus bytes se suman al terminar de enviarse (ver contar_flujo)
+    if not response.streaming:
+        return len(response.content)
+    if response.has_header('Content-Length'):
+        return int(response['Content-Length'])
+    contar_flujo(response, clave)
+    return 0
+
+
+def _numero(valor):
+    return str(int(valor)) if float(valor).is_integer() else repr(float(valor))
+
+
+def _etiquetas(vista, metodo, codigo, **extra):
+    pares = {'vista': vista, 'metodo': metodo, 'codigo': codigo, **extra}
+    texto = ','.join(
+        f'{nombre}="' + valor.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+        for nombre, valor in pares.items()
+    )
+    return '{' + texto + '}'
+
+
+# (nombre, ayuda, serie)
+_CONTADORES = (
+    ('biblioteca_peticiones_total', 'Peticiones atendidas', 'peticiones'),
+    ('biblioteca_consultas_db_total', 'Consultas a la base de datos', 'consultas'),
+    ('biblioteca_db_segundos_total', 'Tiempo esperando a la base de datos', 'db_segundos'),
+    ('biblioteca_respuesta_bytes_total', 'Bytes de las respuestas', 'bytes'),
+)
+_HISTOGRAMA = 'biblioteca_peticion_segundos'
+
+
+def exponer(totales):
+    # Formato de texto de Prometheus 0.0.4
+    claves = sorted(totales)
+    lineas = []
+    for nombre, ayuda, serie in _CONTADORES:
+        lineas += [f'# HELP {nombre} {ayuda} por vista', f'# TYPE {nombre} counter']
+        lineas += [f'{nombre}{_etiquetas(*clave)} {_numero(totales[clave][serie])}' for clave in claves]
+    lineas += [f'# HELP {_HISTOGRAMA} Latencia de las peticiones por vista', f'# TYPE {_HISTOGRAMA} histogram']
+    for clave in claves:
+        fila = totales[clave]
+        acumulado = 0
+        for limite in LIMITES + ('+Inf',):
+            acumulado += fila[f'le={limite}']
+            lineas.append(f'{_HISTOGRAMA}_bucket{_etiquetas(*clave, le=str(limite))} {_numero(acumulado)}')
+        lineas.append(f'{_HISTOGRAMA}_sum{_etiquetas(*clave)} {_numero(fila["segundos"])}')
+        lineas.append(f'{_HISTOGRAMA}_count{_etiquetas(*clave)} {_numero(fila["peticiones"])}')
+    return '\n'.join(lineas) + '\n'
+
+
+class EsAdministrador(BasePermission):
+    message = 'Solo los administradores pueden ver las métricas'
+
+    def has_permission(self, request, view):
+        usuario = request.user
+        return bool(usuario and usuario.is_authenticated and (usuario.is_staff or getattr(usuario, 'is_admin', False)))
+
+
+class TextoPrometheus(BaseRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # Los errores (403) llegan como {'detail': ...} y se devuelven como texto
+        if isinstance(data, dict):
+            data = data.get('detail', '')
+        return str(data).encode(self.charset)
+
+
+# GET /metricas/ (texto de Prometheus, o JSON con los errores si se pide ?format=json)
+@api_view(['GET'])
+@permission_classes([EsAdministrador])
+@renderer_classes([TextoPrometheus, JSONRenderer])
+def metricas(request):
+    totales = registro.leer()
+    if totales is None:
+        return Response('Métricas no disponibles', status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    return Response(exponer(totales))
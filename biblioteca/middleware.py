@@ -0,0 +1,69 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+
+# WhiteNoise solo ofrece middleware síncrono: bajo ASGI Django tendría que pasar cada
+# petición a un hilo y volver, también las de la API que nunca son archivos estáticos
+# Esta versión acepta ambos modos y solo usa un hilo para servir el archivo estático
+class WhiteNoiseAsincrono(WhiteNoiseMiddleware):
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, *args, **kwargs):
+        super().__init__(get_response, *args, **kwargs)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = await sync_to_async(self.find_file)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return await sync_to_async(self.serve)(static_file, request)
+        return await self.get_response(request)
+
+
+# Mide cada petición para las métricas por vista (biblioteca/metricas.py)
+# Funciona en ambos modos sin saltos de hilo: solo suma en memoria, y el volcado al
+# archivo compartido lo hace un hilo aparte
+class MetricasMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICAS['ACTIVAS']:
+            raise MiddlewareNotUsed
+        from . import metricas
+        metricas.instalar()
+        self.metricas = metricas
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        estado = self.metricas.iniciar()
+        response = self.get_response(request)
+        self._registrar(request, response, estado)
+        return response
+
+    async def __acall__(self, request):
+        estado = self.metricas.iniciar()
+        response = await self.get_response(request)
+        self._registrar(request, response, estado)
+        return response
+
+    def _registrar(self, request, response, estado):
+        segundos, consultas, db_segundos = self.metricas.terminar(estado)
+        clave = self.metricas.clave(request, response)
+        tamano = self.metricas.tamano_respuesta(response, clave)
+        self.metricas.registro.sumar(clave, segundos, consultas, db_segundos, tamano)
@@ -12,7 +12,10 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 import os
+import sys
+import tempfile
 import dj_database_url
+from django.core.exceptions import ImproperlyConfigured
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -64,7 +67,8 @@ AUTH_USER_MODEL = 'gestion.Usuario'
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'biblioteca.middleware.WhiteNoiseAsincrono',  # WhiteNoise válido también bajo ASGI
+    'biblioteca.middleware.MetricasMiddleware',  # Métricas por vista (no mide los estáticos)
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -96,21 +100,65 @@ WSGI_APPLICATION = 'biblioteca.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# SQLITE_RUTA permite apuntar a otro archivo (lo usa el benchmark concurrencia_http)
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': os.environ.get('SQLITE_RUTA', BASE_DIR / 'db.sqlite3'),
     }
 }
 
+# Perfiles de base de datos (DB_PERFIL)
+# - basico: SQLite sin ajustes y PostgreSQL con conexiones persistentes de 600 s
+# - concurrente: SQLite en modo WAL, con espera ante bloqueos y transacciones IMMEDIATE,
+#   para varios workers de gunicorn en una sola máquina; PostgreSQL con un pool de
+#   conexiones por proceso que comprueba cada conexión antes de entregarla
+# transaction_mode de SQLite y el pool de PostgreSQL existen desde Django 5.1
+DB_PERFIL = os.environ.get('DB_PERFIL', 'basico')
+if DB_PERFIL not in ('basico', 'concurrente'):
+    raise ImproperlyConfigured(f"DB_PERFIL debe ser 'basico' o 'concurrente', no '{DB_PERFIL}'")
+
+SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL').upper()
+if SQLITE_SYNCHRONOUS not in ('OFF', 'NORMAL', 'FULL', 'EXTRA'):
+    raise ImproperlyConfigured(f"SQLITE_SYNCHRONOUS no admite '{SQLITE_SYNCHRONOUS}'")
+
+if DB_PERFIL == 'concurrente':
+    DATABASES['default']['OPTIONS'] = {
+        # Segundos que una conexión espera a que se libere el bloqueo de escritura
+        'timeout': float(os.environ.get('SQLITE_ESPERA_S', '20')),
+        # Las transacciones piden el bloqueo de escritura al empezar: así esperan con el
+        # timeout en lugar de fallar con "database is locked" al pasar de leer a escribir
+        'transaction_mode': 'IMMEDIATE',
+        'init_command': ';'.join([
+            'PRAGMA journal_mode=WAL',
+            f'PRAGMA synchronous={SQLITE_SYNCHRONOUS}',
+            f"PRAGMA mmap_size={int(os.environ.get('SQLITE_MMAP_MB', '256')) * 1024 * 1024}",
+            # En negativo, cache_size va en KiB por conexión
+            f"PRAGMA cache_size=-{int(os.environ.get('SQLITE_CACHE_MB', '64')) * 1024}",
+            'PRAGMA temp_store=MEMORY',
+        ]),
+    }
+
 # Configuración de base de datos para Railway
 DATABASE_URL = os.environ.get('DATABASE_URL')
 if DATABASE_URL:
     DATABASES['default'] = dj_database_url.config(
         default=DATABASE_URL,
-        conn_max_age=600,
+        # El pool de Django no admite conexiones persistentes: el pool ya las reutiliza
+        conn_max_age=600 if DB_PERFIL == 'basico' else 0,
+        # Con el pool, Django comprueba cada conexión antes de entregarla y descarta las
+        # que el servidor cerró mientras estaban libres
+        conn_health_checks=DB_PERFIL == 'concurrente',
         ssl_require=True
     )
+    if DB_PERFIL == 'concurrente':
+        # Pool nativo de Django (requiere psycopg 3 con psycopg_pool)
+        DATABASES['default'].setdefault('OPTIONS', {})['pool'] = {
+            'min_size': int(os.environ.get('DB_POOL_MIN', '2')),
+            'max_size': int(os.environ.get('DB_POOL_MAX', '10')),
+            # Segundos que una petición espera una conexión libre antes de fallar
+            'timeout': float(os.environ.get('DB_POOL_ESPERA_S', '10')),
+        }
 
 
 # Password validation
@@ -126,7 +174,11 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 # Hacer que el nombre de usuario no sea sensible a mayúsculas/minúsculas
+# BackendConCache autentica como ModelBackend y puede leer el usuario de la sesión de la
+# caché (SESION_EN_CACHE). ModelBackend sigue en la lista para que las sesiones iniciadas
+# con él (guardan su ruta) sigan valiendo; los inicios de sesión nuevos usan el primero
 AUTHENTICATION_BACKENDS = [
+    'gestion.autenticacion.BackendConCache',
     'django.contrib.auth.backends.ModelBackend',
 ]
 
@@ -156,6 +208,14 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # Configuración para  la api rest framenwork
+# Autorización JWT sin leer el usuario en cada petición (gestion/autenticacion.py)
+# Con ACTIVO los permisos de la API se responden con los claims del token de acceso;
+# la versión de tokens de cada usuario (revocación) se guarda CACHE_SEGUNDOS en la caché
+JWT_SIN_ESTADO = {
+    'ACTIVO': os.environ.get('JWT_SIN_ESTADO', 'False') == 'True',
+    'CACHE_SEGUNDOS': int(os.environ.get('JWT_VERSION_CACHE_SEGUNDOS', '30')),
+}
+
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticatedOrReadOnly',
@@ -163,16 +223,131 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.SessionAuthentication',
         'rest_framework.authentication.BasicAuthentication',
-        'rest_framework_simplejwt.authentication.JWTAuthentication',  # para autenticación JWT
+        # para autenticación JWT
+        'gestion.autenticacion.JWTSinEstado' if JWT_SIN_ESTADO['ACTIVO']
+        else 'rest_framework_simplejwt.authentication.JWTAuthentication',
+    ],
+    # JSON con orjson y la misma salida que el renderizador de DRF (gestion/renderizadores.py)
+    'DEFAULT_RENDERER_CLASSES': [
+        'gestion.renderizadores.JSONRapidoRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
     ],
 }
 
+# Paginación por cursor de los listados de la API (gestion/paginacion.py)
+# CONTEO controla cómo se calcula el total del mensaje: 'exacto', 'estimado' o 'no'
+# Cada petición puede cambiarlo con ?conteo= y el tamaño de página con ?tamano=
+PAGINACION_API = {
+    'TAMANO_PAGINA': int(os.environ.get('API_TAMANO_PAGINA', '50')),
+    'TAMANO_MAXIMO': int(os.environ.get('API_TAMANO_MAXIMO', '500')),
+    'CONTEO': os.environ.get('API_CONTEO', 'exacto'),
+    'LIMITE_ESTIMADO': 1000,  # Máximo de filas que se cuentan en modo estimado con filtros
+}
+
+# Vistas asíncronas para las lecturas de la API (gestion/vistas_async.py)
+# biblioteca/asgi.py la activa por defecto; con WSGI no aportan nada y quedan apagadas
+API_ASINCRONA = os.environ.get('API_ASINCRONA', 'False') == 'True'
+
+# Préstamos y devoluciones por lotes (/api/usuarios/{id}/prestar_libros/ y similares)
+# MAX_FALLOS es el número de elementos que pueden fallar antes de cancelar todo el lote
+# (vacío = sin límite, 0 = todo o nada). Cada petición puede indicar su propio max_fallos
+LOTES_PRESTAMO = {
+    'TAMANO_MAXIMO': int(os.environ.get('LOTE_TAMANO_MAXIMO', '100')),
+    'MAX_FALLOS': int(os.environ['LOTE_MAX_FALLOS']) if os.environ.get('LOTE_MAX_FALLOS') else None,
+}
+
+# Caché de Django, usada por las páginas públicas del catálogo (web/cache_catalogo.py)
+# Por defecto memoria local de cada proceso; con
+# CACHE_BACKEND=django.core.cache.backends.filebased.FileBasedCache y CACHE_LOCATION
+# apuntando a un directorio, los procesos del mismo servidor comparten las entradas
+# Las claves del catálogo llevan la versión guardada en la base de datos, así que
+# ninguna de las dos opciones sirve datos desactualizados
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'biblioteca'),
+        'OPTIONS': {'MAX_ENTRIES': int(os.environ.get('CACHE_MAX_ENTRADAS', '1000'))},
+    }
+}
+
+# Sesiones y usuario de la web en caché (gestion/autenticacion.py)
+# Con ACTIVA, las sesiones se leen de la caché antes que de la base de datos (cached_db)
+# y el usuario de la sesión se guarda en la caché USUARIO_SEGUNDOS. Con varios workers
+# conviene una caché compartida: con la de cada proceso, cerrar sesión en un worker no
+# la cierra en la caché de los demás (manage.py check --deploy lo avisa)
+SESION_EN_CACHE = {
+    'ACTIVA': os.environ.get('SESION_EN_CACHE', 'False') == 'True',
+    'USUARIO_SEGUNDOS': int(os.environ.get('SESION_USUARIO_CACHE_SEGUNDOS', '60')),
+}
+if SESION_EN_CACHE['ACTIVA']:
+    SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
+# Autocompletado de títulos y autores (gestion/autocompletado.py)
+# El índice se guarda en DIRECTORIO para que los workers lo carguen al arrancar. Debe
+# ser un directorio del proyecto o de su usuario, nunca uno compartido como /tmp; cada
+# worker aplica los cambios del catálogo como mucho cada REFRESCO_S segundos y, con más
+# de MAX_CAMBIOS pendientes, reconstruye el índice
+AUTOCOMPLETADO = {
+    'DIRECTORIO': os.environ.get('AUTOCOMPLETADO_DIRECTORIO', os.path.join(BASE_DIR, 'var')),
+    'REFRESCO_S': float(os.environ.get('AUTOCOMPLETADO_REFRESCO_S', '2')),
+    'MARGEN_S': float(os.environ.get('AUTOCOMPLETADO_MARGEN_S', '10')),
+    'MAX_CAMBIOS': int(os.environ.get('AUTOCOMPLETADO_MAX_CAMBIOS', '20000')),
+}
+
+# Facetas del listado de libros de la API (gestion/facetas.py)
+# MAX_AUTORES: autores con más libros que se devuelven en la faceta de autor
+FACETAS = {
+    'MAX_AUTORES': int(os.environ.get('FACETAS_MAX_AUTORES', '20')),
+}
+
+# Analítica de préstamos (gestion/analitica.py)
+# Un préstamo sin devolver cuenta como vencido pasados PLAZO_DIAS días; MAX_DIAS limita
+# la serie diaria que se puede pedir de una vez
+ANALITICA = {
+    'PLAZO_DIAS': int(os.environ.get('PRESTAMO_PLAZO_DIAS', '14')),
+    'MAX_DIAS': int(os.environ.get('ANALITICA_MAX_DIAS', '366')),
+}
+
+# Archivado de préstamos devueltos (gestion/archivado.py)
+# Los devueltos hace más de DIAS días pasan de Prestamo a PrestamoArchivado en lotes de
+# LOTE filas, cada uno en su propia transacción corta. El historial con los archivados
+# (?completo=1) se muestra en páginas de PAGINA_HISTORIAL préstamos
+ARCHIVADO = {
+    'DIAS': int(os.environ.get('ARCHIVADO_DIAS', '365')),
+    'LOTE': int(os.environ.get('ARCHIVADO_LOTE', '1000')),
+    'PAGINA_HISTORIAL': int(os.environ.get('ARCHIVADO_PAGINA_HISTORIAL', '100')),
+}
+
+# Reservas de libros sin ejemplares (gestion/reservas.py)
+# Un ejemplar devuelto queda apartado PLAZO_HORAS horas para el primero de la cola; el
+# barrido (manage.py barrer_reservas) pasa los vencidos al siguiente en lotes de LOTE
+RESERVAS = {
+    'PLAZO_HORAS': int(os.environ.get('RESERVAS_PLAZO_HORAS', '48')),
+    'LOTE': int(os.environ.get('RESERVAS_LOTE', '500')),
+}
+
+# Métricas por vista expuestas en /metricas/ para administradores (biblioteca/metricas.py)
+# ARCHIVO es un SQLite local donde todos los workers del servidor suman sus métricas;
+# cada proceso vuelca lo acumulado cada INTERVALO segundos. Va en var/ junto al proyecto
+# (no en el directorio temporal, que otros usuarios de la máquina pueden escribir);
+# manage.py test usa un archivo temporal propio para no mezclarse con el del servidor
+METRICAS = {
+    'ACTIVAS': os.environ.get('METRICAS_ACTIVAS', 'True') == 'True',
+    'ARCHIVO': os.environ.get('METRICAS_ARCHIVO', os.path.join(BASE_DIR, 'var', 'metricas.sqlite3')),
+    'INTERVALO': float(os.environ.get('METRICAS_INTERVALO', '1')),
+}
+if sys.argv[1:2] == ['test']:
+    METRICAS['ARCHIVO'] = os.path.join(tempfile.mkdtemp(prefix='biblioteca_pruebas_'), 'metricas.sqlite3')
+
 # Añade estas líneas adicionales
 from datetime import timedelta
 
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
+    # Tokens con rol, permisos y versión del usuario, y refresco que comprueba la versión
+    'TOKEN_OBTAIN_SERIALIZER': 'gestion.autenticacion.TokenConRolSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'gestion.autenticacion.TokenRefrescoSerializer',
 }
 
 # CSRF configuration para Railway y desarrollo local
@@ -17,6 +17,7 @@ Including another URLconf
 
 from django.contrib import admin
 from django.urls import path, include
+from biblioteca.metricas import metricas
 from rest_framework_simplejwt.views import (
     TokenObtainPairView,
     TokenRefreshView,
@@ -28,4 +29,5 @@ urlpatterns = [
     path('', include('web.urls')),
     path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+    path('metricas/', metricas, name='metricas'),  # Métricas por vista para Prometheus
 ]
\ No newline at end of file
@@ -0,0 +1,339 @@
+import datetime
+import random
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, DateField, DurationField, ExpressionWrapper, F, Sum
+from django.db.models.functions import TruncDate, TruncMonth
+from django.utils import timezone
+
+from . import contadores
+from .archivado import TABLAS
+from .models import Prestamo, ResumenDiarioPrestamos, ResumenMensualLibro
+
+# Analítica de préstamos con resúmenes que se mantienen al prestar y devolver
+# - ResumenDiarioPrestamos: préstamos, devoluciones y duración total de los devueltos por
+#   día, repartidos en fragmentos como ContadorPrestamos para que los préstamos
+#   simultáneos no compitan por la misma fila
+# - ResumenMensualLibro: préstamos de cada libro por mes, para los más prestados
+# - gestion/prestamos.py llama a al_prestar y al_devolver dentro de la transacción de cada
+#   operación, así que los resúmenes nunca quedan a medias; al borrar un libro o un
+#   usuario se descuentan sus préstamos, igual que en los contadores
+# - Los vencidos (préstamos abiertos de hace más de PLAZO_DIAS) se cuentan en el momento
+#   con el índice parcial de préstamos activos por fecha: dependen de la hora de la
+#   consulta y solo recorren los préstamos abiertos, no el historial
+# Las consultas de la analítica leen como mucho MAX_DIAS × FRAGMENTOS filas diarias y
+# los primeros libros de un mes en orden del índice: no dependen del tamaño del historial
+# El comando reconstruir_analitica los recalcula desde el historial por meses; el
+# historial son Prestamo y PrestamoArchivado (archivar un préstamo no cambia los resúmenes)
+
+FRAGMENTOS = 8
+
+DURACION = ExpressionWrapper(F('fecha_devolucion') - F('fecha_prestamo'), output_field=DurationField())
+
+
+def _mes(momento):
+    # Primer día del mes local del momento
+    return timezone.localdate(momento).replace(day=1)
+
+
+def _sumar_dia(dia, prestamos=0, devoluciones=0, duracion_s=0):
+    # Sumo en un fragmento al azar del día; si aún no existe lo creo
+    if not (prestamos or devoluciones or duracion_s):
+        return
+    fragmento = random.randrange(FRAGMENTOS)
+    actualizados = ResumenDiarioPrestamos.objects.filter(dia=dia, fragmento=fragmento).update(
+        prestamos=F('prestamos') + prestamos,
+        devoluciones=F('devoluciones') + devoluciones,
+        duracion_total_s=F('duracion_total_s') + int(duracion_s),
+    )
+    if not actualizados:
+        ResumenDiarioPrestamos.objects.get_or_create(dia=dia, fragmento=fragmento)
+        _sumar_dia(dia, prestamos, devoluciones, duracion_s)
+
+
+def _sumar_libros(mes, cantidades):
+    # cantidades: {libro_id: n}; n puede ser negativo al descontar
+    cantidades = {libro_id: n for libro_id, n in cantidades.items() if n}
+    if not cantidades:
+        return
+    if len(cantidades) == 1:
+        # Préstamo individual: un UPDATE, salvo el primer préstamo del libro en el mes
+        [(libro_id, n)] = cantidades.items()
+        if ResumenMensualLibro.objects.filter(mes=mes, libro_id=libro_id).update(prestamos=F('prestamos') + n):
+            return
+    filas = dict(
+        ResumenMensualLibro.objects.filter(mes=mes, libro_id__in=cantidades).values_list('libro_id', 'pk')
+    )
+    faltan = [libro_id for libro_id in cantidades if libro_id not in filas]
+    if faltan:
+        # Otro préstamo simultáneo puede crear la misma fila: la que ya existe se respeta
+        ResumenMensualLibro.objects.bulk_create(
+            [ResumenMensualLibro(mes=mes, libro_id=libro_id) for libro_id in faltan],
+            ignore_conflicts=True,
+        )
+        filas.update(
+            ResumenMensualLibro.objects.filter(mes=mes, libro_id__in=faltan).values_list('libro_id', 'pk')
+        )
+    contadores.actualizar_en_bloque(
+        ResumenMensualLibro,
+        {filas[libro_id]: n for libro_id, n in cantidades.items()},
+        lambda n: {'prestamos': F('prestamos') + n},
+    )
+
+
+def al_prestar(libros, momento):
+    # libros: {libro_id: préstamos} de una operación, todos con fecha `momento`
+    # Las filas del resumen vuelven indexadas por el id numérico: las claves también
+    libros = {int(libro_id): n for libro_id, n in libros.items()}
+    _sumar_dia(timezone.localdate(momento), prestamos=sum(libros.values()))
+    _sumar_libros(_mes(momento), libros)
+
+
+def al_devolver(fechas_prestamo, momento):
+    # fechas_prestamo: fecha de préstamo de cada préstamo cerrado en `momento`
+    if not fechas_prestamo:
+        return
+    _sumar_dia(
+        timezone.localdate(momento),
+        devoluciones=len(fechas_prestamo),
+        duracion_s=sum((momento - fecha).total_seconds() for fecha in fechas_prestamo),
+    )
+
+
+def descontar_historial(libro_id=None, usuario_id=None):
+    # Antes de borrar un libro o un usuario (sus préstamos se borran en cascada) resto sus
+    # préstamos de los resúmenes; las filas mensuales del libro se borran con él
+    filtro = {'libro_id': libro_id} if libro_id is not None else {'usuario_id': usuario_id}
+    por_mes = defaultdict(Counter)
+    for tabla in TABLAS:
+        prestamos = tabla.objects.filter(**filtro)
+        for fila in prestamos.annotate(d=TruncDate('fecha_prestamo')).values('d').annotate(n=Count('id')).order_by():
+            _sumar_dia(fila['d'], prestamos=-fila['n'])
+        devueltos = (
+            prestamos.filter(devuelto=True).annotate(d=TruncDate('fecha_devolucion'))
+            .values('d').annotate(n=Count('id'), duracion=Sum(DURACION)).order_by()
+        )
+        for fila in devueltos:
+            _sumar_dia(fila['d'], devoluciones=-fila['n'], duracion_s=-fila['duracion'].total_seconds())
+        if usuario_id is not None:
+            meses = prestamos.annotate(m=TruncMonth('fecha_prestamo', output_field=DateField()))
+            for fila in meses.values('m', 'libro_id').annotate(n=Count('id')).order_by():
+                por_mes[fila['m']][fila['libro_id']] -= fila['n']
+    for mes, cantidades in por_mes.items():
+        _sumar_libros(mes, cantidades)
+
+
+# Reconstrucción desde el historial
+
+def _meses(desde, hasta):
+    # Límites [inicio, fin) de cada mes local entre dos momentos
+    mes = _mes(desde)
+    while True:
+        inicio = timezone.make_aware(datetime.datetime(mes.year, mes.month, 1))
+        if inicio > hasta:
+            return
+        siguiente = (mes + datetime.timedelta(days=32)).replace(day=1)
+        yield mes, inicio, timezone.make_aware(datetime.datetime(siguiente.year, siguiente.month, 1))
+        mes = siguiente
+
+
+def _calcular_mes(inicio, fin, dias):
+    # Tres consultas agrupadas por tabla sobre los préstamos del mes, que salen del índice
+    # por fecha. Suma en `dias` los préstamos y las devoluciones por día (una devolución
+    # cae en el día en que se devolvió, quizá de otro mes) y devuelve {libro_id: préstamos}
+    libros = Counter()
+    for tabla in TABLAS:
+        prestamos = tabla.objects.filter(fecha_prestamo__gte=inicio, fecha_prestamo__lt=fin)
+        for fila in prestamos.annotate(d=TruncDate('fecha_prestamo')).values('d').annotate(n=Count('id')).order_by():
+            dias[fila['d']][0] += fila['n']
+        devueltos = (
+            prestamos.filter(devuelto=True).annotate(d=TruncDate('fecha_devolucion'))
+            .values('d').annotate(n=Count('id'), duracion=Sum(DURACION)).order_by()
+        )
+        for fila in devueltos:
+            dias[fila['d']][1] += fila['n']
+            dias[fila['d']][2] += int(fila['duracion'].total_seconds())
+        libros.update(dict(prestamos.values('libro_id').annotate(n=Count('id')).order_by().values_list('libro_id', 'n')))
+    return dict(libros)
+
+
+def _recorrer_meses(al_mes):
+    # Primera y última fecha de préstamo entre las dos tablas
+    fechas = []
+    for tabla in TABLAS:
+        ordenadas = tabla.objects.order_by('fecha_prestamo').values_list('fecha_prestamo', flat=True)
+        fechas += [fecha for fecha in (ordenadas.first(), ordenadas.last()) if fecha is not None]
+    dias = defaultdict(lambda: [0, 0, 0])
+    if fechas:
+        for mes, inicio, fin in _meses(min(fechas), max(fechas)):
+            al_mes(mes, _calcular_mes(inicio, fin, dias))
+    return dias
+
+
+def reconstruir(tamano_lote=5000, al_progresar=None):
+    # Recalcula los resúmenes mes a mes: cada mes de libros se escribe en su transacción
+    # y los días al final, así que la memoria no depende del tamaño del historial
+    # Los préstamos que lleguen mientras tanto pueden quedar contados dos veces o ninguna
+    # en el día en curso: conviene ejecutarlo sin tráfico o repetir verificar() después
+    al_progresar = al_progresar or (lambda mes, libros: None)
+    meses = []
+
+    def escribir_mes(mes, libros):
+        meses.append(mes)
+        with transaction.atomic():
+            ResumenMensualLibro.objects.filter(mes=mes).delete()
+            ResumenMensualLibro.objects.bulk_create(
+                [ResumenMensualLibro(mes=mes, libro_id=libro_id, prestamos=n) for libro_id, n in libros.items()],
+                batch_size=tamano_lote,
+            )
+        al_progresar(mes, len(libros))
+
+    dias = _recorrer_meses(escribir_mes)
+    with transaction.atomic():
+        ResumenMensualLibro.objects.exclude(mes__in=meses).delete()
+        ResumenDiarioPrestamos.objects.all().delete()
+        ResumenDiarioPrestamos.objects.bulk_create([
+            ResumenDiarioPrestamos(dia=dia, prestamos=p, devoluciones=d, duracion_total_s=s)
+            for dia, (p, d, s) in sorted(dias.items())
+        ], batch_size=tamano_lote)
+    return {'dias': len(dias), 'meses': len(meses)}
+
+
+def _desviado(calculado, guardado):
+    # (préstamos, devoluciones, duración) de un día. Cada devolución guarda su duración en
+    # segundos enteros, así que se admite un segundo de diferencia por devolución
+    return calculado[:2] != guardado[:2] or abs(calculado[2] - guardado[2]) > max(1, calculado[1])
+
+
+def verificar():
+    # Compara los resúmenes con el historial sin escribir nada
+    # Devuelve {'dias': n, 'libros_mes': n} con los días y las filas (mes, libro) desviados
+    libros_desviados = Counter()
+
+    def comparar_mes(mes, libros):
+        guardados = dict(ResumenMensualLibro.objects.filter(mes=mes).exclude(prestamos=0).values_list('libro_id', 'prestamos'))
+        libros_desviados[mes] = sum(1 for libro_id in libros.keys() | guardados.keys()
+                                    if libros.get(libro_id, 0) != guardados.get(libro_id, 0))
+
+    dias = _recorrer_meses(comparar_mes)
+    guardados = {
+        fila['dia']: [fila['p'], fila['d'], fila['s']]
+        for fila in ResumenDiarioPrestamos.objects.values('dia').annotate(
+            p=Sum('prestamos'), d=Sum('devoluciones'), s=Sum('duracion_total_s'),
+        ).order_by()
+    }
+    ceros = [0, 0, 0]
+    dias_desviados = sum(
+        1 for dia in dias.keys() | guardados.keys()
+        if _desviado(dias.get(dia, ceros), guardados.get(dia, ceros))
+    )
+    return {'dias': dias_desviados, 'libros_mes': sum(libros_desviados.values())}
+
+
+# Lecturas para la página y la API
+
+def leer_parametros(parametros):
+    # ?dias= (1 a MAX_DIAS), ?mes=AAAA-MM y ?limite= (1 a 50); devuelvo (opciones, errores)
+    opciones, errores = {'dias': 30, 'mes': None, 'limite': 10}, {}
+    maximos = {'dias': settings.ANALITICA['MAX_DIAS'], 'limite': 50}
+    for nombre, maximo in maximos.items():
+        valor = parametros.get(nombre, '').strip()
+        if valor:
+            if not valor.isdigit() or not 1 <= int(valor) <= maximo:
+                errores[nombre] = [f'Debe ser un número entre 1 y {maximo}']
+            else:
+                opciones[nombre] = int(valor)
+    valor = parametros.get('mes', '').strip()
+    if valor:
+        try:
+            opciones['mes'] = datetime.datetime.strptime(valor, '%Y-%m').date()
+        except ValueError:
+            errores['mes'] = ['Usa el formato AAAA-MM']
+    return opciones, errores
+
+
+def sin_resumenes():
+    # Hay historial pero ningún resumen: falta ejecutar reconstruir_analitica (por ejemplo
+    # justo después de la migración que creó las tablas)
+    return not ResumenDiarioPrestamos.objects.exists() and any(tabla.objects.exists() for tabla in TABLAS)
+
+
+def _media_dias(duracion_s, devoluciones):
+    return round(duracion_s / devoluciones / 86400, 2) if devoluciones else None
+
+
+def serie_diaria(dias, hoy=None):
+    # Préstamos, devoluciones y duración media de los últimos `dias` días, incluidos los
+    # días sin movimiento
+    hoy = hoy or timezone.localdate()
+    desde = hoy - datetime.timedelta(days=dias - 1)
+    filas = {
+        fila['dia']: fila
+        for fila in ResumenDiarioPrestamos.objects.filter(dia__gte=desde, dia__lte=hoy)
+        .values('dia').annotate(p=Sum('prestamos'), d=Sum('devoluciones'), s=Sum('duracion_total_s')).order_by()
+    }
+    serie = []
+    for desplazamiento in range(dias):
+        dia = desde + datetime.timedelta(days=desplazamiento)
+        fila = filas.get(dia, {'p': 0, 'd': 0, 's': 0})
+        serie.append({
+            'dia': dia, 'prestamos': fila['p'], 'devoluciones': fila['d'],
+            'duracion_media_dias': _media_dias(fila['s'], fila['d']),
+            'duracion_total_s': fila['s'],
+        })
+    return serie
+
+
+def libros_mas_prestados(mes, limite=10):
+    return [
+        {'id': fila['libro_id'], 'titulo': fila['libro__titulo'], 'autor': fila['libro__autor'], 'prestamos': fila['prestamos']}
+        for fila in ResumenMensualLibro.objects.filter(mes=mes, prestamos__gt=0)
+        .order_by('-prestamos')
+        .values('libro_id', 'libro__titulo', 'libro__autor', 'prestamos')[:limite]
+    ]
+
+
+def vencidos(limite=10, ahora=None):
+    ahora = ahora or timezone.now()
+    plazo = settings.ANALITICA['PLAZO_DIAS']
+    abiertos = Prestamo.objects.filter(devuelto=False, fecha_prestamo__lt=ahora - datetime.timedelta(days=plazo))
+    return {
+        'plazo_dias': plazo,
+        'total': abiertos.count(),
+        'mas_antiguos': [
+            {
+                'id': fila['pk'], 'libro_id': fila['libro_id'], 'titulo': fila['libro__titulo'],
+                'usuario': fila['usuario__username'], 'fecha_prestamo': fila['fecha_prestamo'],
+                'dias': (ahora - fila['fecha_prestamo']).days,
+            }
+            for fila in abiertos.order_by('fecha_prestamo')
+            .values('pk', 'libro_id', 'libro__titulo', 'usuario__username', 'fecha_prestamo')[:limite]
+        ],
+    }
+
+
+def resumen(dias=30, mes=None, limite=10):
+    # Todo lo que muestran la página de analítica y GET /api/analitica/
+    serie = serie_diaria(dias)
+    mes = mes or _mes(timezone.now())
+    prestamos = sum(dia['prestamos'] for dia in serie)
+    devoluciones = sum(dia['devoluciones'] for dia in serie)
+    duracion_s = sum(dia['duracion_total_s'] for dia in serie)
+    globales = contadores.estadisticas_globales()
+    return {
+        'desde': serie[0]['dia'],
+        'hasta': serie[-1]['dia'],
+        'totales': {
+            'prestamos': prestamos,
+            'devoluciones': devoluciones,
+            'duracion_media_dias': _media_dias(duracion_s, devoluciones),
+            'activos': globales['activos'],
+            'historicos': globales['totales'],
+        },
+        'por_dia': serie,
+        'mes': mes,
+        'libros_mas_prestados': libros_mas_prestados(mes, limite),
+        'vencidos': vencidos(limite),
+    }
@@ -1,4 +1,4 @@
-from django.apps import AppConfig
+from django.apps import AppConfig, apps as global_apps
 from django.db.models.signals import post_migrate
 
 
@@ -9,6 +9,8 @@ class GestionConfig(AppConfig):
     def ready(self):
         # Importar aquí para evitar importación circular
         from django.contrib.auth import get_user_model
+        from . import signals  # noqa: F401 (registra los receptores del índice de búsqueda)
+        from . import checks  # noqa: F401 (registra las comprobaciones de manage.py check)
         
         # Registrar la señal para crear el superusuario después de las migraciones
         post_migrate.connect(self.crear_superusuario, sender=self)
@@ -18,7 +20,8 @@ class GestionConfig(AppConfig):
         Crea un superusuario predeterminado si no existe.
         Este usuario tendrá los privilegios máximos en el sistema.
         """
-        Usuario = kwargs.get('apps').get_model('gestion', 'Usuario')
+        # manage.py flush (y los TransactionTestCase) emiten la señal sin `apps`
+        Usuario = (kwargs.get('apps') or global_apps).get_model('gestion', 'Usuario')
         
         # Verifica si ya existe un superusuario
         if not Usuario.objects.filter(username='SuperAdmin').exists():
@@ -0,0 +1,116 @@
+import datetime
+import heapq
+import itertools
+import operator
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Prestamo, PrestamoArchivado
+
+# Archivado de préstamos devueltos (manage.py archivar_prestamos)
+# - Prestamo solo guarda los préstamos activos y los devueltos en los últimos
+#   ARCHIVADO['DIAS'] días; los más antiguos pasan a PrestamoArchivado con su mismo id
+# - Se mueven en lotes recorridos por id (WHERE id > x LIMIT n): cada lote copia y borra
+#   sus filas en una transacción corta, así que los bloqueos duran lo que un lote y se
+#   puede interrumpir en cualquier momento sin perder ni duplicar préstamos
+# - Un préstamo devuelto no vuelve a cambiar, así que moverlo no afecta a los contadores
+#   ni a los resúmenes de la analítica; los que recorren el historial leen las dos tablas
+# - Las consultas de préstamos activos (prestar, devolver, libros prestados) solo tocan
+#   Prestamo; las páginas de historial unen las dos tablas cuando se pide con ?completo=1,
+#   de página en página (pagina_historial), sin cargar el archivo entero
+
+CAMPOS = ('pk', 'libro_id', 'usuario_id', 'fecha_prestamo', 'devuelto', 'fecha_devolucion')
+
+TABLAS = (Prestamo, PrestamoArchivado)
+
+
+def limite_archivado(dias=None, ahora=None):
+    # Se archivan los devueltos antes de este momento
+    dias = settings.ARCHIVADO['DIAS'] if dias is None else dias
+    return (ahora or timezone.now()) - datetime.timedelta(days=dias)
+
+
+def archivar_lote(limite, desde_id=0, tamano_lote=None):
+    # Mueve hasta tamano_lote préstamos devueltos antes de `limite` con id > desde_id
+    # Devuelve (movidos, último id recorrido); (0, None) cuando ya no queda nada
+    tamano_lote = tamano_lote or settings.ARCHIVADO['LOTE']
+    with transaction.atomic():
+        # select_for_update: en PostgreSQL un borrado simultáneo del libro o del usuario
+        # espera al lote en lugar de dejar una fila archivada huérfana
+        filas = list(
+            Prestamo.objects.filter(pk__gt=desde_id, devuelto=True, fecha_devolucion__lt=limite)
+            .select_for_update().order_by('pk').values_list(*CAMPOS)[:tamano_lote]
+        )
+        if not filas:
+            return 0, None
+        # ignore_conflicts: si un lote anterior ya copió la fila, la copia existente vale
+        PrestamoArchivado.objects.bulk_create(
+            [PrestamoArchivado(**dict(zip(('id', *CAMPOS[1:]), fila))) for fila in filas],
+            ignore_conflicts=True,
+        )
+        Prestamo.objects.filter(pk__in=[fila[0] for fila in filas], devuelto=True).delete()
+    return len(filas), filas[-1][0]
+
+
+def archivar(dias=None, tamano_lote=None, desde_id=0, pausa=0, max_lotes=None, al_progresar=None):
+    # Archiva lote a lote hasta que no quede nada que mover (o hasta max_lotes)
+    # `pausa` segundos entre lotes deja pasar al resto de escrituras; para retomar una
+    # ejecución interrumpida basta con pasar el último id recorrido como desde_id
+    # Devuelve {'lotes', 'movidos', 'ultimo_id', 'max_lote_ms'}
+    limite = limite_archivado(dias)
+    al_progresar = al_progresar or (lambda lote, movidos, ultimo_id, segundos: None)
+    resultado = {'lotes': 0, 'movidos': 0, 'ultimo_id': desde_id, 'max_lote_ms': 0.0}
+    while max_lotes is None or resultado['lotes'] < max_lotes:
+        inicio = time.perf_counter()
+        movidos, ultimo_id = archivar_lote(limite, resultado['ultimo_id'], tamano_lote)
+        segundos = time.perf_counter() - inicio
+        if ultimo_id is None:
+            break
+        resultado['lotes'] += 1
+        resultado['movidos'] += movidos
+        resultado['ultimo_id'] = ultimo_id
+        resultado['max_lote_ms'] = max(resultado['max_lote_ms'], round(segundos * 1000, 2))
+        al_progresar(resultado['lotes'], movidos, ultimo_id, segundos)
+        if pausa:
+            time.sleep(pausa)
+    return resultado
+
+
+def pendientes(dias=None):
+    # Préstamos que el próximo archivado movería
+    return Prestamo.objects.filter(devuelto=True, fecha_devolucion__lt=limite_archivado(dias)).count()
+
+
+def cursor(prestamo):
+    # Posición de un préstamo en el historial, para pedir la página que le sigue
+    return f'{prestamo.fecha_prestamo.isoformat()}_{prestamo.pk}'
+
+
+def leer_cursor(texto):
+    # (fecha_prestamo, id) de un cursor; ValueError si no es válido
+    fecha, _, pk = texto.rpartition('_')
+    fecha = datetime.datetime.fromisoformat(fecha)
+    if timezone.is_naive(fecha) and settings.USE_TZ:
+        raise ValueError(texto)
+    return fecha, int(pk)
+
+
+def pagina_historial(consultas, tamano, antes=None):
+    # Una página del historial de varias tablas (una consulta por tabla, con los mismos
+    # atributos), de más reciente a más antiguo. Keyset sobre (fecha_prestamo, id): cada
+    # tabla lee como mucho tamano + 1 filas posteriores al cursor `antes` por su índice
+    # de fecha, y las dos páginas se mezclan. Devuelve (filas, cursor de la siguiente)
+    if antes is not None:
+        fecha, pk = antes
+        posteriores = Q(fecha_prestamo__lt=fecha) | Q(fecha_prestamo=fecha, pk__lt=pk)
+        consultas = [consulta.filter(posteriores) for consulta in consultas]
+    paginas = [consulta.order_by('-fecha_prestamo', '-pk')[:tamano + 1] for consulta in consultas]
+    filas = list(itertools.islice(
+        heapq.merge(*paginas, key=operator.attrgetter('fecha_prestamo', 'pk'), reverse=True), tamano + 1,
+    ))
+    siguiente = cursor(filas[tamano - 1]) if len(filas) > tamano else None
+    return filas[:tamano], siguiente
@@ -0,0 +1,150 @@
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.utils.functional import cached_property
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+
+from .models import Usuario
+
+# Autorización JWT sin consultar el usuario en cada petición
+# - Los tokens llevan el rol y los permisos del usuario (rol, is_staff, is_superuser) y
+#   su versión de tokens (Usuario.version_token); el token de acceso que se obtiene al
+#   refrescar copia los del token de refresco
+# - Con JWT_SIN_ESTADO['ACTIVO'] la API autentica con JWTSinEstado: request.user es un
+#   UsuarioToken construido con el token, y los permisos se responden sin leer la fila
+# - Revocación: la versión del usuario cambia al cambiar su rol, sus permisos, su estado
+#   o su contraseña, o al borrarlo (gestion/signals.py). Cada petición compara la del
+#   token con la vigente, que se guarda en la caché CACHE_SEGUNDOS; con la caché en
+#   memoria de cada proceso, otro worker puede aceptar un token revocado durante ese
+#   tiempo como mucho
+# Sin el modo activo, la API sigue con JWTAuthentication y la versión solo se comprueba
+# al refrescar, así que un token de refresco revocado no genera tokens nuevos
+
+CLAIM_VERSION = 'ver'
+# Versión de un usuario que ya no existe: ningún token la lleva
+_SIN_USUARIO = -1
+
+
+def _clave(usuario_id):
+    return f'jwt-version-{usuario_id}'
+
+
+def version_vigente(usuario_id):
+    clave = _clave(usuario_id)
+    version = cache.get(clave)
+    if version is None:
+        version = Usuario.objects.filter(pk=usuario_id).values_list('version_token', flat=True).first()
+        if version is None:
+            version = _SIN_USUARIO
+        cache.set(clave, version, settings.JWT_SIN_ESTADO['CACHE_SEGUNDOS'])
+    return version
+
+
+def olvidar_version(usuario_id):
+    # Después del commit: antes, otra petición podría volver a guardar la versión anterior
+    transaction.on_commit(lambda: cache.delete(_clave(usuario_id)))
+
+
+def revocar_tokens(usuario_id):
+    # Invalida todos los tokens emitidos hasta ahora para el usuario
+    Usuario.objects.filter(pk=usuario_id).update(version_token=F('version_token') + 1)
+    olvidar_version(usuario_id)
+    olvidar_usuario(usuario_id)
+
+
+def comprobar_version(token):
+    usuario_id = token.get(api_settings.USER_ID_CLAIM)
+    if usuario_id is None or token.get(CLAIM_VERSION) != version_vigente(usuario_id):
+        raise InvalidToken('El token ha sido revocado')
+
+
+def tokens_para(usuario):
+    # Token de refresco con los claims de autorización; .access_token da el de acceso
+    return TokenConRolSerializer.get_token(usuario)
+
+
+class TokenConRolSerializer(TokenObtainPairSerializer):
+    # POST /api/token/ (SIMPLE_JWT['TOKEN_OBTAIN_SERIALIZER'])
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        token['username'] = user.username
+        token['rol'] = user.rol
+        token['is_staff'] = user.is_staff
+        token['is_superuser'] = user.is_superuser
+        token[CLAIM_VERSION] = user.version_token
+        return token
+
+
+class TokenRefrescoSerializer(TokenRefreshSerializer):
+    # POST /api/token/refresh/ (SIMPLE_JWT['TOKEN_REFRESH_SERIALIZER'])
+    def validate(self, attrs):
+        comprobar_version(self.token_class(attrs['refresh']))
+        return super().validate(attrs)
+
+
+class UsuarioToken(TokenUser):
+    # Lo que las vistas y los permisos leen de request.user, sacado del token
+    # (username, is_staff e is_superuser ya los resuelve TokenUser)
+
+    @cached_property
+    def id(self):
+        # simplejwt guarda el id como texto; como número se compara igual que Usuario.pk
+        return int(self.token[api_settings.USER_ID_CLAIM])
+
+    @cached_property
+    def rol(self):
+        return self.token.get('rol', '')
+
+    @property
+    def is_admin(self):
+        return self.rol == 'admin'
+
+
+class JWTSinEstado(JWTAuthentication):
+    def get_user(self, validated_token):
+        if api_settings.USER_ID_CLAIM not in validated_token:
+            raise InvalidToken('El token no identifica a ningún usuario')
+        comprobar_version(validated_token)
+        return UsuarioToken(validated_token)
+
+
+# Usuario de las sesiones web leído de la caché (SESION_EN_CACHE)
+# - AuthenticationMiddleware pide el usuario de la sesión al backend con el que inició
+#   sesión; BackendConCache lo guarda en la caché USUARIO_SEGUNDOS y las páginas ya no
+#   leen la fila de Usuario en cada petición
+# - La sesión sigue comprobando el hash de la contraseña contra el usuario en caché, así
+#   que cambiar la contraseña cierra las demás sesiones en cuanto se olvida la entrada
+# - Cualquier guardado o borrado del usuario la olvida (gestion/signals.py); con la
+#   caché en memoria de cada proceso, otro worker puede servir el usuario anterior
+#   durante USUARIO_SEGUNDOS como mucho
+
+
+def _clave_usuario(usuario_id):
+    return f'sesion-usuario-{usuario_id}'
+
+
+def olvidar_usuario(usuario_id):
+    # Después del commit, por lo mismo que olvidar_version
+    transaction.on_commit(lambda: cache.delete(_clave_usuario(usuario_id)))
+
+
+class BackendConCache(ModelBackend):
+    # Autentica igual que ModelBackend; solo cambia cómo se recupera el usuario de la sesión
+    def get_user(self, user_id):
+        if not settings.SESION_EN_CACHE['ACTIVA']:
+            return super().get_user(user_id)
+        clave = _clave_usuario(user_id)
+        usuario = cache.get(clave)
+        if usuario is None:
+            usuario = super().get_user(user_id)
+            # Los usuarios inactivos o borrados no se guardan: se vuelven a leer
+            if usuario is not None:
+                cache.set(clave, usuario, settings.SESION_EN_CACHE['USUARIO_SEGUNDOS'])
+        return usuario
@@ -0,0 +1,585 @@
+import hashlib
+import heapq
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from .busqueda import tokenizar
+from .models import Libro, LibroEliminado
+
+# Autocompletado de títulos y autores con un índice de prefijos en memoria
+# - Cada título y cada autor distinto genera una entrada por palabra (menos las palabras
+#   vacías): "Cien años de soledad" aparece al escribir "cien", "años" o "soledad"
+# - Las claves normalizadas de todos los textos van en un único bloque de bytes y las
+#   entradas son posiciones dentro de él, ordenadas: un prefijo es un rango de entradas
+#   que se encuentra con dos búsquedas binarias
+# - Un árbol de segmentos guarda la entrada más prestada de cada tramo, así que las N
+#   sugerencias más populares del rango salen sin recorrerlo entero
+# - El índice se guarda en un archivo binario propio (solo bytes y arrays, nada que se
+#   ejecute al leerlo) que los workers cargan al arrancar; los cambios
+#   posteriores (libros con `actualizado` reciente y LibroEliminado) se aplican encima
+#   en cada proceso, como mucho cada REFRESCO_S segundos. Con más de MAX_CAMBIOS
+#   cambios pendientes se reconstruye el archivo
+# La popularidad es la de prestamos_totales al construir el índice: los préstamos no
+# reordenan las sugerencias hasta la siguiente reconstrucción
+
+FORMATO = 2
+MAGIA = b'BIBAUTOC'
+# Cabecera del archivo: magia, formato, orden de bytes (0 little, 1 big) y longitudes de
+# la identidad de la base de datos y de la marca; cada bloque después lleva su tipo de
+# array, el tamaño de elemento y cuántos bytes ocupa
+CABECERA = struct.Struct('<8sIBHH')
+BLOQUE = struct.Struct('<cBQ')
+# Atributos que se guardan de cada Campo y del Indice, en este orden
+BLOQUES_CAMPO = ('claves', 'inicio_clave', 'textos', 'inicio_texto', 'pesos', 'entradas', 'item_de_entrada', 'arbol')
+BLOQUES_INDICE = ('libro_ids', 'autor_de', 'libros_autor')
+# Bytes de cada entrada que cuentan al ordenar; las consultas más largas se recortan
+LONGITUD_PREFIJO = 32
+PALABRAS_VACIAS = frozenset(
+    palabra.encode('latin-1')
+    for palabra in ('a', 'al', 'de', 'del', 'el', 'en', 'la', 'las', 'lo', 'los', 'o', 'un', 'una', 'y')
+)
+# Entradas que se examinan como mucho por consulta (repetidas o cambiadas incluidas)
+MAX_CANDIDATOS = 200
+# Libros que se comparan al cargar el archivo para detectar que es de otra base de datos
+MUESTRAS = 32
+
+
+def clave(texto):
+    # Texto normalizado de gestion.busqueda; solo contiene [0-9a-zñ ] y cabe en latin-1
+    return ' '.join(tokenizar(texto))
+
+
+def _prefijo(texto):
+    # Un separador al final cierra la palabra: "cien " ya no sugiere "cienfuegos"
+    prefijo = clave(texto)
+    if prefijo and texto[-1:].isspace():
+        prefijo += ' '
+    return prefijo.encode('latin-1')[:LONGITUD_PREFIJO]
+
+
+def _inicios(clave_bytes):
+    # Posición de cada palabra indexada dentro de la clave; la primera siempre cuenta
+    inicios, posicion = [], 0
+    for palabra in clave_bytes.split(b' '):
+        if not posicion or palabra not in PALABRAS_VACIAS:
+            inicios.append(posicion)
+        posicion += len(palabra) + 1
+    return inicios
+
+
+def _ordenar(claves):
+    # Entradas (palabra en adelante, identificador) de unas pocas claves, para los cambios
+    # que se aplican encima del índice; se buscan igual que las del índice
+    return sorted(
+        (clave_bytes[inicio:inicio + LONGITUD_PREFIJO], identificador)
+        for identificador, clave_bytes in claves
+        for inicio in _inicios(clave_bytes)
+    )
+
+
+def _coincidencias(entradas, prefijo):
+    # Identificadores distintos con alguna entrada que empieza por el prefijo
+    encontrados = set()
+    for posicion in range(bisect_left(entradas, (prefijo,)), len(entradas)):
+        entrada, identificador = entradas[posicion]
+        if not entrada.startswith(prefijo):
+            break
+        encontrados.add(identificador)
+    return encontrados
+
+
+class Campo:
+    # Los textos de un tipo de sugerencia (títulos o autores) y sus entradas ordenadas
+    # Un item es un texto; todo se guarda en arrays y bloques de bytes, sin un objeto
+    # de Python por texto
+
+    def __init__(self):
+        self.claves = bytearray()
+        self.inicio_clave = array('I', [0])
+        self.textos = bytearray()
+        self.inicio_texto = array('I', [0])
+        self.pesos = array('I')
+
+    def agregar(self, clave_texto, texto, peso):
+        self.claves += clave_texto.encode('latin-1') + b'\n'
+        self.inicio_clave.append(len(self.claves))
+        self.textos += texto.encode()
+        self.inicio_texto.append(len(self.textos))
+        self.pesos.append(max(0, peso))
+
+    def terminar(self):
+        self.claves = bytes(self.claves)
+        self.textos = bytes(self.textos)
+        self._ordenar_entradas()
+        self._construir_arbol()
+
+    def __len__(self):
+        return len(self.pesos)
+
+    def clave(self, item):
+        return self.claves[self.inicio_clave[item]:self.inicio_clave[item + 1] - 1]
+
+    def texto(self, item):
+        return self.textos[self.inicio_texto[item]:self.inicio_texto[item + 1]].decode()
+
+    def _ordenar_entradas(self):
+        # Reparto las entradas por sus dos primeros bytes y ordeno cada cubeta por
+        # separado: las claves de comparación nunca están todas en memoria a la vez
+        cubetas = defaultdict(lambda: (array('I'), array('I')))
+        for item in range(len(self)):
+            inicio = self.inicio_clave[item]
+            clave_item = self.clave(item)
+            if not clave_item:
+                continue
+            for desplazamiento in _inicios(clave_item):
+                posiciones, items = cubetas[self.claves[inicio + desplazamiento:inicio + desplazamiento + 2]]
+                posiciones.append(inicio + desplazamiento)
+                items.append(item)
+        self.entradas = array('I')
+        self.item_de_entrada = array('I')
+        for cabeza in sorted(cubetas):
+            posiciones, items = cubetas.pop(cabeza)
+            orden = sorted(
+                range(len(posiciones)),
+                key=lambda i: self.claves[posiciones[i]:posiciones[i] + LONGITUD_PREFIJO],
+            )
+            self.entradas.extend(posiciones[i] for i in orden)
+            self.item_de_entrada.extend(items[i] for i in orden)
+
+    def _peso_entrada(self, entrada):
+        return self.pesos[self.item_de_entrada[entrada]]
+
+    def _mejor(self, a, b):
+        # La entrada más popular; a igualdad, la primera en orden alfabético
+        if a < 0:
+            return b
+        peso_a, peso_b = self._peso_entrada(a), self._peso_entrada(b)
+        return a if peso_a > peso_b or (peso_a == peso_b and a < b) else b
+
+    def _construir_arbol(self):
+        # Árbol de segmentos iterativo: las hojas (m..2m) son las entradas y cada nodo
+        # guarda la mejor entrada de sus dos hijos
+        m = len(self.entradas)
+        self.arbol = array('I', bytes(4 * 2 * m))
+        for entrada in range(m):
+            self.arbol[m + entrada] = entrada
+        for nodo in range(m - 1, 0, -1):
+            self.arbol[nodo] = self._mejor(self.arbol[2 * nodo], self.arbol[2 * nodo + 1])
+
+    def _maximo(self, izquierda, derecha):
+        # Mejor entrada de [izquierda, derecha) en O(log m)
+        m = len(self.entradas)
+        mejor = -1
+        izquierda += m
+        derecha += m
+        while izquierda < derecha:
+            if izquierda & 1:
+                mejor = self._mejor(mejor, self.arbol[izquierda])
+                izquierda += 1
+            if derecha & 1:
+                derecha -= 1
+                mejor = self._mejor(mejor, self.arbol[derecha])
+            izquierda >>= 1
+            derecha >>= 1
+        return mejor
+
+    def rango(self, prefijo):
+        longitud = len(prefijo)
+
+        def clave_entrada(entrada):
+            posicion = self.entradas[entrada]
+            return self.claves[posicion:posicion + longitud]
+
+        entradas = range(len(self.entradas))
+        inicio = bisect_left(entradas, prefijo, key=clave_entrada)
+        return inicio, bisect_right(entradas, prefijo, lo=inicio, key=clave_entrada)
+
+    def mejores(self, prefijo):
+        # Items del rango del prefijo de más a menos popular, sin recorrer el rango:
+        # cada entrada sacada parte su tramo en dos y se busca el máximo de cada mitad
+        monton = []
+
+        def empujar(izquierda, derecha):
+            if izquierda < derecha:
+                entrada = self._maximo(izquierda, derecha)
+                heapq.heappush(monton, (-self._peso_entrada(entrada), entrada, izquierda, derecha))
+
+        empujar(*self.rango(prefijo))
+        while monton:
+            _, entrada, izquierda, derecha = heapq.heappop(monton)
+            yield self.item_de_entrada[entrada]
+            empujar(izquierda, entrada)
+            empujar(entrada + 1, derecha)
+
+    def buscar(self, clave_bytes):
+        # Item con exactamente esa clave (los autores están ordenados por clave)
+        item = bisect_left(range(len(self)), clave_bytes, key=self.clave)
+        return item if item < len(self) and self.clave(item) == clave_bytes else None
+
+
+class Indice:
+    # Títulos (uno por libro, en orden de id) y autores distintos (en orden de clave)
+
+    def __init__(self, marca):
+        self.marca = marca
+        self.titulos = Campo()
+        self.autores = Campo()
+        self.libro_ids = array('q')
+        self.autor_de = array('I')
+        self.libros_autor = array('I')
+        self.muestras = []
+
+    @classmethod
+    def construir(cls, filas, marca):
+        # filas: (id, titulo, autor, prestamos_totales) en orden de id
+        indice = cls(marca)
+        autores = {}
+        autor_provisional = array('I')
+        for libro_id, titulo, autor, peso in filas:
+            clave_autor = clave(autor)
+            datos = autores.get(clave_autor)
+            if datos is None:
+                datos = autores[clave_autor] = [len(autores), autor, 0, 0]
+            datos[2] += 1
+            datos[3] += peso
+            indice.libro_ids.append(libro_id)
+            autor_provisional.append(datos[0])
+            indice.titulos.agregar(clave(titulo), titulo, peso)
+        indice.titulos.terminar()
+
+        definitivo = array('I', bytes(4 * len(autores)))
+        for item, clave_autor in enumerate(sorted(autores)):
+            provisional, texto, libros, peso = autores.pop(clave_autor)
+            definitivo[provisional] = item
+            indice.autores.agregar(clave_autor, texto, peso)
+            indice.libros_autor.append(libros)
+        indice.autores.terminar()
+        indice.autor_de = array('I', (definitivo[provisional] for provisional in autor_provisional))
+        indice.tomar_muestras()
+        return indice
+
+    def tomar_muestras(self):
+        paso = max(1, len(self.libro_ids) // MUESTRAS)
+        self.muestras = [
+            (self.libro_ids[item], self.titulos.texto(item)) for item in range(0, len(self.libro_ids), paso)
+        ][:MUESTRAS]
+
+    def item_libro(self, libro_id):
+        item = bisect_left(self.libro_ids, libro_id)
+        return item if item < len(self.libro_ids) and self.libro_ids[item] == libro_id else None
+
+    def sin_cambios(self, item, titulo, autor):
+        return self.titulos.texto(item) == titulo and self.autores.clave(self.autor_de[item]) == clave(autor).encode('latin-1')
+
+    def sugerir(self, texto, limite, cambios):
+        prefijo = _prefijo(texto)
+        if not prefijo:
+            return {'titulos': [], 'autores': []}
+        return {
+            'titulos': self._titulos(prefijo, limite, cambios),
+            'autores': self._autores(prefijo, limite, cambios),
+        }
+
+    def _titulos(self, prefijo, limite, cambios):
+        # Sugerencias del índice (sin los libros cambiados o borrados) más las de los
+        # cambios, de más a menos prestadas y sin repetir título y autor
+        candidatos, vistos = [], set()
+        for examinados, item in enumerate(self.titulos.mejores(prefijo)):
+            if examinados >= MAX_CANDIDATOS or len(candidatos) >= limite:
+                break
+            if item in cambios.ocultos:
+                continue
+            titulo, autor = self.titulos.texto(item), self.autores.texto(self.autor_de[item])
+            if (titulo, autor) not in vistos:
+                vistos.add((titulo, autor))
+                candidatos.append((-self.titulos.pesos[item], len(candidatos), self.libro_ids[item], titulo, autor))
+        for libro_id in sorted(_coincidencias(cambios.entradas_titulos, prefijo)):
+            titulo, autor, peso, _ = cambios.libros[libro_id]
+            candidatos.append((-peso, len(candidatos), libro_id, titulo, autor))
+        resultado, vistos = [], set()
+        for _, _, libro_id, titulo, autor in sorted(candidatos):
+            if (titulo, autor) not in vistos:
+                vistos.add((titulo, autor))
+                resultado.append({'id': libro_id, 'titulo': titulo, 'autor': autor})
+        return resultado[:limite]
+
+    def _autores(self, prefijo, limite, cambios):
+        candidatos, vistos = [], set()
+        for examinados, item in enumerate(self.autores.mejores(prefijo)):
+            if examinados >= MAX_CANDIDATOS or len(candidatos) >= limite:
+                break
+            if item in vistos:
+                continue
+            vistos.add(item)
+            libros = self.libros_autor[item] + cambios.autores.get(self.autores.clave(item), 0)
+            if libros > 0:
+                candidatos.append((-self.autores.pesos[item], len(candidatos), self.autores.texto(item), libros))
+        for clave_autor in sorted(_coincidencias(cambios.entradas_autores, prefijo)):
+            texto, libros, peso = cambios.autores_nuevos[clave_autor]
+            candidatos.append((-peso, len(candidatos), texto, libros))
+        return [{'autor': texto, 'libros': libros} for _, _, texto, libros in sorted(candidatos)[:limite]]
+
+
+class Cambios:
+    # Lo que ha cambiado desde que se construyó el índice; nunca se modifica, cada
+    # revisión crea uno nuevo y las peticiones en curso siguen con el anterior
+    # - libros: libro_id -> (titulo, autor, peso, clave del título) de los libros nuevos
+    #   o con otro título o autor
+    # - ocultos: items del índice cambiados o borrados
+    # - autores: diferencia de libros por clave de autor; autores_nuevos, los que el
+    #   índice no tiene
+
+    def __init__(self, indice, libros=None, eliminados=frozenset()):
+        self.libros = libros or {}
+        self.eliminados = frozenset(eliminados)
+        self.ocultos = set()
+        self.autores = Counter()
+        for libro_id in (*self.libros, *self.eliminados):
+            item = indice.item_libro(libro_id)
+            if item is not None:
+                self.ocultos.add(item)
+                self.autores[indice.autores.clave(indice.autor_de[item])] -= 1
+        self.autores_nuevos = {}
+        for titulo, autor, peso, _ in self.libros.values():
+            clave_autor = clave(autor).encode('latin-1')
+            self.autores[clave_autor] += 1
+            if clave_autor and indice.autores.buscar(clave_autor) is None:
+                texto, libros, total = self.autores_nuevos.get(clave_autor, (autor, 0, 0))
+                self.autores_nuevos[clave_autor] = (texto, libros + 1, total + peso)
+        self.entradas_titulos = _ordenar(
+            (libro_id, datos[3]) for libro_id, datos in self.libros.items() if datos[3]
+        )
+        self.entradas_autores = _ordenar((clave_autor, clave_autor) for clave_autor in self.autores_nuevos)
+
+    def __len__(self):
+        return len(self.libros) + len(self.eliminados)
+
+    def aplicar(self, indice, filas, bajas, maximo):
+        # None si quedan más de `maximo` cambios: entonces conviene reconstruir el índice
+        # Las filas pueden ser muchas (un préstamo también mueve `actualizado`), así que
+        # se recorren sin cargarlas todas y solo cuentan las que cambian título o autor
+        libros = dict(self.libros)
+        eliminados = set(self.eliminados)
+        for libro_id, titulo, autor, peso in filas:
+            item = indice.item_libro(libro_id)
+            if item is not None and indice.sin_cambios(item, titulo, autor):
+                # Un préstamo o un cambio de stock también mueve `actualizado`
+                libros.pop(libro_id, None)
+            else:
+                libros[libro_id] = (titulo, autor, peso, clave(titulo).encode('latin-1'))
+                if len(libros) + len(eliminados) > maximo:
+                    return None
+        for libro_id in bajas:
+            libros.pop(libro_id, None)
+            if indice.item_libro(libro_id) is not None:
+                eliminados.add(libro_id)
+        if len(libros) + len(eliminados) > maximo:
+            return None
+        return Cambios(indice, libros, eliminados)
+
+
+def _identidad():
+    datos = connection.settings_dict
+    return f"{connection.vendor}:{datos.get('HOST') or ''}:{datos.get('PORT') or ''}:{datos['NAME']}"
+
+
+def ruta_archivo():
+    # Un archivo por base de datos: la de pruebas nunca pisa el índice de la real
+    resumen = hashlib.sha1(_identidad().encode()).hexdigest()[:12]
+    return os.path.join(settings.AUTOCOMPLETADO['DIRECTORIO'], f'biblioteca_autocompletado_{resumen}.indice')
+
+
+def construir(tamano_lote=5000):
+    # La marca se toma antes de leer: lo que cambie durante la lectura se vuelve a
+    # aplicar en la primera revisión
+    marca = timezone.now()
+    filas = (
+        Libro.objects.order_by('pk')
+        .values_list('pk', 'titulo', 'autor', 'prestamos_totales')
+        .iterator(chunk_size=tamano_lote)
+    )
+    return Indice.construir(filas, marca)
+
+
+def _escribir_bloque(archivo, valor):
+    # bytes se guardan tal cual (tipo b'-'); los arrays con su tipo y tamaño de elemento
+    if isinstance(valor, bytes):
+        archivo.write(BLOQUE.pack(b'-', 1, len(valor)))
+        archivo.write(valor)
+    else:
+        archivo.write(BLOQUE.pack(valor.typecode.encode(), valor.itemsize, len(valor) * valor.itemsize))
+        valor.tofile(archivo)
+
+
+def _leer_bloque(archivo):
+    tipo, tamano, longitud = BLOQUE.unpack(archivo.read(BLOQUE.size))
+    if tipo == b'-':
+        valor = archivo.read(longitud)
+        if len(valor) != longitud:
+            raise EOFError
+        return valor
+    if tipo not in (b'I', b'q'):
+        raise ValueError(tipo)
+    valor = array(tipo.decode())
+    if valor.itemsize != tamano or longitud % tamano:
+        # Archivo de otra plataforma: se reconstruye
+        raise ValueError(tipo)
+    valor.fromfile(archivo, longitud // tamano)
+    return valor
+
+
+def guardar(indice):
+    ruta = ruta_archivo()
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    temporal = f'{ruta}.{os.getpid()}.{threading.get_ident()}'
+    identidad = _identidad().encode()
+    marca = indice.marca.isoformat().encode()
+    with open(temporal, 'wb') as archivo:
+        archivo.write(CABECERA.pack(MAGIA, FORMATO, sys.byteorder == 'big', len(identidad), len(marca)))
+        archivo.write(identidad + marca)
+        for campo in (indice.titulos, indice.autores):
+            for nombre in BLOQUES_CAMPO:
+                _escribir_bloque(archivo, getattr(campo, nombre))
+        for nombre in BLOQUES_INDICE:
+            _escribir_bloque(archivo, getattr(indice, nombre))
+    os.replace(temporal, ruta)
+
+
+def _leer(archivo):
+    # None si el archivo es de otro formato, de otra plataforma o de otra base de datos;
+    # la identidad se comprueba antes de leer los bloques
+    magia, formato, big_endian, largo_identidad, largo_marca = CABECERA.unpack(archivo.read(CABECERA.size))
+    if magia != MAGIA or formato != FORMATO or bool(big_endian) != (sys.byteorder == 'big'):
+        return None
+    if archivo.read(largo_identidad).decode() != _identidad():
+        return None
+    indice = Indice(datetime.fromisoformat(archivo.read(largo_marca).decode()))
+    for campo in (indice.titulos, indice.autores):
+        for nombre in BLOQUES_CAMPO:
+            setattr(campo, nombre, _leer_bloque(archivo))
+    for nombre in BLOQUES_INDICE:
+        setattr(indice, nombre, _leer_bloque(archivo))
+    indice.tomar_muestras()
+    return indice
+
+
+def cargar():
+    # None si no hay archivo o si no corresponde a esta base de datos
+    try:
+        with open(ruta_archivo(), 'rb') as archivo:
+            indice = _leer(archivo)
+    except (OSError, EOFError, ValueError, struct.error):
+        return None
+    if indice is None:
+        return None
+    # Misma ruta, otra base (p. ej. borrada y creada de nuevo): algún libro de muestra
+    # tiene otro título sin haber cambiado después de construir el índice
+    actuales = dict(
+        Libro.objects.filter(pk__in=[libro_id for libro_id, _ in indice.muestras], actualizado__lte=indice.marca)
+        .values_list('pk', 'titulo')
+    )
+    if any(actuales.get(libro_id, titulo) != titulo for libro_id, titulo in indice.muestras):
+        return None
+    return indice
+
+
+def reconstruir():
+    indice = construir()
+    guardar(indice)
+    return indice
+
+
+def _modificado():
+    try:
+        return os.path.getmtime(ruta_archivo())
+    except OSError:
+        return None
+
+
+class _Estado:
+    # Índice y cambios que usan las peticiones de este proceso
+    # - desde: los cambios se piden desde aquí menos MARGEN_S, porque una transacción que
+    #   confirma tarde puede traer un `actualizado` anterior a la última revisión
+    # - modificado: fecha del archivo del que salió el índice, para notar otro más nuevo
+    def __init__(self, indice, modificado, cambios=None, desde=None):
+        self.indice = indice
+        self.modificado = modificado
+        self.cambios = cambios or Cambios(indice)
+        self.desde = desde or indice.marca
+        self.proxima_revision = 0.0
+
+
+_estado = None
+_bloqueo = threading.Lock()
+
+
+def _iniciar():
+    # Al arrancar el worker se carga el archivo; solo se construye si no existe
+    modificado = _modificado()
+    indice = cargar()
+    if indice is None:
+        indice = reconstruir()
+        modificado = _modificado()
+    return _revisar(_Estado(indice, modificado))
+
+
+def _revisar(estado):
+    ajustes = settings.AUTOCOMPLETADO
+    modificado = _modificado()
+    if modificado is not None and modificado != estado.modificado:
+        # Otro proceso (o reconstruir_autocompletado) ha guardado un índice más reciente
+        indice = cargar()
+        if indice is not None:
+            estado = _Estado(indice, modificado)
+
+    ahora = timezone.now()
+    desde = estado.desde - timedelta(seconds=ajustes['MARGEN_S'])
+    filas = (
+        Libro.objects.filter(actualizado__gte=desde)
+        .values_list('pk', 'titulo', 'autor', 'prestamos_totales')
+        .iterator(chunk_size=2000)
+    )
+    bajas = list(LibroEliminado.objects.filter(eliminado__gte=desde).values_list('libro_id', flat=True))
+    cambios = estado.cambios.aplicar(estado.indice, filas, bajas, ajustes['MAX_CAMBIOS'])
+    if cambios is None:
+        # Demasiados cambios para aplicarlos encima (p. ej. una importación masiva)
+        indice = reconstruir()
+        estado = _Estado(indice, _modificado())
+        estado.proxima_revision = time.monotonic() + ajustes['REFRESCO_S']
+        return estado
+    nuevo = _Estado(estado.indice, estado.modificado, cambios, ahora)
+    nuevo.proxima_revision = time.monotonic() + ajustes['REFRESCO_S']
+    return nuevo
+
+
+def estado_actual():
+    global _estado
+    estado = _estado
+    if estado is None:
+        with _bloqueo:
+            if _estado is None:
+                _estado = _iniciar()
+            return _estado
+    # Una sola revisión a la vez; las demás peticiones siguen con el estado actual
+    if time.monotonic() >= estado.proxima_revision and _bloqueo.acquire(blocking=False):
+        try:
+            _estado = estado = _revisar(_estado)
+        finally:
+            _bloqueo.release()
+    return estado
+
+
+def sugerencias(texto, limite=8):
+    estado = estado_actual()
+    return estado.indice.sugerir(texto, limite, estado.cambios)
@@ -0,0 +1,25 @@
+# Benchmarks de rendimiento del sistema
+# Cada módulo de este paquete define:
+#   - DESCRIPCION: texto corto que aparece en la ayuda del comando
+#   - agregar_argumentos(parser): opciones propias del benchmark
+#   - ejecutar(opciones, escribir): corre el benchmark y devuelve un dict con los resultados
+# Se ejecutan con: python manage.py benchmark <nombre> [opciones]
+
+BENCHMARKS = [
+    'busqueda',
+    'paginacion',
+    'concurrencia_prestamos',
+    'concurrencia_http',
+    'serializacion',
+    'metricas',
+    'carga',
+    'escrituras',
+    'autenticacion',
+    'sesiones',
+    'perfiles_bd',
+    'autocompletado',
+    'facetas',
+    'analitica',
+    'archivado',
+    'reservas',
+]
@@ -0,0 +1,155 @@
+import contextlib
+import datetime
+import itertools
+import time
+from unittest import mock
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from gestion import analitica, generacion, prestamos
+from gestion.models import Libro, Prestamo, Usuario
+
+from .utilidades import crear_usuarios, medir
+
+DESCRIPCION = 'Analítica de préstamos: agregar el historial en cada consulta frente a los resúmenes incrementales'
+
+
+def agregar_argumentos(parser):
+    parser.add_argument('--libros', type=int, default=50_000)
+    parser.add_argument('--usuarios', type=int, default=20_000)
+    parser.add_argument('--prestamos', type=int, default=1_000_000)
+    parser.add_argument('--dias', type=int, nargs='+', default=[30, 365], help='Ventanas de la serie diaria')
+    parser.add_argument('--repeticiones', type=int, default=20)
+    parser.add_argument('--semilla', type=int, default=0)
+
+
+def _al_vuelo(dias, limite=10):
+    # Lo mismo que analitica.resumen calculado directamente sobre Prestamo
+    hoy = timezone.localdate()
+    desde = timezone.make_aware(datetime.datetime.combine(hoy - datetime.timedelta(days=dias - 1), datetime.time()))
+    inicio_mes = timezone.make_aware(datetime.datetime.combine(hoy.replace(day=1), datetime.time()))
+    por_dia = {
+        fila['d']: [fila['n'], 0, 0]
+        for fila in Prestamo.objects.filter(fecha_prestamo__gte=desde)
+        .annotate(d=TruncDate('fecha_prestamo')).values('d').annotate(n=Count('id')).order_by()
+    }
+    devueltos = (
+        Prestamo.objects.filter(devuelto=True, fecha_devolucion__gte=desde)
+        .annotate(d=TruncDate('fecha_devolucion')).values('d')
+        .annotate(n=Count('id'), duracion=Sum(analitica.DURACION)).order_by()
+    )
+    for fila in devueltos:
+        dia = por_dia.setdefault(fila['d'], [0, 0, 0])
+        dia[1], dia[2] = fila['n'], fila['duracion'].total_seconds()
+    mas_prestados = list(
+        Prestamo.objects.filter(fecha_prestamo__gte=inicio_mes).values('libro_id')
+        .annotate(n=Count('id')).order_by('-n').values_list('n', flat=True)[:limite]
+    )
+    return {
+        'por_dia': por_dia,
+        'mas_prestados': mas_prestados,
+        'activos': Prestamo.objects.filter(devuelto=False).count(),
+        'historicos': Prestamo.objects.count(),
+        'vencidos': analitica.vencidos(limite),
+    }
+
+
+def _comprobar(dias):
+    # Los resúmenes deben dar las mismas cifras que el historial
+    esperado = _al_vuelo(dias)
+    obtenido = analitica.resumen(dias=dias)
+    for dia in obtenido['por_dia']:
+        calculado = esperado['por_dia'].get(dia['dia'], [0, 0, 0])
+        if analitica._desviado(calculado, [dia['prestamos'], dia['devoluciones'], dia['duracion_total_s']]):
+            raise AssertionError(f'El resumen del {dia["dia"]} no coincide con el historial')
+    if [libro['prestamos'] for libro in obtenido['libros_mas_prestados']] != esperado['mas_prestados']:
+        raise AssertionError('Los libros más prestados no coinciden con el historial')
+    if (obtenido['totales']['activos'], obtenido['totales']['historicos']) != (esperado['activos'], esperado['historicos']):
+        raise AssertionError('Los préstamos activos o históricos no coinciden con el historial')
+
+
+def _ciclos(usuario):
+    # Préstamo y devolución de libros con ejemplares libres, en bucle
+    libros = itertools.cycle(
+        Libro.objects.filter(cantidad_stock__gt=1).order_by('pk').values_list('pk', flat=True)[:50]
+    )
+
+    def ciclo():
+        libro_id = next(libros)
+        if not prestamos.prestar_libro(usuario, libro_id).ok:
+            raise AssertionError('No se pudo prestar el libro del benchmark')
+        prestamos.devolver_libro(usuario, libro_id)
+    return ciclo
+
+
+def _coste_operaciones(repeticiones):
+    # Consultas y latencia de prestar + devolver con los resúmenes y sin ellos
+    crear_usuarios(1, semilla='analitica')
+    usuario = Usuario.objects.get(username='lectoranalitica_0')
+    ciclo = _ciclos(usuario)
+    resultado = {}
+    for modo in ('sin resumenes', 'con resumenes'):
+        with mock.patch.multiple(analitica, al_prestar=mock.DEFAULT, al_devolver=mock.DEFAULT) \
+                if modo == 'sin resumenes' else contextlib.nullcontext():
+            latencias = medir(ciclo, repeticiones=repeticiones)
+            # Las consultas se cuentan después: las filas del día y del mes ya existen,
+            # como en casi todos los préstamos reales
+            connection.queries_log.clear()
+            with CaptureQueriesContext(connection) as contexto:
+                ciclo()
+            resultado[modo] = {'consultas': len(contexto.captured_queries), **latencias}
+    return resultado
+
+
+def ejecutar(opciones, escribir):
+    inicio = time.monotonic()
+    generacion.generar(opciones['libros'], opciones['usuarios'], opciones['prestamos'],
+                       semilla=opciones['semilla'], indexar=False)
+    escribir(f'  historial de {Prestamo.objects.count()} préstamos generado en {time.monotonic() - inicio:.1f} s')
+
+    inicio = time.monotonic()
+    reconstruido = analitica.reconstruir()
+    reconstruir_s = time.monotonic() - inicio
+    inicio = time.monotonic()
+    desviados = analitica.verificar()
+    verificar_s = time.monotonic() - inicio
+    if any(desviados.values()):
+        raise AssertionError(f'Resúmenes desviados tras reconstruir: {desviados}')
+    escribir(f'  reconstruir: {reconstruir_s:.1f} s ({reconstruido["dias"]} días, {reconstruido["meses"]} meses) | '
+             f'verificar: {verificar_s:.1f} s')
+
+    ventanas = []
+    for dias in opciones['dias']:
+        _comprobar(dias)
+        al_vuelo = medir(lambda: _al_vuelo(dias), repeticiones=opciones['repeticiones'])
+        resumenes = medir(lambda: analitica.resumen(dias=dias), repeticiones=opciones['repeticiones'])
+        ventanas.append({'dias': dias, 'al_vuelo': al_vuelo, 'resumenes': resumenes})
+        escribir(f'  {dias:>4} días | sobre el historial: p50 {al_vuelo["p50_ms"]:>8.2f} ms, p95 {al_vuelo["p95_ms"]:>8.2f} ms | '
+                 f'con resúmenes: p50 {resumenes["p50_ms"]:>6.2f} ms, p95 {resumenes["p95_ms"]:>6.2f} ms')
+
+    # La API completa, con la sesión de un administrador (IsAdminUser mira is_staff)
+    administrador = Usuario.objects.create_user('admin_analitica', password='x', rol='admin', is_staff=True)
+    with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+        cliente = Client()
+        cliente.force_login(administrador)
+        api = medir(lambda: cliente.get('/api/analitica/?dias=30'), repeticiones=opciones['repeticiones'])
+    escribir(f'  GET /api/analitica/?dias=30: p50 {api["p50_ms"]:.2f} ms, p95 {api["p95_ms"]:.2f} ms')
+
+    operaciones = _coste_operaciones(opciones['repeticiones'])
+    for modo, fila in operaciones.items():
+        escribir(f'  prestar + devolver {modo}: {fila["consultas"]} consultas, p50 {fila["p50_ms"]:.2f} ms')
+
+    return {
+        'prestamos': opciones['prestamos'],
+        'reconstruir_s': round(reconstruir_s, 2),
+        'verificar_s': round(verificar_s, 2),
+        'ventanas': ventanas,
+        'api': api,
+        'operaciones': operaciones,
+    }
@@ -0,0 +1,117 @@
+import itertools
+import time
+
+from django.conf import settings
+from django.db.models import Count
+
+from gestion import archivado, generacion, prestamos
+from gestion.models import Libro, Prestamo, PrestamoArchivado, Usuario
+
+from .utilidades import crear_usuarios, medir
+
+DESCRIPCION = 'Archivado de préstamos devueltos: consultas antes y después de vaciar la tabla de préstamos'
+
+COLUMNAS_ADMIN = ('fecha_prestamo', 'fecha_devolucion', 'devuelto', 'libro__titulo', 'usuario__username')
+COLUMNAS_LECTOR = ('fecha_prestamo', 'fecha_devolucion', 'devuelto', 'libro__titulo', 'libro__autor')
+
+
+def agregar_argumentos(parser):
+    parser.add_argument('--libros', type=int, default=20_000)
+    parser.add_argument('--usuarios', type=int, default=10_000)
+    parser.add_argument('--prestamos', type=int, default=300_000)
+    parser.add_argument('--dias', type=int, default=365, help='Se archivan los devueltos hace más de estos días')
+    parser.add_argument('--lote', type=int, default=1000)
+    parser.add_argument('--repeticiones', type=int, default=10)
+    parser.add_argument('--semilla', type=int, default=0)
+
+
+def _consultas(lector_id):
+    # Lo que leen las páginas de historial (como en web/views.py) y la analítica
+    def historial(tabla, columnas, **filtro):
+        relaciones = {columna.split('__')[0] for columna in columnas if '__' in columna}
+        return tabla.objects.filter(**filtro).select_related(*relaciones).only(*columnas).order_by('-fecha_prestamo')
+
+    def completo(columnas, **filtro):
+        # Primera página de ?completo=1; todo() recorre las demás siguiendo el cursor
+        consultas = [historial(tabla, columnas, **filtro) for tabla in archivado.TABLAS]
+        return lambda: archivado.pagina_historial(consultas, settings.ARCHIVADO['PAGINA_HISTORIAL'])[0]
+
+    return {
+        'historial administrador': lambda: list(historial(Prestamo, COLUMNAS_ADMIN)),
+        'historial administrador completo': completo(COLUMNAS_ADMIN),
+        'historial del lector': lambda: list(historial(Prestamo, COLUMNAS_LECTOR, usuario_id=lector_id)),
+        'historial del lector completo': completo(COLUMNAS_LECTOR, usuario_id=lector_id),
+        'préstamos por libro': lambda: list(
+            Prestamo.objects.values('libro_id').annotate(n=Count('id')).order_by('-n')[:10]),
+    }
+
+
+def _contar_paginas(filtro):
+    # Préstamos distintos del historial completo recorriendo todas sus páginas
+    consultas = [tabla.objects.filter(**filtro).only('fecha_prestamo') for tabla in archivado.TABLAS]
+    vistos, antes = set(), None
+    while True:
+        filas, siguiente = archivado.pagina_historial(consultas, settings.ARCHIVADO['PAGINA_HISTORIAL'], antes)
+        vistos.update(fila.pk for fila in filas)
+        if siguiente is None:
+            return len(vistos)
+        antes = archivado.leer_cursor(siguiente)
+
+
+def _ciclo(usuario):
+    # Préstamo y devolución de libros con ejemplares libres, en bucle
+    libros = itertools.cycle(
+        Libro.objects.filter(cantidad_stock__gt=1).order_by('pk').values_list('pk', flat=True)[:50]
+    )
+
+    def ciclo():
+        libro_id = next(libros)
+        if not prestamos.prestar_libro(usuario, libro_id).ok:
+            raise AssertionError('No se pudo prestar el libro del benchmark')
+        prestamos.devolver_libro(usuario, libro_id)
+    return ciclo
+
+
+def _medir_todo(consultas, ciclo, repeticiones):
+    resultado = {nombre: medir(funcion, repeticiones=repeticiones, calentamiento=1) for nombre, funcion in consultas.items()}
+    resultado['prestar + devolver'] = medir(ciclo, repeticiones=repeticiones * 5)
+    return resultado
+
+
+def ejecutar(opciones, escribir):
+    generacion.generar(opciones['libros'], opciones['usuarios'], opciones['prestamos'],
+                       semilla=opciones['semilla'], indexar=False)
+    crear_usuarios(1, semilla='archivado')
+    ciclo = _ciclo(Usuario.objects.get(username='lectorarchivado_0'))
+    # El lector con más préstamos: su historial es el más largo
+    lector_id = Usuario.objects.order_by('-prestamos_totales').values_list('pk', flat=True).first()
+    consultas = _consultas(lector_id)
+
+    antes = _medir_todo(consultas, ciclo, opciones['repeticiones'])
+    esperado = {nombre: len(consultas[nombre]()) for nombre in ('historial administrador', 'historial del lector')}
+    filas_antes = Prestamo.objects.count()
+
+    inicio = time.monotonic()
+    resultado = archivado.archivar(dias=opciones['dias'], tamano_lote=opciones['lote'])
+    archivar_s = time.monotonic() - inicio
+    escribir(f'  {resultado["movidos"]} de {filas_antes} préstamos archivados en {archivar_s:.1f} s, '
+             f'{resultado["lotes"]} lotes, el más largo {resultado["max_lote_ms"]:.0f} ms')
+
+    # El historial completo, página a página, debe seguir teniendo todos los préstamos
+    for nombre, filtro in (('historial administrador', {}), ('historial del lector', {'usuario_id': lector_id})):
+        if _contar_paginas(filtro) != esperado[nombre]:
+            raise AssertionError(f'El {nombre} completo no tiene los mismos préstamos que antes de archivar')
+
+    despues = _medir_todo(consultas, ciclo, opciones['repeticiones'])
+    for nombre in antes:
+        escribir(f'  {nombre:<34} | antes: p50 {antes[nombre]["p50_ms"]:>9.2f} ms | '
+                 f'después: p50 {despues[nombre]["p50_ms"]:>9.2f} ms')
+
+    return {
+        'prestamos': filas_antes,
+        'archivados': resultado['movidos'],
+        'archivar_s': round(archivar_s, 2),
+        'max_lote_ms': resultado['max_lote_ms'],
+        'antes': antes,
+        'despues': despues,
+    }
@@ -0,0 +1,120 @@
+import os
+import random
+import tempfile
+import time
+
+from biblioteca.metricas import Registro
+from gestion import prestamos
+from gestion.autenticacion import tokens_para
+from gestion.models import Libro, Usuario
+
+from .cliente_http import SERVIDORES, generar_carga, preparar_peticion, servidor
+from .utilidades import crear_libros, crear_usuarios
+
+DESCRIPCION = 'Peticiones/s de la API autenticada con JWT leyendo el usuario en cada petición y solo con el token'
+
+# consulta: JWTAuthentication de simplejwt; token: JWTSinEstado (JWT_SIN_ESTADO=True)
+MODOS = ('consulta', 'token')
+ENDPOINTS = ('libro', 'mis_libros', 'usuarios')
+
+
+def agregar_argumentos(parser):
+    parser.add_argument('--modos', choices=MODOS, nargs='+', default=list(MODOS))
+    parser.add_argument('--endpoints', choices=ENDPOINTS, nargs='+', default=list(ENDPOINTS))
+    parser.add_argument('--servidor', choices=SERVIDORES, default='wsgi')
+    parser.add_argument('--conexiones', type=int, default=20)
+    parser.add_argument('--duracion', type=float, default=10, help='Segundos medidos por endpoint')
+    parser.add_argument('--calentamiento', type=float, default=2)
+    parser.add_argument('--procesos', type=int, default=2, help='Workers del servidor')
+    parser.add_argument('--hilos', type=int, default=8, help='Hilos por worker de gunicorn (WSGI)')
+    parser.add_argument('--libros', type=int, default=2000)
+    parser.add_argument('--usuarios', type=int, default=200)
+    parser.add_argument('--semilla', type=int, default=0)
+
+
+def _rutas(opciones):
+    # (endpoint, ruta, cabeceras) con un token distinto por usuario, como muchos clientes
+    crear_libros(opciones['libros'], semilla=opciones['semilla'], indexar=False)
+    Libro.objects.update(cantidad_stock=opciones['usuarios'])
+    crear_usuarios(opciones['usuarios'], semilla=opciones['semilla'])
+    aleatorio = random.Random(opciones['semilla'])
+    libro_ids = list(Libro.objects.values_list('pk', flat=True))
+    lectores = list(Usuario.objects.filter(rol='regular'))
+    prestamos.prestar_lote([
+        (lector.pk, libro_id) for lector in lectores for libro_id in aleatorio.sample(libro_ids, 3)
+    ])
+    administrador = Usuario.objects.get(username='SuperAdmin')
+    autorizacion = {
+        usuario.pk: {'Authorization': f'Bearer {tokens_para(usuario).access_token}'}
+        for usuario in lectores + [administrador]
+    }
+    return {
+        'libro': [
+            (f'/api/libros/{aleatorio.choice(libro_ids)}/', autorizacion[lector.pk]) for lector in lectores
+        ],
+        'mis_libros': [(f'/api/usuarios/{lector.pk}/mis_libros/', autorizacion[lector.pk]) for lector in lectores],
+        # Reservado a administradores: el permiso se decide con is_staff
+        'usuarios': [('/api/usuarios/', autorizacion[administrador.pk])],
+    }
+
+
+def _consultas(archivo):
+    # Consultas por petición de cada vista según las métricas del servidor
+    return {
+        vista: round(fila['consultas'] / fila['peticiones'], 2)
+        for (vista, metodo, codigo), fila in Registro(archivo, 1).leer().items()
+        if codigo == '200' and fila['peticiones']
+    }
+
+
+def ejecutar(opciones, escribir):
+    rutas = _rutas(opciones)
+    resultados = []
+    for modo in opciones['modos']:
+        archivo = os.path.join(tempfile.gettempdir(), f'biblioteca_autenticacion_{os.getpid()}_{modo}.sqlite3')
+        entorno = {
+            'JWT_SIN_ESTADO': 'True' if modo == 'token' else 'False',
+            'METRICAS_ACTIVAS': 'True', 'METRICAS_ARCHIVO': archivo, 'METRICAS_INTERVALO': '0.5',
+        }
+        mediciones = []
+        try:
+            with servidor(opciones['servidor'], opciones['procesos'], opciones['hilos'], entorno_extra=entorno) as (host, puerto):
+                for endpoint in opciones['endpoints']:
+                    peticiones = [preparar_peticion(host, puerto, ruta, cabeceras) for ruta, cabeceras in rutas[endpoint]]
+                    medicion = generar_carga(
+                        host, puerto, peticiones, opciones['conexiones'],
+                        duracion=opciones['duracion'], calentamiento=opciones['calentamiento'],
+                    )
+                    mediciones.append({'modo': modo, 'endpoint': endpoint, **medicion})
+                # Da tiempo a que cada worker vuelque sus métricas
+                time.sleep(1.5)
+            consultas = _consultas(archivo)
+        finally:
+            for sufijo in ('', '-wal', '-shm'):
+                if os.path.exists(archivo + sufijo):
+                    os.remove(archivo + sufijo)
+
+        vistas = {'libro': 'libro-detail', 'mis_libros': 'usuario-mis-libros', 'usuarios': 'usuario-list'}
+        for medicion in mediciones:
+            medicion['consultas_por_peticion'] = consultas.get(vistas[medicion['endpoint']])
+            resultados.append(medicion)
+            escribir(
+                f"  {modo:<8} {medicion['endpoint']:<10} {medicion['peticiones_por_s']:>8} pet/s | "
+                f"p50 {medicion['p50_ms']:>8} ms | p99 {medicion['p99_ms']:>8} ms | "
+                f"{medicion['consultas_por_peticion']} consultas/petición | errores {medicion['errores']} | "
+                f"status {medicion['status']}"
+            )
+
+    # Cambio de cada endpoint del modo consulta al modo token
+    por_clave = {(r['modo'], r['endpoint']): r for r in resultados}
+    for endpoint in opciones['endpoints']:
+        antes, despues = por_clave.get(('consulta', endpoint)), por_clave.get(('token', endpoint))
+        if antes and despues and antes['peticiones_por_s']:
+            cambio = (despues['peticiones_por_s'] - antes['peticiones_por_s']) / antes['peticiones_por_s'] * 100
+            escribir(f'  {endpoint:<10} token frente a consulta: {cambio:+.1f}% pet/s')
+    return {
+        'servidor': opciones['servidor'],
+        'conexiones': opciones['conexiones'],
+        'duracion_s': opciones['duracion'],
+        'resultados': resultados,
+    }
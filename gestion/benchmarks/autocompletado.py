@@ -0,0 +1,166 @@
+import os
+import random
+import resource
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.test import Client, override_settings
+from django.utils import timezone
+
+from gestion import autocompletado
+from gestion.busqueda import tokenizar
+from gestion.models import Libro
+
+from .utilidades import crear_libros, resumir
+
+DESCRIPCION = 'Memoria, construcción, carga y latencia del índice de prefijos del autocompletado'
+
+
+def agregar_argumentos(parser):
+    parser.add_argument('--libros', type=int, default=1_000_000)
+    parser.add_argument('--consultas', type=int, default=2000, help='Prefijos medidos contra el índice')
+    parser.add_argument('--peticiones', type=int, default=300, help='Peticiones al endpoint de la API')
+    parser.add_argument('--cambios', type=int, default=2000, help='Libros editados después de construir el índice')
+    parser.add_argument('--limite', type=int, default=8)
+    parser.add_argument('--semilla', type=int, default=0)
+
+
+def _memoria(indice):
+    # Bytes de los bloques y arrays del índice (lo que queda en cada worker)
+    partes = {}
+    for nombre, campo in (('titulos', indice.titulos), ('autores', indice.autores)):
+        partes[nombre] = sum(
+            len(valor) * getattr(valor, 'itemsize', 1)
+            for valor in (
+                campo.claves, campo.textos, campo.inicio_clave, campo.inicio_texto,
+                campo.pesos, campo.entradas, campo.item_de_entrada, campo.arbol,
+            )
+        )
+    partes['libros'] = sum(len(a) * a.itemsize for a in (indice.libro_ids, indice.autor_de, indice.libros_autor))
+    return {nombre: round(total / 1024 / 1024, 1) for nombre, total in partes.items()}
+
+
+def _maximo_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _prefijos(aleatorio, cantidad):
+    # Lo que teclea alguien: el principio de una palabra de un título o autor real, de
+    # 1 a 8 letras, a veces con la palabra anterior delante
+    muestra = list(
+        Libro.objects.filter(pk__in=[aleatorio.randint(1, Libro.objects.count()) for _ in range(200)])
+        .values_list('titulo', 'autor')
+    )
+    prefijos = []
+    while len(prefijos) < cantidad:
+        palabras = tokenizar(aleatorio.choice(aleatorio.choice(muestra)))
+        posicion = aleatorio.randrange(len(palabras))
+        texto = palabras[posicion][:aleatorio.randint(1, 8)]
+        if posicion and aleatorio.random() < 0.3:
+            texto = f'{palabras[posicion - 1]} {texto}'
+        prefijos.append(texto)
+    return prefijos
+
+
+def _latencias(prefijos, limite):
+    estado = autocompletado.estado_actual()
+    latencias = []
+    for texto in prefijos:
+        inicio = time.perf_counter()
+        estado.indice.sugerir(texto, limite, estado.cambios)
+        latencias.append((time.perf_counter() - inicio) * 1000)
+    return resumir(latencias)
+
+
+def _por_longitud(prefijos, limite):
+    grupos = {}
+    for texto in prefijos:
+        grupos.setdefault(min(len(texto), 4), []).append(texto)
+    return {f"{longitud}{'+' if longitud == 4 else ''} letras": _latencias(textos, limite)['p50_ms'] for longitud, textos in sorted(grupos.items())}
+
+
+def ejecutar(opciones, escribir):
+    aleatorio = random.Random(opciones['semilla'])
+    inicio = time.perf_counter()
+    crear_libros(opciones['libros'], semilla=opciones['semilla'], indexar=False)
+    # Un catálogo ya asentado: nada cambió justo antes de construir el índice, y unos
+    # cuantos libros concentran los préstamos
+    Libro.objects.update(actualizado=timezone.now() - timedelta(days=1))
+    for libro_id in aleatorio.sample(range(1, opciones['libros'] + 1), min(opciones['libros'], 5000)):
+        Libro.objects.filter(pk=libro_id).update(prestamos_totales=aleatorio.randint(1, 500))
+    escribir(f"  {opciones['libros']} libros creados en {time.perf_counter() - inicio:.1f} s")
+
+    ruta = autocompletado.ruta_archivo()
+    if os.path.exists(ruta):
+        os.remove(ruta)
+    rss_antes = _maximo_rss_mb()
+    inicio = time.perf_counter()
+    indice = autocompletado.reconstruir()
+    construccion_s = time.perf_counter() - inicio
+    pico_mb = _maximo_rss_mb() - rss_antes
+    memoria = _memoria(indice)
+    archivo_mb = os.path.getsize(ruta) / 1024 / 1024
+    escribir(
+        f"  construcción {construccion_s:.1f} s (pico +{pico_mb:.0f} MB de RSS) | índice {sum(memoria.values()):.1f} MB "
+        f"{memoria} | {len(indice.titulos.entradas)} entradas de título | archivo {archivo_mb:.1f} MB"
+    )
+
+    # Arranque de un worker: carga el archivo y revisa los cambios, sin reconstruir
+    autocompletado._estado = None
+    inicio = time.perf_counter()
+    autocompletado.estado_actual()
+    carga_s = time.perf_counter() - inicio
+    escribir(f'  arranque de un worker (cargar el archivo) {carga_s * 1000:.0f} ms')
+
+    prefijos = _prefijos(aleatorio, opciones['consultas'])
+    sin_cambios = _latencias(prefijos, opciones['limite'])
+    escribir(
+        f"  consulta sin cambios: p50 {sin_cambios['p50_ms']} ms | p99 {sin_cambios['p99_ms']} ms | "
+        f"máx {sin_cambios['max_ms']} ms | p50 por longitud {_por_longitud(prefijos, opciones['limite'])}"
+    )
+
+    # Cambios después de construir: se aplican en la revisión, no se reconstruye nada
+    editados = aleatorio.sample(range(1, opciones['libros'] + 1), min(opciones['cambios'], opciones['libros']))
+    for libro in Libro.objects.filter(pk__in=editados):
+        libro.titulo = f'{libro.titulo} (edición revisada)'
+        libro.save()
+    autocompletado._estado.proxima_revision = 0
+    inicio = time.perf_counter()
+    estado = autocompletado.estado_actual()
+    revision_ms = (time.perf_counter() - inicio) * 1000
+    con_cambios = _latencias(prefijos, opciones['limite'])
+    escribir(
+        f"  revisión con {len(estado.cambios)} libros cambiados {revision_ms:.0f} ms | consulta con cambios: "
+        f"p50 {con_cambios['p50_ms']} ms | p99 {con_cambios['p99_ms']} ms"
+    )
+
+    # Petición completa a la API (DRF, renderizado JSON); la revisión periódica no cuenta
+    with override_settings(
+        ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+        AUTOCOMPLETADO={**settings.AUTOCOMPLETADO, 'REFRESCO_S': 3600},
+    ):
+        cliente = Client()
+        latencias = []
+        for texto in prefijos[:opciones['peticiones']]:
+            inicio = time.perf_counter()
+            respuesta = cliente.get('/api/libros/autocompletar/', {'q': texto, 'limite': opciones['limite']}, HTTP_ACCEPT='application/json')
+            latencias.append((time.perf_counter() - inicio) * 1000)
+            assert respuesta.status_code == 200, respuesta.status_code
+        endpoint = resumir(latencias)
+    escribir(f"  GET /api/libros/autocompletar/: p50 {endpoint['p50_ms']} ms | p99 {endpoint['p99_ms']} ms")
+
+    os.remove(ruta)
+    autocompletado._estado = None
+    return {
+        'libros': opciones['libros'],
+        'construccion_s': round(construccion_s, 2),
+        'pico_construccion_mb': round(pico_mb, 1),
+        'memoria_mb': memoria,
+        'archivo_mb': round(archivo_mb, 1),
+        'carga_worker_ms': round(carga_s * 1000, 1),
+        'consulta': sin_cambios,
+        'revision_ms': round(revision_ms, 1),
+        'consulta_con_cambios': con_cambios,
+        'endpoint': endpoint,
+    }
@@ -0,0 +1,50 @@
+from django.db.models import Q
+
+from gestion.busqueda import buscar_libros
+from gestion.models import Libro
+
+from .utilidades import crear_libros, medir
+
+DESCRIPCION = 'Latencia de búsqueda: índice invertido frente al antiguo filtro icontains'
+
+CONSULTAS = ['sombra viento', 'Márquez', 'cien años soledad', 'jardin secreto', 'Íñigo Núñez', 'cor']
+
+
+def agregar_argumentos(parser):
+    parser.add_argument(
+        '--tamanos', type=int, nargs='+', default=[100_000, 1_000_000],
+        help='Tamaños de catálogo a medir (por defecto 100000 y 1000000)',
+    )
+    parser.add_argument('--repeticiones', type=int, default=20)
+    parser.add_argument('--semilla', type=int, default=0)
+
+
+def _busqueda_icontains(consulta):
+    # Reproduce el filtro que usaba LibroListView antes del índice
+    return Libro.objects.filter(Q(titulo__icontains=consulta) | Q(autor__icontains=consulta))
+
+
+def ejecutar(opciones, escribir):
+    resultados = []
+    existentes = 0
+    for tamano in sorted(opciones['tamanos']):
+        # Los catálogos crecen de forma incremental para no regenerar los libros anteriores
+        crear_libros(tamano - existentes, semilla=opciones['semilla'] + tamano)
+        existentes = tamano
+        for consulta in CONSULTAS:
+            for metodo, construir in (('indice', buscar_libros), ('icontains', _busqueda_icontains)):
+                coincidencias = len(list(construir(consulta)))
+                resumen = medir(lambda: list(construir(consulta)), repeticiones=opciones['repeticiones'])
+                resultados.append({
+                    'libros': tamano,
+                    'consulta': consulta,
+                    'metodo': metodo,
+                    'coincidencias': coincidencias,
+                    **resumen,
+                })
+                escribir(
+                    f'{tamano:>9} libros | {metodo:<9} | {consulta!r:<22} | '
+                    f'{coincidencias:>7} resultados | p50 {resumen["p50_ms"]:>9.2f} ms | '
+                    f'p95 {resumen["p95_ms"]:>9.2f} ms'
+                )
+    return {'resultados': resultados}
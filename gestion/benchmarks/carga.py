@@ -0,0 +1,313 @@
+import json
+import os
+import random
+import subprocess
+import tempfile
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from biblioteca.metricas import Registro
+from gestion.autenticacion import tokens_para
+from gestion.models import Libro, Usuario
+
+from .cliente_http import SERVIDORES, PasoFallido, ejecutar_usuarios, servidor
+from .utilidades import PALABRAS_TITULO, crear_libros, crear_prestamos, crear_usuarios
+
+DESCRIPCION = 'Carga de extremo a extremo: catálogo, login JWT, préstamos por API y web, historial de administración'
+
+# Usuarios creados por crear_usuarios y superusuario de GestionConfig.crear_superusuario
+PASSWORD_LECTOR = 'lector1234'
+ADMIN = ('SuperAdmin', 'admin1234')
+
+HTML = {'Accept': 'text/html'}
+
+# Reparto de usuarios virtuales en el escenario mixto (por cada 10 usuarios)
+MEZCLA = {'catalogo': 6, 'prestamos_api': 1, 'prestamos_web': 1, 'login_jwt': 1, 'historial_admin': 1}
+
+
+def agregar_argumentos(parser):
+    parser.add_argument('--escenarios', choices=[*ESCENARIOS, 'mixto'], nargs='+', default=[*ESCENARIOS, 'mixto'])
+    parser.add_argument('--usuarios-virtuales', dest='usuarios_virtuales', type=int, default=20)
+    parser.add_argument('--duracion', type=float, default=20, help='Segundos medidos por escenario')
+    parser.add_argument('--calentamiento', type=float, default=3, help='Segundos sin medir antes de cada escenario')
+    parser.add_argument('--servidor', choices=SERVIDORES, default='wsgi')
+    parser.add_argument('--procesos', type=int, default=2, help='Workers del servidor')
+    parser.add_argument('--hilos', type=int, default=8, help='Hilos por worker de gunicorn (WSGI)')
+    parser.add_argument('--libros', type=int, default=5000)
+    parser.add_argument('--usuarios', type=int, default=500, help='Usuarios con historial (además de los virtuales)')
+    parser.add_argument('--prestamos', type=int, default=5000, help='Préstamos del historial inicial')
+    parser.add_argument('--semilla', type=int, default=0)
+    parser.add_argument('--comparar', help='JSON de una ejecución anterior (--salida-json) con el que comparar')
+
+
+def _preparar_datos(opciones):
+    # Los usuarios del historial y los de los usuarios virtuales son distintos: así los
+    # virtuales empiezan sin préstamos activos y cada uno presta y devuelve los suyos
+    crear_libros(opciones['libros'], semilla=opciones['semilla'])
+    crear_usuarios(opciones['usuarios'], semilla=opciones['semilla'])
+    crear_prestamos(opciones['prestamos'], semilla=opciones['semilla'])
+    crear_usuarios(opciones['usuarios_virtuales'], semilla=opciones['semilla'] + 1)
+    Libro.objects.update(cantidad_stock=opciones['usuarios_virtuales'] + 1)
+    return {
+        'libro_ids': list(Libro.objects.values_list('pk', flat=True)),
+        'usuario_ids': list(Usuario.objects.filter(rol='regular').values_list('pk', flat=True)),
+        'virtuales': list(Usuario.objects.filter(username__startswith=f"lector{opciones['semilla'] + 1}_").order_by('pk')),
+    }
+
+
+async def _iniciar_sesion_web(usuario, username, password):
+    # Mismo camino que un navegador: la página de login deja la cookie CSRF y el
+    # formulario la devuelve; al terminar el usuario tiene su cookie de sesión
+    await usuario.pedir('GET', '/login/', HTML)
+    respuesta = await usuario.pedir('POST', '/login/', HTML, formulario={
+        'username': username,
+        'password': password,
+        'csrfmiddlewaretoken': usuario.cookies.get(settings.CSRF_COOKIE_NAME, ''),
+    })
+    if respuesta.status != 302 or settings.SESSION_COOKIE_NAME not in usuario.cookies:
+        raise PasoFallido(f'login de {username}: status {respuesta.status}')
+
+
+def _csrf(usuario):
+    return {'csrfmiddlewaretoken': usuario.cookies.get(settings.CSRF_COOKIE_NAME, '')}
+
+
+# Cada escenario devuelve (preparar, recorrido) para el usuario virtual número `indice`
+
+def catalogo(datos, indice, aleatorio):
+    # Visitante anónimo: listado, búsqueda y detalle en la web y en la API
+    async def preparar(usuario):
+        return None
+
+    async def recorrido(usuario, estado):
+        palabra = aleatorio.choice(PALABRAS_TITULO)
+        libro = aleatorio.choice(datos['libro_ids'])
+        await usuario.paso('web /libros/', 'GET', '/libros/', cabeceras=HTML)
+        await usuario.paso('web /libros/?buscar=', 'GET', f'/libros/?buscar={palabra}', cabeceras=HTML)
+        await usuario.paso('web /libros/{pk}/', 'GET', f'/libros/{libro}/', cabeceras=HTML)
+        await usuario.paso('api /api/libros/', 'GET', '/api/libros/')
+        await usuario.paso('api /api/libros/?buscar=', 'GET', f'/api/libros/?buscar={palabra}')
+        await usuario.paso('api /api/libros/{id}/', 'GET', f'/api/libros/{libro}/')
+
+    return preparar, recorrido
+
+
+def login_jwt(datos, indice, aleatorio):
+    # App móvil: obtiene los tokens, los renueva y consulta sus libros
+    lector = datos['virtuales'][indice % len(datos['virtuales'])]
+
+    async def preparar(usuario):
+        return None
+
+    async def recorrido(usuario, estado):
+        tokens = (await usuario.paso('api /api/token/', 'POST', '/api/token/', datos={
+            'username': lector.username, 'password': PASSWORD_LECTOR,
+        })).json()
+        await usuario.paso('api /api/token/refresh/', 'POST', '/api/token/refresh/', datos={'refresh': tokens['refresh']})
+        await usuario.paso(
+            'api mis_libros', 'GET', f'/api/usuarios/{lector.pk}/mis_libros/',
+            cabeceras={'Authorization': f"Bearer {tokens['access']}"},
+        )
+
+    return preparar, recorrido
+
+
+def prestamos_api(datos, indice, aleatorio):
+    # App móvil ya autenticada con JWT: presta un libro, mira sus libros y lo devuelve
+    lector = datos['virtuales'][indice % len(datos['virtuales'])]
+    cabeceras = {'Authorization': f'Bearer {tokens_para(lector).access_token}'}
+    base = f'/api/usuarios/{lector.pk}'
+
+    async def preparar(usuario):
+        return None
+
+    async def recorrido(usuario, estado):
+        libro = aleatorio.choice(datos['libro_ids'])
+        await usuario.paso('api prestar_libro', 'POST', f'{base}/prestar_libro/', cabeceras=cabeceras, datos={'libro_id': libro})
+        await usuario.paso('api mis_libros', 'GET', f'{base}/mis_libros/', cabeceras=cabeceras)
+        await usuario.paso('api devolver_libro', 'POST', f'{base}/devolver_libro/', cabeceras=cabeceras, datos={'libro_id': libro})
+
+    return preparar, recorrido
+
+
+def prestamos_web(datos, indice, aleatorio):
+    # Navegador con sesión: detalle del libro, préstamo, sus préstamos y devolución
+    lector = datos['virtuales'][indice % len(datos['virtuales'])]
+
+    async def preparar(usuario):
+        await _iniciar_sesion_web(usuario, lector.username, PASSWORD_LECTOR)
+
+    async def recorrido(usuario, estado):
+        libro = aleatorio.choice(datos['libro_ids'])
+        await usuario.paso('web /libros/{pk}/', 'GET', f'/libros/{libro}/', cabeceras=HTML)
+        await usuario.paso(
+            'web /libros/{pk}/prestar/', 'POST', f'/libros/{libro}/prestar/', esperado=302,
+            destino='/mis-prestamos/', cabeceras=HTML, formulario=_csrf(usuario),
+        )
+        await usuario.paso('web /mis-prestamos/', 'GET', '/mis-prestamos/', cabeceras=HTML)
+        await usuario.paso(
+            'web /libros/{pk}/devolver/', 'POST', f'/libros/{libro}/devolver/', esperado=302,
+            destino='/mis-prestamos/', cabeceras=HTML, formulario=_csrf(usuario),
+        )
+
+    return preparar, recorrido
+
+
+def historial_admin(datos, indice, aleatorio):
+    # Administrador: historial completo, usuarios y exportación del historial de un usuario
+    async def preparar(usuario):
+        await _iniciar_sesion_web(usuario, *ADMIN)
+
+    async def recorrido(usuario, estado):
+        lector = aleatorio.choice(datos['usuario_ids'])
+        await usuario.paso('web /historial-prestamos/', 'GET', '/historial-prestamos/', cabeceras=HTML)
+        await usuario.paso('web /administrar-usuarios/', 'GET', '/administrar-usuarios/', cabeceras=HTML)
+        await usuario.paso(
+            'web /historial-prestamos/exportar/', 'GET',
+            f'/historial-prestamos/exportar/?formato=csv&usuario={lector}', cabeceras=HTML,
+        )
+
+    return preparar, recorrido
+
+
+ESCENARIOS = {
+    'catalogo': catalogo,
+    'login_jwt': login_jwt,
+    'prestamos_api': prestamos_api,
+    'prestamos_web': prestamos_web,
+    'historial_admin': historial_admin,
+}
+
+
+def _flujos(escenario, datos, opciones):
+    if escenario == 'mixto':
+        rueda = [nombre for nombre, peso in MEZCLA.items() for _ in range(peso)]
+        nombres = [rueda[i % len(rueda)] for i in range(opciones['usuarios_virtuales'])]
+    else:
+        nombres = [escenario] * opciones['usuarios_virtuales']
+    flujos = []
+    for indice, nombre in enumerate(nombres):
+        aleatorio = random.Random(f"{opciones['semilla']}-{indice}")
+        flujos.append((nombre, *ESCENARIOS[nombre](datos, indice, aleatorio)))
+    return flujos
+
+
+def _vistas(archivo):
+    # Lo que vio el servidor por vista (biblioteca/metricas.py): el número de consultas
+    # por petición no depende de la máquina y sirve para comparar entre commits
+    vistas = []
+    for (vista, metodo, codigo), fila in sorted(Registro(archivo, 1).leer().items()):
+        if vista == 'metricas':
+            continue
+        peticiones = fila['peticiones']
+        vistas.append({
+            'vista': vista,
+            'metodo': metodo,
+            'codigo': codigo,
+            'peticiones': int(peticiones),
+            'consultas_por_peticion': round(fila['consultas'] / peticiones, 2),
+            'db_ms_por_peticion': round(fila['db_segundos'] / peticiones * 1000, 3),
+            'servidor_ms_por_peticion': round(fila['segundos'] / peticiones * 1000, 3),
+            'bytes_por_peticion': round(fila['bytes'] / peticiones),
+        })
+    return vistas
+
+
+def _commit():
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+        cambios = subprocess.run(
+            ['git', 'status', '--porcelain', '--untracked-files=no'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return f'{commit}-modificado' if cambios else commit
+
+
+def _comparar(anterior, actual, escribir):
+    escribir(f"Comparación con {anterior.get('commit')} ({anterior.get('fecha')}):")
+    previos = {(r['escenario'], p['flujo'], p['paso']): p for r in anterior['resultados'] for p in r['pasos']}
+    for resultado in actual['resultados']:
+        for paso in resultado['pasos']:
+            previo = previos.get((resultado['escenario'], paso['flujo'], paso['paso']))
+            if not previo or not previo['peticiones_por_s']:
+                continue
+            cambio = (paso['peticiones_por_s'] - previo['peticiones_por_s']) / previo['peticiones_por_s'] * 100
+            escribir(
+                f"  {resultado['escenario']:<15} {paso['paso']:<34} "
+                f"{previo['peticiones_por_s']:>7} -> {paso['peticiones_por_s']:>7} pet/s ({cambio:+.0f}%) | "
+                f"p95 {previo['p95_ms']:>8} -> {paso['p95_ms']:>8} ms"
+            )
+    consultas = {
+        (r['escenario'], v['vista'], v['metodo'], v['codigo']): v for r in anterior['resultados'] for v in r['vistas']
+    }
+    for resultado in actual['resultados']:
+        for vista in resultado['vistas']:
+            previa = consultas.get((resultado['escenario'], vista['vista'], vista['metodo'], vista['codigo']))
+            if previa and previa['consultas_por_peticion'] != vista['consultas_por_peticion']:
+                escribir(
+                    f"  {resultado['escenario']:<15} consultas {vista['metodo']} {vista['vista']}: "
+                    f"{previa['consultas_por_peticion']} -> {vista['consultas_por_peticion']} por petición"
+                )
+
+
+def ejecutar(opciones, escribir):
+    anterior = None
+    if opciones['comparar']:
+        with open(opciones['comparar'], encoding='utf-8') as archivo:
+            anterior = json.load(archivo)
+    datos = _preparar_datos(opciones)
+
+    resultados = []
+    for escenario in opciones['escenarios']:
+        flujos = _flujos(escenario, datos, opciones)
+        # Métricas del servidor en un archivo propio para cada escenario
+        archivo_metricas = os.path.join(tempfile.gettempdir(), f'biblioteca_carga_{os.getpid()}_{escenario}.sqlite3')
+        entorno = {'METRICAS_ACTIVAS': 'True', 'METRICAS_ARCHIVO': archivo_metricas, 'METRICAS_INTERVALO': '0.5'}
+        try:
+            with servidor(opciones['servidor'], opciones['procesos'], opciones['hilos'], entorno_extra=entorno) as (host, puerto):
+                medicion = ejecutar_usuarios(
+                    host, puerto, flujos, duracion=opciones['duracion'], calentamiento=opciones['calentamiento'],
+                )
+                # Da tiempo a que cada worker vuelque sus métricas
+                time.sleep(1.5)
+            vistas = _vistas(archivo_metricas)
+        finally:
+            for sufijo in ('', '-wal', '-shm'):
+                if os.path.exists(archivo_metricas + sufijo):
+                    os.remove(archivo_metricas + sufijo)
+        resultados.append({'escenario': escenario, **medicion, 'vistas': vistas})
+
+        escribir(f'Escenario {escenario}:')
+        for flujo in medicion['flujos']:
+            escribir(f"  {flujo['flujo']:<16} {flujo['usuarios']:>3} usuarios | {flujo['recorridos_por_s']:>7} recorridos/s")
+            for paso in medicion['pasos']:
+                if paso['flujo'] != flujo['flujo']:
+                    continue
+                escribir(
+                    f"    {paso['paso']:<34} {paso['peticiones_por_s']:>7} pet/s | p50 {paso['p50_ms']:>8} ms | "
+                    f"p95 {paso['p95_ms']:>8} ms | p99 {paso['p99_ms']:>8} ms | errores {paso['errores']}"
+                )
+
+    salida = {
+        'commit': _commit(),
+        'fecha': timezone.now().isoformat(),
+        'motor': connection.vendor,
+        'servidor': opciones['servidor'],
+        'procesos': opciones['procesos'],
+        'hilos_wsgi': opciones['hilos'],
+        'usuarios_virtuales': opciones['usuarios_virtuales'],
+        'duracion_s': opciones['duracion'],
+        'datos': {clave: opciones[clave] for clave in ('libros', 'usuarios', 'prestamos', 'semilla')},
+        'resultados': resultados,
+    }
+    if anterior:
+        _comparar(anterior, salida, escribir)
+    return salida
@@ -0,0 +1,363 @@
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from urllib.parse import urlencode
+
+from django.core.management.base import CommandError
+from django.db import connection
+
+from .utilidades import resumir
+
+# Herramientas para los benchmarks que miden el sistema a través de HTTP:
+# - servidor(): arranca gunicorn (WSGI) o uvicorn (ASGI) en un subproceso apuntando
+#   a la base de datos de pruebas del benchmark
+# - generar_carga(): cliente asyncio mínimo con conexiones HTTP/1.1 persistentes, que
+#   no necesita dependencias y aguanta miles de conexiones en un solo proceso
+# - ejecutar_usuarios(): usuarios virtuales que recorren flujos completos (iniciar sesión,
+#   prestar, devolver...) con sus cookies, midiendo cada paso por separado
+
+SERVIDORES = ('wsgi', 'asgi')
+
+
+def _puerto_libre():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _entorno_base_de_pruebas():
+    # El subproceso carga los mismos settings; solo cambia la base de datos a la que apunta
+    datos = connection.settings_dict
+    entorno = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'biblioteca.settings'))
+    if connection.vendor == 'sqlite':
+        entorno['SQLITE_RUTA'] = str(datos['NAME'])
+        entorno.pop('DATABASE_URL', None)
+    else:
+        entorno['DATABASE_URL'] = (
+            f"postgres://{datos['USER']}:{datos['PASSWORD']}@{datos['HOST']}:{datos['PORT'] or 5432}/{datos['NAME']}"
+        )
+    # Con DEBUG=False los settings redirigen todo a HTTPS y el benchmark habla HTTP plano
+    # con el servidor local; ambos servidores corren igual, así que la comparación es justa
+    entorno['DEBUG'] = 'True'
+    return entorno
+
+
+def comando_servidor(tipo, puerto, procesos, hilos):
+    if tipo == 'wsgi':
+        # Mismo servidor que el Procfile, con hilos para que un worker no se quede
+        # esperando a un único cliente
+        return [
+            sys.executable, '-m', 'gunicorn', 'biblioteca.wsgi', '--bind', f'127.0.0.1:{puerto}',
+            '--workers', str(procesos), '--worker-class', 'gthread', '--threads', str(hilos),
+            '--backlog', '4096', '--log-level', 'warning',
+        ]
+    return [
+        sys.executable, '-m', 'uvicorn', 'biblioteca.asgi:application', '--host', '127.0.0.1',
+        '--port', str(puerto), '--workers', str(procesos), '--backlog', '4096',
+        '--log-level', 'warning', '--no-access-log',
+    ]
+
+
+@contextmanager
+def servidor(tipo, procesos=2, hilos=8, espera=30, entorno_extra=None):
+    # Arranca el servidor y devuelve (host, puerto) cuando ya acepta conexiones
+    puerto = _puerto_libre()
+    entorno = _entorno_base_de_pruebas()
+    entorno['API_ASINCRONA'] = 'True' if tipo == 'asgi' else 'False'
+    entorno.update(entorno_extra or {})
+    proceso = subprocess.Popen(comando_servidor(tipo, puerto, procesos, hilos), env=entorno)
+    try:
+        limite = time.monotonic() + espera
+        while True:
+            if proceso.poll() is not None:
+                raise CommandError(f'El servidor {tipo} terminó al arrancar (código {proceso.returncode})')
+            try:
+                socket.create_connection(('127.0.0.1', puerto), timeout=1).close()
+                break
+            except OSError:
+                if time.monotonic() > limite:
+                    raise CommandError(f'El servidor {tipo} no respondió en {espera} segundos')
+                time.sleep(0.2)
+        yield '127.0.0.1', puerto
+    finally:
+        proceso.terminate()
+        try:
+            proceso.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            proceso.kill()
+            proceso.wait()
+
+
+async def _leer_respuesta(lector):
+    # Devuelve (status, cabeceras, cuerpo, mantener conexión)
+    # cabeceras es una lista de (nombre en minúsculas, valor), porque Set-Cookie se repite
+    linea_estado = await lector.readline()
+    if not linea_estado:
+        raise ConnectionError('El servidor cerró la conexión')
+    status = int(linea_estado.split(b' ', 2)[1])
+    cabeceras = []
+    while True:
+        linea = await lector.readline()
+        if linea in (b'\r\n', b''):
+            break
+        nombre, _, valor = linea.partition(b':')
+        cabeceras.append((nombre.strip().lower().decode('latin-1'), valor.strip().decode('latin-1')))
+    indice = dict(cabeceras)
+    if 'content-length' in indice:
+        cuerpo = await lector.readexactly(int(indice['content-length']))
+    elif indice.get('transfer-encoding', '').lower() == 'chunked':
+        partes = []
+        while True:
+            tamano = int((await lector.readline()).split(b';')[0], 16)
+            partes.append((await lector.readexactly(tamano + 2))[:-2])
+            if not tamano:
+                break
+        cuerpo = b''.join(partes)
+    elif status not in (204, 304):
+        return status, cabeceras, await lector.read(), False
+    else:
+        cuerpo = b''
+    return status, cabeceras, cuerpo, indice.get('connection', '').lower() != 'close'
+
+
+async def _conexion(host, puerto, peticiones, indice, fin, medir_desde, tiempo_maximo, latencias, resultado):
+    lector = escritor = None
+    numero = indice
+    while time.monotonic() < fin:
+        peticion = peticiones[numero % len(peticiones)]
+        numero += 1
+        inicio = time.monotonic()
+        try:
+            if escritor is None:
+                lector, escritor = await asyncio.open_connection(host, puerto, limit=2 ** 20)
+            escritor.write(peticion)
+            await escritor.drain()
+            status, _, _, mantener = await asyncio.wait_for(_leer_respuesta(lector), tiempo_maximo)
+        except (OSError, ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError):
+            if time.monotonic() >= medir_desde:
+                resultado['errores'] += 1
+            if escritor is not None:
+                escritor.close()
+            lector = escritor = None
+            await asyncio.sleep(0.01)
+            continue
+        if not mantener:
+            escritor.close()
+            lector = escritor = None
+        # Cuenta toda respuesta completada dentro de la ventana medida: con muchas
+        # conexiones una petición puede tardar más que el propio calentamiento
+        ahora = time.monotonic()
+        if medir_desde <= ahora <= fin:
+            latencias.append((ahora - inicio) * 1000)
+            resultado['status'][status] = resultado['status'].get(status, 0) + 1
+    if escritor is not None:
+        escritor.close()
+
+
+def preparar_peticion(host, puerto, ruta, cabeceras=None, metodo='GET', cuerpo=b''):
+    cabeceras = {'Accept': 'application/json', **(cabeceras or {})}
+    lineas = [f'{metodo} {ruta} HTTP/1.1', f'Host: {host}:{puerto}']
+    lineas += [f'{nombre}: {valor}' for nombre, valor in cabeceras.items()]
+    if cuerpo or metodo not in ('GET', 'HEAD'):
+        lineas.append(f'Content-Length: {len(cuerpo)}')
+    return ('\r\n'.join(lineas) + '\r\n\r\n').encode('latin-1') + cuerpo
+
+
+def generar_carga(host, puerto, peticiones, conexiones, duracion, calentamiento=1.0, tiempo_maximo=30.0):
+    # Mantiene `conexiones` conexiones enviando peticiones sin pausa durante
+    # calentamiento + duracion segundos; solo se mide la parte posterior al calentamiento
+    # Una respuesta que tarda más de tiempo_maximo segundos cuenta como error
+    # peticiones: lista de peticiones ya codificadas (ver preparar_peticion) que se reparten en rueda
+    async def principal():
+        ahora = time.monotonic()
+        medir_desde = ahora + calentamiento
+        fin = medir_desde + duracion
+        latencias = []
+        resultado = {'errores': 0, 'status': {}}
+        await asyncio.gather(*[
+            _conexion(host, puerto, peticiones, i, fin, medir_desde, tiempo_maximo, latencias, resultado)
+            for i in range(conexiones)
+        ])
+        return latencias, resultado
+
+    latencias, resultado = asyncio.run(principal())
+    return {
+        'conexiones': conexiones,
+        'peticiones': len(latencias),
+        'peticiones_por_s': round(len(latencias) / duracion, 1),
+        'errores': resultado['errores'],
+        'status': {str(codigo): n for codigo, n in sorted(resultado['status'].items())},
+        **resumir(latencias),
+    }
+
+
+_ERRORES_CONEXION = (OSError, ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError)
+
+
+class PasoFallido(Exception):
+    pass
+
+
+class RespuestaHTTP:
+    def __init__(self, status, cabeceras, cuerpo):
+        self.status = status
+        self.cabeceras = cabeceras
+        self.cuerpo = cuerpo
+
+    def cabecera(self, nombre, defecto=''):
+        return next((valor for clave, valor in self.cabeceras if clave == nombre), defecto)
+
+    def json(self):
+        return json.loads(self.cuerpo)
+
+
+class UsuarioVirtual:
+    # Una conexión persistente con sus cookies, como un navegador o una app móvil
+    # pedir() hace una petición sin medirla (preparación); paso() la mide con su nombre
+
+    def __init__(self, host, puerto, tiempo_maximo, flujo, mediciones):
+        self.host = host
+        self.puerto = puerto
+        self.tiempo_maximo = tiempo_maximo
+        self.flujo = flujo
+        self.mediciones = mediciones
+        self.ventana = None
+        self.cookies = {}
+        self._lector = self._escritor = None
+
+    def cerrar(self):
+        if self._escritor is not None:
+            self._escritor.close()
+        self._lector = self._escritor = None
+
+    async def pedir(self, metodo, ruta, cabeceras=None, formulario=None, datos=None):
+        cabeceras = dict(cabeceras or {})
+        cuerpo = b''
+        if formulario is not None:
+            cuerpo = urlencode(formulario).encode()
+            cabeceras['Content-Type'] = 'application/x-www-form-urlencoded'
+        elif datos is not None:
+            cuerpo = json.dumps(datos).encode()
+            cabeceras['Content-Type'] = 'application/json'
+        if self.cookies:
+            cabeceras['Cookie'] = '; '.join(f'{nombre}={valor}' for nombre, valor in self.cookies.items())
+        peticion = preparar_peticion(self.host, self.puerto, ruta, cabeceras, metodo, cuerpo)
+        try:
+            if self._escritor is None:
+                self._lector, self._escritor = await asyncio.open_connection(self.host, self.puerto, limit=2 ** 20)
+            self._escritor.write(peticion)
+            await self._escritor.drain()
+            status, cabeceras, cuerpo, mantener = await asyncio.wait_for(
+                _leer_respuesta(self._lector), self.tiempo_maximo,
+            )
+        except _ERRORES_CONEXION:
+            self.cerrar()
+            raise
+        if not mantener:
+            self.cerrar()
+        for nombre, valor in cabeceras:
+            if nombre == 'set-cookie':
+                cookie, _, atributos = valor.partition(';')
+                clave, _, contenido = cookie.partition('=')
+                if 'max-age=0' in atributos.lower().replace(' ', ''):
+                    self.cookies.pop(clave.strip(), None)
+                else:
+                    self.cookies[clave.strip()] = contenido.strip()
+        return RespuestaHTTP(status, cabeceras, cuerpo)
+
+    async def paso(self, nombre, metodo, ruta, esperado=200, destino=None, **kwargs):
+        # Falla (PasoFallido) si el status no es el esperado o, en una redirección, si no
+        # lleva a `destino`; el fallo cuenta como error del paso y corta el recorrido
+        inicio = time.monotonic()
+        try:
+            respuesta = await self.pedir(metodo, ruta, **kwargs)
+        except _ERRORES_CONEXION as error:
+            self._anotar(nombre, inicio, None)
+            raise PasoFallido(f'{nombre}: {error!r}')
+        valido = respuesta.status == esperado and (destino is None or respuesta.cabecera('location') == destino)
+        self._anotar(nombre, inicio, respuesta.status, valido)
+        if not valido:
+            raise PasoFallido(f'{nombre}: status {respuesta.status} {respuesta.cabecera("location")}')
+        return respuesta
+
+    def _anotar(self, nombre, inicio, status, valido=False):
+        ahora = time.monotonic()
+        if self.ventana is None or not self.ventana[0] <= ahora <= self.ventana[1]:
+            return
+        medicion = self.mediciones.setdefault((self.flujo, nombre), {'latencias': [], 'errores': 0, 'status': {}})
+        medicion['latencias'].append((ahora - inicio) * 1000)
+        if status is not None:
+            medicion['status'][status] = medicion['status'].get(status, 0) + 1
+        if not valido:
+            medicion['errores'] += 1
+
+
+def ejecutar_usuarios(host, puerto, flujos, duracion, calentamiento=1.0, tiempo_maximo=30.0):
+    # Un usuario virtual por elemento de `flujos`: (nombre, preparar, recorrido)
+    # - preparar(usuario) corre antes de medir (inicio de sesión, tokens) y devuelve un estado
+    # - recorrido(usuario, estado) es una visita completa y se repite sin pausa
+    # Solo se mide lo que termina después del calentamiento y antes del final
+    async def principal():
+        mediciones = {}
+        usuarios = [UsuarioVirtual(host, puerto, tiempo_maximo, nombre, mediciones) for nombre, _, _ in flujos]
+        try:
+            estados = await asyncio.gather(*[
+                preparar(usuario) for usuario, (_, preparar, _) in zip(usuarios, flujos)
+            ])
+        except (PasoFallido, *_ERRORES_CONEXION) as error:
+            for usuario in usuarios:
+                usuario.cerrar()
+            raise CommandError(f'No se pudo preparar a los usuarios virtuales: {error}')
+        medir_desde = time.monotonic() + calentamiento
+        fin = medir_desde + duracion
+        recorridos = {}
+
+        async def repetir(usuario, recorrido, estado):
+            usuario.ventana = (medir_desde, fin)
+            while time.monotonic() < fin:
+                try:
+                    await recorrido(usuario, estado)
+                except PasoFallido:
+                    await asyncio.sleep(0.01)
+                    continue
+                if medir_desde <= time.monotonic() <= fin:
+                    recorridos[usuario.flujo] = recorridos.get(usuario.flujo, 0) + 1
+            usuario.cerrar()
+
+        await asyncio.gather(*[
+            repetir(usuario, recorrido, estado)
+            for usuario, (_, _, recorrido), estado in zip(usuarios, flujos, estados)
+        ])
+        return mediciones, recorridos
+
+    mediciones, recorridos = asyncio.run(principal())
+    usuarios_por_flujo = {}
+    for nombre, _, _ in flujos:
+        usuarios_por_flujo[nombre] = usuarios_por_flujo.get(nombre, 0) + 1
+    return {
+        'flujos': [
+            {
+                'flujo': nombre,
+                'usuarios': usuarios,
+                'recorridos': recorridos.get(nombre, 0),
+                'recorridos_por_s': round(recorridos.get(nombre, 0) / duracion, 2),
+            }
+            for nombre, usuarios in usuarios_por_flujo.items()
+        ],
+        'pasos': [
+            {
+                'flujo': flujo,
+                'paso': paso,
+                'peticiones_por_s': round(len(medicion['latencias']) / duracion, 1),
+                'errores': medicion['errores'],
+                'status': {str(codigo): n for codigo, n in sorted(medicion['status'].items())},
+                **resumir(medicion['latencias']),
+            }
+            for (flujo, paso), medicion in mediciones.items()
+        ],
+    }
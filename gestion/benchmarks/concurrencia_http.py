@@ -0,0 +1,89 @@
+import importlib.util
+import random
+
+from django.core.management.base import CommandError
+
+from gestion import prestamos
+from gestion.autenticacion import tokens_para
+from gestion.models import Libro, Usuario
+
+from .cliente_http import SERVIDORES, generar_carga, preparar_peticion, servidor
+from .utilidades import crear_libros, crear_usuarios
+
+DESCRIPCION = 'Peticiones/s y p99 de la API servida con WSGI (gunicorn) y ASGI (uvicorn) con muchas conexiones'
+
+ENDPOINTS = ('libros', 'libro', 'mis_libros', 'prestamos')
+
+
+def agregar_argumentos(parser):
+    parser.add_argument('--conexiones', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--servidores', choices=SERVIDORES, nargs='+', default=list(SERVIDORES))
+    parser.add_argument('--endpoints', choices=ENDPOINTS, nargs='+', default=list(ENDPOINTS))
+    parser.add_argument('--duracion', type=float, default=10, help='Segundos medidos por escenario')
+    parser.add_argument('--calentamiento', type=float, default=2, help='Segundos sin medir antes de cada escenario')
+    parser.add_argument('--procesos', type=int, default=2, help='Workers de cada servidor')
+    parser.add_argument('--hilos', type=int, default=8, help='Hilos por worker de gunicorn (WSGI)')
+    parser.add_argument('--libros', type=int, default=5000)
+    parser.add_argument('--usuarios', type=int, default=200)
+    parser.add_argument('--prestamos-por-usuario', dest='prestamos_por_usuario', type=int, default=5)
+    parser.add_argument('--semilla', type=int, default=0)
+
+
+def _preparar_datos(opciones):
+    crear_libros(opciones['libros'], semilla=opciones['semilla'])
+    Libro.objects.update(cantidad_stock=opciones['usuarios'])
+    crear_usuarios(opciones['usuarios'], semilla=opciones['semilla'])
+    aleatorio = random.Random(opciones['semilla'])
+    libro_ids = list(Libro.objects.values_list('pk', flat=True))
+    usuarios = list(Usuario.objects.filter(rol='regular'))
+    pares = [
+        (usuario.pk, libro_id)
+        for usuario in usuarios
+        for libro_id in aleatorio.sample(libro_ids, opciones['prestamos_por_usuario'])
+    ]
+    prestamos.prestar_lote(pares)
+    return aleatorio, libro_ids, usuarios
+
+
+def _rutas(endpoint, aleatorio, libro_ids, usuarios):
+    # Una lista de (ruta, cabeceras) por endpoint; el cliente las recorre en rueda
+    # Los endpoints de usuario se autentican con JWT, como una app móvil
+    if endpoint == 'libros':
+        return [('/api/libros/', {})]
+    if endpoint == 'libro':
+        return [(f'/api/libros/{libro_id}/', {}) for libro_id in aleatorio.sample(libro_ids, min(500, len(libro_ids)))]
+    return [
+        (f'/api/usuarios/{usuario.pk}/{endpoint}/', {'Authorization': f'Bearer {tokens_para(usuario).access_token}'})
+        for usuario in usuarios
+    ]
+
+
+def ejecutar(opciones, escribir):
+    if 'asgi' in opciones['servidores'] and importlib.util.find_spec('uvicorn') is None:
+        raise CommandError('El servidor ASGI necesita uvicorn: pip install -r requirements.txt')
+    aleatorio, libro_ids, usuarios = _preparar_datos(opciones)
+    rutas = {endpoint: _rutas(endpoint, aleatorio, libro_ids, usuarios) for endpoint in opciones['endpoints']}
+
+    resultados = []
+    for tipo in opciones['servidores']:
+        with servidor(tipo, procesos=opciones['procesos'], hilos=opciones['hilos']) as (host, puerto):
+            for endpoint in opciones['endpoints']:
+                peticiones = [preparar_peticion(host, puerto, ruta, cabeceras) for ruta, cabeceras in rutas[endpoint]]
+                for conexiones in opciones['conexiones']:
+                    medicion = generar_carga(
+                        host, puerto, peticiones, conexiones,
+                        duracion=opciones['duracion'], calentamiento=opciones['calentamiento'],
+                    )
+                    medicion = {'servidor': tipo, 'endpoint': endpoint, **medicion}
+                    resultados.append(medicion)
+                    escribir(
+                        f"  {tipo:<5} {endpoint:<11} {conexiones:>5} conexiones: "
+                        f"{medicion['peticiones_por_s']:>8} pet/s | p50 {medicion['p50_ms']:>9} ms | "
+                        f"p99 {medicion['p99_ms']:>9} ms | errores {medicion['errores']} | status {medicion['status']}"
+                    )
+    return {
+        'procesos': opciones['procesos'],
+        'hilos_wsgi': opciones['hilos'],
+        'duracion_s': opciones['duracion'],
+        'resultados': resultados,
+    }
@@ -0,0 +1,129 @@
+import random
+import threading
+import time
+from collections import Counter
+
+from django.db import connection
+from django.db.models import Count, Min
+
+from gestion import prestamos
+from gestion.models import Libro, Prestamo, Usuario
+
+from .utilidades import crear_libros, crear_usuarios
+
+DESCRIPCION = 'Estrés multihilo de préstamos: comprueba que el stock nunca sea negativo'
+
+
+def agregar_argumentos(parser):
+    parser.add_argument('--hilos', type=int, default=16)
+    parser.add_argument('--operaciones', type=int, default=200, help='Operaciones por hilo')
+    parser.add_argument('--libros', type=int, default=20, help='Pocos libros para forzar contención')
+    parser.add_argument('--stock', type=int, default=3, help='Ejemplares iniciales de cada libro')
+    parser.add_argument('--usuarios', type=int, default=200)
+    parser.add_argument(
+        '--modo', choices=['servicio', 'legado'], default='servicio',
+        help='"legado" reproduce el antiguo leer-comprobar-guardar para comparar',
+    )
+    parser.add_argument('--semilla', type=int, default=0)
+
+
+def _prestar_legado(usuario, libro_id):
+    # Copia del flujo anterior de PrestamoCreateView (lectura, comprobación y save completo)
+    # sin la antigua tabla intermedia: el préstamo abierto es ahora el que cuenta
+    libro = Libro.objects.get(pk=libro_id)
+    if libro.cantidad_stock <= 0:
+        return prestamos.ResultadoPrestamo.SIN_STOCK
+    if libro in usuario.libros_prestados:
+        return prestamos.ResultadoPrestamo.YA_PRESTADO
+    libro.cantidad_stock -= 1
+    libro.save()
+    Prestamo.objects.create(libro=libro, usuario=usuario)
+    return prestamos.ResultadoPrestamo.OK
+
+
+def _devolver_legado(usuario, libro_id):
+    libro = Libro.objects.get(pk=libro_id)
+    if libro not in usuario.libros_prestados:
+        return prestamos.ResultadoPrestamo.NO_PRESTADO
+    libro.cantidad_stock += 1
+    libro.save()
+    Prestamo.objects.filter(libro=libro, usuario=usuario, devuelto=False).update(devuelto=True)
+    return prestamos.ResultadoPrestamo.OK
+
+
+def _trabajador(semilla, operaciones, usuarios, libro_ids, modo, resultados, bloqueo):
+    aleatorio = random.Random(semilla)
+    locales = Counter()
+    try:
+        for _ in range(operaciones):
+            usuario = aleatorio.choice(usuarios)
+            libro_id = aleatorio.choice(libro_ids)
+            prestar = aleatorio.random() < 0.6
+            try:
+                if modo == 'servicio':
+                    operacion = prestamos.prestar_libro if prestar else prestamos.devolver_libro
+                    estado = operacion(usuario, libro_id).estado
+                else:
+                    estado = (_prestar_legado if prestar else _devolver_legado)(usuario, libro_id)
+            except Exception as error:  # noqa: BLE001 - se reportan como errores del benchmark
+                estado = f'error:{type(error).__name__}'
+            locales[('prestamo' if prestar else 'devolucion', estado)] += 1
+    finally:
+        connection.close()
+    with bloqueo:
+        resultados.update(locales)
+
+
+def ejecutar(opciones, escribir):
+    crear_libros(opciones['libros'], semilla=opciones['semilla'], indexar=False)
+    Libro.objects.update(cantidad_stock=opciones['stock'])
+    crear_usuarios(opciones['usuarios'], semilla=opciones['semilla'])
+    libro_ids = list(Libro.objects.values_list('pk', flat=True))
+    usuarios = list(Usuario.objects.filter(rol='regular'))
+
+    resultados = Counter()
+    bloqueo = threading.Lock()
+    hilos = [
+        threading.Thread(target=_trabajador, args=(
+            opciones['semilla'] + i, opciones['operaciones'], usuarios, libro_ids,
+            opciones['modo'], resultados, bloqueo,
+        ))
+        for i in range(opciones['hilos'])
+    ]
+    inicio = time.perf_counter()
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    duracion = time.perf_counter() - inicio
+
+    # Invariantes: stock nunca negativo y stock + préstamos activos = stock inicial
+    stock_minimo = Libro.objects.aggregate(minimo=Min('cantidad_stock'))['minimo']
+    activos = dict(
+        Prestamo.objects.filter(devuelto=False).values('libro_id').annotate(activos=Count('id'))
+        .values_list('libro_id', 'activos')
+    )
+    descuadres = [
+        pk for pk, stock in Libro.objects.values_list('pk', 'cantidad_stock')
+        if stock + activos.get(pk, 0) != opciones['stock']
+    ]
+    total = sum(resultados.values())
+    prestamos_ok = resultados[('prestamo', prestamos.ResultadoPrestamo.OK)]
+    resumen = {
+        'modo': opciones['modo'],
+        'hilos': opciones['hilos'],
+        'operaciones': total,
+        'duracion_s': round(duracion, 3),
+        'operaciones_por_s': round(total / duracion, 1),
+        'prestamos_por_s': round(prestamos_ok / duracion, 1),
+        'stock_minimo': stock_minimo,
+        'libros_descuadrados': len(descuadres),
+        'resultados': {f'{tipo}:{estado}': n for (tipo, estado), n in sorted(resultados.items())},
+    }
+    for clave, valor in resumen['resultados'].items():
+        escribir(f'  {clave:<32} {valor:>7}')
+    escribir(
+        f"{resumen['operaciones_por_s']} operaciones/s | {resumen['prestamos_por_s']} préstamos/s | "
+        f"stock mínimo {stock_minimo} | libros descuadrados {len(descuadres)}"
+    )
+    return resumen
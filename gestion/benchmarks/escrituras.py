@@ -0,0 +1,91 @@
+import random
+import re
+import time
+from collections import Counter
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from gestion import prestamos
+from gestion.models import Libro, Usuario
+
+from .utilidades import crear_libros, crear_usuarios, resumir
+
+DESCRIPCION = 'Sentencias de escritura y consultas por préstamo y devolución, individuales y por lotes'
+
+_SENTENCIA = re.compile(r'\s*(INSERT|UPDATE|DELETE|SELECT|SAVEPOINT|RELEASE|ROLLBACK)\b(?:.*?\b(?:INTO|FROM)\b)?\s*"?(\w+)?', re.I | re.S)
+_ESCRITURAS = ('INSERT', 'UPDATE', 'DELETE')
+
+
+def agregar_argumentos(parser):
+    parser.add_argument('--operaciones', type=int, default=200, help='Préstamos y devoluciones individuales')
+    parser.add_argument('--lote', type=int, default=50, help='Tamaño de los lotes de préstamo y devolución')
+    parser.add_argument('--lotes', type=int, default=10)
+    parser.add_argument('--semilla', type=int, default=0)
+
+
+def _clasificar(sql):
+    # ('UPDATE', 'gestion_libro'), ('SELECT', None)... según la primera palabra de la sentencia
+    encontrado = _SENTENCIA.match(sql)
+    if not encontrado:
+        return 'OTRA', None
+    tipo = encontrado.group(1).upper()
+    return tipo, encontrado.group(2) if tipo in _ESCRITURAS else None
+
+
+def _medir(operacion, llamadas, prestamos_por_llamada):
+    # Ejecuta cada llamada capturando sus consultas y devuelve las medias por préstamo
+    tipos, tablas, latencias = Counter(), Counter(), []
+    for argumentos in llamadas:
+        with CaptureQueriesContext(connection) as capturadas:
+            inicio = time.perf_counter()
+            resultado = operacion(*argumentos)
+            latencias.append((time.perf_counter() - inicio) * 1000)
+        assert getattr(resultado, 'ok', None) is not False and not getattr(resultado, 'fallos', 0), resultado
+        for consulta in capturadas.captured_queries:
+            tipo, tabla = _clasificar(consulta['sql'])
+            tipos[tipo] += 1
+            if tabla:
+                tablas[tabla] += 1
+    prestamos_medidos = len(llamadas) * prestamos_por_llamada
+    escrituras = sum(tipos[tipo] for tipo in _ESCRITURAS)
+    return {
+        'llamadas': len(llamadas),
+        'escrituras_por_llamada': round(escrituras / len(llamadas), 2),
+        'escrituras_por_prestamo': round(escrituras / prestamos_medidos, 2),
+        'consultas_por_prestamo': round(sum(tipos.values()) / prestamos_medidos, 2),
+        'por_tipo': {tipo: round(n / prestamos_medidos, 2) for tipo, n in sorted(tipos.items())},
+        'escrituras_por_tabla': {tabla: round(n / prestamos_medidos, 2) for tabla, n in sorted(tablas.items())},
+        'latencia_por_llamada': resumir(latencias),
+    }
+
+
+def ejecutar(opciones, escribir):
+    # Stock de sobra: todas las operaciones tienen que salir bien para que la cuenta sea limpia
+    aleatorio = random.Random(opciones['semilla'])
+    necesarios = max(opciones['operaciones'], opciones['lote'])
+    crear_libros(necesarios, semilla=opciones['semilla'], indexar=False)
+    crear_usuarios(max(opciones['operaciones'], opciones['lotes']), semilla=opciones['semilla'])
+    Libro.objects.update(cantidad_stock=10)
+    libro_ids = list(Libro.objects.order_by('pk').values_list('pk', flat=True))
+    usuarios = list(Usuario.objects.filter(rol='regular').order_by('pk'))
+
+    individuales = [(usuario, aleatorio.choice(libro_ids)) for usuario in usuarios[:opciones['operaciones']]]
+    lotes = [
+        ([(usuario.pk, libro_id) for libro_id in aleatorio.sample(libro_ids, opciones['lote'])],)
+        for usuario in usuarios[:opciones['lotes']]
+    ]
+    resultados = {
+        'prestar_libro': _medir(prestamos.prestar_libro, individuales, 1),
+        'devolver_libro': _medir(prestamos.devolver_libro, individuales, 1),
+        'prestar_lote': _medir(prestamos.prestar_lote, lotes, opciones['lote']),
+        'devolver_lote': _medir(prestamos.devolver_lote, lotes, opciones['lote']),
+    }
+    for operacion, fila in resultados.items():
+        tablas = ', '.join(f'{tabla} {n:g}' for tabla, n in fila['escrituras_por_tabla'].items())
+        escribir(
+            f"{operacion:<15} | {fila['escrituras_por_llamada']:>5.2f} escrituras por llamada | "
+            f"{fila['escrituras_por_prestamo']:>5.2f} escrituras y {fila['consultas_por_prestamo']:>5.2f} "
+            f"consultas por préstamo | p50 {fila['latencia_por_llamada']['p50_ms']:>7.2f} ms | {tablas}"
+        )
+    return {'lote': opciones['lote'], 'resultados': resultados}
@@ -0,0 +1,88 @@
+from django.conf import settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from gestion import facetas, versiones
+from gestion.busqueda import buscar_libros
+from gestion.models import Libro
+
+from .utilidades import crear_libros, medir
+
+DESCRIPCION = 'Recuentos de facetas del listado de libros: una consulta por valor frente a una sola consulta'
+
+# (nombre, texto de ?buscar=, filtros)
+ESCENARIOS = [
+    ('sin filtros', '', {}),
+    ('autor', '', {'autor': ['Laura García', 'Mario Allende']}),
+    ('años y disponibles', '', {'año_desde': 1950, 'año_hasta': 1999, 'disponible': True}),
+    ('búsqueda y autor', 'amor', {'autor': ['Laura García']}),
+]
+
+
+def agregar_argumentos(parser):
+    parser.add_argument('--libros', type=int, default=100_000)
+    parser.add_argument('--repeticiones', type=int, default=10)
+    parser.add_argument('--semilla', type=int, default=0)
+
+
+def _por_valor(queryset, filtros):
+    # Lo que haría un cliente (o una vista ingenua): leer los valores de cada faceta y
+    # contar los libros de cada uno con su propia consulta
+    resultado = {}
+    base = queryset.order_by()
+    autores = base.filter(facetas._condiciones(filtros, 'autor'))
+    resultado['autor'] = sorted(
+        ({'autor': autor, 'libros': autores.filter(autor=autor).count()}
+         for autor in autores.values_list('autor', flat=True).distinct()),
+        key=lambda fila: (-fila['libros'], fila['autor']),
+    )[:settings.FACETAS['MAX_AUTORES']]
+    decadas = base.filter(facetas._condiciones(filtros, 'decada'))
+    resultado['decada'] = [
+        {'decada': decada, 'libros': decadas.filter(año_publicacion__gte=decada, año_publicacion__lt=decada + 10).count()}
+        for decada in sorted({año // 10 * 10 for año in decadas.values_list('año_publicacion', flat=True).distinct()})
+    ]
+    disponibles = base.filter(facetas._condiciones(filtros, 'disponible'))
+    resultado['disponible'] = {
+        'disponibles': disponibles.filter(cantidad_stock__gt=0).count(),
+        'no_disponibles': disponibles.filter(cantidad_stock__lte=0).count(),
+    }
+    return resultado
+
+
+def _consultas(funcion):
+    # El registro de consultas tiene un límite; lo vacío para contar solo las de esta llamada
+    connection.queries_log.clear()
+    with CaptureQueriesContext(connection) as contexto:
+        resultado = funcion()
+    return resultado, len(contexto.captured_queries)
+
+
+def ejecutar(opciones, escribir):
+    crear_libros(opciones['libros'], semilla=opciones['semilla'])
+    resultados = []
+    for nombre, buscar, filtros in ESCENARIOS:
+        queryset = buscar_libros(buscar) if buscar else Libro.objects.all()
+        esperado, consultas_por_valor = _consultas(lambda: _por_valor(queryset, filtros))
+        obtenido, consultas_union = _consultas(lambda: facetas.contar(queryset, filtros))
+        if obtenido != esperado:
+            raise AssertionError(f'Las facetas de "{nombre}" no coinciden con el recuento por valor')
+        por_valor = medir(lambda: _por_valor(queryset, filtros), repeticiones=opciones['repeticiones'])
+        union = medir(lambda: facetas.contar(queryset, filtros), repeticiones=opciones['repeticiones'])
+        # Con la caché, como en el listado: la versión del catálogo y la entrada guardada
+        en_cache = medir(
+            lambda: facetas.contar_en_cache(versiones.version_catalogo()[0], queryset, filtros, buscar),
+            repeticiones=opciones['repeticiones'],
+        )
+        fila = {
+            'escenario': nombre,
+            'por_valor': {'consultas': consultas_por_valor, **por_valor},
+            'una_consulta': {'consultas': consultas_union, **union},
+            'en_cache': en_cache,
+        }
+        resultados.append(fila)
+        escribir(
+            f'  {nombre:<20} | por valor: {consultas_por_valor:>4} consultas, p50 {por_valor["p50_ms"]:>9.2f} ms | '
+            f'una consulta: {consultas_union} consulta, p50 {union["p50_ms"]:>8.2f} ms | '
+            f'en caché: p50 {en_cache["p50_ms"]:>6.2f} ms'
+        )
+    return {'libros': opciones['libros'], 'resultados': resultados}
@@ -0,0 +1,117 @@
+import os
+import tempfile
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse
+from django.test import Client, RequestFactory, override_settings
+from django.urls import resolve
+
+from biblioteca import metricas
+from biblioteca.middleware import MetricasMiddleware
+from gestion.models import Libro, Usuario
+
+from .utilidades import crear_libros, resumir
+
+DESCRIPCION = 'Coste por petición del middleware de métricas por vista (con y sin MetricasMiddleware)'
+
+MIDDLEWARE_METRICAS = 'biblioteca.middleware.MetricasMiddleware'
+
+
+def agregar_argumentos(parser):
+    parser.add_argument('--peticiones', type=int, default=2000, help='Peticiones por ruta y modo')
+    parser.add_argument('--rondas', type=int, default=10, help='Rondas alternando con y sin métricas')
+    parser.add_argument('--libros', type=int, default=500)
+    parser.add_argument('--semilla', type=int, default=0)
+
+
+def _rutas():
+    libro = Libro.objects.order_by('pk').values_list('pk', flat=True).first()
+    return {
+        'api libro-detail': f'/api/libros/{libro}/',
+        'api libro-list': '/api/libros/',
+        'web libros-lista': '/libros/',
+    }
+
+
+def _medir_lote(ruta, peticiones, con_metricas, usuario):
+    middleware = [m for m in settings.MIDDLEWARE if m != MIDDLEWARE_METRICAS]
+    if con_metricas:
+        middleware.insert(settings.MIDDLEWARE.index(MIDDLEWARE_METRICAS), MIDDLEWARE_METRICAS)
+    with override_settings(MIDDLEWARE=middleware, ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+        cliente = Client()
+        cliente.force_login(usuario)
+        cliente.get(ruta)
+        latencias = []
+        for _ in range(peticiones):
+            inicio = time.perf_counter()
+            cliente.get(ruta)
+            latencias.append((time.perf_counter() - inicio) * 1000)
+    return latencias
+
+
+def _coste_directo(repeticiones):
+    # Lo que añade el middleware alrededor de una vista que no hace nada, y lo que añade
+    # el envoltorio de consultas a un SELECT trivial; sin el ruido del resto de la petición
+    respuesta = HttpResponse(b'x' * 1000)
+    request = RequestFactory().get('/api/libros/')
+    request.resolver_match = resolve('/api/libros/')
+    vista = MetricasMiddleware(lambda request: respuesta)
+
+    def por_llamada(funcion):
+        inicio = time.perf_counter()
+        for _ in range(repeticiones):
+            funcion()
+        return (time.perf_counter() - inicio) / repeticiones * 1e6
+
+    middleware_us = por_llamada(lambda: vista(request)) - por_llamada(lambda: respuesta)
+    with connection.cursor() as cursor:
+        def consulta():
+            cursor.execute('SELECT 1')
+        sin_medir = por_llamada(consulta)
+        estado = metricas.iniciar()
+        try:
+            con_medir = por_llamada(consulta)
+        finally:
+            metricas.terminar(estado)
+    return {'middleware_us': round(middleware_us, 2), 'consulta_us': round(con_medir - sin_medir, 2)}
+
+
+def ejecutar(opciones, escribir):
+    crear_libros(opciones['libros'], semilla=opciones['semilla'], indexar=False)
+    usuario = Usuario.objects.get(username='SuperAdmin')
+    # Las métricas del benchmark van a un archivo propio, no al del servidor
+    archivo_original = metricas.registro.archivo
+    metricas.registro.archivo = os.path.join(tempfile.gettempdir(), 'biblioteca_benchmark_metricas.sqlite3')
+    try:
+        resultados = []
+        por_lote = max(1, opciones['peticiones'] // opciones['rondas'])
+        for nombre, ruta in _rutas().items():
+            latencias = {False: [], True: []}
+            # Rondas alternas para que el ruido de la máquina afecte igual a ambos modos
+            for _ in range(opciones['rondas']):
+                for con_metricas in (False, True):
+                    latencias[con_metricas] += _medir_lote(ruta, por_lote, con_metricas, usuario)
+            sin, con = resumir(latencias[False]), resumir(latencias[True])
+            fila = {
+                'ruta': nombre,
+                'sin_metricas': sin,
+                'con_metricas': con,
+                'coste_p50_us': round((con['p50_ms'] - sin['p50_ms']) * 1000, 1),
+                'coste_media_us': round((con['media_ms'] - sin['media_ms']) * 1000, 1),
+            }
+            resultados.append(fila)
+            escribir(
+                f"{nombre:<18} | sin métricas p50 {sin['p50_ms']:>7.3f} ms | con métricas p50 {con['p50_ms']:>7.3f} ms | "
+                f"coste p50 {fila['coste_p50_us']:>6} µs | media {fila['coste_media_us']:>6} µs"
+            )
+        directo = _coste_directo(opciones['peticiones'] * 10)
+        escribir(
+            f"Coste directo: middleware {directo['middleware_us']} µs por petición | "
+            f"{directo['consulta_us']} µs por consulta"
+        )
+        metricas.registro.volcar()
+    finally:
+        metricas.registro.archivo = archivo_original
+    return {'coste_directo': directo, 'resultados': resultados}
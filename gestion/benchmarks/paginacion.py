@@ -0,0 +1,57 @@
+from gestion.models import Libro
+from gestion.serializers import LibroSerializer
+
+from .utilidades import crear_libros, medir, memoria_pico
+
+DESCRIPCION = 'Latencia de páginas profundas: paginación por cursor frente a offset'
+
+
+def agregar_argumentos(parser):
+    parser.add_argument('--libros', type=int, default=500_000, help='Tamaño del catálogo (por defecto 500000)')
+    parser.add_argument('--tamano-pagina', dest='tamano_pagina', type=int, default=50)
+    parser.add_argument(
+        '--profundidades', type=float, nargs='+', default=[0, 0.1, 0.5, 0.9, 0.999],
+        help='Posición de la página como fracción del catálogo',
+    )
+    parser.add_argument('--repeticiones', type=int, default=20)
+    parser.add_argument('--semilla', type=int, default=0)
+
+
+def _pagina_offset(offset, tamano):
+    return LibroSerializer(Libro.objects.order_by('pk')[offset:offset + tamano], many=True).data
+
+
+def _pagina_cursor(ultimo_pk, tamano):
+    return LibroSerializer(Libro.objects.filter(pk__gt=ultimo_pk).order_by('pk')[:tamano], many=True).data
+
+
+def ejecutar(opciones, escribir):
+    total = opciones['libros']
+    tamano = opciones['tamano_pagina']
+    crear_libros(total, semilla=opciones['semilla'], indexar=False)
+    resultados = []
+    for profundidad in opciones['profundidades']:
+        offset = min(int(total * profundidad), total - tamano)
+        # El cursor equivale al pk del último libro de la página anterior
+        ultimo_pk = Libro.objects.order_by('pk').values_list('pk', flat=True)[offset - 1] if offset else 0
+        for metodo, funcion in (
+            ('offset', lambda: _pagina_offset(offset, tamano)),
+            ('cursor', lambda: _pagina_cursor(ultimo_pk, tamano)),
+        ):
+            resumen = medir(funcion, repeticiones=opciones['repeticiones'])
+            resultados.append({'libros': total, 'offset': offset, 'metodo': metodo, **resumen})
+            escribir(
+                f'offset {offset:>9} | {metodo:<6} | p50 {resumen["p50_ms"]:>9.2f} ms | '
+                f'p95 {resumen["p95_ms"]:>9.2f} ms'
+            )
+
+    # Memoria del listado completo (comportamiento anterior) frente a una sola página
+    memoria = {
+        'listado_completo_mb': memoria_pico(lambda: LibroSerializer(Libro.objects.all(), many=True).data),
+        'pagina_cursor_mb': memoria_pico(lambda: _pagina_cursor(0, tamano)),
+    }
+    escribir(
+        f'Memoria pico: listado completo {memoria["listado_completo_mb"]} MB | '
+        f'una página {memoria["pagina_cursor_mb"]} MB'
+    )
+    return {'resultados': resultados, 'memoria': memoria}
@@ -0,0 +1,99 @@
+import random
+
+from django.db import connection
+
+from gestion import contadores
+from gestion.autenticacion import tokens_para
+from gestion.models import Libro, Usuario
+
+from .cliente_http import SERVIDORES, ejecutar_usuarios, servidor
+from .utilidades import crear_libros, crear_usuarios
+
+DESCRIPCION = 'Préstamos y devoluciones por segundo con varios workers en cada perfil de base de datos (DB_PERFIL)'
+
+PERFILES = ('basico', 'concurrente')
+
+
+def agregar_argumentos(parser):
+    parser.add_argument('--perfiles', choices=PERFILES, nargs='+', default=list(PERFILES))
+    parser.add_argument('--servidor', choices=SERVIDORES, default='wsgi')
+    parser.add_argument('--usuarios-virtuales', dest='usuarios_virtuales', type=int, default=60)
+    parser.add_argument('--duracion', type=float, default=10, help='Segundos medidos por perfil')
+    parser.add_argument('--calentamiento', type=float, default=2)
+    parser.add_argument('--procesos', type=int, default=4, help='Workers del servidor')
+    parser.add_argument('--hilos', type=int, default=4, help='Hilos por worker de gunicorn (WSGI)')
+    parser.add_argument('--libros', type=int, default=100, help='Pocos libros: varios lectores piden los mismos')
+    parser.add_argument('--semilla', type=int, default=0)
+
+
+def _flujos(opciones, lectores, libro_ids):
+    # Cada usuario virtual es un lector con su token que presta un libro, consulta sus
+    # libros y lo devuelve: las lecturas compiten con las escrituras de los demás
+    flujos = []
+    for indice, lector in enumerate(lectores):
+        aleatorio = random.Random(f"{opciones['semilla']}-{indice}")
+        cabeceras = {'Authorization': f'Bearer {tokens_para(lector).access_token}'}
+        base = f'/api/usuarios/{lector.pk}'
+
+        async def preparar(usuario):
+            return None
+
+        async def recorrido(usuario, estado, aleatorio=aleatorio, cabeceras=cabeceras, base=base):
+            libro = aleatorio.choice(libro_ids)
+            await usuario.paso('prestar_libro', 'POST', f'{base}/prestar_libro/', cabeceras=cabeceras, datos={'libro_id': libro})
+            await usuario.paso('mis_libros', 'GET', f'{base}/mis_libros/', cabeceras=cabeceras)
+            await usuario.paso('devolver_libro', 'POST', f'{base}/devolver_libro/', cabeceras=cabeceras, datos={'libro_id': libro})
+
+        flujos.append(('prestamos', preparar, recorrido))
+    return flujos
+
+
+def _modo_diario(perfil):
+    # El modo WAL queda guardado en el archivo: cada perfil empieza con el suyo, porque
+    # el perfil basico con un archivo ya en WAL mediría otra cosa
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA journal_mode=%s' % ('WAL' if perfil == 'concurrente' else 'DELETE'))
+    connection.close()
+
+
+def ejecutar(opciones, escribir):
+    crear_libros(opciones['libros'], semilla=opciones['semilla'], indexar=False)
+    # Stock de sobra: los fallos que se cuenten son de la base de datos, no de stock
+    Libro.objects.update(cantidad_stock=opciones['usuarios_virtuales'])
+    crear_usuarios(opciones['usuarios_virtuales'], semilla=opciones['semilla'])
+    lectores = list(Usuario.objects.filter(rol='regular').order_by('pk')[:opciones['usuarios_virtuales']])
+    libro_ids = list(Libro.objects.values_list('pk', flat=True))
+
+    resultados = []
+    for perfil in opciones['perfiles']:
+        _modo_diario(perfil)
+        with servidor(opciones['servidor'], opciones['procesos'], opciones['hilos'], entorno_extra={'DB_PERFIL': perfil}) as (host, puerto):
+            medicion = ejecutar_usuarios(
+                host, puerto, _flujos(opciones, lectores, libro_ids),
+                duracion=opciones['duracion'], calentamiento=opciones['calentamiento'],
+            )
+        # Los contadores tienen que cuadrar con Prestamo aunque haya habido errores
+        desviaciones = contadores.verificar()
+        fila = {
+            'perfil': perfil,
+            'motor': connection.vendor,
+            'prestamos_por_s': medicion['flujos'][0]['recorridos_por_s'] if medicion['flujos'] else 0,
+            'pasos': medicion['pasos'],
+            'contadores_desviados': desviaciones,
+        }
+        resultados.append(fila)
+        escribir(f"  {perfil:<12} {fila['prestamos_por_s']:>8} préstamos y devoluciones/s | contadores {desviaciones}")
+        for paso in medicion['pasos']:
+            escribir(
+                f"    {paso['paso']:<15} {paso['peticiones_por_s']:>8} pet/s | p50 {paso['p50_ms']:>8} ms | "
+                f"p99 {paso['p99_ms']:>8} ms | errores {paso['errores']} | status {paso['status']}"
+            )
+    return {
+        'servidor': opciones['servidor'],
+        'procesos': opciones['procesos'],
+        'hilos': opciones['hilos'],
+        'usuarios_virtuales': opciones['usuarios_virtuales'],
+        'resultados': resultados,
+    }
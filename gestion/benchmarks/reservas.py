@@ -0,0 +1,246 @@
+import datetime
+import random
+import time
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from gestion import contadores, generacion, prestamos, reservas
+from gestion.models import Libro, Prestamo, Reserva, Usuario
+
+from .utilidades import crear_reservas, crear_usuarios, percentil, resumir
+
+DESCRIPCION = 'Lista de espera: consultar el stock una y otra vez frente a reservar, coste de la devolución y barrido'
+
+MODOS = ('sondeo', 'reservas')
+
+
+def agregar_argumentos(parser):
+    parser.add_argument('--libros', type=int, default=20_000)
+    parser.add_argument('--usuarios', type=int, default=10_000)
+    parser.add_argument('--prestamos', type=int, default=200_000)
+    parser.add_argument('--reservas', type=int, default=100_000, help='Historial de reservas de fondo')
+    parser.add_argument('--populares', type=int, default=30, help='Libros agotados de la simulación')
+    parser.add_argument('--lectores', type=int, default=20, help='Lectores que esperan cada libro popular')
+    parser.add_argument('--ejemplares', type=int, default=2, help='Ejemplares de cada libro popular')
+    parser.add_argument('--intervalo', type=int, default=5, help='Cada cuántos turnos consulta el stock quien sondea')
+    parser.add_argument('--cola', type=int, default=1000, help='Reservas en espera detrás del libro al medir la devolución')
+    parser.add_argument('--vencidas', type=int, default=5000, help='Apartados vencidos que resuelve el barrido')
+    parser.add_argument('--lote', type=int, default=500)
+    parser.add_argument('--repeticiones', type=int, default=50)
+    parser.add_argument('--semilla', type=int, default=0)
+
+
+def _desorden(llegadas):
+    # Fracción de pares de lectores servidos en orden inverso al de llegada (0 = justo)
+    pares = len(llegadas) * (len(llegadas) - 1) // 2
+    invertidos = sum(1 for i, a in enumerate(llegadas) for b in llegadas[i + 1:] if a > b)
+    return invertidos / pares if pares else 0.0
+
+
+def _simular(modo, opciones):
+    # Turnos simulados sobre libros agotados con lectores esperando
+    # - En cada turno cada préstamo activo se devuelve con probabilidad 1/20
+    # - sondeo: cada lector en espera consulta el stock cada `intervalo` turnos y pide el
+    #   préstamo si ve ejemplares; en un mismo turno gana el que llega antes a pedirlo
+    # - reservas: cada lector reserva al llegar y pide el préstamo en el turno siguiente
+    #   a que se le aparte un ejemplar (el aviso no cuenta como petición)
+    aleatorio = random.Random(opciones['semilla'])
+    ejemplares, por_libro = opciones['ejemplares'], opciones['lectores']
+    crear_usuarios(opciones['populares'] * (ejemplares + por_libro), semilla=modo)
+    usuarios = iter(Usuario.objects.filter(username__startswith=f'lector{modo}_').order_by('pk'))
+    libro_ids = [
+        Libro.objects.create(titulo=f'Popular {modo} {i}', autor='Benchmark', año_publicacion=2024,
+                             cantidad_stock=ejemplares).pk
+        for i in range(opciones['populares'])
+    ]
+    activos = []  # (usuario, libro_id) de los préstamos en curso
+    for libro_id in libro_ids:
+        for _ in range(ejemplares):
+            usuario = next(usuarios)
+            prestamos.prestar_libro(usuario, libro_id)
+            activos.append((usuario, libro_id))
+    # Llegadas repartidas por los primeros 100 turnos; el orden de llegada es el justo
+    lectores = sorted(
+        ((aleatorio.randrange(100), next(usuarios), libro_id) for libro_id in libro_ids for _ in range(por_libro)),
+        key=lambda lector: (lector[0], lector[1].pk),
+    )
+    orden = {lector[1].pk: puesto for puesto, lector in enumerate(lectores)}
+    pendientes = list(lectores)
+    esperando = []
+    servidos = {libro_id: [] for libro_id in libro_ids}
+    esperas = []
+    peticiones = 0
+    segundos_bd = 0.0
+
+    def peticion(funcion, *args):
+        nonlocal peticiones, segundos_bd
+        peticiones += 1
+        inicio = time.perf_counter()
+        resultado = funcion(*args)
+        segundos_bd += time.perf_counter() - inicio
+        return resultado
+
+    def consultar_stock(libro_id):
+        return Libro.objects.filter(pk=libro_id).values_list('cantidad_stock', flat=True).first()
+
+    def servir(lector, turno):
+        llegada, usuario, libro_id = lector
+        activos.append((usuario, libro_id))
+        servidos[libro_id].append(orden[usuario.pk])
+        esperas.append(turno - llegada)
+
+    turno = 0
+    while (pendientes or esperando) and turno < 5000:
+        for prestamo in [prestamo for prestamo in activos if aleatorio.random() < 0.05]:
+            activos.remove(prestamo)
+            prestamos.devolver_libro(*prestamo)
+        while pendientes and pendientes[0][0] == turno:
+            lector = pendientes.pop(0)
+            if modo == 'reservas' and peticion(reservas.reservar, lector[1], lector[2]).estado == 'hay_stock' \
+                    and peticion(prestamos.prestar_libro, lector[1], lector[2]).ok:
+                servir(lector, turno)
+            else:
+                esperando.append(lector)
+        if modo == 'sondeo':
+            turno_lectores = [lector for lector in esperando if (turno - lector[0]) % opciones['intervalo'] == 0]
+            aleatorio.shuffle(turno_lectores)
+            for lector in turno_lectores:
+                if peticion(consultar_stock, lector[2]) and peticion(prestamos.prestar_libro, lector[1], lector[2]).ok:
+                    esperando.remove(lector)
+                    servir(lector, turno)
+        else:
+            # Los avisados en el turno anterior: el aviso lo haría la aplicación
+            avisados = set(Reserva.objects.filter(
+                usuario_id__in=[lector[1].pk for lector in esperando], estado=Reserva.ASIGNADA,
+            ).values_list('usuario_id', flat=True))
+            for lector in [lector for lector in esperando if lector[1].pk in avisados]:
+                if peticion(prestamos.prestar_libro, lector[1], lector[2]).ok:
+                    esperando.remove(lector)
+                    servir(lector, turno)
+        turno += 1
+
+    # Ningún ejemplar se pierde ni se duplica: stock + prestados + apartados = ejemplares
+    for libro_id in libro_ids:
+        cuenta = (Libro.objects.get(pk=libro_id).cantidad_stock
+                  + Prestamo.objects.filter(libro_id=libro_id, devuelto=False).count()
+                  + Reserva.objects.filter(libro_id=libro_id, estado=Reserva.ASIGNADA).count())
+        if cuenta != ejemplares:
+            raise AssertionError(f'El libro {libro_id} tiene {cuenta} ejemplares en lugar de {ejemplares}')
+    lectores_servidos = len(esperas)
+    return {
+        'turnos': turno,
+        'servidos': lectores_servidos,
+        'peticiones': peticiones,
+        'peticiones_por_lector': round(peticiones / max(lectores_servidos, 1), 2),
+        'segundos_bd': round(segundos_bd, 2),
+        'espera_media': round(sum(esperas) / max(lectores_servidos, 1), 1),
+        'espera_p95': percentil(esperas, 95),
+        'desorden': round(sum(_desorden(cola) for cola in servidos.values()) / len(servidos), 3),
+    }
+
+
+def _coste_operaciones(opciones):
+    # Latencia y consultas de devolver y prestar sin cola y con `cola` reservas esperando
+    # Con cola, cada devolución aparta el ejemplar para el primero, que lo recoge, y quien
+    # devolvió vuelve a reservar al final: la cola mantiene su longitud
+    crear_usuarios(opciones['cola'] + 1, semilla='coste')
+    usuarios = list(Usuario.objects.filter(username__startswith='lectorcoste_').order_by('pk'))
+    resultado = {}
+    for modo in ('sin cola', 'con cola'):
+        libro = Libro.objects.create(titulo=f'Coste {modo}', autor='Benchmark', año_publicacion=2024, cantidad_stock=1)
+        poseedor = usuarios[0]
+        prestamos.prestar_libro(poseedor, libro.pk)
+        if modo == 'con cola':
+            inicio = timezone.now() - datetime.timedelta(hours=1)
+            Reserva.objects.bulk_create([
+                Reserva(libro=libro, usuario=usuario, creada=inicio + datetime.timedelta(milliseconds=i))
+                for i, usuario in enumerate(usuarios[1:])
+            ])
+        latencias = {'devolver': [], 'prestar': []}
+        consultas = {}
+        for repeticion in range(opciones['repeticiones'] + 3):
+            contar = repeticion == opciones['repeticiones'] + 2
+            for operacion in ('devolver', 'prestar'):
+                if operacion == 'prestar':
+                    siguiente = poseedor if modo == 'sin cola' else Usuario.objects.get(
+                        reservas__libro=libro, reservas__estado=Reserva.ASIGNADA)
+                connection.queries_log.clear()
+                with CaptureQueriesContext(connection) as capturadas:
+                    inicio = time.perf_counter()
+                    if operacion == 'devolver':
+                        ok = prestamos.devolver_libro(poseedor, libro.pk).ok
+                    else:
+                        ok = prestamos.prestar_libro(siguiente, libro.pk).ok
+                    segundos = time.perf_counter() - inicio
+                if not ok:
+                    raise AssertionError(f'No se pudo {operacion} el libro del benchmark ({modo})')
+                if repeticion >= 3:
+                    latencias[operacion].append(segundos * 1000)
+                if contar:
+                    consultas[operacion] = len(capturadas)
+            if modo == 'con cola':
+                reservas.reservar(poseedor, libro.pk)
+                poseedor = siguiente
+        resultado[modo] = {
+            operacion: {'consultas': consultas[operacion], **resumir(valores)}
+            for operacion, valores in latencias.items()
+        }
+    return resultado
+
+
+def _barrido(opciones):
+    # `vencidas` libros agotados con el primero de su cola apartado y ya vencido
+    crear_usuarios(2, semilla='barrido')
+    primero, segundo = Usuario.objects.filter(username__startswith='lectorbarrido_').order_by('pk')
+    libro_ids = list(Libro.objects.order_by('pk').values_list('pk', flat=True)[:opciones['vencidas']])
+    Libro.objects.filter(pk__in=libro_ids).update(cantidad_stock=0)
+    antes = timezone.now() - datetime.timedelta(days=10)
+    Reserva.objects.bulk_create([
+        Reserva(libro_id=libro_id, usuario=usuario, creada=antes, estado=estado,
+                asignada=antes if estado == Reserva.ASIGNADA else None,
+                vence=antes if estado == Reserva.ASIGNADA else None)
+        for libro_id in libro_ids
+        for usuario, estado in ((primero, Reserva.ASIGNADA), (segundo, Reserva.ESPERA))
+    ])
+    inicio = time.monotonic()
+    resultado = reservas.barrer(tamano_lote=opciones['lote'])
+    segundos = time.monotonic() - inicio
+    # Las asignadas pueden ser más: el barrido también reparte el stock libre de otras colas
+    if resultado['vencidas'] != len(libro_ids) or resultado['asignadas'] < len(libro_ids):
+        raise AssertionError(f'El barrido resolvió {resultado} en lugar de {len(libro_ids)} vencidas')
+    if Libro.objects.filter(pk__in=libro_ids, cantidad_stock__gt=0).exists():
+        raise AssertionError('El barrido dejó en el stock ejemplares con la cola esperando')
+    return {**resultado, 'segundos': round(segundos, 2), 'por_segundo': round(resultado['vencidas'] / segundos)}
+
+
+def ejecutar(opciones, escribir):
+    generacion.generar(opciones['libros'], opciones['usuarios'], opciones['prestamos'],
+                       semilla=opciones['semilla'], indexar=False)
+    crear_reservas(opciones['reservas'], semilla=opciones['semilla'])
+    escribir(f'  {Prestamo.objects.count()} préstamos y {Reserva.objects.count()} reservas de fondo')
+
+    simulacion = {}
+    for modo in MODOS:
+        simulacion[modo] = fila = _simular(modo, opciones)
+        escribir(f'  {modo:<8} | {fila["servidos"]} lectores en {fila["turnos"]} turnos | '
+                 f'{fila["peticiones"]:>6} peticiones ({fila["peticiones_por_lector"]:.1f} por lector, '
+                 f'{fila["segundos_bd"]:.1f} s de BD) | espera media {fila["espera_media"]} turnos, '
+                 f'p95 {fila["espera_p95"]} | desorden {fila["desorden"]:.3f}')
+
+    operaciones = _coste_operaciones(opciones)
+    for modo, filas in operaciones.items():
+        for operacion, fila in filas.items():
+            escribir(f'  {operacion} {modo:<8}: {fila["consultas"]:>2} consultas, '
+                     f'p50 {fila["p50_ms"]:.2f} ms, p95 {fila["p95_ms"]:.2f} ms')
+
+    barrido = _barrido(opciones)
+    escribir(f'  barrido: {barrido["vencidas"]} vencidas reasignadas en {barrido["segundos"]:.1f} s '
+             f'({barrido["por_segundo"]}/s), {barrido["lotes"]} lotes, el más largo {barrido["max_lote_ms"]:.0f} ms')
+
+    desviados = contadores.verificar()
+    if desviados['libro'] or desviados['usuario'] or desviados['global']:
+        raise AssertionError(f'Contadores desviados: {desviados}')
+
+    return {'simulacion': simulacion, 'operaciones': operaciones, 'barrido': barrido}
@@ -0,0 +1,84 @@
+import random
+
+from rest_framework.renderers import JSONRenderer
+
+from gestion import serializacion
+from gestion.models import Libro, Prestamo, Usuario
+from gestion.renderizadores import JSONRapidoRenderer
+from gestion.serializers import LibroSerializer, UsuarioSerializer
+
+from .utilidades import crear_libros, crear_usuarios, medir, memoria_pico
+
+DESCRIPCION = 'Serialización y JSON de listados: ModelSerializer + JSONRenderer frente a la ruta rápida'
+
+MODELOS = ('libros', 'usuarios')
+
+
+def agregar_argumentos(parser):
+    parser.add_argument('--tamanos', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--modelos', choices=MODELOS, nargs='+', default=list(MODELOS))
+    parser.add_argument('--repeticiones', type=int, default=5)
+    parser.add_argument('--semilla', type=int, default=0)
+
+
+def _preparar(opciones):
+    # Cada usuario tiene hasta 3 libros prestados para que libros_prestados no vaya vacío
+    maximo = max(opciones['tamanos'])
+    crear_libros(maximo, semilla=opciones['semilla'], indexar=False)
+    if 'usuarios' in opciones['modelos']:
+        crear_usuarios(maximo, semilla=opciones['semilla'])
+        aleatorio = random.Random(opciones['semilla'])
+        libro_ids = list(Libro.objects.values_list('pk', flat=True))
+        usuario_ids = list(Usuario.objects.order_by('pk').values_list('pk', flat=True))
+        for inicio in range(0, len(usuario_ids), 5000):
+            Prestamo.objects.bulk_create([
+                Prestamo(usuario_id=usuario_id, libro_id=libro_id)
+                for usuario_id in usuario_ids[inicio:inicio + 5000]
+                for libro_id in aleatorio.sample(libro_ids, aleatorio.randint(0, 3))
+            ])
+
+
+# Cada ruta lee n filas y devuelve los bytes de la respuesta con la forma de la API
+def _actual(modelo, n):
+    if modelo == 'libros':
+        data = LibroSerializer(Libro.objects.order_by('pk')[:n], many=True).data
+    else:
+        data = UsuarioSerializer(Usuario.objects.order_by('pk')[:n], many=True).data
+    return JSONRenderer().render({'mensaje': f'Se encontraron {n} {modelo}', modelo: data})
+
+
+def _rapida(modelo, n):
+    if modelo == 'libros':
+        data = serializacion.filas_libros(Libro.objects.order_by('pk').values('pk', *serializacion.CAMPOS_LIBRO)[:n])
+    else:
+        data = serializacion.filas_usuarios(
+            Usuario.objects.order_by('pk').values('pk', *serializacion.CAMPOS_USUARIO)[:n]
+        )
+    return JSONRapidoRenderer().render({'mensaje': f'Se encontraron {n} {modelo}', modelo: data})
+
+
+def ejecutar(opciones, escribir):
+    _preparar(opciones)
+    resultados = []
+    for modelo in opciones['modelos']:
+        for n in opciones['tamanos']:
+            # La comparación solo vale si ambas rutas producen exactamente los mismos bytes
+            identicos = _actual(modelo, n) == _rapida(modelo, n)
+            for ruta, funcion in (('actual', _actual), ('rapida', _rapida)):
+                resumen = medir(lambda: funcion(modelo, n), repeticiones=opciones['repeticiones'], calentamiento=1)
+                fila = {
+                    'modelo': modelo,
+                    'filas': n,
+                    'ruta': ruta,
+                    'filas_por_s': round(n / (resumen['p50_ms'] / 1000)),
+                    'memoria_pico_mb': memoria_pico(lambda: funcion(modelo, n)),
+                    'identicos': identicos,
+                    **resumen,
+                }
+                resultados.append(fila)
+                escribir(
+                    f"{modelo:<8} {n:>7} filas | {ruta:<6} | p50 {fila['p50_ms']:>10.2f} ms | "
+                    f"{fila['filas_por_s']:>9} filas/s | pico {fila['memoria_pico_mb']:>8.2f} MB | "
+                    f"bytes idénticos: {'sí' if identicos else 'NO'}"
+                )
+    return {'resultados': resultados}
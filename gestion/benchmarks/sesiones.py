@@ -0,0 +1,122 @@
+import random
+import time
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from gestion import prestamos
+from gestion.models import Libro, Usuario
+
+from .utilidades import crear_libros, crear_usuarios, resumir
+
+DESCRIPCION = 'Consultas y latencia por página de la web con la sesión y el usuario leídos de la base de datos o de la caché'
+
+# db: sesiones en la base de datos y usuario leído en cada petición; cache: SESION_EN_CACHE
+MODOS = ('db', 'cache')
+MOTORES = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cache': 'django.contrib.sessions.backends.cached_db',
+}
+# Página -> (ruta, requiere administrador)
+PAGINAS = {
+    'catalogo': ('/libros/', False),
+    'detalle': ('/libros/{libro}/', False),
+    'mis_prestamos': ('/mis-prestamos/', False),
+    'mi_historial': ('/mi-historial-prestamos/', False),
+    'usuarios': ('/administrar-usuarios/', True),
+    'historial': ('/historial-prestamos/', True),
+}
+
+
+def agregar_argumentos(parser):
+    parser.add_argument('--modos', choices=MODOS, nargs='+', default=list(MODOS))
+    parser.add_argument('--paginas', choices=PAGINAS, nargs='+', default=list(PAGINAS))
+    parser.add_argument('--peticiones', type=int, default=300, help='Peticiones medidas por página y modo')
+    parser.add_argument('--libros', type=int, default=500)
+    parser.add_argument('--usuarios', type=int, default=50)
+    parser.add_argument('--semilla', type=int, default=0)
+
+
+def _preparar(opciones):
+    crear_libros(opciones['libros'], semilla=opciones['semilla'], indexar=False)
+    Libro.objects.update(cantidad_stock=opciones['usuarios'])
+    crear_usuarios(opciones['usuarios'], semilla=opciones['semilla'])
+    aleatorio = random.Random(opciones['semilla'])
+    libro_ids = list(Libro.objects.values_list('pk', flat=True))
+    lector = Usuario.objects.filter(rol='regular').order_by('pk').first()
+    prestamos.prestar_lote([(lector.pk, libro_id) for libro_id in aleatorio.sample(libro_ids, 5)])
+    return lector, Usuario.objects.get(username='SuperAdmin'), aleatorio.choice(libro_ids)
+
+
+def _consultas_autenticacion(cliente):
+    # Lo que cuestan SessionMiddleware y AuthenticationMiddleware por sí solos: cargar la
+    # sesión de la cookie y resolver su usuario, fuera del resto de la página
+    request = RequestFactory().get('/')
+    request.session = import_module(settings.SESSION_ENGINE).SessionStore(
+        cliente.cookies[settings.SESSION_COOKIE_NAME].value
+    )
+    with CaptureQueriesContext(connection) as capturadas:
+        usuario = get_user(request)
+    assert usuario.is_authenticated
+    return len(capturadas)
+
+
+def _medir_pagina(cliente, ruta, peticiones):
+    # La primera petición calienta la caché (sesión, usuario y páginas del catálogo)
+    assert cliente.get(ruta).status_code == 200, ruta
+    latencias, consultas = [], 0
+    for _ in range(peticiones):
+        with CaptureQueriesContext(connection) as capturadas:
+            inicio = time.perf_counter()
+            respuesta = cliente.get(ruta)
+            latencias.append((time.perf_counter() - inicio) * 1000)
+        assert respuesta.status_code == 200, (ruta, respuesta.status_code)
+        consultas += len(capturadas)
+    return {
+        'consultas_por_pagina': round(consultas / peticiones, 2),
+        'consultas_autenticacion': _consultas_autenticacion(cliente),
+        'latencia': resumir(latencias),
+    }
+
+
+def ejecutar(opciones, escribir):
+    lector, administrador, libro_id = _preparar(opciones)
+    resultados = []
+    for modo in opciones['modos']:
+        ajustes = {
+            'SESSION_ENGINE': MOTORES[modo],
+            'SESION_EN_CACHE': {**settings.SESION_EN_CACHE, 'ACTIVA': modo == 'cache'},
+            'ALLOWED_HOSTS': [*settings.ALLOWED_HOSTS, 'testserver'],
+        }
+        with override_settings(**ajustes):
+            cache.clear()
+            # Un cliente por modo: SessionMiddleware elige el motor de sesiones al crearse
+            clientes = {False: Client(), True: Client()}
+            clientes[False].force_login(lector)
+            clientes[True].force_login(administrador)
+            for pagina in opciones['paginas']:
+                ruta, de_administrador = PAGINAS[pagina]
+                fila = _medir_pagina(clientes[de_administrador], ruta.format(libro=libro_id), opciones['peticiones'])
+                resultados.append({'modo': modo, 'pagina': pagina, **fila})
+                escribir(
+                    f"  {modo:<6} {pagina:<14} {fila['consultas_por_pagina']:>5} consultas/página "
+                    f"({fila['consultas_autenticacion']} de sesión y usuario) | "
+                    f"p50 {fila['latencia']['p50_ms']:>7.2f} ms | p99 {fila['latencia']['p99_ms']:>7.2f} ms"
+                )
+
+    # Cambio de cada página del modo db al modo cache
+    por_clave = {(r['modo'], r['pagina']): r for r in resultados}
+    for pagina in opciones['paginas']:
+        antes, despues = por_clave.get(('db', pagina)), por_clave.get(('cache', pagina))
+        if antes and despues:
+            cambio = (despues['latencia']['p50_ms'] - antes['latencia']['p50_ms']) / antes['latencia']['p50_ms'] * 100
+            escribir(
+                f"  {pagina:<14} cache frente a db: {antes['consultas_por_pagina']} → "
+                f"{despues['consultas_por_pagina']} consultas, {cambio:+.1f}% p50"
+            )
+    return {'peticiones': opciones['peticiones'], 'resultados': resultados}
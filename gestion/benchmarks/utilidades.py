@@ -0,0 +1,256 @@
+import math
+import os
+import random
+import statistics
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# Funciones compartidas por los benchmarks: medición de latencias y datos sintéticos
+
+PALABRAS_TITULO = [
+    'El', 'La', 'Los', 'Las', 'de', 'del', 'y', 'en', 'sombra', 'viento', 'camino',
+    'corazón', 'noche', 'mañana', 'historia', 'jardín', 'canción', 'océano', 'memoria',
+    'ciudad', 'río', 'montaña', 'silencio', 'árbol', 'estación', 'invierno', 'verano',
+    'niño', 'último', 'perdido', 'secreto', 'tiempo', 'años', 'pájaro', 'fuego', 'agua',
+    'luz', 'cien', 'soledad', 'amor', 'guerra', 'paz', 'isla', 'puerta', 'reino', 'sueño',
+]
+NOMBRES_AUTOR = [
+    'Gabriel', 'Isabel', 'Julio', 'Mario', 'Laura', 'Jorge', 'Elena', 'Ramón', 'Sofía',
+    'Andrés', 'Begoña', 'José', 'María', 'Íñigo', 'Lucía', 'Rosalía', 'Benito', 'Carmen',
+]
+APELLIDOS_AUTOR = [
+    'García', 'Márquez', 'Allende', 'Cortázar', 'Vargas', 'Borges', 'Poniatowska',
+    'Núñez', 'Pérez', 'Muñoz', 'Galdós', 'Castro', 'Martín', 'Ibáñez', 'Gómez', 'Sánchez',
+]
+
+
+@contextmanager
+def base_de_pruebas(keepdb=False):
+    # Crea una base de datos de pruebas (como manage.py test) y la destruye al salir,
+    # para no tocar nunca los datos reales del entorno en el que se lanza
+    from django.db import connection
+
+    nombre_original = connection.settings_dict['NAME']
+    if connection.vendor == 'sqlite' and not connection.settings_dict['TEST']['NAME']:
+        # En SQLite uso un archivo en lugar de la base en memoria de los tests:
+        # es lo que corre en producción y permite medir varios hilos escribiendo
+        connection.settings_dict['TEST']['NAME'] = os.path.join(
+            tempfile.gettempdir(), 'biblioteca_benchmark.sqlite3'
+        )
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=keepdb)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(nombre_original, verbosity=0, keepdb=keepdb)
+
+
+def percentil(valores, p):
+    # Percentil por el método del rango más cercano, suficiente para reportes de latencia
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    rango = max(1, math.ceil(p / 100 * len(ordenados)))
+    return ordenados[rango - 1]
+
+
+def resumir(latencias_ms):
+    # Resumen estándar que usan todos los benchmarks para reportar latencias
+    return {
+        'n': len(latencias_ms),
+        'media_ms': round(statistics.fmean(latencias_ms), 3) if latencias_ms else 0.0,
+        'p50_ms': round(percentil(latencias_ms, 50), 3),
+        'p95_ms': round(percentil(latencias_ms, 95), 3),
+        'p99_ms': round(percentil(latencias_ms, 99), 3),
+        'max_ms': round(max(latencias_ms), 3) if latencias_ms else 0.0,
+    }
+
+
+def medir(funcion, repeticiones=50, calentamiento=3):
+    # Ejecuta la función varias veces y devuelve el resumen de latencias en milisegundos
+    for _ in range(calentamiento):
+        funcion()
+    latencias = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        latencias.append((time.perf_counter() - inicio) * 1000)
+    return resumir(latencias)
+
+
+def memoria_pico(funcion):
+    # Pico de memoria reservada por Python durante la llamada, en MB
+    tracemalloc.start()
+    try:
+        funcion()
+        _, pico = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return round(pico / 1024 / 1024, 2)
+
+
+def titulo_aleatorio(aleatorio):
+    return ' '.join(aleatorio.choices(PALABRAS_TITULO, k=aleatorio.randint(2, 6))).capitalize()
+
+
+def autor_aleatorio(aleatorio):
+    return f'{aleatorio.choice(NOMBRES_AUTOR)} {aleatorio.choice(APELLIDOS_AUTOR)}'
+
+
+def crear_libros(cantidad, semilla=0, tamano_lote=5000, indexar=True):
+    # Inserta libros sintéticos con bulk_create y reconstruye el índice de búsqueda
+    # (bulk_create no dispara post_save, así que el índice se construye al final)
+    # Los benchmarks que no buscan pueden saltarse el índice con indexar=False
+    from gestion.busqueda import reindexar_catalogo
+    from gestion.models import Libro
+
+    aleatorio = random.Random(semilla)
+    for inicio in range(0, cantidad, tamano_lote):
+        Libro.objects.bulk_create([
+            Libro(
+                titulo=titulo_aleatorio(aleatorio),
+                autor=autor_aleatorio(aleatorio),
+                año_publicacion=aleatorio.randint(1850, 2024),
+                cantidad_stock=aleatorio.randint(0, 10),
+            )
+            for _ in range(min(tamano_lote, cantidad - inicio))
+        ])
+    if indexar:
+        reindexar_catalogo(tamano_lote=tamano_lote)
+
+
+def crear_usuarios(cantidad, semilla=0, tamano_lote=5000, password='lector1234'):
+    # Inserta usuarios regulares con bulk_create
+    # La contraseña se hashea una sola vez y se reutiliza para todos los usuarios
+    from django.contrib.auth.hashers import make_password
+    from gestion.models import Usuario
+
+    password_hash = make_password(password)
+    for inicio in range(0, cantidad, tamano_lote):
+        Usuario.objects.bulk_create([
+            Usuario(
+                username=f'lector{semilla}_{i}',
+                email=f'lector{semilla}_{i}@biblioteca.test',
+                password=password_hash,
+                rol='regular',
+            )
+            for i in range(inicio, min(inicio + tamano_lote, cantidad))
+        ])
+
+
+# Páginas con un número de consultas fijo, sin importar cuántas filas muestran:
+# (nombre de la URL, usuario que la visita). Sus presupuestos están en gestion/tests.py
+# y el comando verificar_consultas las recorre con más rondas
+PAGINAS_ACOTADAS = [
+    ('historial-prestamos', 'admin'),
+    ('mi-historial-prestamos', 'lector'),
+    ('prestamos-listas', 'lector'),
+    ('mis-reservas', 'lector'),
+    ('administrar-usuarios', 'admin'),
+]
+
+
+def crear_ronda_historial(lector, filas, semilla=0):
+    # Añade `filas` libros prestados al lector, préstamos de otros tantos usuarios
+    # nuevos (con alguna devolución) y reservas del lector en libros agotados, la mitad
+    # ya canceladas: lo que pintan las PAGINAS_ACOTADAS
+    from gestion import prestamos, reservas
+    from gestion.models import Libro, Usuario
+
+    ultimo_libro = Libro.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+    ultimo_usuario = Usuario.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+    crear_libros(filas, semilla=semilla, indexar=False)
+    crear_usuarios(filas, semilla=semilla)
+    libro_ids = list(Libro.objects.filter(pk__gt=ultimo_libro).values_list('pk', flat=True))
+    Libro.objects.filter(pk__in=libro_ids).update(cantidad_stock=2)
+    usuario_ids = list(Usuario.objects.filter(pk__gt=ultimo_usuario).values_list('pk', flat=True))
+    pares = [(lector.pk, libro_id) for libro_id in libro_ids]
+    pares += list(zip(usuario_ids, libro_ids))
+    prestamos.prestar_lote(pares)
+    prestamos.devolver_lote(pares[len(libro_ids)::2])
+    ultimo_libro = Libro.objects.order_by('-pk').values_list('pk', flat=True).first()
+    crear_libros(filas, semilla=f'reservas{semilla}', indexar=False)
+    agotados = list(Libro.objects.filter(pk__gt=ultimo_libro).values_list('pk', flat=True))
+    Libro.objects.filter(pk__in=agotados).update(cantidad_stock=0)
+    for libro_id in agotados:
+        reservas.reservar(lector, libro_id)
+    for libro_id in agotados[::2]:
+        reservas.cancelar(lector, libro_id)
+
+
+def crear_prestamos(cantidad, semilla=0, proporcion_activos=0.05, dias=3 * 365, tamano_lote=5000):
+    # Inserta un historial sintético entre los libros y usuarios regulares existentes
+    # - Las fechas avanzan con el id, como en un historial real, y cubren los últimos `dias`
+    # - Los préstamos más recientes quedan activos (uno como mucho por usuario y libro)
+    # bulk_create no pasa por gestion/prestamos.py, así que al final se recalculan los
+    # contadores; el stock de los libros no se toca
+    import datetime
+
+    from django.utils import timezone
+
+    from gestion import contadores
+    from gestion.models import Libro, Prestamo, Usuario
+
+    aleatorio = random.Random(semilla)
+    libro_ids = list(Libro.objects.values_list('pk', flat=True))
+    usuario_ids = list(Usuario.objects.filter(rol='regular').values_list('pk', flat=True))
+    ahora = timezone.now()
+    paso = datetime.timedelta(days=dias) / max(cantidad, 1)
+    inicio_activos = cantidad - int(cantidad * proporcion_activos)
+    activos = set()
+    for inicio in range(0, cantidad, tamano_lote):
+        lote = []
+        for i in range(inicio, min(inicio + tamano_lote, cantidad)):
+            par = (aleatorio.choice(usuario_ids), aleatorio.choice(libro_ids))
+            fecha = ahora - paso * (cantidad - i)
+            if i >= inicio_activos and par not in activos:
+                activos.add(par)
+                lote.append(Prestamo(usuario_id=par[0], libro_id=par[1], fecha_prestamo=fecha))
+            else:
+                devolucion = fecha + datetime.timedelta(days=aleatorio.randint(1, 30))
+                lote.append(Prestamo(
+                    usuario_id=par[0], libro_id=par[1], fecha_prestamo=fecha,
+                    devuelto=True, fecha_devolucion=min(devolucion, ahora),
+                ))
+        Prestamo.objects.bulk_create(lote)
+    contadores.verificar(reparar=True, tamano_lote=tamano_lote)
+
+
+def crear_reservas(cantidad, semilla=0, proporcion_abiertas=0.1, dias=365, tamano_lote=5000):
+    # Inserta un historial sintético de reservas entre los libros y usuarios regulares existentes
+    # - Las fechas avanzan con el id y cubren los últimos `dias`
+    # - Casi todas están resueltas; las más recientes siguen en espera en los libros sin
+    #   stock (una abierta como mucho por usuario y libro). Ninguna tiene ejemplar apartado,
+    #   así que el stock de los libros sigue cuadrando
+    import datetime
+
+    from django.utils import timezone
+
+    from gestion.models import Libro, Reserva, Usuario
+
+    aleatorio = random.Random(semilla)
+    libro_ids = list(Libro.objects.values_list('pk', flat=True))
+    agotados = list(Libro.objects.filter(cantidad_stock=0).values_list('pk', flat=True)) or libro_ids
+    usuario_ids = list(Usuario.objects.filter(rol='regular').values_list('pk', flat=True))
+    resueltas = (Reserva.COMPLETADA, Reserva.COMPLETADA, Reserva.CANCELADA, Reserva.VENCIDA)
+    ahora = timezone.now()
+    paso = datetime.timedelta(days=dias) / max(cantidad, 1)
+    inicio_abiertas = cantidad - int(cantidad * proporcion_abiertas)
+    abiertas = set()
+    for inicio in range(0, cantidad, tamano_lote):
+        lote = []
+        for i in range(inicio, min(inicio + tamano_lote, cantidad)):
+            creada = ahora - paso * (cantidad - i)
+            par = (aleatorio.choice(usuario_ids), aleatorio.choice(agotados))
+            if i >= inicio_abiertas and par not in abiertas:
+                abiertas.add(par)
+                lote.append(Reserva(usuario_id=par[0], libro_id=par[1], creada=creada))
+                continue
+            estado = aleatorio.choice(resueltas)
+            asignada = None if estado == Reserva.CANCELADA else creada + datetime.timedelta(days=aleatorio.randint(1, 20))
+            lote.append(Reserva(
+                usuario_id=par[0], libro_id=aleatorio.choice(libro_ids), creada=creada, estado=estado,
+                asignada=asignada, vence=asignada and asignada + datetime.timedelta(days=2),
+            ))
+        Reserva.objects.bulk_create(lote)
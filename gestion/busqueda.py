@@ -0,0 +1,166 @@
+import re
+import unicodedata
+from collections import Counter
+from functools import reduce
+from operator import or_
+
+from django.db import connections, transaction
+from django.db.models import Case, IntegerField, OuterRef, Q, Subquery, Sum, When
+
+# Índice invertido del catálogo
+# Reemplaza el antiguo filtro icontains (que recorría toda la tabla en cada búsqueda)
+# por una tabla de términos normalizados con índice B-tree, que funciona igual
+# en SQLite y en PostgreSQL sin depender de extensiones de ninguna de las dos
+
+# Pesos por campo: una coincidencia en el título es más relevante que en el autor
+PESO_TITULO = 3
+PESO_AUTOR = 2
+
+# Límite de términos por consulta para acotar el tamaño del SQL generado
+MAX_TERMINOS_CONSULTA = 8
+
+# Longitud máxima de un término indexado (coincide con el max_length del modelo)
+LONGITUD_MAXIMA_TERMINO = 100
+
+# Carácter usado como cota superior en las búsquedas por prefijo en SQLite
+# Con la collation BINARY cualquier término que empiece por el prefijo es menor
+# que prefijo + este carácter
+_FIN_PREFIJO = '\uffff'
+
+_SEPARADORES = re.compile(r'[^0-9a-zñ]+')
+
+
+def normalizar(texto):
+    # Paso a minúsculas y elimino tildes y diéresis, conservando la ñ
+    # porque en español "año" y "ano" son palabras distintas
+    texto = (texto or '').lower().replace('ñ', '\x00')
+    texto = unicodedata.normalize('NFKD', texto)
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    return texto.replace('\x00', 'ñ')
+
+
+def tokenizar(texto):
+    # Divido el texto normalizado en palabras, descartando los separadores
+    return [
+        termino[:LONGITUD_MAXIMA_TERMINO]
+        for termino in _SEPARADORES.split(normalizar(texto))
+        if termino
+    ]
+
+
+def terminos_libro(titulo, autor):
+    # Calculo el peso de cada término sumando sus apariciones ponderadas por campo
+    # Devuelvo un diccionario {termino: peso} listo para guardar en el índice
+    pesos = Counter()
+    for termino in tokenizar(titulo):
+        pesos[termino] += PESO_TITULO
+    for termino in tokenizar(autor):
+        pesos[termino] += PESO_AUTOR
+    return dict(pesos)
+
+
+def indexar_libro(libro):
+    # Actualización incremental: solo se reescriben las filas de este libro
+    # La uso desde la señal post_save para que el índice nunca quede desfasado
+    from .models import TerminoBusqueda
+
+    with transaction.atomic():
+        TerminoBusqueda.objects.filter(libro_id=libro.pk).delete()
+        TerminoBusqueda.objects.bulk_create([
+            TerminoBusqueda(libro_id=libro.pk, termino=termino, peso=peso)
+            for termino, peso in terminos_libro(libro.titulo, libro.autor).items()
+        ])
+
+
+def indexar_libros(libros):
+    # Igual que indexar_libro pero para muchos libros a la vez (cargas masivas)
+    # Dos consultas en total sin importar cuántos libros lleguen
+    from .models import TerminoBusqueda
+
+    with transaction.atomic():
+        TerminoBusqueda.objects.filter(libro_id__in=[libro.pk for libro in libros]).delete()
+        TerminoBusqueda.objects.bulk_create([
+            TerminoBusqueda(libro_id=libro.pk, termino=termino, peso=peso)
+            for libro in libros
+            for termino, peso in terminos_libro(libro.titulo, libro.autor).items()
+        ])
+
+
+def reindexar_catalogo(tamano_lote=2000):
+    # Reconstruye el índice completo recorriendo el catálogo por lotes
+    # (la migración 0003 lleva su propia copia para los modelos históricos)
+    from .models import Libro, TerminoBusqueda
+
+    TerminoBusqueda.objects.all().delete()
+    total = 0
+    ultimo_id = 0
+    while True:
+        lote = list(
+            Libro.objects.filter(pk__gt=ultimo_id)
+            .order_by('pk')
+            .values_list('pk', 'titulo', 'autor')[:tamano_lote]
+        )
+        if not lote:
+            break
+        TerminoBusqueda.objects.bulk_create([
+            TerminoBusqueda(libro_id=pk, termino=termino, peso=peso)
+            for pk, titulo, autor in lote
+            for termino, peso in terminos_libro(titulo, autor).items()
+        ], batch_size=tamano_lote)
+        total += len(lote)
+        ultimo_id = lote[-1][0]
+    return total
+
+
+def _condicion_prefijo(prefijo, vendor):
+    # En PostgreSQL el LIKE 'prefijo%' usa el índice varchar_pattern_ops del modelo
+    # En SQLite el LIKE no es capaz de usar el índice (es insensible a mayúsculas),
+    # así que lo expreso como un rango sobre la collation BINARY
+    if vendor == 'postgresql':
+        return Q(termino__startswith=prefijo)
+    return Q(termino__gte=prefijo, termino__lt=prefijo + _FIN_PREFIJO)
+
+
+def terminos_consulta(consulta):
+    # Términos distintos de una consulta, en orden y como mucho MAX_TERMINOS_CONSULTA
+    # Dos consultas con los mismos términos devuelven exactamente los mismos libros
+    return list(dict.fromkeys(tokenizar(consulta)))[:MAX_TERMINOS_CONSULTA]
+
+
+def buscar_libros(consulta, queryset=None):
+    # Devuelve un queryset de libros ordenado por relevancia
+    # Todas las palabras de la consulta deben aparecer (como prefijo) en el título
+    # o en el autor, y las coincidencias exactas puntúan el doble
+    from .models import Libro, TerminoBusqueda
+
+    if queryset is None:
+        queryset = Libro.objects.all()
+
+    terminos = terminos_consulta(consulta)
+    if not terminos:
+        return queryset.none()
+
+    vendor = connections[queryset.db].vendor
+    condiciones = [_condicion_prefijo(termino, vendor) for termino in terminos]
+
+    # Cada palabra se resuelve con un recorrido por rango del índice de términos,
+    # así el motor parte de los libros candidatos en lugar de recorrer el catálogo
+    for condicion in condiciones:
+        queryset = queryset.filter(
+            pk__in=TerminoBusqueda.objects.filter(condicion).values('libro_id')
+        )
+
+    # La relevancia se calcula solo para los libros que ya pasaron el filtro,
+    # usando el índice único (libro, termino)
+    relevancia = (
+        TerminoBusqueda.objects
+        .filter(reduce(or_, condiciones), libro_id=OuterRef('pk'))
+        .values('libro_id')
+        .annotate(total=Sum('peso') + Sum(Case(
+            When(termino__in=terminos, then='peso'),
+            default=0,
+            output_field=IntegerField(),
+        )))
+        .values('total')
+    )
+    return queryset.annotate(relevancia=Subquery(relevancia)).order_by('-relevancia', 'titulo', 'pk')
@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+# Cachés que viven dentro de cada proceso: no se comparten entre los workers del servidor
+CACHES_POR_PROCESO = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register(Tags.security, deploy=True)
+def comprobar_sesion_en_cache(app_configs, **kwargs):
+    # Con las sesiones en la caché de cada proceso, cerrar sesión (o cambiar la contraseña)
+    # solo borra la sesión en el worker que atiende la petición
+    if not settings.SESION_EN_CACHE['ACTIVA']:
+        return []
+    alias = getattr(settings, 'SESSION_CACHE_ALIAS', 'default')
+    if settings.CACHES[alias]['BACKEND'] not in CACHES_POR_PROCESO:
+        return []
+    return [Warning(
+        'SESION_EN_CACHE está activo con una caché local de cada proceso.',
+        hint='Con varios workers, una sesión cerrada sigue abierta en la caché de los demás '
+             'hasta que caduca. Configura una caché compartida con CACHE_BACKEND.',
+        id='gestion.W001',
+    )]
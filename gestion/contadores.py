@@ -0,0 +1,181 @@
+import random
+
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+
+from .archivado import TABLAS
+from .models import ContadorPrestamos, Libro, Prestamo, PrestamoArchivado, Usuario
+
+# Contadores desnormalizados de préstamos
+# Libro y Usuario guardan sus préstamos activos y totales, y ContadorPrestamos guarda
+# los globales repartidos en fragmentos. Todas las funciones de escritura se llaman
+# desde gestion/prestamos.py dentro de la transacción del préstamo o la devolución,
+# así que los contadores nunca quedan a medias. El comando verificar_contadores
+# compara los contadores con el historial (Prestamo y PrestamoArchivado) y corrige
+# cualquier desviación. Archivar un préstamo devuelto no cambia ningún contador
+
+FRAGMENTOS = 8
+
+
+def al_prestar(cantidad=1):
+    # Expresiones para incluir en el UPDATE de un libro o usuario al prestar
+    return {
+        'prestamos_activos': F('prestamos_activos') + cantidad,
+        'prestamos_totales': F('prestamos_totales') + cantidad,
+    }
+
+
+def al_devolver(cantidad=1):
+    return {'prestamos_activos': F('prestamos_activos') - cantidad}
+
+
+def actualizar_global(activos=0, totales=0):
+    # Actualizo un fragmento al azar; si aún no existe (base recién vaciada) lo creo
+    if not activos and not totales:
+        return
+    fragmento = random.randrange(FRAGMENTOS)
+    actualizados = ContadorPrestamos.objects.filter(fragmento=fragmento).update(
+        activos=F('activos') + activos,
+        totales=F('totales') + totales,
+    )
+    if not actualizados:
+        ContadorPrestamos.objects.get_or_create(fragmento=fragmento)
+        actualizar_global(activos, totales)
+
+
+def actualizar_en_bloque(modelo, cantidades, expresiones):
+    # Un único UPDATE ... CASE WHEN para todos los objetos afectados de un lote
+    # cantidades: {pk: n} y expresiones: función que devuelve los campos para n
+    if not cantidades:
+        return
+    objetos = []
+    for pk, cantidad in cantidades.items():
+        objeto = modelo(pk=pk)
+        for campo, expresion in expresiones(cantidad).items():
+            setattr(objeto, campo, expresion)
+        objetos.append(objeto)
+    modelo.objects.bulk_update(objetos, list(expresiones(1)))
+
+
+def estadisticas_globales():
+    # Suma de los fragmentos: como mucho FRAGMENTOS filas, sin importar el historial
+    totales = ContadorPrestamos.objects.aggregate(activos=Sum('activos'), totales=Sum('totales'))
+    activos = totales['activos'] or 0
+    total = totales['totales'] or 0
+    return {'activos': activos, 'totales': total, 'devueltos': total - activos}
+
+
+def contar_historial(campo, filtro):
+    # {pk: (activos, totales)} de los libros o usuarios que cumplen filtro, sumando
+    # Prestamo y PrestamoArchivado
+    reales = {}
+    for tabla in TABLAS:
+        for fila in (
+            tabla.objects.filter(**filtro)
+            .values(campo)
+            .annotate(activos=Count('id', filter=Q(devuelto=False)), totales=Count('id'))
+            .order_by()
+        ):
+            anterior = reales.get(fila[campo], (0, 0))
+            reales[fila[campo]] = (anterior[0] + fila['activos'], anterior[1] + fila['totales'])
+    return reales
+
+
+def descontar_historial(libro_id=None, usuario_id=None):
+    # Cuando se elimina un libro o un usuario, sus préstamos se borran en cascada
+    # Antes del borrado resto esos préstamos de los contadores de la otra parte
+    # (los usuarios del libro o los libros del usuario) y de los globales
+    if libro_id is not None:
+        filtro, campo, modelo = {'libro_id': libro_id}, 'usuario_id', Usuario
+    else:
+        filtro, campo, modelo = {'usuario_id': usuario_id}, 'libro_id', Libro
+
+    # Los archivados también se borran en cascada y cuentan en los totales
+    reales = contar_historial(campo, filtro)
+    if not reales:
+        return
+    objetos = []
+    for pk, (activos, totales) in reales.items():
+        objeto = modelo(pk=pk)
+        objeto.prestamos_activos = F('prestamos_activos') - activos
+        objeto.prestamos_totales = F('prestamos_totales') - totales
+        objetos.append(objeto)
+    modelo.objects.bulk_update(objetos, ['prestamos_activos', 'prestamos_totales'])
+    actualizar_global(
+        activos=-sum(activos for activos, _ in reales.values()),
+        totales=-sum(totales for _, totales in reales.values()),
+    )
+
+
+def reparar_filas(modelo, campo, pks):
+    # Corrige los contadores de los libros o usuarios pks y devuelve cuántos seguían mal
+    # Las filas se bloquean antes de volver a contar: un préstamo simultáneo de esos
+    # libros o usuarios espera a que termine la transacción para sumar su F() sobre el
+    # valor corregido, o ya está confirmado y entra en el recuento
+    with transaction.atomic():
+        filas = list(
+            modelo.objects.filter(pk__in=pks).select_for_update().order_by('pk')
+            .values_list('pk', 'prestamos_activos', 'prestamos_totales')
+        )
+        reales = contar_historial(campo, {f'{campo}__in': pks})
+        corregir = []
+        for pk, activos, totales in filas:
+            real = reales.get(pk, (0, 0))
+            if (activos, totales) != real:
+                corregir.append(modelo(pk=pk, prestamos_activos=real[0], prestamos_totales=real[1]))
+        modelo.objects.bulk_update(corregir, ['prestamos_activos', 'prestamos_totales'])
+    return len(corregir)
+
+
+def comparar_globales():
+    # (activos y totales según el historial, si los fragmentos se desvían de ellos)
+    reales = Prestamo.objects.aggregate(totales=Count('id'), activos=Count('id', filter=Q(devuelto=False)))
+    reales['totales'] += PrestamoArchivado.objects.count()
+    actuales = estadisticas_globales()
+    return reales, (actuales['activos'], actuales['totales']) != (reales['activos'], reales['totales'])
+
+
+def reparar_global():
+    # Reparto de nuevo los globales con los fragmentos bloqueados, por lo mismo que en
+    # reparar_filas; devuelve si había desviación
+    with transaction.atomic():
+        list(ContadorPrestamos.objects.select_for_update().values_list('pk'))
+        reales, desviado = comparar_globales()
+        if not desviado:
+            return False
+        ContadorPrestamos.objects.all().delete()
+        ContadorPrestamos.objects.bulk_create(
+            [ContadorPrestamos(fragmento=0, activos=reales['activos'], totales=reales['totales'])]
+            + [ContadorPrestamos(fragmento=i) for i in range(1, FRAGMENTOS)]
+        )
+    return True
+
+
+def verificar(reparar=False, tamano_lote=2000):
+    # Compara los contadores con el historial recorriendo libros y usuarios por lotes
+    # Devuelve {'libro': n, 'usuario': n, 'global': bool} con las desviaciones halladas
+    # La comparación no bloquea nada; con reparar, cada lote con desviaciones se vuelve
+    # a contar y se corrige en su propia transacción con las filas bloqueadas
+    desviaciones = {}
+    for modelo, campo in ((Libro, 'libro_id'), (Usuario, 'usuario_id')):
+        desviados = 0
+        ultimo_id = 0
+        while True:
+            lote = list(
+                modelo.objects.filter(pk__gt=ultimo_id)
+                .order_by('pk')
+                .values_list('pk', 'prestamos_activos', 'prestamos_totales')[:tamano_lote]
+            )
+            if not lote:
+                break
+            reales = contar_historial(campo, {f'{campo}__gte': lote[0][0], f'{campo}__lte': lote[-1][0]})
+            sospechosos = [pk for pk, activos, totales in lote if (activos, totales) != reales.get(pk, (0, 0))]
+            if reparar and sospechosos:
+                desviados += reparar_filas(modelo, campo, sospechosos)
+            else:
+                desviados += len(sospechosos)
+            ultimo_id = lote[-1][0]
+        desviaciones[modelo._meta.model_name] = desviados
+
+    desviaciones['global'] = reparar_global() if reparar else comparar_globales()[1]
+    return desviaciones
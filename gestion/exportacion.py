@@ -0,0 +1,99 @@
+import csv
+import datetime
+import heapq
+import json
+
+from django.db import reset_queries
+from django.utils import timezone
+
+from .archivado import TABLAS
+
+# Exportación del historial de préstamos en CSV o NDJSON
+# La usan la vista de exportación de la web y el comando exportar_prestamos
+# - El historial se recorre por lotes de id (WHERE id > x LIMIT n), así que la memoria
+#   depende del tamaño del lote y no de cuántos préstamos haya
+# - Cada lote trae el título del libro y el nombre del usuario en el mismo JOIN
+# - Las funciones devuelven generadores de texto que se escriben a medida que se producen
+# - Incluye los préstamos archivados: cada tabla se recorre por separado y las dos se
+#   mezclan por id, que es el mismo que tenía el préstamo antes de archivarse
+
+COLUMNAS = (
+    'id', 'fecha_prestamo', 'fecha_devolucion', 'devuelto',
+    'libro_id', 'libro_titulo', 'usuario_id', 'usuario_username',
+)
+CAMPOS_CONSULTA = (
+    'pk', 'fecha_prestamo', 'fecha_devolucion', 'devuelto',
+    'libro_id', 'libro__titulo', 'usuario_id', 'usuario__username',
+)
+FORMATOS = ('csv', 'ndjson')
+
+
+def _inicio_del_dia(fecha):
+    return timezone.make_aware(datetime.datetime.combine(fecha, datetime.time.min))
+
+
+def filtrar_prestamos(desde=None, hasta=None, usuario_id=None, libro_id=None):
+    # desde y hasta son fechas (datetime.date) inclusivas sobre fecha_prestamo
+    # Uso límites de fecha y hora en lugar de __date para que la consulta pueda usar índices
+    # Devuelvo una consulta por tabla: Prestamo y PrestamoArchivado
+    filtros = {}
+    if desde:
+        filtros['fecha_prestamo__gte'] = _inicio_del_dia(desde)
+    if hasta:
+        filtros['fecha_prestamo__lt'] = _inicio_del_dia(hasta + datetime.timedelta(days=1))
+    if usuario_id:
+        filtros['usuario_id'] = usuario_id
+    if libro_id:
+        filtros['libro_id'] = libro_id
+    return [tabla.objects.filter(**filtros) for tabla in TABLAS]
+
+
+def filas_prestamos(prestamos, tamano_lote=2000):
+    # Genera una tupla por préstamo en el orden de COLUMNAS y de id, lote a lote
+    # `prestamos` son las consultas de filtrar_prestamos
+    return heapq.merge(*(_filas_tabla(consulta, tamano_lote) for consulta in prestamos))
+
+
+def _filas_tabla(prestamos, tamano_lote):
+    ultimo_id = 0
+    while True:
+        lote = list(
+            prestamos.filter(pk__gt=ultimo_id)
+            .order_by('pk')
+            .values_list(*CAMPOS_CONSULTA)[:tamano_lote]
+        )
+        if not lote:
+            return
+        yield from lote
+        ultimo_id = lote[-1][0]
+        # Con DEBUG=True el registro de consultas crecería durante exportaciones largas
+        reset_queries()
+
+
+def _texto(valor):
+    if isinstance(valor, datetime.datetime):
+        return timezone.localtime(valor).isoformat()
+    return valor
+
+
+class _Eco:
+    # Pseudo archivo para csv.writer: devuelve la línea en lugar de guardarla
+    def write(self, valor):
+        return valor
+
+
+def lineas_csv(filas):
+    escritor = csv.writer(_Eco())
+    yield escritor.writerow(COLUMNAS)
+    for fila in filas:
+        yield escritor.writerow([_texto(valor) for valor in fila])
+
+
+def lineas_ndjson(filas):
+    for fila in filas:
+        yield json.dumps(dict(zip(COLUMNAS, map(_texto, fila))), ensure_ascii=False) + '\n'
+
+
+def exportar(prestamos, formato, tamano_lote=2000):
+    generador = lineas_csv if formato == 'csv' else lineas_ndjson
+    return generador(filas_prestamos(prestamos, tamano_lote=tamano_lote))
@@ -0,0 +1,127 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.db.models import Case, CharField, Count, F, Q, Value, When
+from django.db.models.functions import Cast
+
+# Filtros y facetas del listado de libros de la API
+# - ?autor= (se puede repetir), ?año_desde=, ?año_hasta= y ?disponible=true|false
+# - Con ?facetas=true la respuesta añade cuántos libros hay por autor, por década y
+#   disponibles o no entre los que cumplen la búsqueda y los filtros
+# - Cada faceta se cuenta con todos los filtros menos el suyo: con ?autor=X siguen
+#   apareciendo los demás autores con sus libros, así que el cliente ve las alternativas
+# - Los tres recuentos son agregaciones agrupadas unidas con UNION ALL: una sola consulta
+#   por petición, sin importar cuántos autores o décadas haya
+# - El resultado se guarda en la caché con la versión del catálogo en la clave, igual que
+#   las páginas de la web (web/cache_catalogo.py): nunca se sirve desactualizado
+
+FACETAS = ('autor', 'decada', 'disponible')
+VERDADERO = ('true', '1', 'si', 'sí')
+FALSO = ('false', '0', 'no')
+
+
+def leer_filtros(parametros):
+    # Devuelvo (filtros, errores) con los parámetros de la petición ya validados
+    filtros, errores = {}, {}
+    autores = list(dict.fromkeys(autor.strip() for autor in parametros.getlist('autor') if autor.strip()))
+    if autores:
+        filtros['autor'] = autores
+    for nombre in ('año_desde', 'año_hasta'):
+        valor = parametros.get(nombre, '').strip()
+        if valor:
+            try:
+                filtros[nombre] = int(valor)
+            except ValueError:
+                errores[nombre] = ['Debe ser un año (número entero)']
+    if 'año_desde' in filtros and 'año_hasta' in filtros and filtros['año_desde'] > filtros['año_hasta']:
+        errores['año_hasta'] = ['No puede ser anterior a año_desde']
+    disponible = parametros.get('disponible', '').strip().lower()
+    if disponible in VERDADERO:
+        filtros['disponible'] = True
+    elif disponible in FALSO:
+        filtros['disponible'] = False
+    elif disponible:
+        errores['disponible'] = ['Debe ser true o false']
+    return filtros, errores
+
+
+def _condiciones(filtros, excepto=None):
+    # Condiciones de todos los filtros salvo el de la faceta `excepto`
+    condiciones = Q()
+    if 'autor' in filtros and excepto != 'autor':
+        condiciones &= Q(autor__in=filtros['autor'])
+    if excepto != 'decada':
+        if 'año_desde' in filtros:
+            condiciones &= Q(año_publicacion__gte=filtros['año_desde'])
+        if 'año_hasta' in filtros:
+            condiciones &= Q(año_publicacion__lte=filtros['año_hasta'])
+    if 'disponible' in filtros and excepto != 'disponible':
+        condiciones &= Q(cantidad_stock__gt=0) if filtros['disponible'] else Q(cantidad_stock__lte=0)
+    return condiciones
+
+
+def filtrar(queryset, filtros):
+    return queryset.filter(_condiciones(filtros))
+
+
+def _valores():
+    # Valor agrupado de cada faceta, como texto para que las tres ramas del UNION encajen
+    return {
+        'autor': F('autor'),
+        'decada': Cast(F('año_publicacion') / 10 * 10, CharField()),
+        'disponible': Case(When(cantidad_stock__gt=0, then=Value('1')), default=Value('0'), output_field=CharField()),
+    }
+
+
+def consulta_facetas(queryset, filtros, max_autores):
+    # Una consulta con una rama agrupada por faceta; el orden de la búsqueda no cambia
+    # los recuentos (la relevancia no entra en el GROUP BY porque no se selecciona)
+    base = queryset.order_by()
+    ramas = []
+    for nombre, valor in _valores().items():
+        rama = (
+            base.filter(_condiciones(filtros, excepto=nombre))
+            .values(faceta=Value(nombre, output_field=CharField()), valor=valor)
+            .annotate(libros=Count('pk'))
+            .values_list('faceta', 'valor', 'libros')
+        )
+        # PostgreSQL admite ORDER BY/LIMIT dentro de cada rama: solo viajan los primeros
+        # autores. SQLite no, y el recorte se hace al leer el resultado
+        if nombre == 'autor' and connections[queryset.db].features.supports_slicing_ordering_in_compound:
+            rama = rama.order_by('-libros', 'valor')[:max_autores]
+        ramas.append(rama)
+    return ramas[0].union(*ramas[1:], all=True)
+
+
+def contar(queryset, filtros, max_autores=None):
+    max_autores = max_autores or settings.FACETAS['MAX_AUTORES']
+    filas = {nombre: [] for nombre in FACETAS}
+    for faceta, valor, libros in consulta_facetas(queryset, filtros, max_autores):
+        filas[faceta].append((valor, libros))
+    disponibles = dict(filas['disponible'])
+    return {
+        'autor': [
+            {'autor': autor, 'libros': libros}
+            for autor, libros in sorted(filas['autor'], key=lambda fila: (-fila[1], fila[0]))[:max_autores]
+        ],
+        'decada': [
+            {'decada': decada, 'libros': libros}
+            for decada, libros in sorted((int(decada), libros) for decada, libros in filas['decada'])
+        ],
+        'disponible': {'disponibles': disponibles.get('1', 0), 'no_disponibles': disponibles.get('0', 0)},
+    }
+
+
+def contar_en_cache(version, queryset, filtros, buscar=''):
+    # La versión se lee ANTES de contar, como en web/cache_catalogo.py
+    partes = [buscar, sorted(filtros.get('autor', [])), filtros.get('año_desde'), filtros.get('año_hasta'),
+              filtros.get('disponible'), settings.FACETAS['MAX_AUTORES']]
+    resumen = hashlib.sha1(repr(partes).encode()).hexdigest()
+    entrada = f'facetas:v{version}:{resumen}'
+    resultado = cache.get(entrada)
+    if resultado is None:
+        resultado = contar(queryset, filtros)
+        cache.set(entrada, resultado, timeout=None)
+    return resultado
@@ -0,0 +1,348 @@
+import datetime
+import math
+import os
+import random
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.color import no_style
+from django.db import connection, connections, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from . import analitica, contadores, versiones
+from .benchmarks.utilidades import autor_aleatorio, titulo_aleatorio
+from .busqueda import indexar_libros
+from .models import Libro, Prestamo, Usuario
+
+# Generador de datos sintéticos a gran escala (manage.py generar_datos)
+# - Libros, usuarios y préstamos se insertan por lotes con bulk_create y con ids
+#   reservados de antemano, así que los lotes son independientes y se pueden repartir
+#   entre varios procesos; cada lote usa su propia semilla y el resultado no depende
+#   del número de procesos
+# - Popularidad sesgada (ley de potencias): pocos libros concentran muchos préstamos y
+#   pocos lectores hacen muchos; duración de los préstamos log-normal
+# - Los préstamos cuya devolución cae en el futuro (y algunos atrasados) son los
+#   activos: el proceso principal los acepta en orden respetando los ejemplares de cada
+#   libro y un préstamo activo por usuario y libro, y deja cantidad_stock y los
+#   contadores igual que si se hubieran prestado uno a uno
+# - Los préstamos se insertan con executemany y los contadores se calculan al generar:
+#   el ORM y una pasada de contadores.verificar sobre decenas de millones de filas
+#   costarían más que la propia generación
+
+# Exponentes de la ley de potencias: mayor exponente = popularidad más concentrada
+SESGO_LIBROS = 0.8
+SESGO_USUARIOS = 0.6
+
+# Duración de los préstamos: mediana y dispersión de la log-normal (en días)
+DURACION_MEDIANA = 14
+DURACION_DISPERSION = 0.6
+
+# Préstamos de los últimos DIAS_ATRASO días que siguen sin devolverse aunque ya tocaba
+PROBABILIDAD_ATRASO = 0.02
+DIAS_ATRASO = 180
+
+
+class Permutacion:
+    # Biyección barata entre el rango de popularidad y la posición en la tabla, para que
+    # los libros y usuarios más populares no sean simplemente los primeros ids
+
+    def __init__(self, n, semilla):
+        self.n = max(n, 1)
+        aleatorio = random.Random(f'{semilla}-permutacion-{n}')
+        multiplicador = aleatorio.randrange(1, 2 ** 31) | 1
+        while math.gcd(multiplicador, self.n) != 1:
+            multiplicador += 2
+        self.multiplicador = multiplicador % self.n or 1
+        self.inverso = pow(self.multiplicador, -1, self.n) if self.n > 1 else 0
+        self.desplazamiento = aleatorio.randrange(self.n)
+
+    def posicion(self, rango):
+        return ((rango - 1) * self.multiplicador + self.desplazamiento) % self.n
+
+    def rango(self, posicion):
+        return (posicion - self.desplazamiento) * self.inverso % self.n + 1
+
+
+def _rango_potencia(aleatorio, n, sesgo):
+    # Rango entre 1 y n con probabilidad proporcional a rango ** -sesgo (inversa de la CDF continua)
+    u = aleatorio.random()
+    if sesgo == 1:
+        rango = n ** u
+    else:
+        exponente = 1 - sesgo
+        rango = ((n ** exponente - 1) * u + 1) ** (1 / exponente)
+    return min(max(int(rango), 1), n)
+
+
+def ejemplares(posicion, permutacion):
+    # Ejemplares de un libro según su popularidad (los más prestados tienen más copias)
+    # Es determinista para poder calcularlo igual al crear el libro y al aceptar préstamos
+    rango = permutacion.rango(posicion)
+    return 1 + int(12 / rango ** 0.35) + (posicion * 2654435761 >> 16) % 3
+
+
+class Plan:
+    # Todo lo necesario para generar cualquier lote sin consultar la base de datos
+    # Se envía a los procesos, así que solo guarda datos simples
+
+    def __init__(self, libros, usuarios, prestamos, semilla, tamano_lote, dias, prefijo, password, indexar):
+        self.libros = libros
+        self.usuarios = usuarios
+        self.prestamos = prestamos
+        self.semilla = semilla
+        self.tamano_lote = tamano_lote
+        self.dias = dias
+        self.prefijo = prefijo
+        self.password_hash = make_password(password)
+        self.indexar = indexar
+        self.ahora = timezone.now()
+        self.base_libro = Libro.objects.aggregate(m=Max('pk'))['m'] or 0
+        self.base_usuario = Usuario.objects.aggregate(m=Max('pk'))['m'] or 0
+        self.base_prestamo = Prestamo.objects.aggregate(m=Max('pk'))['m'] or 0
+        self.libros_permutacion = Permutacion(libros, semilla)
+        self.usuarios_permutacion = Permutacion(usuarios, f'{semilla}-usuarios')
+
+    def lotes(self, total):
+        return [(inicio, min(inicio + self.tamano_lote, total)) for inicio in range(0, total, self.tamano_lote)]
+
+    def aleatorio(self, tipo, inicio):
+        return random.Random(f'{self.semilla}-{tipo}-{inicio}')
+
+
+def _generar_libros(plan, inicio, fin):
+    aleatorio = plan.aleatorio('libros', inicio)
+    libros = [
+        Libro(
+            pk=plan.base_libro + posicion + 1,
+            titulo=titulo_aleatorio(aleatorio),
+            autor=autor_aleatorio(aleatorio),
+            año_publicacion=aleatorio.randint(1850, 2024),
+            cantidad_stock=ejemplares(posicion, plan.libros_permutacion),
+        )
+        for posicion in range(inicio, fin)
+    ]
+    with transaction.atomic():
+        Libro.objects.bulk_create(libros)
+        if plan.indexar:
+            indexar_libros(libros)
+    return 'libros', fin - inicio, None
+
+
+def _generar_usuarios(plan, inicio, fin):
+    usuarios = []
+    for posicion in range(inicio, fin):
+        username = f'{plan.prefijo}{posicion}'
+        usuarios.append(Usuario(
+            pk=plan.base_usuario + posicion + 1,
+            username=username,
+            email=f'{username}@biblioteca.test',
+            password=plan.password_hash,
+            rol='regular',
+        ))
+    Usuario.objects.bulk_create(usuarios)
+    return 'usuarios', fin - inicio, None
+
+
+def _insertar_prestamos(filas):
+    # filas: (id, usuario_id, libro_id, fecha_prestamo, devuelto, fecha_devolucion)
+    if not filas:
+        return
+    tabla = connection.ops.quote_name(Prestamo._meta.db_table)
+    adaptar = connection.ops.adapt_datetimefield_value
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'INSERT INTO {tabla} (id, usuario_id, libro_id, fecha_prestamo, devuelto, fecha_devolucion) '
+            'VALUES (%s, %s, %s, %s, %s, %s)',
+            [
+                (pk, usuario_id, libro_id, adaptar(fecha), devuelto, adaptar(devolucion))
+                for pk, usuario_id, libro_id, fecha, devuelto, devolucion in filas
+            ],
+        )
+
+
+def _generar_prestamos(plan, inicio, fin):
+    # Inserta los préstamos ya devueltos del lote y devuelve los candidatos a activos
+    # (índice, usuario_id, libro_id, fecha) para que los acepte el proceso principal,
+    # junto con los préstamos insertados por libro y por usuario
+    aleatorio = plan.aleatorio('prestamos', inicio)
+    periodo = datetime.timedelta(days=plan.dias)
+    desde = plan.ahora - periodo
+    limite_atraso = plan.ahora - datetime.timedelta(days=DIAS_ATRASO)
+    devueltos, candidatos = [], []
+    for indice in range(inicio, fin):
+        # Las fechas avanzan con el índice (y con el id), como en un historial real
+        fecha = desde + periodo * ((indice + aleatorio.random()) / plan.prestamos)
+        usuario_rango = _rango_potencia(aleatorio, plan.usuarios, SESGO_USUARIOS)
+        libro_rango = _rango_potencia(aleatorio, plan.libros, SESGO_LIBROS)
+        usuario_id = plan.base_usuario + plan.usuarios_permutacion.posicion(usuario_rango) + 1
+        libro_id = plan.base_libro + plan.libros_permutacion.posicion(libro_rango) + 1
+        devolucion = fecha + datetime.timedelta(
+            days=aleatorio.lognormvariate(math.log(DURACION_MEDIANA), DURACION_DISPERSION),
+        )
+        atrasado = fecha > limite_atraso and aleatorio.random() < PROBABILIDAD_ATRASO
+        if devolucion > plan.ahora or atrasado:
+            candidatos.append((indice, usuario_id, libro_id, fecha))
+        else:
+            devueltos.append((plan.base_prestamo + indice + 1, usuario_id, libro_id, fecha, True, devolucion))
+    with transaction.atomic():
+        _insertar_prestamos(devueltos)
+    totales = (Counter(fila[2] for fila in devueltos), Counter(fila[1] for fila in devueltos))
+    return 'prestamos', len(devueltos), (candidatos, totales)
+
+
+_GENERADORES = {'libros': _generar_libros, 'usuarios': _generar_usuarios, 'prestamos': _generar_prestamos}
+
+
+def _generar_lote(plan, tipo, inicio, fin):
+    return _GENERADORES[tipo](plan, inicio, fin)
+
+
+def _inicializar_proceso():
+    # Con el método spawn el proceso hijo empieza sin Django configurado
+    import django
+    django.setup()
+
+
+def _ejecutar(plan, tareas, procesos, al_progresar):
+    # Ejecuta los lotes en este proceso o repartidos entre varios y devuelve lo que
+    # devuelve cada lote (None en libros y usuarios)
+    if procesos <= 1:
+        resultados = (_generar_lote(plan, *tarea) for tarea in tareas)
+    else:
+        # Cada proceso abre sus propias conexiones: no se pueden heredar abiertas
+        connections.close_all()
+        ejecutor = ProcessPoolExecutor(max_workers=procesos, initializer=_inicializar_proceso)
+        futuros = [ejecutor.submit(_generar_lote, plan, *tarea) for tarea in tareas]
+        resultados = (futuro.result() for futuro in futuros)
+    try:
+        extras = []
+        for tipo, filas, extra in resultados:
+            extras.append(extra)
+            al_progresar(tipo, filas)
+        return extras
+    finally:
+        if procesos > 1:
+            ejecutor.shutdown(cancel_futures=True)
+
+
+def _aceptar_activos(plan, candidatos):
+    # En orden de índice, para que el resultado no dependa del orden en que terminaron
+    # los procesos: un candidato queda activo si el libro aún tiene ejemplares libres y
+    # el usuario no tiene ya ese libro; si no, se devolvió antes de tiempo
+    aleatorio = random.Random(f'{plan.semilla}-activos')
+    prestados = {}
+    pares = set()
+    activos, devueltos = [], []
+    for indice, usuario_id, libro_id, fecha in sorted(candidatos):
+        pk = plan.base_prestamo + indice + 1
+        posicion = libro_id - plan.base_libro - 1
+        if prestados.get(libro_id, 0) < ejemplares(posicion, plan.libros_permutacion) \
+                and (usuario_id, libro_id) not in pares:
+            prestados[libro_id] = prestados.get(libro_id, 0) + 1
+            pares.add((usuario_id, libro_id))
+            activos.append((pk, usuario_id, libro_id, fecha, False, None))
+        else:
+            devolucion = fecha + (plan.ahora - fecha) * aleatorio.random()
+            devueltos.append((pk, usuario_id, libro_id, fecha, True, devolucion))
+    return activos, devueltos
+
+
+def _guardar_activos(plan, activos, devueltos):
+    # Préstamos activos y los devueltos antes de tiempo
+    filas = activos + devueltos
+    for inicio in range(0, len(filas), plan.tamano_lote):
+        with transaction.atomic():
+            _insertar_prestamos(filas[inicio:inicio + plan.tamano_lote])
+
+
+def _guardar_contadores(plan, totales_libros, totales_usuarios, activos):
+    # Los libros y usuarios generados empiezan con los contadores a cero, así que basta
+    # con escribir los valores finales de los que tienen préstamos
+    activos_libros = Counter(fila[2] for fila in activos)
+    activos_usuarios = Counter(fila[1] for fila in activos)
+    libros = [
+        (activos_libros[libro_id], totales,
+         ejemplares(libro_id - plan.base_libro - 1, plan.libros_permutacion) - activos_libros[libro_id], libro_id)
+        for libro_id, totales in sorted(totales_libros.items())
+    ]
+    usuarios = [
+        (activos_usuarios[usuario_id], totales, usuario_id)
+        for usuario_id, totales in sorted(totales_usuarios.items())
+    ]
+    operaciones = connection.ops
+    with connection.cursor() as cursor:
+        for inicio in range(0, len(libros), plan.tamano_lote):
+            with transaction.atomic():
+                cursor.executemany(
+                    f'UPDATE {operaciones.quote_name(Libro._meta.db_table)} '
+                    'SET prestamos_activos = %s, prestamos_totales = %s, cantidad_stock = %s WHERE id = %s',
+                    libros[inicio:inicio + plan.tamano_lote],
+                )
+        for inicio in range(0, len(usuarios), plan.tamano_lote):
+            with transaction.atomic():
+                cursor.executemany(
+                    f'UPDATE {operaciones.quote_name(Usuario._meta.db_table)} '
+                    'SET prestamos_activos = %s, prestamos_totales = %s WHERE id = %s',
+                    usuarios[inicio:inicio + plan.tamano_lote],
+                )
+    contadores.actualizar_global(activos=len(activos), totales=plan.prestamos)
+
+
+def _reiniciar_secuencias():
+    # Los ids se asignaron a mano; en PostgreSQL la secuencia tiene que saltar por encima
+    sql = connection.ops.sequence_reset_sql(no_style(), [Libro, Usuario, Prestamo])
+    if sql:
+        with connection.cursor() as cursor:
+            for sentencia in sql:
+                cursor.execute(sentencia)
+
+
+def generar(libros, usuarios, prestamos, semilla=0, procesos=1, tamano_lote=5000, dias=3 * 365,
+            prefijo=None, password='lector1234', indexar=True, al_progresar=None):
+    # Devuelve {'libros', 'usuarios', 'prestamos', 'activos', 'segundos'}
+    if prestamos and (not libros or not usuarios):
+        raise ValueError('Para generar préstamos hacen falta libros y usuarios')
+    al_progresar = al_progresar or (lambda tipo, filas: None)
+    inicio = time.monotonic()
+    plan = Plan(
+        libros, usuarios, prestamos, semilla, tamano_lote, dias,
+        prefijo if prefijo is not None else f'gen{semilla}_', password, indexar,
+    )
+    # Primero libros y usuarios (los préstamos los referencian) y luego el historial
+    _ejecutar(plan, [('libros', *lote) for lote in plan.lotes(libros)]
+              + [('usuarios', *lote) for lote in plan.lotes(usuarios)], procesos, al_progresar)
+    candidatos, totales_libros, totales_usuarios = [], Counter(), Counter()
+    for candidatos_lote, (libros_lote, usuarios_lote) in _ejecutar(
+            plan, [('prestamos', *lote) for lote in plan.lotes(prestamos)], procesos, al_progresar):
+        candidatos += candidatos_lote
+        totales_libros.update(libros_lote)
+        totales_usuarios.update(usuarios_lote)
+    # Los candidatos acaban todos en la tabla, activos o devueltos antes de tiempo
+    totales_libros.update(fila[2] for fila in candidatos)
+    totales_usuarios.update(fila[1] for fila in candidatos)
+    activos, devueltos = _aceptar_activos(plan, candidatos)
+    _guardar_activos(plan, activos, devueltos)
+    al_progresar('prestamos', len(activos) + len(devueltos))
+
+    _guardar_contadores(plan, totales_libros, totales_usuarios, activos)
+    _reiniciar_secuencias()
+    if prestamos:
+        # Los resúmenes de la analítica salen del historial ya insertado, mes a mes
+        analitica.reconstruir(tamano_lote=tamano_lote)
+    if libros:
+        versiones.incrementar_catalogo()
+    return {
+        'libros': libros,
+        'usuarios': usuarios,
+        'prestamos': prestamos,
+        'activos': len(activos),
+        'segundos': round(time.monotonic() - inicio, 1),
+    }
+
+
+def procesos_por_defecto():
+    # SQLite admite un solo escritor a la vez: varios procesos solo reparten la generación
+    return 1 if connection.vendor == 'sqlite' else min(os.cpu_count() or 1, 8)
@@ -0,0 +1,154 @@
+import csv
+import json
+
+from django.db import reset_queries, transaction
+from django.db.models import F
+from rest_framework import serializers
+
+from . import versiones
+from .busqueda import indexar_libros
+from .models import Libro
+from .serializers import LibroSerializer
+
+# Importación masiva del catálogo desde archivos CSV o JSON lines
+# - Las filas se leen de una en una y se procesan por lotes, así que la memoria
+#   depende del tamaño del lote y no del tamaño del archivo
+# - Cada fila se valida con LibroSerializer, las mismas reglas que la API
+# - Un libro se identifica por (titulo, autor, año_publicacion): si ya existe se
+#   actualiza su stock en lugar de crear un duplicado
+# - Cada lote es una transacción con un bulk_create para los libros nuevos y un
+#   UPDATE agrupado para el stock de los existentes; bulk_create y update no disparan
+#   señales, así que el lote actualiza también las versiones (gestion/versiones.py)
+
+CAMPOS_LIBRO = ('titulo', 'autor', 'año_publicacion', 'cantidad_stock')
+FORMATOS = ('csv', 'jsonl')
+
+
+def leer_csv(archivo):
+    # Genera (número de línea, fila, error); la primera línea es la cabecera
+    lector = csv.DictReader(archivo)
+    for fila in lector:
+        yield lector.line_num, fila, None
+
+
+def leer_jsonl(archivo):
+    for numero, linea in enumerate(archivo, start=1):
+        if not linea.strip():
+            continue
+        try:
+            fila = json.loads(linea)
+        except ValueError as error:
+            yield numero, None, f'JSON inválido: {error}'
+            continue
+        if not isinstance(fila, dict):
+            yield numero, None, 'Cada línea debe ser un objeto JSON'
+            continue
+        yield numero, fila, None
+
+
+def _errores_en_texto(errores):
+    # Aplano los errores del serializer en una sola línea legible
+    return '; '.join(
+        f"{campo}: {' '.join(str(mensaje) for mensaje in mensajes)}"
+        for campo, mensajes in errores.items()
+    )
+
+
+class ResumenImportacion:
+    # Totales acumulados de una importación; los rechazos se entregan al llamador
+    # a medida que aparecen para no acumularlos en memoria
+    def __init__(self):
+        self.leidas = 0
+        self.creados = 0
+        self.actualizados = 0
+        self.rechazadas = 0
+
+    def __repr__(self):
+        return (
+            f'<ResumenImportacion leidas={self.leidas} creados={self.creados} '
+            f'actualizados={self.actualizados} rechazadas={self.rechazadas}>'
+        )
+
+
+def _guardar_lote(lote, sumar_stock):
+    # lote: {(titulo, autor, año): cantidad_stock}; las repeticiones dentro del lote ya
+    # están combinadas. Devuelve (creados, actualizados)
+    # Busco los existentes por título (primera columna de libro_clave_catalogo_idx)
+    # y comparo la clave completa en memoria
+    existentes = {}
+    candidatos = Libro.objects.filter(
+        titulo__in={clave[0] for clave in lote},
+    ).values_list('pk', 'titulo', 'autor', 'año_publicacion')
+    for pk, titulo, autor, año in candidatos:
+        clave = (titulo, autor, año)
+        if clave in lote:
+            existentes.setdefault(clave, []).append(pk)
+
+    # Agrupo los existentes por stock: un UPDATE ... WHERE id IN (...) por cada valor
+    # distinto, que suelen ser pocos (bulk_update genera un CASE por fila y es mucho más lento)
+    por_stock = {}
+    for clave, stock in lote.items():
+        por_stock.setdefault(stock, []).extend(existentes.get(clave, []))
+
+    with transaction.atomic():
+        actualizados = 0
+        for stock, pks in por_stock.items():
+            if pks:
+                actualizados += Libro.objects.filter(pk__in=pks).update(
+                    cantidad_stock=F('cantidad_stock') + stock if sumar_stock else stock,
+                    **versiones.al_modificar_libro(),
+                )
+
+        # bulk_create no dispara post_save, así que indexo los libros nuevos aquí mismo
+        nuevos = Libro.objects.bulk_create([
+            Libro(titulo=titulo, autor=autor, año_publicacion=año, cantidad_stock=stock)
+            for (titulo, autor, año), stock in lote.items() if (titulo, autor, año) not in existentes
+        ])
+        indexar_libros(nuevos)
+        versiones.incrementar_catalogo()
+    return len(nuevos), actualizados
+
+
+def importar_libros(filas, tamano_lote=1000, sumar_stock=False, al_rechazar=None, al_progresar=None):
+    # filas: iterable de (número de línea, fila, error) como los de leer_csv/leer_jsonl
+    # al_rechazar(linea, motivo) y al_progresar(resumen) son callbacks opcionales
+    resumen = ResumenImportacion()
+    lote = {}
+    # Una sola instancia del serializer para todo el archivo: construir sus campos
+    # por cada fila costaba más que validarla
+    serializer = LibroSerializer()
+
+    def vaciar():
+        creados, actualizados = _guardar_lote(lote, sumar_stock)
+        resumen.creados += creados
+        resumen.actualizados += actualizados
+        lote.clear()
+        # Con DEBUG=True Django guarda el SQL de cada consulta; en archivos de millones
+        # de filas ese registro sería lo único que crece, así que lo vacío por lote
+        reset_queries()
+        if al_progresar:
+            al_progresar(resumen)
+
+    for linea, fila, error in filas:
+        resumen.leidas += 1
+        if error is None:
+            # Las celdas vacías cuentan como ausentes para que se apliquen los valores por defecto
+            datos = {campo: fila.get(campo) for campo in CAMPOS_LIBRO if fila.get(campo) not in (None, '')}
+            try:
+                datos = serializer.run_validation(datos)
+            except serializers.ValidationError as excepcion:
+                error = _errores_en_texto(excepcion.detail)
+            else:
+                clave = (datos['titulo'], datos['autor'], datos['año_publicacion'])
+                stock = datos.get('cantidad_stock', 0)
+                lote[clave] = lote.get(clave, 0) + stock if sumar_stock else stock
+                if len(lote) >= tamano_lote:
+                    vaciar()
+                continue
+        resumen.rechazadas += 1
+        if al_rechazar:
+            al_rechazar(linea, error)
+
+    if lote:
+        vaciar()
+    return resumen
@@ -0,0 +1,53 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from gestion import archivado
+
+
+# Comando para mover los préstamos devueltos hace tiempo a PrestamoArchivado
+# Se puede lanzar con el servidor en marcha: cada lote es una transacción corta y --pausa
+# deja pasar al resto de escrituras entre lotes. Si se interrumpe, lo movido se queda
+# movido; con --desde-id y el último id mostrado se retoma sin volver a recorrer lo ya visto
+class Command(BaseCommand):
+    help = 'Archiva por lotes los préstamos devueltos hace más de ARCHIVADO_DIAS días'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dias', type=int, default=settings.ARCHIVADO['DIAS'],
+            help=f"Archiva los devueltos hace más de estos días (por defecto {settings.ARCHIVADO['DIAS']})",
+        )
+        parser.add_argument(
+            '--lote', type=int, default=settings.ARCHIVADO['LOTE'],
+            help=f"Préstamos movidos por transacción (por defecto {settings.ARCHIVADO['LOTE']})",
+        )
+        parser.add_argument('--desde-id', dest='desde_id', type=int, default=0, help='Retoma a partir de este id')
+        parser.add_argument('--pausa', type=float, default=0, help='Segundos de espera entre lotes')
+        parser.add_argument('--max-lotes', dest='max_lotes', type=int, help='Se detiene tras este número de lotes')
+        parser.add_argument(
+            '--pendientes', action='store_true',
+            help='Solo cuenta los préstamos que se archivarían, sin mover nada',
+        )
+
+    def handle(self, *args, **opciones):
+        if opciones['pendientes']:
+            self.stdout.write(f"Préstamos por archivar: {archivado.pendientes(opciones['dias'])}")
+            return
+
+        inicio = time.monotonic()
+
+        def al_progresar(lote, movidos, ultimo_id, segundos):
+            if lote % 50 == 0:
+                self.stdout.write(f'  lote {lote}: {movidos} préstamos en {segundos * 1000:.0f} ms, último id {ultimo_id}')
+
+        resultado = archivado.archivar(
+            dias=opciones['dias'], tamano_lote=opciones['lote'], desde_id=opciones['desde_id'],
+            pausa=opciones['pausa'], max_lotes=opciones['max_lotes'], al_progresar=al_progresar,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"{resultado['movidos']} préstamos archivados en {resultado['lotes']} lotes "
+            f"({time.monotonic() - inicio:.1f} s, lote más largo {resultado['max_lote_ms']:.0f} ms)"
+        ))
+        if opciones['max_lotes'] and resultado['lotes'] == opciones['max_lotes']:
+            self.stdout.write(f"Para continuar: --desde-id {resultado['ultimo_id']}")
@@ -0,0 +1,46 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from gestion import reservas
+
+
+# Comando para hacer cumplir el plazo de las reservas con ejemplar apartado
+# Pasa los apartados vencidos al siguiente de la cola (o al stock si no queda nadie) y
+# aparta para la cola el stock añadido al editar un libro. Cada lote es una transacción
+# corta, así que se puede lanzar con el servidor en marcha: una vez (p. ej. desde cron)
+# o en bucle con --intervalo
+class Command(BaseCommand):
+    help = 'Resuelve por lotes las reservas vencidas y asigna el stock libre a las colas de espera'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--lote', type=int, default=settings.RESERVAS['LOTE'],
+            help=f"Reservas o libros por transacción (por defecto {settings.RESERVAS['LOTE']})",
+        )
+        parser.add_argument(
+            '--intervalo', type=float,
+            help='Repite el barrido cada estos segundos hasta interrumpirlo (Ctrl+C)',
+        )
+
+    def handle(self, *args, **opciones):
+        def al_progresar(lote, vencidas, asignadas, segundos):
+            if lote % 50 == 0:
+                self.stdout.write(f'  lote {lote}: {vencidas} vencidas, {asignadas} asignadas en {segundos * 1000:.0f} ms')
+
+        try:
+            while True:
+                inicio = time.monotonic()
+                resultado = reservas.barrer(tamano_lote=opciones['lote'], al_progresar=al_progresar)
+                if resultado['lotes'] or not opciones['intervalo']:
+                    self.stdout.write(self.style.SUCCESS(
+                        f"{resultado['vencidas']} reservas vencidas y {resultado['asignadas']} ejemplares "
+                        f"apartados en {resultado['lotes']} lotes ({time.monotonic() - inicio:.1f} s, "
+                        f"lote más largo {resultado['max_lote_ms']:.0f} ms)"
+                    ))
+                if not opciones['intervalo']:
+                    return
+                time.sleep(opciones['intervalo'])
+        except KeyboardInterrupt:
+            self.stdout.write('Barrido detenido')
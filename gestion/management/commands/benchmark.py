@@ -0,0 +1,41 @@
+import importlib
+import json
+
+from django.core.management.base import BaseCommand
+
+from gestion.benchmarks import BENCHMARKS
+from gestion.benchmarks.utilidades import base_de_pruebas
+
+
+# Comando para ejecutar los benchmarks de gestion/benchmarks
+# Cada ejecución trabaja sobre una base de datos de pruebas (como manage.py test)
+# para no tocar nunca los datos reales del entorno en el que se lanza
+class Command(BaseCommand):
+    help = 'Ejecuta un benchmark de rendimiento sobre una base de datos de pruebas'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--keepdb', action='store_true',
+            help='Reutiliza la base de datos de pruebas entre ejecuciones',
+        )
+        parser.add_argument(
+            '--salida-json', dest='salida_json',
+            help='Ruta donde guardar los resultados en formato JSON',
+        )
+        subparsers = parser.add_subparsers(dest='benchmark', required=True)
+        for nombre in BENCHMARKS:
+            modulo = importlib.import_module(f'gestion.benchmarks.{nombre}')
+            subparser = subparsers.add_parser(nombre, help=modulo.DESCRIPCION)
+            modulo.agregar_argumentos(subparser)
+
+    def handle(self, *args, **opciones):
+        modulo = importlib.import_module(f"gestion.benchmarks.{opciones['benchmark']}")
+        self.stdout.write(self.style.MIGRATE_HEADING(modulo.DESCRIPCION))
+
+        with base_de_pruebas(keepdb=opciones['keepdb']):
+            resultados = modulo.ejecutar(opciones, self.stdout.write)
+
+        if opciones['salida_json']:
+            with open(opciones['salida_json'], 'w', encoding='utf-8') as archivo:
+                json.dump(resultados, archivo, ensure_ascii=False, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Resultados guardados en {opciones['salida_json']}"))
@@ -0,0 +1,54 @@
+import argparse
+import datetime
+
+from django.core.management.base import BaseCommand
+
+from gestion.exportacion import FORMATOS, exportar, filtrar_prestamos
+
+
+def _fecha(valor):
+    try:
+        return datetime.date.fromisoformat(valor)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'fecha inválida: {valor} (usa el formato AAAA-MM-DD)')
+
+
+# Comando para exportar el historial de préstamos para auditorías
+# Escribe las filas a medida que las lee, así que sirve para historiales de cualquier tamaño
+class Command(BaseCommand):
+    help = 'Exporta el historial de préstamos en CSV o NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--formato', choices=FORMATOS, default='csv')
+        parser.add_argument('--salida', help='Ruta del archivo de salida (por defecto la salida estándar)')
+        parser.add_argument('--desde', type=_fecha, help='Fecha de préstamo inicial, AAAA-MM-DD (inclusive)')
+        parser.add_argument('--hasta', type=_fecha, help='Fecha de préstamo final, AAAA-MM-DD (inclusive)')
+        parser.add_argument('--usuario', type=int, help='Solo los préstamos de este id de usuario')
+        parser.add_argument('--libro', type=int, help='Solo los préstamos de este id de libro')
+        parser.add_argument(
+            '--lote', type=int, default=2000,
+            help='Cantidad de préstamos leídos por consulta (por defecto 2000)',
+        )
+
+    def handle(self, *args, **opciones):
+        prestamos = filtrar_prestamos(
+            desde=opciones['desde'],
+            hasta=opciones['hasta'],
+            usuario_id=opciones['usuario'],
+            libro_id=opciones['libro'],
+        )
+        archivo = open(opciones['salida'], 'w', encoding='utf-8', newline='') if opciones['salida'] else None
+        escribir = archivo.write if archivo else lambda linea: self.stdout.write(linea, ending='')
+        filas = 0
+        try:
+            for linea in exportar(prestamos, opciones['formato'], tamano_lote=opciones['lote']):
+                escribir(linea)
+                filas += 1
+        finally:
+            if archivo:
+                archivo.close()
+
+        if opciones['salida']:
+            # La cabecera del CSV no es un préstamo
+            exportados = filas - 1 if opciones['formato'] == 'csv' else filas
+            self.stdout.write(self.style.SUCCESS(f"{exportados} préstamos exportados a {opciones['salida']}"))
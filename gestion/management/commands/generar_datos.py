@@ -0,0 +1,72 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from gestion.generacion import generar, procesos_por_defecto
+from gestion.models import Usuario
+
+
+# Comando para generar volúmenes realistas de libros, usuarios y préstamos en la base de
+# datos configurada, para reproducir en local problemas de rendimiento de producción
+# Ejemplo: python manage.py generar_datos --libros 2000000 --usuarios 300000 --prestamos 20000000 --procesos 8
+# Con la misma semilla y los mismos tamaños se generan exactamente los mismos datos
+class Command(BaseCommand):
+    help = 'Genera libros, usuarios y préstamos sintéticos a gran escala con distribuciones realistas'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--libros', type=int, default=100000)
+        parser.add_argument('--usuarios', type=int, default=20000)
+        parser.add_argument('--prestamos', type=int, default=1000000)
+        parser.add_argument('--semilla', type=int, default=0)
+        parser.add_argument(
+            '--procesos', type=int,
+            help='Procesos que generan e insertan lotes en paralelo '
+                 '(por defecto 1 con SQLite y un proceso por CPU, hasta 8, con PostgreSQL)',
+        )
+        parser.add_argument('--lote', type=int, default=5000, help='Filas por lote (por defecto 5000)')
+        parser.add_argument('--dias', type=int, default=3 * 365, help='Días de historial (por defecto 3 años)')
+        parser.add_argument(
+            '--prefijo',
+            help='Prefijo de los nombres de usuario generados (por defecto gen<semilla>_)',
+        )
+        parser.add_argument('--password', default='lector1234', help='Contraseña de todos los usuarios generados')
+        parser.add_argument(
+            '--sin-indice', action='store_true', dest='sin_indice',
+            help='No indexa los libros para la búsqueda (reindexar_catalogo lo hace después)',
+        )
+
+    def handle(self, *args, **opciones):
+        if min(opciones['libros'], opciones['usuarios'], opciones['prestamos']) < 0 or opciones['lote'] < 1:
+            raise CommandError('Las cantidades no pueden ser negativas y el lote debe ser mayor que cero')
+        prefijo = opciones['prefijo'] if opciones['prefijo'] is not None else f"gen{opciones['semilla']}_"
+        if opciones['usuarios'] and Usuario.objects.filter(username__startswith=prefijo).exists():
+            raise CommandError(f'Ya hay usuarios con el prefijo "{prefijo}"; usa otra --semilla o --prefijo')
+        procesos = opciones['procesos'] or procesos_por_defecto()
+
+        totales = {'libros': 0, 'usuarios': 0, 'prestamos': 0}
+        objetivo = {clave: opciones[clave] for clave in totales}
+        inicio = time.monotonic()
+
+        def al_progresar(tipo, filas):
+            totales[tipo] += filas
+            segundos = time.monotonic() - inicio
+            self.stdout.write(
+                f'{tipo:<9} {totales[tipo]:>11} / {objetivo[tipo]:<11} '
+                f'({sum(totales.values()) / max(segundos, 0.001):,.0f} filas/s)'
+            )
+
+        self.stdout.write(f'Generando con {procesos} proceso(s)...')
+        try:
+            resumen = generar(
+                opciones['libros'], opciones['usuarios'], opciones['prestamos'],
+                semilla=opciones['semilla'], procesos=procesos, tamano_lote=opciones['lote'],
+                dias=opciones['dias'], prefijo=prefijo, password=opciones['password'],
+                indexar=not opciones['sin_indice'], al_progresar=al_progresar,
+            )
+        except ValueError as error:
+            raise CommandError(str(error))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Generados {resumen['libros']} libros, {resumen['usuarios']} usuarios y {resumen['prestamos']} "
+            f"préstamos ({resumen['activos']} activos) en {resumen['segundos']} s"
+        ))
@@ -0,0 +1,93 @@
+import csv
+import os
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from gestion.importacion import FORMATOS, importar_libros, leer_csv, leer_jsonl
+
+
+# Comando para cargar el catálogo de una biblioteca desde un archivo CSV o JSON lines
+# El archivo se lee en streaming, así que sirve igual para cien libros que para millones
+# Ejemplo de CSV: titulo,autor,año_publicacion,cantidad_stock
+class Command(BaseCommand):
+    help = 'Importa libros desde un archivo CSV o JSON lines, actualizando el stock de los que ya existen'
+
+    def add_arguments(self, parser):
+        parser.add_argument('archivo', help='Ruta del archivo a importar ("-" para la entrada estándar)')
+        parser.add_argument(
+            '--formato', choices=FORMATOS,
+            help='Formato del archivo; por defecto se deduce de la extensión',
+        )
+        parser.add_argument(
+            '--lote', type=int, default=1000,
+            help='Cantidad de libros guardados por lote (por defecto 1000)',
+        )
+        parser.add_argument(
+            '--sumar-stock', action='store_true', dest='sumar_stock',
+            help='Suma el stock importado al existente en lugar de reemplazarlo',
+        )
+        parser.add_argument(
+            '--rechazados',
+            help='Ruta de un CSV donde guardar las filas rechazadas (línea y motivo)',
+        )
+
+    def handle(self, *args, **opciones):
+        formato = opciones['formato'] or self._deducir_formato(opciones['archivo'])
+        if opciones['archivo'] == '-':
+            archivo = sys.stdin
+        else:
+            try:
+                # utf-8-sig para aceptar los CSV exportados desde Excel con BOM
+                archivo = open(opciones['archivo'], encoding='utf-8-sig', newline='')
+            except OSError as error:
+                raise CommandError(f'No se pudo abrir el archivo: {error}')
+
+        rechazados = open(opciones['rechazados'], 'w', encoding='utf-8', newline='') if opciones['rechazados'] else None
+        escritor = csv.writer(rechazados) if rechazados else None
+        if escritor:
+            escritor.writerow(['linea', 'motivo'])
+        mostrados = 0
+
+        def al_rechazar(linea, motivo):
+            # Sin archivo de rechazados muestro solo los primeros para no inundar la consola
+            nonlocal mostrados
+            if escritor:
+                escritor.writerow([linea, motivo])
+            elif mostrados < 20:
+                self.stdout.write(self.style.WARNING(f'Línea {linea} rechazada: {motivo}'))
+                mostrados += 1
+
+        def al_progresar(resumen):
+            self.stdout.write(
+                f'{resumen.leidas} filas leídas | {resumen.creados} creados | '
+                f'{resumen.actualizados} actualizados | {resumen.rechazadas} rechazadas'
+            )
+
+        lector = leer_csv if formato == 'csv' else leer_jsonl
+        try:
+            resumen = importar_libros(
+                lector(archivo),
+                tamano_lote=opciones['lote'],
+                sumar_stock=opciones['sumar_stock'],
+                al_rechazar=al_rechazar,
+                al_progresar=al_progresar,
+            )
+        finally:
+            if archivo is not sys.stdin:
+                archivo.close()
+            if rechazados:
+                rechazados.close()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Importación terminada: {resumen.creados} libros creados, {resumen.actualizados} actualizados '
+            f'y {resumen.rechazadas} filas rechazadas de {resumen.leidas}'
+        ))
+
+    def _deducir_formato(self, ruta):
+        extension = os.path.splitext(ruta)[1].lower()
+        if extension == '.csv':
+            return 'csv'
+        if extension in ('.jsonl', '.ndjson'):
+            return 'jsonl'
+        raise CommandError('No se puede deducir el formato del archivo; usa --formato csv o --formato jsonl')
@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from gestion import analitica
+
+
+# Comando para recalcular los resúmenes de la analítica de préstamos desde el historial
+# Hace falta una vez tras crear las tablas (migración) y después de cambios hechos fuera
+# del servicio de préstamos (SQL directo, cargas masivas, restauraciones)
+# Con --verificar solo compara los resúmenes con Prestamo, sin escribir nada
+class Command(BaseCommand):
+    help = 'Reconstruye los resúmenes diarios y mensuales de la analítica de préstamos desde Prestamo'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verificar', action='store_true',
+            help='Solo compara los resúmenes con el historial y cuenta los desviados',
+        )
+        parser.add_argument(
+            '--lote', type=int, default=5000,
+            help='Filas insertadas por sentencia al escribir cada mes (por defecto 5000)',
+        )
+
+    def handle(self, *args, **opciones):
+        inicio = time.monotonic()
+        if opciones['verificar']:
+            desviaciones = analitica.verificar()
+            self.stdout.write(f"Días desviados: {desviaciones['dias']}")
+            self.stdout.write(f"Libros por mes desviados: {desviaciones['libros_mes']}")
+            if desviaciones['dias'] or desviaciones['libros_mes']:
+                self.stdout.write(self.style.WARNING('Ejecuta el comando sin --verificar para reconstruirlos'))
+            else:
+                self.stdout.write(self.style.SUCCESS('Los resúmenes coinciden con el historial'))
+            return
+
+        def al_progresar(mes, libros):
+            self.stdout.write(f'  {mes:%Y-%m}: {libros} libros prestados')
+
+        resultado = analitica.reconstruir(tamano_lote=opciones['lote'], al_progresar=al_progresar)
+        self.stdout.write(self.style.SUCCESS(
+            f"Resúmenes reconstruidos: {resultado['dias']} días y {resultado['meses']} meses "
+            f"en {time.monotonic() - inicio:.1f} s"
+        ))
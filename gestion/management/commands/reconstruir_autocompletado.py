@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from gestion.autocompletado import reconstruir, ruta_archivo
+
+
+# Comando para reconstruir el índice del autocompletado y guardarlo en su archivo
+# Los workers en marcha cargan el archivo nuevo en su siguiente revisión; útil tras
+# cargas masivas o para que la popularidad de las sugerencias refleje los préstamos
+class Command(BaseCommand):
+    help = 'Reconstruye el índice de prefijos del autocompletado de títulos y autores'
+
+    def handle(self, *args, **opciones):
+        inicio = time.perf_counter()
+        indice = reconstruir()
+        self.stdout.write(self.style.SUCCESS(
+            f'Índice con {len(indice.titulos)} títulos y {len(indice.autores)} autores guardado en '
+            f'{ruta_archivo()} ({time.perf_counter() - inicio:.1f} s)'
+        ))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from gestion.busqueda import reindexar_catalogo
+
+
+# Comando para reconstruir el índice de búsqueda desde cero
+# Normalmente no hace falta porque el índice se actualiza con cada cambio de libro,
+# pero es útil después de cargas masivas que no disparan señales (bulk_create, SQL directo)
+class Command(BaseCommand):
+    help = 'Reconstruye el índice de búsqueda del catálogo de libros'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--lote', type=int, default=2000,
+            help='Cantidad de libros procesados por lote (por defecto 2000)',
+        )
+
+    def handle(self, *args, **opciones):
+        total = reindexar_catalogo(tamano_lote=opciones['lote'])
+        self.stdout.write(self.style.SUCCESS(f'Índice reconstruido para {total} libros'))
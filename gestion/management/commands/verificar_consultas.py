@@ -0,0 +1,67 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from gestion.benchmarks.utilidades import PAGINAS_ACOTADAS, base_de_pruebas, crear_ronda_historial
+from gestion.models import Usuario
+
+
+# Comando para comprobar que las páginas de préstamos y usuarios hacen un número
+# de consultas fijo, sin importar cuántas filas muestran (sin consultas N+1)
+# Carga datos en varias rondas sobre una base de datos de pruebas, cuenta las consultas
+# de cada página tras cada ronda y falla si el número crece con las filas
+# Los presupuestos exactos de cada página están en gestion/tests.py (manage.py test);
+# este comando permite repetir la comprobación con más rondas o más filas
+class Command(BaseCommand):
+    help = 'Verifica que las páginas de historial y usuarios no aumenten sus consultas con el número de filas'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--filas', type=int, nargs='+', default=[5, 50],
+            help='Préstamos y usuarios añadidos en cada ronda (por defecto 5 50)',
+        )
+        parser.add_argument(
+            '--maximo', type=int, default=None,
+            help='Número máximo de consultas permitido por página',
+        )
+
+    def handle(self, *args, **opciones):
+        setup_test_environment()
+        try:
+            with base_de_pruebas():
+                conteos = self._medir(opciones['filas'])
+        finally:
+            teardown_test_environment()
+
+        errores = []
+        for nombre, valores in conteos.items():
+            self.stdout.write(f"  {nombre:<28} {' -> '.join(str(n) for n in valores)}")
+            if len(set(valores)) > 1:
+                errores.append(f'{nombre}: las consultas crecen con las filas ({valores})')
+            if opciones['maximo'] is not None and max(valores) > opciones['maximo']:
+                errores.append(f"{nombre}: {max(valores)} consultas superan el máximo de {opciones['maximo']}")
+
+        if errores:
+            raise CommandError('\n'.join(errores))
+        self.stdout.write(self.style.SUCCESS('Todas las páginas hacen un número de consultas constante'))
+
+    def _medir(self, rondas):
+        admin = Usuario.objects.create_user('admin_consultas', 'admin@biblioteca.test', 'x', rol='admin')
+        lector = Usuario.objects.create_user('lector_consultas', 'lector@biblioteca.test', 'x')
+        clientes = {'admin': Client(), 'lector': Client()}
+        clientes['admin'].force_login(admin)
+        clientes['lector'].force_login(lector)
+
+        conteos = {nombre: [] for nombre, _ in PAGINAS_ACOTADAS}
+        for ronda, filas in enumerate(rondas, start=1):
+            crear_ronda_historial(lector, filas, semilla=ronda)
+
+            for nombre, quien in PAGINAS_ACOTADAS:
+                with CaptureQueriesContext(connection) as consultas:
+                    respuesta = clientes[quien].get(reverse(nombre))
+                if respuesta.status_code != 200:
+                    raise CommandError(f'{nombre} respondió {respuesta.status_code}')
+                conteos[nombre].append(len(consultas))
+        return conteos
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from gestion.contadores import verificar
+
+
+# Comando para comprobar que los contadores de préstamos coinciden con el historial
+# Solo deberían desviarse tras cambios hechos fuera del servicio de préstamos
+# (SQL directo, cargas masivas, restauraciones), y con --reparar se recalculan
+class Command(BaseCommand):
+    help = 'Compara los contadores de préstamos con el historial (activo y archivado) y opcionalmente los repara'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--reparar', action='store_true',
+            help='Corrige los contadores desviados con los valores reales',
+        )
+        parser.add_argument(
+            '--lote', type=int, default=2000,
+            help='Cantidad de libros o usuarios comprobados por lote (por defecto 2000)',
+        )
+
+    def handle(self, *args, **opciones):
+        desviaciones = verificar(reparar=opciones['reparar'], tamano_lote=opciones['lote'])
+        self.stdout.write(f"Libros con contadores desviados: {desviaciones['libro']}")
+        self.stdout.write(f"Usuarios con contadores desviados: {desviaciones['usuario']}")
+        self.stdout.write(f"Contadores globales desviados: {'sí' if desviaciones['global'] else 'no'}")
+
+        if not (desviaciones['libro'] or desviaciones['usuario'] or desviaciones['global']):
+            self.stdout.write(self.style.SUCCESS('Los contadores coinciden con el historial'))
+        elif opciones['reparar']:
+            self.stdout.write(self.style.SUCCESS('Contadores reparados'))
+        else:
+            self.stdout.write(self.style.WARNING('Ejecuta el comando con --reparar para corregirlos'))
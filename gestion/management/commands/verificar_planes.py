@@ -0,0 +1,190 @@
+import json
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from gestion import archivado
+from gestion.benchmarks.utilidades import base_de_pruebas, crear_libros, crear_prestamos, crear_reservas, crear_usuarios
+from gestion.models import Libro, Prestamo, Reserva, Usuario
+
+# Tablas en las que no se admite un recorrido completo cuando la consulta filtra
+TABLAS_VIGILADAS = ['gestion_prestamo', 'gestion_prestamoarchivado', 'gestion_reserva']
+
+# Recorridos completos de tabla en la salida de EXPLAIN de cada motor
+# En SQLite también cuenta "SCAN tabla USING INDEX": recorre el índice entero
+_RECORRIDO = {
+    'sqlite': re.compile(r'\bSCAN (\w+)'),
+    'postgresql': re.compile(r'\bSeq Scan on (\w+)'),
+}
+
+
+def cargar(opciones):
+    # Historial de prueba: libros, usuarios, préstamos (una parte archivada) y reservas
+    crear_libros(opciones['libros'], semilla=opciones['semilla'], indexar=False)
+    crear_usuarios(opciones['usuarios'], semilla=opciones['semilla'])
+    crear_prestamos(opciones['prestamos'], semilla=opciones['semilla'])
+    # Una parte del historial archivada, para que las páginas completas lean las dos tablas
+    archivado.archivar(dias=365)
+    crear_reservas(opciones['reservas'], semilla=opciones['semilla'])
+    # Estadísticas actualizadas para que el planificador vea el tamaño real de las tablas
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+
+
+def peticiones():
+    # (nombre, quién la hace, método, ruta, datos)
+    # Cada préstamo y devolución deja el libro igual que estaba, así que el orden importa
+    lector = Usuario.objects.filter(rol='regular', prestamos_activos__gt=0).order_by('pk').first()
+    sin_activos = Usuario.objects.filter(
+        rol='regular', prestamos_activos=0, prestamos_totales__gt=0,
+    ).order_by('pk').first()
+    prestado = Prestamo.objects.filter(usuario=lector, devuelto=False).values_list('libro_id', flat=True).first()
+    libre = Libro.objects.exclude(pk__in=lector.libros_prestados.values('pk')).order_by('pk').values_list('pk', flat=True).first()
+    sin_prestamos_activos = Libro.objects.filter(prestamos_activos=0).order_by('-pk').values_list('pk', flat=True).first()
+    Libro.objects.filter(pk=libre).update(cantidad_stock=10)
+    # Un libro agotado para la lista de espera y una cola detrás del libro que el lector
+    # devuelve al final, para que la devolución aparte el ejemplar
+    agotado = Libro.objects.filter(cantidad_stock=0).exclude(pk=prestado).order_by('pk').values_list('pk', flat=True).first()
+    Libro.objects.filter(pk=prestado).update(cantidad_stock=0)
+    Reserva.objects.bulk_create([
+        Reserva(libro_id=prestado, usuario_id=usuario_id)
+        for usuario_id in Usuario.objects.filter(rol='regular').exclude(pk=lector.pk).exclude(
+            reservas__libro_id=prestado, reservas__estado__in=[Reserva.ESPERA, Reserva.ASIGNADA],
+        ).order_by('pk').values_list('pk', flat=True)[:3]
+    ])
+    api = f'/api/usuarios/{lector.pk}'
+    return lector, [
+        ('web historial-prestamos', 'admin', 'get', reverse('historial-prestamos'), None),
+        ('web mi-historial-prestamos', 'lector', 'get', reverse('mi-historial-prestamos'), None),
+        ('web historial-prestamos (completo)', 'admin', 'get', f"{reverse('historial-prestamos')}?completo=1", None),
+        ('web mi-historial-prestamos (completo)', 'lector', 'get', f"{reverse('mi-historial-prestamos')}?completo=1", None),
+        ('web prestamos-listas', 'lector', 'get', reverse('prestamos-listas'), None),
+        ('web libro-delete', 'admin', 'get', reverse('libro-delete', args=[prestado]), None),
+        ('web usuario-delete', 'admin', 'get', reverse('usuario-delete', args=[lector.pk]), None),
+        ('web prestamo-create', 'lector', 'post', reverse('prestamo-create', args=[libre]), {}),
+        ('web prestamo-devolucion', 'lector', 'post', reverse('prestamo-devolucion', args=[libre]), {}),
+        ('api mis_libros', 'lector', 'get', f'{api}/mis_libros/', None),
+        ('api prestamos', 'lector', 'get', f'{api}/prestamos/', None),
+        ('api prestar_libro', 'lector', 'post', f'{api}/prestar_libro/', {'libro_id': libre}),
+        ('api devolver_libro', 'lector', 'post', f'{api}/devolver_libro/', {'libro_id': libre}),
+        ('api prestar_libros', 'lector', 'post', f'{api}/prestar_libros/', {'libro_ids': [libre]}),
+        ('api devolver_libros', 'lector', 'post', f'{api}/devolver_libros/', {'libro_ids': [libre]}),
+        # Lista de espera
+        ('web reserva-create', 'lector', 'post', reverse('reserva-create', args=[agotado]), {}),
+        ('web libros-detalles (reserva)', 'lector', 'get', reverse('libros-detalles', args=[agotado]), None),
+        ('web mis-reservas', 'lector', 'get', reverse('mis-reservas'), None),
+        ('api reservas', 'lector', 'get', f'{api}/reservas/', None),
+        ('api cancelar_reserva', 'lector', 'post', f'{api}/cancelar_reserva/', {'libro_id': agotado}),
+        ('api reservar', 'lector', 'post', f'{api}/reservar/', {'libro_id': agotado}),
+        ('web prestamo-devolucion (cola)', 'lector', 'post', reverse('prestamo-devolucion', args=[prestado]), {}),
+        # Borrados en cascada del historial (sin préstamos activos)
+        ('web libro-delete (borrar)', 'admin', 'post', reverse('libro-delete', args=[sin_prestamos_activos]), {}),
+        ('web usuario-delete (borrar)', 'admin', 'post', reverse('usuario-delete', args=[sin_activos.pk]), {}),
+    ]
+
+
+def capturar():
+    # Hace cada petición de peticiones() y devuelve el plan de cada consulta sobre una
+    # tabla vigilada: {'peticion', 'sql', 'filtrada', 'recorridos', 'plan'}
+    admin = Usuario.objects.create_user('admin_planes', 'admin_planes@biblioteca.test', 'x', rol='admin', is_staff=True)
+    lector, lista = peticiones()
+    clientes = {'admin': Client(), 'lector': Client()}
+    clientes['admin'].force_login(admin)
+    clientes['lector'].force_login(lector)
+
+    planes = []
+    for nombre, quien, metodo, ruta, datos in lista:
+        cliente = clientes[quien]
+        with CaptureQueriesContext(connection) as consultas:
+            if metodo == 'get':
+                respuesta = cliente.get(ruta)
+            else:
+                respuesta = cliente.post(ruta, datos, content_type='application/json') if ruta.startswith('/api/') \
+                    else cliente.post(ruta, datos)
+        if respuesta.status_code >= 400:
+            raise CommandError(f'{nombre} respondió {respuesta.status_code}')
+        for consulta in consultas.captured_queries:
+            sql = consulta['sql']
+            if not re.search(rf"\b({'|'.join(TABLAS_VIGILADAS)})\b", sql) or not sql.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE')):
+                continue
+            plan = explicar(sql)
+            recorridos = sorted({
+                tabla for linea in plan for tabla in _RECORRIDO[connection.vendor].findall(linea)
+                if tabla in TABLAS_VIGILADAS
+            })
+            planes.append({
+                'peticion': nombre,
+                'sql': sql,
+                'filtrada': bool(re.search(r'\bWHERE\b', sql)),
+                'recorridos': recorridos,
+                'plan': plan,
+            })
+    return planes
+
+
+def explicar(sql):
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(f'EXPLAIN {sql}')
+            return [fila[0] for fila in cursor.fetchall()]
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+        return [fila[-1] for fila in cursor.fetchall()]
+
+
+# Comando para comprobar que las consultas frecuentes sobre préstamos usan índices
+# Carga un historial grande en una base de datos de pruebas, recorre las páginas y
+# endpoints que consultan préstamos (web.views y gestion.views), captura cada consulta
+# y su EXPLAIN, y falla si alguna consulta filtrada recorre una tabla vigilada entera
+# Las consultas sin WHERE (el historial completo del administrador) se informan pero no fallan
+class Command(BaseCommand):
+    help = 'Verifica con EXPLAIN que las consultas frecuentes de préstamos no recorren la tabla completa'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--libros', type=int, default=20000)
+        parser.add_argument('--usuarios', type=int, default=5000)
+        parser.add_argument('--prestamos', type=int, default=100000)
+        parser.add_argument('--reservas', type=int, default=50000)
+        parser.add_argument('--semilla', type=int, default=0)
+        parser.add_argument(
+            '--planes',
+            help='Ruta de un archivo JSON donde guardar cada consulta con su plan',
+        )
+
+    def handle(self, *args, **opciones):
+        if connection.vendor not in _RECORRIDO:
+            raise CommandError(f'Motor no soportado: {connection.vendor} (solo SQLite y PostgreSQL)')
+        setup_test_environment()
+        try:
+            with base_de_pruebas():
+                self.stdout.write('Cargando datos de prueba...')
+                cargar(opciones)
+                planes = capturar()
+        finally:
+            teardown_test_environment()
+
+        errores = []
+        for plan in planes:
+            if plan['recorridos'] and plan['filtrada']:
+                estado = self.style.ERROR('RECORRIDO')
+                errores.append(f"{plan['peticion']}: recorre {', '.join(plan['recorridos'])}\n  {plan['sql']}")
+            elif plan['recorridos']:
+                estado = self.style.WARNING('completa')
+            else:
+                estado = self.style.SUCCESS('índice')
+            self.stdout.write(f"  {plan['peticion']:<32} {estado}  {plan['sql'][:90]}")
+            if opciones['verbosity'] > 1:
+                for linea in plan['plan']:
+                    self.stdout.write(f'      {linea}')
+
+        if opciones['planes']:
+            with open(opciones['planes'], 'w', encoding='utf-8') as archivo:
+                json.dump({'motor': connection.vendor, 'planes': planes}, archivo, ensure_ascii=False, indent=2)
+            self.stdout.write(f"Planes guardados en {opciones['planes']}")
+
+        if errores:
+            raise CommandError('Consultas que recorren la tabla completa:\n' + '\n'.join(errores))
+        self.stdout.write(self.style.SUCCESS(f'Las {len(planes)} consultas sobre préstamos usan índices'))
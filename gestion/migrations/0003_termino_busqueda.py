@@ -0,0 +1,79 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:26
+
+import re
+import unicodedata
+from collections import Counter
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Copia del tokenizador de gestion/busqueda.py tal como estaba al crear el índice:
+# la migración no importa código de la aplicación, que puede cambiar después sin que
+# esta migración deba cambiar con él
+PESO_TITULO = 3
+PESO_AUTOR = 2
+LONGITUD_MAXIMA_TERMINO = 100
+_SEPARADORES = re.compile(r'[^0-9a-zñ]+')
+
+
+def tokenizar(texto):
+    # Minúsculas, sin tildes ni diéresis (conservando la ñ) y partido por separadores
+    texto = (texto or '').lower().replace('ñ', '\x00')
+    texto = unicodedata.normalize('NFKD', texto)
+    texto = ''.join(c for c in texto if not unicodedata.combining(c)).replace('\x00', 'ñ')
+    return [termino[:LONGITUD_MAXIMA_TERMINO] for termino in _SEPARADORES.split(texto) if termino]
+
+
+def terminos_libro(titulo, autor):
+    pesos = Counter()
+    for termino in tokenizar(titulo):
+        pesos[termino] += PESO_TITULO
+    for termino in tokenizar(autor):
+        pesos[termino] += PESO_AUTOR
+    return pesos
+
+
+def poblar_indice(apps, schema_editor, tamano_lote=2000):
+    # Construyo el índice para los libros que ya existían antes de esta migración
+    Libro = apps.get_model('gestion', 'Libro')
+    TerminoBusqueda = apps.get_model('gestion', 'TerminoBusqueda')
+
+    ultimo_id = 0
+    while True:
+        lote = list(
+            Libro.objects.filter(pk__gt=ultimo_id).order_by('pk').values_list('pk', 'titulo', 'autor')[:tamano_lote]
+        )
+        if not lote:
+            break
+        TerminoBusqueda.objects.bulk_create([
+            TerminoBusqueda(libro_id=pk, termino=termino, peso=peso)
+            for pk, titulo, autor in lote
+            for termino, peso in terminos_libro(titulo, autor).items()
+        ], batch_size=tamano_lote)
+        ultimo_id = lote[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion', '0002_prestamo'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TerminoBusqueda',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('termino', models.CharField(max_length=100)),
+                ('peso', models.PositiveSmallIntegerField(default=1)),
+                ('libro', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='terminos', to='gestion.libro')),
+            ],
+            options={
+                'verbose_name': 'Término de búsqueda',
+                'verbose_name_plural': 'Términos de búsqueda',
+                'indexes': [models.Index(fields=['termino', 'libro'], name='termino_busqueda_idx', opclasses=['varchar_pattern_ops', 'int8_ops'])],
+                'constraints': [models.UniqueConstraint(fields=('libro', 'termino'), name='termino_unico_por_libro')],
+            },
+        ),
+        migrations.RunPython(poblar_indice, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,78 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:39
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+
+FRAGMENTOS = 8
+
+
+def _conteo(prestamo_model, campo, filtro=None):
+    # Subconsulta correlacionada con el número de préstamos de cada fila
+    consulta = (
+        prestamo_model.objects.filter(**{campo: OuterRef('pk')}, **(filtro or {}))
+        .values(campo)
+        .annotate(n=Count('id'))
+        .values('n')
+    )
+    return Coalesce(Subquery(consulta, output_field=IntegerField()), Value(0))
+
+
+def poblar_contadores(apps, schema_editor):
+    # Relleno los contadores a partir del historial con un UPDATE por tabla
+    Prestamo = apps.get_model('gestion', 'Prestamo')
+    ContadorPrestamos = apps.get_model('gestion', 'ContadorPrestamos')
+    for nombre, campo in (('Libro', 'libro'), ('Usuario', 'usuario')):
+        apps.get_model('gestion', nombre).objects.update(
+            prestamos_activos=_conteo(Prestamo, campo, {'devuelto': False}),
+            prestamos_totales=_conteo(Prestamo, campo),
+        )
+    totales = Prestamo.objects.aggregate(totales=Count('id'), activos=Count('id', filter=Q(devuelto=False)))
+    ContadorPrestamos.objects.bulk_create(
+        [ContadorPrestamos(fragmento=0, activos=totales['activos'], totales=totales['totales'])]
+        + [ContadorPrestamos(fragmento=i) for i in range(1, FRAGMENTOS)]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion', '0003_termino_busqueda'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContadorPrestamos',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fragmento', models.PositiveSmallIntegerField(unique=True)),
+                ('activos', models.IntegerField(default=0)),
+                ('totales', models.IntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Contador de préstamos',
+                'verbose_name_plural': 'Contadores de préstamos',
+            },
+        ),
+        migrations.AddField(
+            model_name='libro',
+            name='prestamos_activos',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='libro',
+            name='prestamos_totales',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='usuario',
+            name='prestamos_activos',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='usuario',
+            name='prestamos_totales',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(poblar_contadores, migrations.RunPython.noop),
+    ]
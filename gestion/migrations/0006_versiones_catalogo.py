@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:22
+
+import django.utils.timezone
+from django.db import migrations, models
+
+FRAGMENTOS = 8
+
+
+def crear_fragmentos(apps, schema_editor):
+    VersionCatalogo = apps.get_model('gestion', 'VersionCatalogo')
+    VersionCatalogo.objects.bulk_create([VersionCatalogo(fragmento=i) for i in range(FRAGMENTOS)])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion', '0005_libro_clave_catalogo'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VersionCatalogo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fragmento', models.PositiveSmallIntegerField(unique=True)),
+                ('version', models.PositiveBigIntegerField(default=0)),
+                ('actualizado', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Versión del catálogo',
+                'verbose_name_plural': 'Versiones del catálogo',
+            },
+        ),
+        migrations.AddField(
+            model_name='libro',
+            name='actualizado',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='libro',
+            name='version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.RunPython(crear_fragmentos, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:45
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion', '0006_versiones_catalogo'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='prestamo',
+            index=models.Index(fields=['usuario', '-fecha_prestamo'], name='prestamo_usuario_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='prestamo',
+            index=models.Index(fields=['-fecha_prestamo'], name='prestamo_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='prestamo',
+            index=models.Index(condition=models.Q(('devuelto', False)), fields=['libro', 'usuario'], name='prestamo_activo_libro_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='prestamo',
+            index=models.Index(condition=models.Q(('devuelto', False)), fields=['usuario', 'libro'], name='prestamo_activo_usuario_idx'),
+        ),
+        # El índice simple de usuario se elimina después de crear el compuesto que lo cubre
+        migrations.AlterField(
+            model_name='prestamo',
+            name='usuario',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+    ]
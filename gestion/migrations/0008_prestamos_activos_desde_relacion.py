@@ -0,0 +1,96 @@
+from django.db import migrations
+from django.db.models import Count, IntegerField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+FRAGMENTOS = 8
+LOTE = 2000
+
+
+def _conteo(prestamo_model, campo, filtro=None):
+    # Subconsulta correlacionada con el número de préstamos de cada fila (como en 0004)
+    consulta = (
+        prestamo_model.objects.filter(**{campo: OuterRef('pk')}, **(filtro or {}))
+        .values(campo)
+        .annotate(n=Count('id'))
+        .values('n')
+    )
+    return Coalesce(Subquery(consulta, output_field=IntegerField()), Value(0))
+
+
+def _recalcular_contadores(apps):
+    Prestamo = apps.get_model('gestion', 'Prestamo')
+    ContadorPrestamos = apps.get_model('gestion', 'ContadorPrestamos')
+    for nombre, campo in (('Libro', 'libro'), ('Usuario', 'usuario')):
+        apps.get_model('gestion', nombre).objects.update(
+            prestamos_activos=_conteo(Prestamo, campo, {'devuelto': False}),
+            prestamos_totales=_conteo(Prestamo, campo),
+        )
+    totales = Prestamo.objects.aggregate(totales=Count('id'), activos=Count('id', filter=Q(devuelto=False)))
+    ContadorPrestamos.objects.all().delete()
+    ContadorPrestamos.objects.bulk_create(
+        [ContadorPrestamos(fragmento=0, activos=totales['activos'], totales=totales['totales'])]
+        + [ContadorPrestamos(fragmento=i) for i in range(1, FRAGMENTOS)]
+    )
+
+
+def sincronizar_prestamos(apps, schema_editor):
+    # Antes de quitar libros_prestados dejo Prestamo igual que la relación, que era la que
+    # decidía el stock: cada libro prestado tiene un préstamo abierto, y solo uno
+    # - Los préstamos antiguos de la API solo existían en la relación: se crean con la
+    #   fecha de la migración, porque la fecha real no se guardó nunca
+    # - Los abiertos sin relación (devoluciones antiguas que no cerraron el préstamo) y los
+    #   abiertos repetidos para el mismo usuario y libro se cierran
+    Usuario = apps.get_model('gestion', 'Usuario')
+    Prestamo = apps.get_model('gestion', 'Prestamo')
+    LibroPrestado = Usuario.libros_prestados.through
+    ahora = timezone.now()
+
+    pendientes = set(LibroPrestado.objects.values_list('usuario_id', 'libro_id'))
+    cerrar = []
+    abiertos = (
+        Prestamo.objects.filter(devuelto=False)
+        .order_by('usuario_id', 'libro_id', '-fecha_prestamo', '-pk')
+        .values_list('pk', 'usuario_id', 'libro_id')
+    )
+    for pk, usuario_id, libro_id in abiertos.iterator(chunk_size=LOTE):
+        if (usuario_id, libro_id) in pendientes:
+            # El más reciente queda abierto; los demás del mismo par ya no están en pendientes
+            pendientes.discard((usuario_id, libro_id))
+        else:
+            cerrar.append(pk)
+
+    for inicio in range(0, len(cerrar), LOTE):
+        Prestamo.objects.filter(pk__in=cerrar[inicio:inicio + LOTE]).update(devuelto=True, fecha_devolucion=ahora)
+    faltan = sorted(pendientes)
+    for inicio in range(0, len(faltan), LOTE):
+        Prestamo.objects.bulk_create([
+            Prestamo(usuario_id=usuario_id, libro_id=libro_id, fecha_prestamo=ahora)
+            for usuario_id, libro_id in faltan[inicio:inicio + LOTE]
+        ])
+    if cerrar or faltan:
+        _recalcular_contadores(apps)
+
+
+def rellenar_relacion(apps, schema_editor):
+    # Al deshacer, la relación vuelve a tener un libro por cada préstamo abierto
+    Usuario = apps.get_model('gestion', 'Usuario')
+    Prestamo = apps.get_model('gestion', 'Prestamo')
+    LibroPrestado = Usuario.libros_prestados.through
+    pares = list(Prestamo.objects.filter(devuelto=False).values_list('usuario_id', 'libro_id').distinct())
+    for inicio in range(0, len(pares), LOTE):
+        LibroPrestado.objects.bulk_create(
+            [LibroPrestado(usuario_id=usuario_id, libro_id=libro_id) for usuario_id, libro_id in pares[inicio:inicio + LOTE]],
+            ignore_conflicts=True,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion', '0007_prestamo_indices'),
+    ]
+
+    operations = [
+        migrations.RunPython(sincronizar_prestamos, rellenar_relacion),
+    ]
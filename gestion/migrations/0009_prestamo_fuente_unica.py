@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion', '0008_prestamos_activos_desde_relacion'),
+    ]
+
+    operations = [
+        # El índice único sustituye al parcial (usuario, libro), que se quita después de crearlo
+        migrations.AddConstraint(
+            model_name='prestamo',
+            constraint=models.UniqueConstraint(condition=models.Q(('devuelto', False)), fields=('usuario', 'libro'), name='prestamo_activo_unico'),
+        ),
+        migrations.RemoveIndex(
+            model_name='prestamo',
+            name='prestamo_activo_usuario_idx',
+        ),
+        migrations.RemoveField(
+            model_name='usuario',
+            name='libros_prestados',
+        ),
+    ]
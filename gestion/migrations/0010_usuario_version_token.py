@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion', '0009_prestamo_fuente_unica'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usuario',
+            name='version_token',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:51
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion', '0010_usuario_version_token'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LibroEliminado',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('libro_id', models.BigIntegerField()),
+                ('eliminado', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Libro eliminado',
+                'verbose_name_plural': 'Libros eliminados',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='libro',
+            index=models.Index(fields=['actualizado'], name='libro_actualizado_idx'),
+        ),
+    ]
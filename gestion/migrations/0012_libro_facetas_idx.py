@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion', '0011_autocompletado'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='libro',
+            index=models.Index(fields=['autor', 'año_publicacion', 'cantidad_stock'], name='libro_facetas_idx'),
+        ),
+    ]
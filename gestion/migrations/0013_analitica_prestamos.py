@@ -0,0 +1,62 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion', '0012_libro_facetas_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumenDiarioPrestamos',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dia', models.DateField()),
+                ('fragmento', models.PositiveSmallIntegerField(default=0)),
+                ('prestamos', models.IntegerField(default=0)),
+                ('devoluciones', models.IntegerField(default=0)),
+                ('duracion_total_s', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Resumen diario de préstamos',
+                'verbose_name_plural': 'Resúmenes diarios de préstamos',
+            },
+        ),
+        migrations.CreateModel(
+            name='ResumenMensualLibro',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mes', models.DateField()),
+                ('prestamos', models.IntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Resumen mensual de un libro',
+                'verbose_name_plural': 'Resúmenes mensuales de libros',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='prestamo',
+            index=models.Index(condition=models.Q(('devuelto', False)), fields=['fecha_prestamo'], name='prestamo_activo_fecha_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='resumendiarioprestamos',
+            constraint=models.UniqueConstraint(fields=('dia', 'fragmento'), name='resumen_diario_unico'),
+        ),
+        migrations.AddField(
+            model_name='resumenmensuallibro',
+            name='libro',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='resumenes_mensuales', to='gestion.libro'),
+        ),
+        migrations.AddIndex(
+            model_name='resumenmensuallibro',
+            index=models.Index(fields=['mes', '-prestamos'], name='resumen_mensual_top_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='resumenmensuallibro',
+            constraint=models.UniqueConstraint(fields=('mes', 'libro'), name='resumen_mensual_libro_unico'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion', '0013_analitica_prestamos'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PrestamoArchivado',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('fecha_prestamo', models.DateTimeField()),
+                ('devuelto', models.BooleanField(default=True)),
+                ('fecha_devolucion', models.DateTimeField(blank=True, null=True)),
+                ('libro', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='prestamos_archivados', to='gestion.libro')),
+                ('usuario', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='prestamos_archivados', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Préstamo archivado',
+                'verbose_name_plural': 'Préstamos archivados',
+                'ordering': ['-fecha_prestamo'],
+                'indexes': [models.Index(fields=['usuario', '-fecha_prestamo'], name='archivado_usuario_fecha_idx'), models.Index(fields=['-fecha_prestamo'], name='archivado_fecha_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:08
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion', '0014_prestamo_archivado'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Reserva',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('estado', models.CharField(choices=[('espera', 'En espera'), ('asignada', 'Ejemplar apartado'), ('completada', 'Prestado'), ('cancelada', 'Cancelada'), ('vencida', 'Vencida')], default='espera', max_length=10)),
+                ('creada', models.DateTimeField(default=django.utils.timezone.now)),
+                ('asignada', models.DateTimeField(blank=True, null=True)),
+                ('vence', models.DateTimeField(blank=True, null=True)),
+                ('libro', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservas', to='gestion.libro')),
+                ('usuario', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='reservas', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Reserva',
+                'verbose_name_plural': 'Reservas',
+                'ordering': ['creada', 'pk'],
+                'indexes': [models.Index(condition=models.Q(('estado', 'espera')), fields=['libro', 'creada'], name='reserva_cola_idx'), models.Index(condition=models.Q(('estado', 'asignada')), fields=['vence'], name='reserva_vence_idx'), models.Index(fields=['usuario', '-creada'], name='reserva_usuario_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('estado__in', ['espera', 'asignada'])), fields=('usuario', 'libro'), name='reserva_abierta_unica')],
+            },
+        ),
+    ]
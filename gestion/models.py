@@ -11,11 +11,36 @@ class Libro(models.Model):
     año_publicacion = models.IntegerField()  # Año de publicación para catalogado
     cantidad_stock = models.IntegerField(default=0)  # Cantidad de ejemplares disponibles
     
+    # Contadores desnormalizados de préstamos, mantenidos por gestion/contadores.py
+    # en la misma transacción que cada préstamo o devolución. Evitan hacer COUNT(*)
+    # sobre Prestamo cada vez que se muestra la ficha del libro
+    prestamos_activos = models.IntegerField(default=0)
+    prestamos_totales = models.IntegerField(default=0)
+    
+    # Validadores para las peticiones condicionales de la API (ETag / Last-Modified)
+    # Cualquier escritura del libro los cambia; ver gestion/versiones.py
+    version = models.PositiveIntegerField(default=1)
+    actualizado = models.DateTimeField(default=timezone.now)
+    
     def __str__(self):
         # Decidí usar solo el título para facilitar la identificación rápida
         # en la interfaz de administración y en las listas desplegables
         return self.titulo
 
+    class Meta:
+        indexes = [
+            # Clave natural del catálogo: la importación masiva busca por ella
+            # para actualizar libros existentes en lugar de duplicarlos
+            models.Index(fields=['titulo', 'autor', 'año_publicacion'], name='libro_clave_catalogo_idx'),
+            # Libros cambiados desde un momento dado: el autocompletado los aplica sobre
+            # su índice en memoria (gestion/autocompletado.py)
+            models.Index(fields=['actualizado'], name='libro_actualizado_idx'),
+            # Filtros y facetas del listado de la API (gestion/facetas.py): cubre las tres
+            # columnas, así que los recuentos se resuelven leyendo solo el índice. Cada
+            # préstamo o devolución lo actualiza al cambiar cantidad_stock
+            models.Index(fields=['autor', 'año_publicacion', 'cantidad_stock'], name='libro_facetas_idx'),
+        ]
+
 # Modelo de usuario personalizado que extiende el usuario estándar de Django
 # Lo configuré con roles y campos adicionales específicos para la biblioteca
 class Usuario(AbstractUser):
@@ -27,17 +52,27 @@ class Usuario(AbstractUser):
     )
     rol = models.CharField(max_length=7, choices=ROLES, default='regular')
     
-    # Esta relación ManyToMany me pareció la forma más eficiente de registrar
-    # qué libros tiene actualmente cada usuario, facilitando las consultas
-    libros_prestados = models.ManyToManyField(Libro, blank=True)
-    
     # Hice el email único para evitar registros duplicados y poder
     # usarlo como método alternativo de login en el futuro
     email = models.EmailField(unique=True)
     
+    # Mismos contadores que en Libro, para el historial personal del usuario
+    prestamos_activos = models.IntegerField(default=0)
+    prestamos_totales = models.IntegerField(default=0)
+    
+    # Versión de los tokens JWT del usuario: al incrementarla se revocan todos los
+    # emitidos hasta entonces (ver gestion/autenticacion.py)
+    version_token = models.PositiveIntegerField(default=0)
+    
     def __str__(self):
         return self.username
 
+    @property
+    def libros_prestados(self):
+        # Los libros que tiene ahora son sus préstamos sin devolver: Prestamo es la única
+        # fuente de verdad y la consulta la resuelve prestamo_activo_unico
+        return Libro.objects.filter(prestamo__usuario=self.pk, prestamo__devuelto=False).order_by('pk')
+
     @property
     def is_admin(self):
         # Creé esta property para simplificar las verificaciones de permisos
@@ -49,7 +84,8 @@ class Usuario(AbstractUser):
 # incluso después de que los libros sean devueltos
 class Prestamo(models.Model):
     libro = models.ForeignKey(Libro, on_delete=models.CASCADE)  # Referencia al libro
-    usuario = models.ForeignKey(Usuario, on_delete=models.CASCADE)  # Usuario que realizó el préstamo
+    # Sin índice propio: lo cubre prestamo_usuario_fecha_idx, que empieza por usuario
+    usuario = models.ForeignKey(Usuario, on_delete=models.CASCADE, db_index=False)  # Usuario que realizó el préstamo
     fecha_prestamo = models.DateTimeField(default=timezone.now)  # Cuándo se prestó el libro
     devuelto = models.BooleanField(default=False)  # Indica si ya fue devuelto
     fecha_devolucion = models.DateTimeField(null=True, blank=True)  # Cuándo se devolvió
@@ -63,4 +99,221 @@ class Prestamo(models.Model):
         # Configuración adicional para mejorar la presentación y ordenación
         verbose_name = "Préstamo"
         verbose_name_plural = "Préstamos"
-        ordering = ['-fecha_prestamo']  # Los más recientes primero
\ No newline at end of file
+        ordering = ['-fecha_prestamo']  # Los más recientes primero
+        # Índices de las consultas frecuentes (comprobados con manage.py verificar_planes)
+        # Los parciales solo guardan los préstamos activos, una fracción pequeña del
+        # historial, y sirven a los préstamos, devoluciones y comprobaciones antes de borrar
+        indexes = [
+            # Historial de un usuario, más recientes primero (web y API)
+            models.Index(fields=['usuario', '-fecha_prestamo'], name='prestamo_usuario_fecha_idx'),
+            # Historial completo del administrador y filtros por fecha de la exportación
+            models.Index(fields=['-fecha_prestamo'], name='prestamo_fecha_idx'),
+            # Préstamos activos de un libro (y de un libro para un usuario)
+            models.Index(
+                fields=['libro', 'usuario'],
+                condition=models.Q(devuelto=False),
+                name='prestamo_activo_libro_idx',
+            ),
+            # Préstamos activos más antiguos: los vencidos de la analítica (gestion/analitica.py)
+            models.Index(
+                fields=['fecha_prestamo'],
+                condition=models.Q(devuelto=False),
+                name='prestamo_activo_fecha_idx',
+            ),
+        ]
+        constraints = [
+            # Un préstamo activo como mucho por usuario y libro; su índice sirve además
+            # los libros prestados de un usuario (Usuario.libros_prestados)
+            models.UniqueConstraint(
+                fields=['usuario', 'libro'],
+                condition=models.Q(devuelto=False),
+                name='prestamo_activo_unico',
+            ),
+        ]
+
+# Reservas de libros sin ejemplares: una cola por libro en orden de llegada
+# (gestion/reservas.py). Al devolverse un ejemplar se aparta para el primero de la cola
+# (estado 'asignada') hasta `vence`; si no lo pide a tiempo pasa al siguiente
+class Reserva(models.Model):
+    ESPERA = 'espera'
+    ASIGNADA = 'asignada'
+    COMPLETADA = 'completada'
+    CANCELADA = 'cancelada'
+    VENCIDA = 'vencida'
+    ESTADOS = (
+        (ESPERA, 'En espera'),
+        (ASIGNADA, 'Ejemplar apartado'),
+        (COMPLETADA, 'Prestado'),
+        (CANCELADA, 'Cancelada'),
+        (VENCIDA, 'Vencida'),
+    )
+    libro = models.ForeignKey(Libro, on_delete=models.CASCADE, related_name='reservas')
+    # Sin índice propio: lo cubre reserva_usuario_idx, que empieza por usuario
+    usuario = models.ForeignKey(Usuario, on_delete=models.CASCADE, db_index=False, related_name='reservas')
+    estado = models.CharField(max_length=10, choices=ESTADOS, default=ESPERA)
+    creada = models.DateTimeField(default=timezone.now)
+    asignada = models.DateTimeField(null=True, blank=True)  # Cuándo se le apartó el ejemplar
+    vence = models.DateTimeField(null=True, blank=True)  # Hasta cuándo lo tiene apartado
+
+    def __str__(self):
+        return f"{self.libro.titulo} - {self.usuario.username} ({self.estado})"
+
+    class Meta:
+        verbose_name = "Reserva"
+        verbose_name_plural = "Reservas"
+        ordering = ['creada', 'pk']
+        # Los parciales solo guardan las reservas abiertas, no las ya resueltas
+        indexes = [
+            # Cola de un libro en orden de llegada
+            models.Index(fields=['libro', 'creada'], condition=models.Q(estado='espera'), name='reserva_cola_idx'),
+            # Ejemplares apartados por orden de vencimiento, para el barrido
+            models.Index(fields=['vence'], condition=models.Q(estado='asignada'), name='reserva_vence_idx'),
+            # Reservas de un usuario, más recientes primero
+            models.Index(fields=['usuario', '-creada'], name='reserva_usuario_idx'),
+        ]
+        constraints = [
+            # Una reserva abierta como mucho por usuario y libro
+            models.UniqueConstraint(
+                fields=['usuario', 'libro'],
+                condition=models.Q(estado__in=['espera', 'asignada']),
+                name='reserva_abierta_unica',
+            ),
+        ]
+
+# Préstamos devueltos hace tiempo, movidos fuera de Prestamo por gestion/archivado.py
+# Misma forma que Prestamo y el mismo id, así que el historial completo es la unión de
+# las dos tablas; Prestamo solo guarda los activos y los devueltos recientes
+class PrestamoArchivado(models.Model):
+    id = models.BigIntegerField(primary_key=True)  # El id que tenía en Prestamo
+    libro = models.ForeignKey(Libro, on_delete=models.CASCADE, related_name='prestamos_archivados')
+    usuario = models.ForeignKey(Usuario, on_delete=models.CASCADE, db_index=False, related_name='prestamos_archivados')
+    fecha_prestamo = models.DateTimeField()
+    devuelto = models.BooleanField(default=True)
+    fecha_devolucion = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.libro.titulo} - {self.usuario.username} (archivado)"
+
+    class Meta:
+        verbose_name = "Préstamo archivado"
+        verbose_name_plural = "Préstamos archivados"
+        ordering = ['-fecha_prestamo']
+        # Los mismos índices de historial que Prestamo; los parciales de activos no
+        # hacen falta porque aquí todos están devueltos
+        indexes = [
+            models.Index(fields=['usuario', '-fecha_prestamo'], name='archivado_usuario_fecha_idx'),
+            models.Index(fields=['-fecha_prestamo'], name='archivado_fecha_idx'),
+        ]
+
+# Contadores globales de préstamos repartidos en varias filas (fragmentos)
+# Cada préstamo actualiza un fragmento al azar para que las transacciones concurrentes
+# no compitan todas por la misma fila; el total es la suma de los fragmentos
+class ContadorPrestamos(models.Model):
+    fragmento = models.PositiveSmallIntegerField(unique=True)
+    activos = models.IntegerField(default=0)
+    totales = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"Fragmento {self.fragmento}: {self.activos} activos / {self.totales} totales"
+
+    class Meta:
+        verbose_name = "Contador de préstamos"
+        verbose_name_plural = "Contadores de préstamos"
+
+# Resumen de préstamos por día para la analítica (gestion/analitica.py)
+# Cada préstamo y devolución suma en un fragmento al azar del día, como ContadorPrestamos;
+# el día completo es la suma de sus fragmentos. duracion_total_s es la suma de lo que
+# duraron los préstamos devueltos ese día, para calcular la duración media
+class ResumenDiarioPrestamos(models.Model):
+    dia = models.DateField()
+    fragmento = models.PositiveSmallIntegerField(default=0)
+    prestamos = models.IntegerField(default=0)
+    devoluciones = models.IntegerField(default=0)
+    duracion_total_s = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.dia} ({self.fragmento}): {self.prestamos} préstamos / {self.devoluciones} devoluciones"
+
+    class Meta:
+        verbose_name = "Resumen diario de préstamos"
+        verbose_name_plural = "Resúmenes diarios de préstamos"
+        constraints = [
+            models.UniqueConstraint(fields=['dia', 'fragmento'], name='resumen_diario_unico'),
+        ]
+
+# Préstamos de cada libro por mes (primer día del mes) para los libros más prestados
+# Solo hay fila para los libros prestados ese mes; al borrar el libro se borran en cascada
+class ResumenMensualLibro(models.Model):
+    mes = models.DateField()
+    libro = models.ForeignKey(Libro, on_delete=models.CASCADE, related_name='resumenes_mensuales')
+    prestamos = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.mes:%Y-%m} - libro {self.libro_id}: {self.prestamos} préstamos"
+
+    class Meta:
+        verbose_name = "Resumen mensual de un libro"
+        verbose_name_plural = "Resúmenes mensuales de libros"
+        constraints = [
+            models.UniqueConstraint(fields=['mes', 'libro'], name='resumen_mensual_libro_unico'),
+        ]
+        indexes = [
+            # Los más prestados de un mes se leen en orden del índice, sin ordenar el mes
+            models.Index(fields=['mes', '-prestamos'], name='resumen_mensual_top_idx'),
+        ]
+
+# Versión del catálogo completo, repartida en fragmentos como ContadorPrestamos
+# Cada cambio en cualquier libro incrementa un fragmento al azar; la versión del
+# catálogo es la suma de los fragmentos y solo puede crecer
+class VersionCatalogo(models.Model):
+    fragmento = models.PositiveSmallIntegerField(unique=True)
+    version = models.PositiveBigIntegerField(default=0)
+    actualizado = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"Fragmento {self.fragmento}: versión {self.version}"
+
+    class Meta:
+        verbose_name = "Versión del catálogo"
+        verbose_name_plural = "Versiones del catálogo"
+
+# Libros borrados, para los índices en memoria que se actualizan por cambios
+# (gestion/autocompletado.py): un libro borrado ya no aparece al buscar los cambiados
+# Se escribe desde gestion/signals.py al borrar cada libro
+class LibroEliminado(models.Model):
+    libro_id = models.BigIntegerField()
+    eliminado = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return f"Libro {self.libro_id} eliminado el {self.eliminado}"
+
+    class Meta:
+        verbose_name = "Libro eliminado"
+        verbose_name_plural = "Libros eliminados"
+
+# Índice invertido para la búsqueda del catálogo
+# Cada fila relaciona un término normalizado (sin tildes ni mayúsculas) con un libro
+# y su peso de relevancia. Se mantiene automáticamente desde gestion/signals.py
+class TerminoBusqueda(models.Model):
+    libro = models.ForeignKey(Libro, on_delete=models.CASCADE, related_name='terminos')
+    termino = models.CharField(max_length=100)  # Palabra normalizada del título o autor
+    peso = models.PositiveSmallIntegerField(default=1)  # Relevancia acumulada del término
+
+    def __str__(self):
+        return f"{self.termino} ({self.libro_id})"
+
+    class Meta:
+        verbose_name = "Término de búsqueda"
+        verbose_name_plural = "Términos de búsqueda"
+        constraints = [
+            models.UniqueConstraint(fields=['libro', 'termino'], name='termino_unico_por_libro'),
+        ]
+        indexes = [
+            # El índice empieza por el término para resolver búsquedas por prefijo
+            # En PostgreSQL uso varchar_pattern_ops para que LIKE 'abc%' lo aproveche
+            models.Index(
+                fields=['termino', 'libro'],
+                name='termino_busqueda_idx',
+                opclasses=['varchar_pattern_ops', 'int8_ops'],
+            ),
+        ]
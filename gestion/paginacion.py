@@ -0,0 +1,108 @@
+from django.conf import settings
+from django.db import connections
+from django.db.models import F
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+
+# Paginación por cursor (keyset) para los listados de la API
+# A diferencia de la paginación por offset, cada página se obtiene filtrando por la
+# clave estable del último elemento visto (WHERE id > x), así que pedir la página
+# 10.000 cuesta lo mismo que pedir la primera
+
+MODOS_CONTEO = ('exacto', 'estimado', 'no')
+
+# Multiplicador para combinar relevancia y pk en una única clave de orden
+# Permite paginar resultados de búsqueda sin empates (ver paginate_queryset)
+_FACTOR_RELEVANCIA = 10 ** 12
+
+
+def estimar_total(queryset, limite):
+    # Estimación barata del total de filas
+    # - Sin filtros en PostgreSQL: uso las estadísticas del planificador (pg_class.reltuples)
+    # - Sin filtros en otros motores: el id máximo es una cota superior muy cercana
+    # - Con filtros: cuento como mucho `limite` filas (el conteo es exacto si no se alcanza)
+    # Devuelvo (total, precision) con precision en 'exacto', 'aproximado' o 'cota'
+    modelo = queryset.model
+    if not queryset.query.where:
+        conexion = connections[queryset.db]
+        if conexion.vendor == 'postgresql':
+            with conexion.cursor() as cursor:
+                cursor.execute(
+                    'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                    [modelo._meta.db_table],
+                )
+                fila = cursor.fetchone()
+            if fila and fila[0] >= 0:
+                return fila[0], 'aproximado'
+        ultimo = modelo._default_manager.using(queryset.db).order_by('-pk').values_list('pk', flat=True).first()
+        return (ultimo or 0), 'aproximado'
+    total = queryset.order_by()[:limite + 1].count()
+    if total > limite:
+        return limite, 'cota'
+    return total, 'exacto'
+
+
+class PaginacionCursor(CursorPagination):
+    page_size = settings.PAGINACION_API['TAMANO_PAGINA']
+    page_size_query_param = 'tamano'
+    max_page_size = settings.PAGINACION_API['TAMANO_MAXIMO']
+    ordering = 'pk'
+    conteo_query_param = 'conteo'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        # Los resultados de búsqueda vienen ordenados por relevancia, que no es única
+        # Combino relevancia y pk en una sola clave para que el cursor no dependa de
+        # offsets (DRF los limita a 1000 y con muchos empates repetiría páginas)
+        if 'relevancia' in queryset.query.annotations:
+            queryset = queryset.annotate(
+                posicion_busqueda=F('relevancia') * _FACTOR_RELEVANCIA - F('pk')
+            )
+        self.queryset = queryset
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_ordering(self, request, queryset, view):
+        if 'posicion_busqueda' in queryset.query.annotations:
+            return ('-posicion_busqueda',)
+        return super().get_ordering(request, queryset, view)
+
+    def get_modo_conteo(self):
+        modo = self.request.query_params.get(self.conteo_query_param, settings.PAGINACION_API['CONTEO'])
+        return modo if modo in MODOS_CONTEO else settings.PAGINACION_API['CONTEO']
+
+    def get_mensaje(self, nombre):
+        # Conservo el mensaje de siempre ("Se encontraron N libros"), pero el conteo
+        # es configurable porque un COUNT(*) sobre tablas grandes no es gratis
+        modo = self.get_modo_conteo()
+        if modo == 'exacto':
+            self.total = self.queryset.order_by().count()
+            return f'Se encontraron {self.total} {nombre}'
+        if modo == 'estimado':
+            self.total, precision = estimar_total(self.queryset, settings.PAGINACION_API['LIMITE_ESTIMADO'])
+            if precision == 'cota':
+                return f'Se encontraron más de {self.total} {nombre}'
+            if precision == 'aproximado':
+                return f'Se encontraron aproximadamente {self.total} {nombre}'
+            return f'Se encontraron {self.total} {nombre}'
+        self.total = None
+        return f'Se muestran {len(self.page)} {nombre}'
+
+    def datos_respuesta(self, data, clave, nombre):
+        # Mismo sobre que usaban los listados (mensaje + colección) más los cursores
+        mensaje = self.get_mensaje(nombre)
+        return {
+            'mensaje': mensaje,
+            clave: data,
+            'total': self.total,
+            'siguiente': self.get_next_link(),
+            'anterior': self.get_previous_link(),
+        }
+
+    def respuesta(self, data, clave, nombre):
+        return Response(self.datos_respuesta(data, clave, nombre))
+
+
+class PaginacionHistorial(PaginacionCursor):
+    # El historial de préstamos se lee de más reciente a más antiguo, en el orden
+    # del índice prestamo_usuario_fecha_idx; la fecha de un préstamo nunca cambia,
+    # así que sirve de clave del cursor (los empates de un lote se resuelven con offset)
+    ordering = '-fecha_prestamo'
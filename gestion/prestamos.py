@@ -0,0 +1,330 @@
+from collections import Counter
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import analitica, contadores, reservas, versiones
+from .models import Libro, Prestamo, Usuario
+
+# Servicio único de préstamos y devoluciones
+# Lo usan tanto la API (UsuarioViewSet) como la web (PrestamoCreateView y
+# PrestamoDevolucionView) para que las reglas y la consistencia sean las mismas
+#
+# Cada operación corre en una transacción y decide con sentencias condicionales:
+# - El stock se descuenta con UPDATE ... SET cantidad_stock = cantidad_stock - 1
+#   WHERE cantidad_stock > 0, así dos préstamos simultáneos nunca dejan stock negativo
+# - Prestamo es la única fuente de verdad: un préstamo activo es una fila con
+#   devuelto=False, y Usuario.libros_prestados se lee de ahí
+# - Antes de tocar el stock se mira si el usuario ya tiene el libro (una lectura por el
+#   índice de prestamo_activo_unico): "ya prestado" gana a "sin stock" cuando el usuario
+#   tiene el último ejemplar. La restricción única parcial sigue detectando el duplicado
+#   de dos peticiones simultáneas
+# - Solo se escriben las columnas que cambian, nunca la fila completa
+# - Los contadores de préstamos (gestion/contadores.py), los resúmenes de la analítica
+#   (gestion/analitica.py) y las versiones del libro y del catálogo (gestion/versiones.py)
+#   se actualizan en la misma transacción
+# - Las reservas (gestion/reservas.py) también: un ejemplar devuelto se aparta para el
+#   primero de la cola del libro, y quien tiene uno apartado lo recibe aunque el stock
+#   esté a cero. Primero se bloquea el libro y después sus reservas
+
+
+class ResultadoPrestamo:
+    OK = 'ok'
+    SIN_STOCK = 'sin_stock'
+    YA_PRESTADO = 'ya_prestado'
+    NO_PRESTADO = 'no_prestado'
+    NO_EXISTE = 'no_existe'
+    CANCELADO = 'cancelado'  # Solo en lotes: habría funcionado, pero el lote se canceló
+    USUARIO_NO_EXISTE = 'usuario_no_existe'  # Solo en lotes de varios usuarios
+    ROL_NO_PERMITIDO = 'rol_no_permitido'  # Solo usuarios regulares pueden pedir préstamos
+
+    def __init__(self, estado, libro=None, prestamo=None):
+        self.estado = estado
+        self.libro = libro  # Libro con el stock ya actualizado (None si no existe)
+        self.prestamo = prestamo
+
+    @property
+    def ok(self):
+        return self.estado == self.OK
+
+    def __repr__(self):
+        return f'<ResultadoPrestamo {self.estado}>'
+
+
+class _OperacionCancelada(Exception):
+    # Uso una excepción para salir del bloque atómico y deshacer lo ya escrito
+    def __init__(self, estado):
+        self.estado = estado
+
+
+def _libro_o_none(libro_id):
+    return Libro.objects.filter(pk=libro_id).first()
+
+
+def prestar_libro(usuario, libro_id):
+    # Presta un ejemplar del libro al usuario y devuelve un ResultadoPrestamo
+    # libro_id puede llegar como texto ('1'); los resúmenes y las reservas usan el entero
+    libro_id = int(libro_id)
+    try:
+        with transaction.atomic():
+            if Prestamo.objects.filter(usuario_id=usuario.pk, libro_id=libro_id, devuelto=False).exists():
+                return ResultadoPrestamo(ResultadoPrestamo.YA_PRESTADO, _libro_o_none(libro_id))
+            # Descuento condicional: si no hay stock (o el libro no existe) no se toca nada
+            descontados = Libro.objects.filter(pk=libro_id, cantidad_stock__gt=0).update(
+                cantidad_stock=F('cantidad_stock') - 1,
+                **contadores.al_prestar(),
+                **versiones.al_modificar_libro(),
+            )
+            ahora = timezone.now()
+            if not descontados:
+                # Sin stock solo queda el ejemplar que el usuario pueda tener apartado
+                # El UPDATE sin descuento bloquea el libro antes que su reserva
+                existe = Libro.objects.filter(pk=libro_id).update(
+                    **contadores.al_prestar(),
+                    **versiones.al_modificar_libro(),
+                )
+                if not existe:
+                    return ResultadoPrestamo(ResultadoPrestamo.NO_EXISTE)
+                if not reservas.recoger(usuario.pk, libro_id, ahora):
+                    raise _OperacionCancelada(ResultadoPrestamo.SIN_STOCK)
+
+            try:
+                with transaction.atomic():
+                    prestamo = Prestamo.objects.create(libro_id=libro_id, usuario_id=usuario.pk)
+            except IntegrityError:
+                raise _OperacionCancelada(ResultadoPrestamo.YA_PRESTADO)
+
+            if descontados:
+                reservas.cerrar([(usuario.pk, libro_id)], ahora)
+            Usuario.objects.filter(pk=usuario.pk).update(**contadores.al_prestar())
+            contadores.actualizar_global(activos=1, totales=1)
+            analitica.al_prestar({prestamo.libro_id: 1}, prestamo.fecha_prestamo)
+            versiones.incrementar_catalogo()
+            return ResultadoPrestamo(ResultadoPrestamo.OK, _libro_o_none(libro_id), prestamo)
+    except _OperacionCancelada as cancelacion:
+        return ResultadoPrestamo(cancelacion.estado, _libro_o_none(libro_id))
+
+
+def devolver_libro(usuario, libro_id):
+    # Devuelve el ejemplar que el usuario tiene prestado y cierra su préstamo
+    libro_id = int(libro_id)
+    with transaction.atomic():
+        # La fecha del préstamo abierto sale de prestamo_activo_unico y da la duración para
+        # la analítica. El UPDATE condicional hace a la vez de comprobación: si no cierra
+        # nada, el usuario no tenía el libro (o ya lo devolvió en otra petición)
+        abierto = (
+            Prestamo.objects.filter(libro_id=libro_id, usuario_id=usuario.pk, devuelto=False)
+            .values_list('pk', 'fecha_prestamo').first()
+        )
+        ahora = timezone.now()
+        cerrados = abierto is not None and Prestamo.objects.filter(pk=abierto[0], devuelto=False).update(
+            devuelto=True,
+            fecha_devolucion=ahora,
+        )
+        if not cerrados:
+            libro = _libro_o_none(libro_id)
+            estado = ResultadoPrestamo.NO_PRESTADO if libro else ResultadoPrestamo.NO_EXISTE
+            return ResultadoPrestamo(estado, libro)
+
+        Libro.objects.filter(pk=libro_id).update(
+            cantidad_stock=F('cantidad_stock') + 1,
+            **contadores.al_devolver(),
+            **versiones.al_modificar_libro(),
+        )
+        # Con el libro ya bloqueado, el ejemplar pasa al primero de la cola si la hay
+        reservas.al_devolver({libro_id: 1}, ahora)
+        Usuario.objects.filter(pk=usuario.pk).update(**contadores.al_devolver())
+        contadores.actualizar_global(activos=-1)
+        analitica.al_devolver([abierto[1]], ahora)
+        versiones.incrementar_catalogo()
+        return ResultadoPrestamo(ResultadoPrestamo.OK, _libro_o_none(libro_id))
+
+
+# Operaciones por lotes
+# Reciben una lista de pares (usuario_id, libro_id) y los resuelven con un número fijo
+# de consultas: una para los libros, una para los préstamos abiertos y operaciones
+# masivas (bulk_create, bulk_update, UPDATE con filtro) para las escrituras.
+# Si los fallos superan max_fallos no se escribe nada y el lote queda cancelado.
+
+class ResultadoLote:
+    def __init__(self, pares, estados, cancelado=False):
+        if cancelado:
+            estados = [
+                ResultadoPrestamo.CANCELADO if estado == ResultadoPrestamo.OK else estado
+                for estado in estados
+            ]
+        self.items = [
+            {'usuario_id': usuario_id, 'libro_id': libro_id, 'estado': estado}
+            for (usuario_id, libro_id), estado in zip(pares, estados)
+        ]
+        self.exitosos = sum(1 for estado in estados if estado == ResultadoPrestamo.OK)
+        self.fallos = sum(
+            1 for estado in estados
+            if estado not in (ResultadoPrestamo.OK, ResultadoPrestamo.CANCELADO)
+        )
+        self.cancelado = cancelado
+
+    def __repr__(self):
+        return f'<ResultadoLote exitosos={self.exitosos} fallos={self.fallos} cancelado={self.cancelado}>'
+
+
+def _supera_limite(estados, max_fallos):
+    fallos = sum(1 for estado in estados if estado != ResultadoPrestamo.OK)
+    return max_fallos is not None and fallos > max_fallos
+
+
+def prestar_lote(pares, max_fallos=None):
+    # Presta varios libros (a uno o varios usuarios) en una sola transacción
+    pares = list(pares)
+    if not pares:
+        return ResultadoLote([], [])
+
+    with transaction.atomic():
+        libro_ids = {libro_id for _, libro_id in pares}
+        usuario_ids = {usuario_id for usuario_id, _ in pares}
+
+        # En PostgreSQL bloqueo las filas de los libros hasta el final de la transacción,
+        # así el stock leído no puede cambiar antes de aplicar el descuento
+        roles = dict(Usuario.objects.filter(pk__in=usuario_ids).values_list('pk', 'rol'))
+        disponibles = dict(
+            Libro.objects.select_for_update()
+            .filter(pk__in=libro_ids)
+            .values_list('pk', 'cantidad_stock')
+        )
+        prestados = set(
+            Prestamo.objects
+            .filter(usuario_id__in=usuario_ids, libro_id__in=libro_ids, devuelto=False)
+            .values_list('usuario_id', 'libro_id')
+        )
+        ahora = timezone.now()
+        apartadas = reservas.apartadas(pares, ahora)
+
+        estados = []
+        desde_stock = []
+        recogidas = []
+        for par in pares:
+            usuario_id, libro_id = par
+            if usuario_id not in roles:
+                estado = ResultadoPrestamo.USUARIO_NO_EXISTE
+            elif roles[usuario_id] != 'regular':
+                estado = ResultadoPrestamo.ROL_NO_PERMITIDO
+            elif libro_id not in disponibles:
+                estado = ResultadoPrestamo.NO_EXISTE
+            elif par in prestados:
+                estado = ResultadoPrestamo.YA_PRESTADO
+            elif par in apartadas:
+                # Primero el ejemplar apartado para el usuario, así el stock queda para
+                # el resto del lote
+                estado = ResultadoPrestamo.OK
+                prestados.add(par)
+                recogidas.append(par)
+            elif disponibles[libro_id] > 0:
+                estado = ResultadoPrestamo.OK
+                prestados.add(par)
+                desde_stock.append(par)
+                disponibles[libro_id] -= 1
+            else:
+                estado = ResultadoPrestamo.SIN_STOCK
+            estados.append(estado)
+
+        if _supera_limite(estados, max_fallos):
+            return ResultadoLote(pares, estados, cancelado=True)
+
+        exitosos = [par for par, estado in zip(pares, estados) if estado == ResultadoPrestamo.OK]
+        if exitosos:
+            Prestamo.objects.bulk_create([
+                Prestamo(usuario_id=usuario_id, libro_id=libro_id, fecha_prestamo=ahora)
+                for usuario_id, libro_id in exitosos
+            ])
+            # Stock y contadores de todos los libros en un UPDATE, y lo mismo para los usuarios
+            contadores.actualizar_en_bloque(
+                Libro,
+                Counter(libro_id for _, libro_id in exitosos),
+                lambda n: {
+                    'cantidad_stock': F('cantidad_stock') - n,
+                    **contadores.al_prestar(n),
+                    **versiones.al_modificar_libro(),
+                },
+            )
+            # Los ejemplares apartados ya estaban fuera del stock: se devuelven a la cuenta
+            # en un segundo UPDATE que solo se lanza si el lote recoge alguno
+            contadores.actualizar_en_bloque(
+                Libro,
+                Counter(libro_id for _, libro_id in recogidas),
+                lambda n: {'cantidad_stock': F('cantidad_stock') + n},
+            )
+            reservas.completar([apartadas[par] for par in recogidas])
+            reservas.cerrar(desde_stock, ahora)
+            contadores.actualizar_en_bloque(
+                Usuario,
+                Counter(usuario_id for usuario_id, _ in exitosos),
+                contadores.al_prestar,
+            )
+            contadores.actualizar_global(activos=len(exitosos), totales=len(exitosos))
+            analitica.al_prestar(Counter(libro_id for _, libro_id in exitosos), ahora)
+            versiones.incrementar_catalogo()
+        return ResultadoLote(pares, estados)
+
+
+def devolver_lote(pares, max_fallos=None):
+    # Devuelve varios libros (de uno o varios usuarios) en una sola transacción
+    pares = list(pares)
+    if not pares:
+        return ResultadoLote([], [])
+
+    with transaction.atomic():
+        libro_ids = {libro_id for _, libro_id in pares}
+        usuario_ids = {usuario_id for usuario_id, _ in pares}
+
+        usuarios = set(Usuario.objects.filter(pk__in=usuario_ids).values_list('pk', flat=True))
+        existentes = set(Libro.objects.filter(pk__in=libro_ids).values_list('pk', flat=True))
+        # Bloqueo los préstamos abiertos para que dos devoluciones simultáneas del mismo
+        # libro no sumen el ejemplar dos veces
+        prestados = {
+            (usuario_id, libro_id): (pk, fecha_prestamo)
+            for pk, usuario_id, libro_id, fecha_prestamo in Prestamo.objects.select_for_update()
+            .filter(usuario_id__in=usuario_ids, libro_id__in=libro_ids, devuelto=False)
+            .values_list('pk', 'usuario_id', 'libro_id', 'fecha_prestamo')
+        }
+
+        estados = []
+        cerrar = []
+        for par in pares:
+            if par[0] not in usuarios:
+                estado = ResultadoPrestamo.USUARIO_NO_EXISTE
+            elif par[1] not in existentes:
+                estado = ResultadoPrestamo.NO_EXISTE
+            elif par not in prestados:
+                estado = ResultadoPrestamo.NO_PRESTADO
+            else:
+                estado = ResultadoPrestamo.OK
+                cerrar.append(prestados.pop(par))
+            estados.append(estado)
+
+        if _supera_limite(estados, max_fallos):
+            return ResultadoLote(pares, estados, cancelado=True)
+
+        exitosos = [par for par, estado in zip(pares, estados) if estado == ResultadoPrestamo.OK]
+        if exitosos:
+            ahora = timezone.now()
+            Prestamo.objects.filter(pk__in=[pk for pk, _ in cerrar]).update(devuelto=True, fecha_devolucion=ahora)
+            contadores.actualizar_en_bloque(
+                Libro,
+                Counter(libro_id for _, libro_id in exitosos),
+                lambda n: {
+                    'cantidad_stock': F('cantidad_stock') + n,
+                    **contadores.al_devolver(n),
+                    **versiones.al_modificar_libro(),
+                },
+            )
+            contadores.actualizar_en_bloque(
+                Usuario,
+                Counter(usuario_id for usuario_id, _ in exitosos),
+                contadores.al_devolver,
+            )
+            reservas.al_devolver(Counter(libro_id for _, libro_id in exitosos), ahora)
+            contadores.actualizar_global(activos=-len(exitosos))
+            analitica.al_devolver([fecha for _, fecha in cerrar], ahora)
+            versiones.incrementar_catalogo()
+        return ResultadoLote(pares, estados)
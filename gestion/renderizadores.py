@@ -0,0 +1,41 @@
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:  # orjson es opcional: sin él se usa el JSONRenderer de DRF tal cual
+    orjson = None
+
+# Renderizado JSON de la API con orjson, varias veces más rápido que json.dumps
+# La salida es idéntica byte a byte a la de JSONRenderer con la configuración por
+# defecto de DRF (UTF-8 sin escapar, compacta):
+# - Fechas, decimales y cadenas traducibles pasan por el codificador de DRF, que
+#   por ejemplo recorta los microsegundos a milisegundos
+# - Las claves no textuales se convierten a texto como en json.dumps
+# - U+2028 y U+2029 se escapan igual que en DRF para que el JSON sea JavaScript válido
+# Con indentación (?format=json; indent=4), STRICT_JSON=False o sin orjson delega en DRF
+
+_CODIFICADOR = JSONEncoder()
+_OPCIONES = (orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS) if orjson else 0
+
+
+def a_json(datos):
+    # bytes JSON de `datos` con el mismo formato que JSONRenderer
+    if orjson is None:
+        return JSONRenderer().render(datos)
+    contenido = orjson.dumps(datos, default=_CODIFICADOR.default, option=_OPCIONES)
+    if b'\xe2\x80' in contenido:
+        contenido = contenido.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+    return contenido
+
+
+class JSONRapidoRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (
+            orjson is None
+            or data is None
+            or not (self.ensure_ascii is False and self.compact and self.strict)
+            or self.get_indent(accepted_media_type, renderer_context or {})
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+        return a_json(data)
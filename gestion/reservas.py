@@ -0,0 +1,330 @@
+import datetime
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery, Window
+from django.db.models.functions import Coalesce, RowNumber
+from django.utils import timezone
+
+from . import contadores, versiones
+from .models import Libro, Prestamo, Reserva
+
+# Reservas de libros sin ejemplares: una cola por libro en orden de llegada
+# - Solo se reserva un libro sin stock; con stock se pide el préstamo directamente
+# - Al devolverse un ejemplar (gestion/prestamos.py) se aparta en la misma transacción
+#   para el primero de la cola: no vuelve al stock, así que nadie de fuera de la cola
+#   puede llevárselo, y el reservado lo pide cuando quiera hasta `vence`
+# - El préstamo de un usuario con un ejemplar apartado cierra su reserva y no descuenta
+#   stock: el ejemplar ya estaba fuera
+# - barrer() (manage.py barrer_reservas) pasa por lotes los apartados vencidos al
+#   siguiente de la cola, o al stock si no queda nadie, y aparta para la cola los
+#   ejemplares que llegan al stock sin una devolución (al editar el libro)
+# Orden de bloqueo: siempre primero la fila del libro y después sus reservas. La
+# devolución bloquea el libro con el UPDATE del stock antes de leer la cola, y reservar
+# lo bloquea antes de mirar el stock, así que una reserva y una devolución simultáneas
+# nunca dejan un ejemplar en el stock con la cola esperando
+
+ABIERTAS = (Reserva.ESPERA, Reserva.ASIGNADA)
+
+
+class ResultadoReserva:
+    OK = 'ok'
+    HAY_STOCK = 'hay_stock'  # Hay ejemplares: no hace falta reservar
+    YA_PRESTADO = 'ya_prestado'
+    YA_RESERVADO = 'ya_reservado'
+    NO_RESERVADO = 'no_reservado'
+    NO_EXISTE = 'no_existe'
+
+    def __init__(self, estado, reserva=None):
+        self.estado = estado
+        self.reserva = reserva
+
+    @property
+    def ok(self):
+        return self.estado == self.OK
+
+    def __repr__(self):
+        return f'<ResultadoReserva {self.estado}>'
+
+
+def _vencimiento(ahora):
+    return ahora + datetime.timedelta(hours=settings.RESERVAS['PLAZO_HORAS'])
+
+
+def _bloquear_libros(libro_ids):
+    # En PostgreSQL bloquea las filas de los libros, en orden de id para que dos
+    # transacciones con varios libros no se esperen mutuamente. Devuelve {pk: stock}
+    return dict(
+        Libro.objects.select_for_update().filter(pk__in=libro_ids)
+        .order_by('pk').values_list('pk', 'cantidad_stock')
+    )
+
+
+def reservar(usuario, libro_id):
+    # Pone al usuario al final de la cola del libro y devuelve un ResultadoReserva
+    # libro_id puede llegar como texto ('1'); el stock bloqueado se indexa por el entero
+    libro_id = int(libro_id)
+    with transaction.atomic():
+        stock = _bloquear_libros([libro_id]).get(libro_id)
+        if stock is None:
+            return ResultadoReserva(ResultadoReserva.NO_EXISTE)
+        if stock > 0:
+            return ResultadoReserva(ResultadoReserva.HAY_STOCK)
+        if Prestamo.objects.filter(usuario_id=usuario.pk, libro_id=libro_id, devuelto=False).exists():
+            return ResultadoReserva(ResultadoReserva.YA_PRESTADO)
+        # La reserva duplicada la detecta la restricción única parcial reserva_abierta_unica
+        try:
+            with transaction.atomic():
+                reserva = Reserva.objects.create(libro_id=libro_id, usuario_id=usuario.pk)
+        except IntegrityError:
+            return ResultadoReserva(ResultadoReserva.YA_RESERVADO)
+        return ResultadoReserva(ResultadoReserva.OK, reserva)
+
+
+def cancelar(usuario, libro_id):
+    # Cancela la reserva abierta del usuario; si ya tenía el ejemplar apartado, pasa al
+    # siguiente de la cola
+    libro_id = int(libro_id)
+    with transaction.atomic():
+        if not _bloquear_libros([libro_id]):
+            return ResultadoReserva(ResultadoReserva.NO_EXISTE)
+        reserva = (
+            Reserva.objects.select_for_update()
+            .filter(usuario_id=usuario.pk, libro_id=libro_id, estado__in=ABIERTAS)
+            .first()
+        )
+        if reserva is None:
+            return ResultadoReserva(ResultadoReserva.NO_RESERVADO)
+        Reserva.objects.filter(pk=reserva.pk).update(estado=Reserva.CANCELADA)
+        if reserva.estado == Reserva.ASIGNADA:
+            liberar_ejemplares({libro_id: 1}, timezone.now())
+        return ResultadoReserva(ResultadoReserva.OK, reserva)
+
+
+def _asignar(ejemplares, ahora):
+    # ejemplares: {libro_id: n}. Aparta hasta n ejemplares de cada libro para los
+    # primeros de su cola y devuelve {libro_id: apartados}
+    ejemplares = {libro_id: n for libro_id, n in ejemplares.items() if n > 0}
+    if not ejemplares:
+        return Counter()
+    # Los primeros de cada cola en una sola consulta, numerados dentro de su libro
+    primeros = [
+        pk for pk, libro_id, puesto in Reserva.objects.filter(libro_id__in=ejemplares, estado=Reserva.ESPERA)
+        .annotate(puesto=Window(RowNumber(), partition_by=F('libro_id'), order_by=[F('creada').asc(), F('pk').asc()]))
+        .filter(puesto__lte=max(ejemplares.values()))
+        .values_list('pk', 'libro_id', 'puesto')
+        if puesto <= ejemplares[libro_id]
+    ]
+    if not primeros:
+        return Counter()
+    # Bloqueo y vuelvo a comprobar: una reserva cancelada mientras tanto se queda fuera
+    elegidas = list(
+        Reserva.objects.select_for_update()
+        .filter(pk__in=primeros, estado=Reserva.ESPERA)
+        .values_list('pk', 'libro_id')
+    )
+    Reserva.objects.filter(pk__in=[pk for pk, _ in elegidas]).update(
+        estado=Reserva.ASIGNADA, asignada=ahora, vence=_vencimiento(ahora),
+    )
+    return Counter(libro_id for _, libro_id in elegidas)
+
+
+def al_devolver(ejemplares, ahora):
+    # Se llama después del UPDATE que suma los ejemplares devueltos al stock, con las
+    # filas de los libros ya bloqueadas: los que aparta para la cola vuelven a salir
+    # del stock. Devuelve cuántos ejemplares se apartaron
+    asignados = _asignar(ejemplares, ahora)
+    contadores.actualizar_en_bloque(Libro, asignados, lambda n: {'cantidad_stock': F('cantidad_stock') - n})
+    return sum(asignados.values())
+
+
+def liberar_ejemplares(ejemplares, ahora):
+    # Ejemplares apartados que se liberan sin una devolución (reserva vencida o cancelada),
+    # con las filas de los libros ya bloqueadas: pasan al siguiente de la cola y solo los
+    # que no encuentran a nadie vuelven al stock. Un apartado que cambia de lector no toca
+    # la fila del libro ni su versión. Devuelve cuántos ejemplares se volvieron a apartar
+    asignados = _asignar(ejemplares, ahora)
+    al_stock = {libro_id: n - asignados[libro_id] for libro_id, n in ejemplares.items() if n > asignados[libro_id]}
+    contadores.actualizar_en_bloque(
+        Libro, al_stock,
+        lambda n: {'cantidad_stock': F('cantidad_stock') + n, **versiones.al_modificar_libro()},
+    )
+    if al_stock:
+        versiones.incrementar_catalogo()
+    return sum(asignados.values())
+
+
+def recoger(usuario_id, libro_id, ahora):
+    # Cierra la reserva con ejemplar apartado (y sin vencer) del usuario para este libro
+    # True si la había: el préstamo usa ese ejemplar y no descuenta stock
+    return bool(
+        Reserva.objects.filter(
+            usuario_id=usuario_id, libro_id=libro_id, estado=Reserva.ASIGNADA, vence__gt=ahora,
+        ).update(estado=Reserva.COMPLETADA)
+    )
+
+
+def _abiertas(pares, **filtro):
+    # {(usuario_id, libro_id): (pk, estado)} de las reservas de los pares, bloqueadas
+    pares = set(pares)
+    if not pares:
+        return {}
+    filas = Reserva.objects.select_for_update().filter(
+        usuario_id__in={usuario_id for usuario_id, _ in pares},
+        libro_id__in={libro_id for _, libro_id in pares},
+        **filtro,
+    ).values_list('pk', 'usuario_id', 'libro_id', 'estado')
+    return {
+        (usuario_id, libro_id): (pk, estado)
+        for pk, usuario_id, libro_id, estado in filas
+        if (usuario_id, libro_id) in pares
+    }
+
+
+def apartadas(pares, ahora):
+    # {(usuario_id, libro_id): pk} de las reservas de un lote con ejemplar apartado sin vencer
+    filas = _abiertas(pares, estado=Reserva.ASIGNADA, vence__gt=ahora)
+    return {par: pk for par, (pk, _) in filas.items()}
+
+
+def completar(pks):
+    if pks:
+        Reserva.objects.filter(pk__in=pks).update(estado=Reserva.COMPLETADA)
+
+
+def cerrar(pares, ahora):
+    # Préstamos servidos desde el stock: la reserva abierta que tuviera el usuario ya no
+    # hace falta, y si tenía un ejemplar apartado vuelve a la cola
+    filas = _abiertas(pares, estado__in=ABIERTAS)
+    if not filas:
+        return
+    completar([pk for pk, _ in filas.values()])
+    liberar_ejemplares(
+        Counter(libro_id for (_, libro_id), (_, estado) in filas.items() if estado == Reserva.ASIGNADA), ahora,
+    )
+
+
+def liberar_usuario(usuario_id):
+    # Antes de borrar un usuario sus ejemplares apartados pasan al siguiente de la cola
+    # (sus reservas se borran en cascada con él)
+    libros = set(
+        Reserva.objects.filter(usuario_id=usuario_id, estado=Reserva.ASIGNADA).values_list('libro_id', flat=True)
+    )
+    if not libros:
+        return
+    with transaction.atomic():
+        _bloquear_libros(libros)
+        apartados = Counter(
+            Reserva.objects.select_for_update()
+            .filter(usuario_id=usuario_id, estado=Reserva.ASIGNADA)
+            .values_list('libro_id', flat=True)
+        )
+        Reserva.objects.filter(usuario_id=usuario_id, estado=Reserva.ASIGNADA).update(estado=Reserva.CANCELADA)
+        liberar_ejemplares(apartados, timezone.now())
+
+
+# Barrido de reservas (manage.py barrer_reservas)
+
+def _barrer_vencidas(ahora, tamano_lote):
+    # Un lote de apartados vencidos en una transacción
+    # Devuelve (vencidas, reasignadas), o None cuando ya no queda ninguno
+    candidatas = list(
+        Reserva.objects.filter(estado=Reserva.ASIGNADA, vence__lte=ahora)
+        .order_by('vence', 'pk').values_list('pk', 'libro_id')[:tamano_lote]
+    )
+    if not candidatas:
+        return None
+    with transaction.atomic():
+        _bloquear_libros({libro_id for _, libro_id in candidatas})
+        # Ya con los libros bloqueados: las recogidas y cancelaciones de mientras se quedan fuera
+        vencidas = list(
+            Reserva.objects.select_for_update()
+            .filter(pk__in=[pk for pk, _ in candidatas], estado=Reserva.ASIGNADA, vence__lte=ahora)
+            .values_list('pk', 'libro_id')
+        )
+        Reserva.objects.filter(pk__in=[pk for pk, _ in vencidas]).update(estado=Reserva.VENCIDA)
+        return len(vencidas), liberar_ejemplares(Counter(libro_id for _, libro_id in vencidas), ahora)
+
+
+def _asignar_disponibles(ahora, tamano_lote, desde_id):
+    # Libros con stock y cola a la vez: el stock llegó sin pasar por una devolución (al
+    # editar el libro). Recorre los libros por id, un lote por llamada
+    # Devuelve (asignados, último libro recorrido), o None cuando ya no queda ninguno
+    libros = list(
+        Reserva.objects.filter(estado=Reserva.ESPERA, libro_id__gt=desde_id, libro__cantidad_stock__gt=0)
+        .order_by('libro_id').values_list('libro_id', flat=True).distinct()[:tamano_lote]
+    )
+    if not libros:
+        return None
+    with transaction.atomic():
+        stock = {pk: n for pk, n in _bloquear_libros(libros).items() if n > 0}
+        asignados = _asignar(stock, ahora)
+        contadores.actualizar_en_bloque(
+            Libro, asignados,
+            lambda n: {'cantidad_stock': F('cantidad_stock') - n, **versiones.al_modificar_libro()},
+        )
+        if asignados:
+            versiones.incrementar_catalogo()
+    return sum(asignados.values()), libros[-1]
+
+
+def barrer(ahora=None, tamano_lote=None, al_progresar=None):
+    # Resuelve los apartados vencidos y el stock con cola, lote a lote en transacciones
+    # cortas. Devuelve {'vencidas', 'asignadas', 'lotes', 'max_lote_ms'}
+    ahora = ahora or timezone.now()
+    tamano_lote = tamano_lote or settings.RESERVAS['LOTE']
+    al_progresar = al_progresar or (lambda lote, vencidas, asignadas, segundos: None)
+    resultado = {'vencidas': 0, 'asignadas': 0, 'lotes': 0, 'max_lote_ms': 0.0}
+
+    def anotar(vencidas, asignadas, segundos):
+        resultado['lotes'] += 1
+        resultado['vencidas'] += vencidas
+        resultado['asignadas'] += asignadas
+        resultado['max_lote_ms'] = max(resultado['max_lote_ms'], round(segundos * 1000, 2))
+        al_progresar(resultado['lotes'], vencidas, asignadas, segundos)
+
+    while True:
+        inicio = time.perf_counter()
+        lote = _barrer_vencidas(ahora, tamano_lote)
+        if lote is None:
+            break
+        anotar(*lote, time.perf_counter() - inicio)
+    desde_id = 0
+    while True:
+        inicio = time.perf_counter()
+        lote = _asignar_disponibles(ahora, tamano_lote, desde_id)
+        if lote is None:
+            break
+        asignadas, desde_id = lote
+        anotar(0, asignadas, time.perf_counter() - inicio)
+    return resultado
+
+
+# Lecturas para la web y la API
+
+def con_posicion(reservas):
+    # Añade `delante`: cuántas reservas en espera del mismo libro llegaron antes
+    # Una subconsulta por fila sobre reserva_cola_idx, dentro de la misma consulta
+    delante = (
+        Reserva.objects.filter(libro_id=OuterRef('libro_id'), estado=Reserva.ESPERA)
+        .filter(Q(creada__lt=OuterRef('creada')) | Q(creada=OuterRef('creada'), pk__lt=OuterRef('pk')))
+        .order_by().values('libro_id').annotate(n=Count('pk')).values('n')
+    )
+    return reservas.annotate(delante=Coalesce(Subquery(delante), 0))
+
+
+def reserva_abierta(usuario_id, libro_id):
+    return con_posicion(
+        Reserva.objects.filter(usuario_id=usuario_id, libro_id=libro_id, estado__in=ABIERTAS)
+    ).first()
+
+
+def reservas_usuario(usuario_id):
+    # Reservas del usuario, más recientes primero, con el libro en el mismo JOIN
+    return con_posicion(
+        Reserva.objects.filter(usuario_id=usuario_id)
+        .select_related('libro').only('estado', 'creada', 'asignada', 'vence', 'libro', 'libro__titulo', 'libro__autor')
+        .order_by('-creada')
+    )
@@ -0,0 +1,75 @@
+from collections import defaultdict
+from operator import itemgetter
+
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework import serializers
+
+from .models import Prestamo
+from .serializers import LibroSerializer, UsuarioSerializer
+
+# Serialización rápida de los listados de la API
+# LibroSerializer y UsuarioSerializer recorren campo a campo cada objeto, y con páginas
+# grandes eso es casi todo el tiempo de CPU de la respuesta. Sus campos son columnas
+# que se devuelven tal cual, así que los listados leen filas con .values() y solo
+# copian las columnas en el orden del serializer, sin instanciar modelos
+# Los serializers siguen siendo la referencia: los campos se obtienen de ellos y el
+# resultado es el mismo diccionario que producirían
+
+# Campos cuya representación es el valor de la columna sin cambios
+_CAMPOS_DIRECTOS = (serializers.IntegerField, serializers.CharField, serializers.ChoiceField)
+_LOTE_RELACIONES = 1000
+
+
+def campos_directos(serializer_class, excluir=()):
+    # Nombres de los campos del serializer en su orden; falla si alguno necesita
+    # su to_representation (en ese caso hay que ampliar la ruta rápida)
+    campos = []
+    for nombre, campo in serializer_class().fields.items():
+        if nombre in excluir:
+            continue
+        if (
+            not isinstance(campo, _CAMPOS_DIRECTOS)
+            or campo.source != nombre
+            or getattr(campo, 'coerce_to_string', False)
+        ):
+            raise ImproperlyConfigured(
+                f'{serializer_class.__name__}.{nombre} no se puede leer directamente de .values()'
+            )
+        campos.append(nombre)
+    return tuple(campos)
+
+
+CAMPOS_LIBRO = campos_directos(LibroSerializer)
+# libros_prestados es el último campo de UsuarioSerializer y se añade aparte
+CAMPOS_USUARIO = campos_directos(UsuarioSerializer, excluir=('libros_prestados',))
+
+
+def _copiar(filas, campos):
+    # Las filas pueden traer columnas extra (pk o la posición de búsqueda del cursor)
+    obtener = itemgetter(*campos)
+    return [dict(zip(campos, obtener(fila))) for fila in filas]
+
+
+def filas_libros(filas):
+    # filas: diccionarios de Libro.objects.values(...) que incluyan CAMPOS_LIBRO
+    return _copiar(filas, CAMPOS_LIBRO)
+
+
+def filas_usuarios(filas):
+    # filas: diccionarios de Usuario.objects.values(...) que incluyan CAMPOS_USUARIO
+    # Los libros prestados de toda la página se leen de los préstamos abiertos en
+    # lotes, en lugar de una consulta por usuario como hace el serializer
+    usuarios = _copiar(filas, CAMPOS_USUARIO)
+    ids = [usuario['id'] for usuario in usuarios]
+    prestados = defaultdict(list)
+    for inicio in range(0, len(ids), _LOTE_RELACIONES):
+        relaciones = (
+            Prestamo.objects.filter(usuario_id__in=ids[inicio:inicio + _LOTE_RELACIONES], devuelto=False)
+            .order_by('usuario_id', 'libro_id')
+            .values_list('usuario_id', 'libro_id')
+        )
+        for usuario_id, libro_id in relaciones:
+            prestados[usuario_id].append(libro_id)
+    for usuario in usuarios:
+        usuario['libros_prestados'] = prestados.get(usuario['id'], [])
+    return usuarios
@@ -1,12 +1,58 @@
+from django.conf import settings
 from rest_framework import serializers
-from .models import Libro, Usuario
+from .models import Libro, Prestamo, Reserva, Usuario
 
 class LibroSerializer(serializers.ModelSerializer):
     class Meta:
         model = Libro
-        fields = '__all__'
+        # Los contadores de préstamos y los validadores de caché son internos:
+        # la versión viaja en las cabeceras ETag y Last-Modified, no en el cuerpo
+        exclude = ['prestamos_activos', 'prestamos_totales', 'version', 'actualizado']
 
 class UsuarioSerializer(serializers.ModelSerializer):
+    # Los libros que tiene ahora, leídos de sus préstamos sin devolver (solo lectura:
+    # se prestan y devuelven con las acciones de préstamo)
+    libros_prestados = serializers.PrimaryKeyRelatedField(many=True, read_only=True)
+
     class Meta:
         model = Usuario
-        fields = ['id', 'username', 'email', 'rol', 'libros_prestados']
\ No newline at end of file
+        fields = ['id', 'username', 'email', 'rol', 'libros_prestados']
+
+# Historial de préstamos de un usuario; el título viaja en el mismo JOIN que el préstamo
+class PrestamoSerializer(serializers.ModelSerializer):
+    libro_titulo = serializers.CharField(source='libro.titulo', read_only=True)
+
+    class Meta:
+        model = Prestamo
+        fields = ['id', 'libro', 'libro_titulo', 'fecha_prestamo', 'fecha_devolucion', 'devuelto']
+
+class ReservaSerializer(serializers.ModelSerializer):
+    libro_titulo = serializers.CharField(source='libro.titulo', read_only=True)
+    # Reservas en espera del mismo libro que llegaron antes (gestion/reservas.con_posicion)
+    delante = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = Reserva
+        fields = ['id', 'libro', 'libro_titulo', 'estado', 'creada', 'asignada', 'vence', 'delante']
+
+# Serializers de entrada para las operaciones de préstamo por lotes
+# Solo validan la forma de la petición; las reglas de negocio están en gestion/prestamos.py
+class LoteLibrosSerializer(serializers.Serializer):
+    libro_ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.LOTES_PRESTAMO['TAMANO_MAXIMO'],
+    )
+    max_fallos = serializers.IntegerField(min_value=0, required=False, allow_null=True)
+
+class ItemLoteSerializer(serializers.Serializer):
+    usuario_id = serializers.IntegerField(min_value=1)
+    libro_id = serializers.IntegerField(min_value=1)
+
+class LotePrestamosSerializer(serializers.Serializer):
+    prestamos = serializers.ListField(
+        child=ItemLoteSerializer(),
+        allow_empty=False,
+        max_length=settings.LOTES_PRESTAMO['TAMANO_MAXIMO'],
+    )
+    max_fallos = serializers.IntegerField(min_value=0, required=False, allow_null=True)
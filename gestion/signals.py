@@ -0,0 +1,118 @@
+from django.db.models import F
+from django.db.models.expressions import Combinable
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import analitica, contadores, reservas, versiones
+from .autenticacion import olvidar_usuario, olvidar_version, revocar_tokens
+from .busqueda import indexar_libro
+from .models import Libro, LibroEliminado, Usuario
+
+# Campos del libro que forman parte del índice de búsqueda
+CAMPOS_INDEXADOS = {'titulo', 'autor'}
+
+# Campos del usuario que viajan en sus tokens JWT o que deben invalidarlos al cambiar
+CAMPOS_TOKEN = ('rol', 'is_staff', 'is_superuser', 'is_active', 'password')
+
+
+@receiver(post_save, sender=Libro)
+def actualizar_indice_libro(sender, instance, created, update_fields=None, raw=False, **kwargs):
+    # Reindexo el libro cada vez que se crea o edita su título o autor
+    # Los guardados parciales que no tocan esos campos (p. ej. el stock) no cuestan nada
+    # El borrado no necesita señal: los términos se eliminan en cascada
+    if raw:
+        return
+    if update_fields is not None and not CAMPOS_INDEXADOS.intersection(update_fields):
+        return
+    indexar_libro(instance)
+
+
+@receiver(pre_save, sender=Libro)
+def incrementar_version_libro(sender, instance, raw=False, update_fields=None, **kwargs):
+    # Cada guardado de un libro existente cambia su versión y su fecha de actualización
+    # Uso F() para que dos guardados simultáneos no acaben con la misma versión
+    # Los guardados parciales solo lo hacen si incluyen 'version' en update_fields
+    if raw or instance._state.adding:
+        return
+    instance.version = F('version') + 1
+    instance.actualizado = timezone.now()
+
+
+@receiver(post_save, sender=Libro)
+def actualizar_version_catalogo(sender, instance, raw=False, **kwargs):
+    # Recupero el valor real de la versión (tras el F() de pre_save) y cambio el catálogo
+    if raw:
+        return
+    if isinstance(instance.version, Combinable):
+        instance.refresh_from_db(fields=['version'])
+    versiones.incrementar_catalogo()
+
+
+@receiver(post_delete, sender=Libro)
+def actualizar_version_catalogo_borrado(sender, instance, **kwargs):
+    versiones.incrementar_catalogo()
+
+
+@receiver(post_delete, sender=Libro)
+def registrar_libro_eliminado(sender, instance, **kwargs):
+    # El autocompletado quita el libro de su índice en memoria al ver el registro
+    LibroEliminado.objects.create(libro_id=instance.pk)
+
+
+@receiver(pre_delete, sender=Libro)
+def descontar_prestamos_libro(sender, instance, **kwargs):
+    # Los préstamos del libro se borran en cascada: los resto antes de los contadores
+    # de sus usuarios y de los globales para que no queden desviados
+    contadores.descontar_historial(libro_id=instance.pk)
+    analitica.descontar_historial(libro_id=instance.pk)
+
+
+@receiver(pre_delete, sender=Usuario)
+def descontar_prestamos_usuario(sender, instance, **kwargs):
+    contadores.descontar_historial(usuario_id=instance.pk)
+    analitica.descontar_historial(usuario_id=instance.pk)
+
+
+@receiver(pre_delete, sender=Usuario)
+def liberar_reservas_usuario(sender, instance, **kwargs):
+    # Sus reservas se borran en cascada; los ejemplares que tuviera apartados pasan
+    # antes al siguiente de cada cola para no quedarse fuera del stock para siempre
+    reservas.liberar_usuario(instance.pk)
+
+
+@receiver(pre_save, sender=Usuario)
+def revocar_tokens_usuario(sender, instance, raw=False, update_fields=None, **kwargs):
+    # Cambiar el rol (p. ej. desde AdministrarUsuariosView), los permisos, el estado o la
+    # contraseña revoca los tokens JWT del usuario
+    # Los guardados parciales que no tocan esos campos (last_login al iniciar sesión) no
+    # cuestan ninguna consulta
+    if raw or instance._state.adding:
+        return
+    if update_fields is not None and not set(CAMPOS_TOKEN).intersection(update_fields):
+        return
+    anterior = Usuario.objects.filter(pk=instance.pk).values(*CAMPOS_TOKEN, 'version_token').first()
+    if anterior is None or all(anterior[campo] == getattr(instance, campo) for campo in CAMPOS_TOKEN):
+        return
+    if update_fields is None:
+        # La nueva versión se escribe en el mismo guardado
+        instance.version_token = anterior['version_token'] + 1
+        olvidar_version(instance.pk)
+    else:
+        revocar_tokens(instance.pk)
+
+
+@receiver(post_delete, sender=Usuario)
+def olvidar_version_usuario(sender, instance, **kwargs):
+    # Sin la versión en caché, sus tokens se rechazan: el usuario ya no existe
+    olvidar_version(instance.pk)
+    olvidar_usuario(instance.pk)
+
+
+@receiver(post_save, sender=Usuario)
+def olvidar_usuario_sesion(sender, instance, raw=False, **kwargs):
+    # Cualquier guardado (rol, contraseña, nombre, last_login...) deja de servir el usuario
+    # de las sesiones web desde la caché; no cuesta ninguna consulta
+    if raw:
+        return
+    olvidar_usuario(instance.pk)
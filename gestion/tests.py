@@ -1,3 +1,1487 @@
-from django.test import TestCase
+import csv
+import datetime
+import decimal
+import importlib
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import urllib.parse
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, LiveServerTestCase, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.exceptions import InvalidToken
+
+from biblioteca import metricas
+
+from . import analitica, archivado, autenticacion, autocompletado, busqueda, contadores, exportacion, generacion, prestamos, renderizadores, reservas, serializacion, views, vistas_async
+from .benchmarks import carga
+from .benchmarks.cliente_http import ejecutar_usuarios
+from .benchmarks.utilidades import PAGINAS_ACOTADAS, crear_ronda_historial
+from .management.commands import verificar_planes
+from .models import Libro, Prestamo, PrestamoArchivado, Reserva, ResumenMensualLibro, Usuario
+from .prestamos import ResultadoPrestamo
+from .serializers import LibroSerializer, UsuarioSerializer
+from .urls import router
+
+# Pruebas del servicio de préstamos (gestion/prestamos.py): el estado de cada resultado
+# y lo que cambia en el stock, los contadores del libro y del usuario y los globales
+
+
+class ServicioPrestamosTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.lector = Usuario.objects.create_user(username='lector', email='lector@biblioteca.test', password='clave1234')
+        cls.otro = Usuario.objects.create_user(username='otro', email='otro@biblioteca.test', password='clave1234')
+        cls.libro = Libro.objects.create(titulo='Rayuela', autor='Julio Cortázar', año_publicacion=1963, cantidad_stock=1)
+
+    def estado(self):
+        # Stock y contadores de todo lo que toca un préstamo, en una sola tupla
+        libro = Libro.objects.get(pk=self.libro.pk)
+        lector = Usuario.objects.get(pk=self.lector.pk)
+        globales = contadores.estadisticas_globales()
+        return {
+            'stock': libro.cantidad_stock,
+            'libro': (libro.prestamos_activos, libro.prestamos_totales),
+            'lector': (lector.prestamos_activos, lector.prestamos_totales),
+            'global': (globales['activos'], globales['totales']),
+        }
+
+    def assertSinDesviaciones(self):
+        self.assertEqual(contadores.verificar(), {'libro': 0, 'usuario': 0, 'global': False})
+
+    def test_prestar_descuenta_stock_y_suma_contadores(self):
+        resultado = prestamos.prestar_libro(self.lector, self.libro.pk)
+
+        self.assertEqual(resultado.estado, ResultadoPrestamo.OK)
+        self.assertEqual(resultado.libro.cantidad_stock, 0)
+        self.assertTrue(Prestamo.objects.filter(usuario=self.lector, libro=self.libro, devuelto=False).exists())
+        self.assertEqual(self.estado(), {'stock': 0, 'libro': (1, 1), 'lector': (1, 1), 'global': (1, 1)})
+        self.assertSinDesviaciones()
+
+    def test_sin_stock_no_cambia_nada(self):
+        prestamos.prestar_libro(self.otro, self.libro.pk)
+        antes = self.estado()
+
+        resultado = prestamos.prestar_libro(self.lector, self.libro.pk)
+
+        self.assertEqual(resultado.estado, ResultadoPrestamo.SIN_STOCK)
+        self.assertEqual(self.estado(), antes)
+        self.assertFalse(Prestamo.objects.filter(usuario=self.lector).exists())
+        self.assertSinDesviaciones()
+
+    def test_ya_prestado_con_stock_no_descuenta(self):
+        Libro.objects.filter(pk=self.libro.pk).update(cantidad_stock=2)
+        prestamos.prestar_libro(self.lector, self.libro.pk)
+        antes = self.estado()
+
+        resultado = prestamos.prestar_libro(self.lector, self.libro.pk)
+
+        self.assertEqual(resultado.estado, ResultadoPrestamo.YA_PRESTADO)
+        self.assertEqual(self.estado(), antes)
+        self.assertEqual(Prestamo.objects.filter(usuario=self.lector, libro=self.libro).count(), 1)
+
+    def test_ya_prestado_gana_a_sin_stock(self):
+        # El usuario tiene el último ejemplar y lo vuelve a pedir
+        prestamos.prestar_libro(self.lector, self.libro.pk)
+        antes = self.estado()
+
+        resultado = prestamos.prestar_libro(self.lector, self.libro.pk)
+
+        self.assertEqual(resultado.estado, ResultadoPrestamo.YA_PRESTADO)
+        self.assertEqual(self.estado(), antes)
+
+    def test_prestar_libro_inexistente(self):
+        antes = self.estado()
+
+        resultado = prestamos.prestar_libro(self.lector, self.libro.pk + 1000)
+
+        self.assertEqual(resultado.estado, ResultadoPrestamo.NO_EXISTE)
+        self.assertIsNone(resultado.libro)
+        self.assertEqual(self.estado(), antes)
+
+    def test_devolver_suma_stock_y_resta_activos(self):
+        prestamos.prestar_libro(self.lector, self.libro.pk)
+
+        resultado = prestamos.devolver_libro(self.lector, self.libro.pk)
+
+        self.assertEqual(resultado.estado, ResultadoPrestamo.OK)
+        self.assertEqual(resultado.libro.cantidad_stock, 1)
+        prestamo = Prestamo.objects.get(usuario=self.lector, libro=self.libro)
+        self.assertTrue(prestamo.devuelto)
+        self.assertIsNotNone(prestamo.fecha_devolucion)
+        # Los totales no cambian: el préstamo sigue en el historial
+        self.assertEqual(self.estado(), {'stock': 1, 'libro': (0, 1), 'lector': (0, 1), 'global': (0, 1)})
+        self.assertSinDesviaciones()
+
+    def test_devolver_sin_prestamo(self):
+        antes = self.estado()
+
+        resultado = prestamos.devolver_libro(self.lector, self.libro.pk)
+
+        self.assertEqual(resultado.estado, ResultadoPrestamo.NO_PRESTADO)
+        self.assertEqual(self.estado(), antes)
+
+    def test_devolver_dos_veces(self):
+        prestamos.prestar_libro(self.lector, self.libro.pk)
+        prestamos.devolver_libro(self.lector, self.libro.pk)
+        antes = self.estado()
+
+        resultado = prestamos.devolver_libro(self.lector, self.libro.pk)
+
+        self.assertEqual(resultado.estado, ResultadoPrestamo.NO_PRESTADO)
+        self.assertEqual(self.estado(), antes)
+        self.assertSinDesviaciones()
+
+    def test_devolver_libro_inexistente(self):
+        resultado = prestamos.devolver_libro(self.lector, self.libro.pk + 1000)
+
+        self.assertEqual(resultado.estado, ResultadoPrestamo.NO_EXISTE)
+
+    def test_volver_a_prestar_tras_devolver(self):
+        prestamos.prestar_libro(self.lector, self.libro.pk)
+        prestamos.devolver_libro(self.lector, self.libro.pk)
+
+        resultado = prestamos.prestar_libro(self.lector, self.libro.pk)
+
+        self.assertEqual(resultado.estado, ResultadoPrestamo.OK)
+        self.assertEqual(self.estado(), {'stock': 0, 'libro': (1, 2), 'lector': (1, 2), 'global': (1, 2)})
+        self.assertSinDesviaciones()
+
+
+    def test_verificar_repara_contadores_desviados(self):
+        prestamos.prestar_libro(self.lector, self.libro.pk)
+        Libro.objects.filter(pk=self.libro.pk).update(prestamos_activos=5)
+        Usuario.objects.filter(pk=self.otro.pk).update(prestamos_totales=3)
+        contadores.actualizar_global(activos=2)
+
+        desviaciones = contadores.verificar(reparar=True)
+
+        self.assertEqual(desviaciones, {'libro': 1, 'usuario': 1, 'global': True})
+        self.assertEqual(self.estado(), {'stock': 0, 'libro': (1, 1), 'lector': (1, 1), 'global': (1, 1)})
+        self.assertEqual(Usuario.objects.get(pk=self.otro.pk).prestamos_totales, 0)
+        self.assertSinDesviaciones()
+
+class LotesPrestamosTests(TestCase):
+    # Los lotes deciden en memoria, pero deben dejar los mismos estados y contadores
+    @classmethod
+    def setUpTestData(cls):
+        cls.lector = Usuario.objects.create_user(username='lector', email='lector@biblioteca.test', password='clave1234')
+        cls.libros = [
+            Libro.objects.create(titulo=f'Libro {i}', autor='Autora', año_publicacion=2000, cantidad_stock=stock)
+            for i, stock in enumerate((1, 0, 2))
+        ]
+
+    def test_prestar_y_devolver_lote(self):
+        con_stock, agotado, doble = (libro.pk for libro in self.libros)
+        pares = [(self.lector.pk, con_stock), (self.lector.pk, agotado), (self.lector.pk, doble),
+                 (self.lector.pk, doble), (self.lector.pk, doble + 1000)]
+
+        lote = prestamos.prestar_lote(pares)
+
+        self.assertEqual([item['estado'] for item in lote.items], [
+            ResultadoPrestamo.OK, ResultadoPrestamo.SIN_STOCK, ResultadoPrestamo.OK,
+            ResultadoPrestamo.YA_PRESTADO, ResultadoPrestamo.NO_EXISTE,
+        ])
+        self.assertEqual(
+            dict(Libro.objects.filter(pk__in=[con_stock, agotado, doble]).values_list('pk', 'cantidad_stock')),
+            {con_stock: 0, agotado: 0, doble: 1},
+        )
+        lector = Usuario.objects.get(pk=self.lector.pk)
+        self.assertEqual((lector.prestamos_activos, lector.prestamos_totales), (2, 2))
+        self.assertEqual(contadores.estadisticas_globales(), {'activos': 2, 'totales': 2, 'devueltos': 0})
+
+        devolucion = prestamos.devolver_lote([(self.lector.pk, con_stock), (self.lector.pk, agotado)])
+
+        self.assertEqual([item['estado'] for item in devolucion.items],
+                         [ResultadoPrestamo.OK, ResultadoPrestamo.NO_PRESTADO])
+        self.assertEqual(Libro.objects.get(pk=con_stock).cantidad_stock, 1)
+        self.assertEqual(contadores.estadisticas_globales(), {'activos': 1, 'totales': 2, 'devueltos': 1})
+        self.assertEqual(contadores.verificar(), {'libro': 0, 'usuario': 0, 'global': False})
+
+    def test_lote_cancelado_no_escribe(self):
+        pares = [(self.lector.pk, self.libros[0].pk), (self.lector.pk, self.libros[1].pk)]
+
+        lote = prestamos.prestar_lote(pares, max_fallos=0)
+
+        self.assertTrue(lote.cancelado)
+        self.assertEqual([item['estado'] for item in lote.items],
+                         [ResultadoPrestamo.CANCELADO, ResultadoPrestamo.SIN_STOCK])
+        self.assertFalse(Prestamo.objects.exists())
+        self.assertEqual(Libro.objects.get(pk=self.libros[0].pk).cantidad_stock, 1)
+
+
+class ApiPrestamosTests(TestCase):
+    # El id del libro llega como número en JSON y como texto en un formulario
+    @classmethod
+    def setUpTestData(cls):
+        cls.lector = Usuario.objects.create_user(username='lector', email='lector@biblioteca.test', password='clave1234')
+        cls.libro = Libro.objects.create(titulo='Ficciones', autor='Jorge Luis Borges', año_publicacion=1944, cantidad_stock=2)
+
+    def setUp(self):
+        self.cliente = APIClient()
+        self.cliente.force_authenticate(self.lector)
+        self.url = f'/api/usuarios/{self.lector.pk}/'
+
+    def test_prestar_con_id_de_formulario(self):
+        # Primer préstamo del libro en el mes: crea su fila del resumen mensual
+        respuesta = self.cliente.post(f'{self.url}prestar_libro/', {'libro_id': str(self.libro.pk)})
+
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(ResumenMensualLibro.objects.get(libro=self.libro).prestamos, 1)
+
+        respuesta = self.cliente.post(f'{self.url}devolver_libro/', {'libro_id': str(self.libro.pk)})
+
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(Libro.objects.get(pk=self.libro.pk).cantidad_stock, 2)
+
+    def test_prestar_con_id_texto_en_json(self):
+        respuesta = self.cliente.post(f'{self.url}prestar_libro/', {'libro_id': str(self.libro.pk)}, format='json')
+
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(ResumenMensualLibro.objects.get(libro=self.libro, mes=timezone.localdate().replace(day=1)).prestamos, 1)
+
+    def test_id_no_valido(self):
+        for valor in ('abc', '1.5', '-3', True):
+            with self.subTest(valor=valor):
+                respuesta = self.cliente.post(f'{self.url}prestar_libro/', {'libro_id': valor}, format='json')
+                self.assertEqual(respuesta.status_code, 400)
+        respuesta = self.cliente.post(f'{self.url}devolver_libro/', {}, format='json')
+        self.assertEqual(respuesta.status_code, 400)
+        self.assertFalse(Prestamo.objects.exists())
+
+    def test_libro_inexistente(self):
+        respuesta = self.cliente.post(f'{self.url}prestar_libro/', {'libro_id': self.libro.pk + 1000}, format='json')
+
+        self.assertEqual(respuesta.status_code, 404)
+
+
+class ReservasTests(TestCase):
+    # Cola de espera de un libro agotado (gestion/reservas.py) a través de la API y del
+    # servicio de préstamos: reservar, apartar al devolver, recoger y barrer
+    @classmethod
+    def setUpTestData(cls):
+        cls.poseedor, cls.primero, cls.segundo, cls.ajeno = (
+            Usuario.objects.create_user(username=nombre, email=f'{nombre}@biblioteca.test', password='clave1234')
+            for nombre in ('poseedor', 'primero', 'segundo', 'ajeno')
+        )
+        cls.libro = Libro.objects.create(titulo='Pedro Páramo', autor='Juan Rulfo', año_publicacion=1955, cantidad_stock=1)
+
+    def setUp(self):
+        prestamos.prestar_libro(self.poseedor, self.libro.pk)
+
+    def reservar(self, usuario, libro_id, formato='json'):
+        cliente = APIClient()
+        cliente.force_authenticate(usuario)
+        return cliente.post(f'/api/usuarios/{usuario.pk}/reservar/', {'libro_id': libro_id}, format=formato)
+
+    def reserva(self, usuario):
+        return Reserva.objects.get(usuario=usuario, libro=self.libro)
+
+    def stock(self):
+        return Libro.objects.get(pk=self.libro.pk).cantidad_stock
+
+    def test_reservar_por_api_en_orden_de_llegada(self):
+        primera = self.reservar(self.primero, str(self.libro.pk))
+        segunda = self.reservar(self.segundo, self.libro.pk, formato='multipart')
+
+        self.assertEqual(primera.status_code, 201)
+        self.assertEqual(primera.data['reserva']['delante'], 0)
+        self.assertEqual(segunda.status_code, 201)
+        self.assertEqual(segunda.data['reserva']['delante'], 1)
+        self.assertEqual(self.reservar(self.primero, self.libro.pk).status_code, 400)  # Ya reservado
+        self.assertEqual(self.reservar(self.poseedor, self.libro.pk).status_code, 400)  # Ya prestado
+        self.assertEqual(self.reservar(self.primero, 'abc').status_code, 400)
+        self.assertEqual(self.reservar(self.primero, self.libro.pk + 1000).status_code, 404)
+
+    def test_no_se_reserva_con_stock(self):
+        Libro.objects.filter(pk=self.libro.pk).update(cantidad_stock=1)
+
+        self.assertEqual(self.reservar(self.primero, self.libro.pk).status_code, 400)
+        self.assertFalse(Reserva.objects.exists())
+
+    def test_devolucion_aparta_para_el_primero(self):
+        reservas.reservar(self.primero, self.libro.pk)
+        reservas.reservar(self.segundo, self.libro.pk)
+
+        prestamos.devolver_libro(self.poseedor, self.libro.pk)
+
+        # El ejemplar no vuelve al stock: nadie de fuera de la cola puede llevárselo
+        self.assertEqual(self.stock(), 0)
+        self.assertEqual(self.reserva(self.primero).estado, Reserva.ASIGNADA)
+        self.assertEqual(self.reserva(self.segundo).estado, Reserva.ESPERA)
+        self.assertEqual(prestamos.prestar_libro(self.ajeno, self.libro.pk).estado, ResultadoPrestamo.SIN_STOCK)
+        self.assertEqual(prestamos.prestar_libro(self.segundo, self.libro.pk).estado, ResultadoPrestamo.SIN_STOCK)
+
+        # Quien lo tiene apartado lo recibe aunque el stock esté a cero
+        self.assertEqual(prestamos.prestar_libro(self.primero, self.libro.pk).estado, ResultadoPrestamo.OK)
+        self.assertEqual(self.reserva(self.primero).estado, Reserva.COMPLETADA)
+        self.assertEqual(self.stock(), 0)
+        self.assertEqual(contadores.verificar(), {'libro': 0, 'usuario': 0, 'global': False})
+
+    def test_cancelar_un_apartado_pasa_al_siguiente(self):
+        reservas.reservar(self.primero, self.libro.pk)
+        reservas.reservar(self.segundo, self.libro.pk)
+        prestamos.devolver_libro(self.poseedor, self.libro.pk)
+        cliente = APIClient()
+        cliente.force_authenticate(self.primero)
+
+        respuesta = cliente.post(f'/api/usuarios/{self.primero.pk}/cancelar_reserva/', {'libro_id': str(self.libro.pk)})
+
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(self.reserva(self.primero).estado, Reserva.CANCELADA)
+        self.assertEqual(self.reserva(self.segundo).estado, Reserva.ASIGNADA)
+        self.assertEqual(self.stock(), 0)
+
+    def test_barrido_pasa_los_vencidos_al_siguiente_y_luego_al_stock(self):
+        reservas.reservar(self.primero, self.libro.pk)
+        reservas.reservar(self.segundo, self.libro.pk)
+        prestamos.devolver_libro(self.poseedor, self.libro.pk)
+        despues = timezone.now() + datetime.timedelta(hours=settings.RESERVAS['PLAZO_HORAS'] + 1)
+
+        resultado = reservas.barrer(ahora=despues)
+
+        self.assertEqual((resultado['vencidas'], resultado['asignadas']), (1, 1))
+        self.assertEqual(self.reserva(self.primero).estado, Reserva.VENCIDA)
+        self.assertEqual(self.reserva(self.segundo).estado, Reserva.ASIGNADA)
+        self.assertEqual(self.stock(), 0)
+
+        # Sin nadie más en la cola, el ejemplar vuelve al stock
+        resultado = reservas.barrer(ahora=despues + datetime.timedelta(hours=settings.RESERVAS['PLAZO_HORAS'] + 1))
+
+        self.assertEqual((resultado['vencidas'], resultado['asignadas']), (1, 0))
+        self.assertEqual(self.reserva(self.segundo).estado, Reserva.VENCIDA)
+        self.assertEqual(self.stock(), 1)
+
+    def test_barrido_aparta_el_stock_que_llega_sin_devolucion(self):
+        reservas.reservar(self.primero, self.libro.pk)
+        # Un administrador añade un ejemplar editando el libro
+        Libro.objects.filter(pk=self.libro.pk).update(cantidad_stock=1)
+
+        resultado = reservas.barrer()
+
+        self.assertEqual(resultado['asignadas'], 1)
+        self.assertEqual(self.reserva(self.primero).estado, Reserva.ASIGNADA)
+        self.assertEqual(self.stock(), 0)
+
+
+class HistorialCompletoApiTests(TestCase):
+    # GET /api/usuarios/{id}/prestamos/?completo=1 mezcla Prestamo y PrestamoArchivado
+    @classmethod
+    def setUpTestData(cls):
+        cls.lector = Usuario.objects.create_user(username='lector', email='lector@biblioteca.test', password='clave1234')
+        libro = Libro.objects.create(titulo='Rayuela', autor='Julio Cortázar', año_publicacion=1963, cantidad_stock=1)
+        inicio = timezone.now() - datetime.timedelta(days=400)
+        # Fechas intercaladas: los pares se archivan, los impares siguen en Prestamo
+        for dia in range(7):
+            fecha = inicio + datetime.timedelta(days=dia)
+            Prestamo.objects.create(
+                usuario=cls.lector, libro=libro, fecha_prestamo=fecha,
+                devuelto=True, fecha_devolucion=fecha + datetime.timedelta(days=dia % 2 * 400),
+            )
+        archivado.archivar(dias=200)
+        # Ids de más reciente a más antiguo (las fechas crecen con el id)
+        cls.recientes = list(Prestamo.objects.order_by('-pk').values_list('pk', flat=True))
+        cls.ids = sorted([*cls.recientes, *PrestamoArchivado.objects.values_list('pk', flat=True)], reverse=True)
+
+    def setUp(self):
+        self.cliente = APIClient()
+        self.cliente.force_authenticate(self.lector)
+        self.url = f'/api/usuarios/{self.lector.pk}/prestamos/'
+
+    def test_sin_completo_solo_lee_prestamo(self):
+        datos = self.cliente.get(self.url).json()
+
+        self.assertFalse(datos['completo'])
+        self.assertEqual([p['id'] for p in datos['prestamos']], self.recientes)
+
+    def test_recorre_todas_las_paginas(self):
+        self.assertEqual(PrestamoArchivado.objects.count(), 4)
+        vistos, url = [], f'{self.url}?completo=1&tamano=2'
+        while url:
+            datos = self.cliente.get(url).json()
+            self.assertTrue(datos['completo'])
+            self.assertLessEqual(len(datos['prestamos']), 2)
+            vistos += [p['id'] for p in datos['prestamos']]
+            url = datos['siguiente']
+
+        self.assertEqual(vistos, self.ids)
+        self.assertEqual(datos['prestamos'][-1]['libro_titulo'], 'Rayuela')
+
+    def test_cursor_no_valido(self):
+        respuesta = self.cliente.get(f'{self.url}?completo=1&antes=ayer')
+
+        self.assertEqual(respuesta.status_code, 400)
+
+    def test_vista_asincrona(self):
+        peticion = RequestFactory().get(f'{self.url}?completo=1&tamano=10')
+
+        respuesta = async_to_sync(vistas_async.prestamos)(peticion, self.lector, pk=self.lector.pk)
+
+        datos = json.loads(respuesta.content)
+        self.assertTrue(datos['completo'])
+        self.assertEqual([p['id'] for p in datos['prestamos']], self.ids)
+
+
+class MetricasTests(TestCase):
+    # /metricas/ (biblioteca/metricas.py); manage.py test escribe en un archivo temporal
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = Usuario.objects.create_user(username='admin', email='admin@biblioteca.test', password='clave1234', is_staff=True)
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def test_archivo_temporal_en_pruebas(self):
+        self.assertNotEqual(os.path.dirname(metricas.registro.archivo), os.path.join(settings.BASE_DIR, 'var'))
+
+    def test_expone_las_vistas_atendidas(self):
+        self.client.get(reverse('libros-lista'))
+
+        respuesta = self.client.get('/metricas/')
+
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertIn('vista="libros-lista",metodo="GET",codigo="200"', respuesta.content.decode())
+
+    def test_archivo_ilegible_responde_503(self):
+        with mock.patch.object(metricas.registro, 'archivo', '/proc/biblioteca/metricas.sqlite3'):
+            with self.assertLogs('biblioteca.metricas', 'WARNING') as avisos:
+                respuesta = self.client.get('/metricas/')
+
+        self.assertEqual(respuesta.status_code, 503)
+        self.assertIn('No se pudieron leer las métricas', '\n'.join(avisos.output))
+
+
+class ConsultasAcotadasTests(TestCase):
+    # Las páginas de historial y de usuarios hacen las mismas consultas con pocas y con
+    # muchas filas (sin N+1); verificar_consultas repite la comprobación con más rondas
+    PRESUPUESTOS = {
+        'historial-prestamos': 4,
+        'mi-historial-prestamos': 3,
+        'prestamos-listas': 3,
+        'mis-reservas': 4,
+        'administrar-usuarios': 3,
+    }
+
+    def test_consultas_constantes(self):
+        admin = Usuario.objects.create_user('admin_consultas', 'admin@biblioteca.test', 'x', rol='admin')
+        lector = Usuario.objects.create_user('lector_consultas', 'lector@biblioteca.test', 'x')
+        clientes = {'admin': Client(), 'lector': Client()}
+        clientes['admin'].force_login(admin)
+        clientes['lector'].force_login(lector)
+        self.assertEqual(set(self.PRESUPUESTOS), {nombre for nombre, _ in PAGINAS_ACOTADAS})
+
+        for ronda, filas in enumerate((5, 40), start=1):
+            crear_ronda_historial(lector, filas, semilla=ronda)
+            for nombre, quien in PAGINAS_ACOTADAS:
+                with self.subTest(pagina=nombre, filas=filas), self.assertNumQueries(self.PRESUPUESTOS[nombre]):
+                    respuesta = clientes[quien].get(reverse(nombre))
+                    self.assertEqual(respuesta.status_code, 200)
+
+
+class PlanesConsultasTests(TestCase):
+    # Las consultas filtradas de las rutas de préstamos y reservas no recorren tablas
+    # enteras (verificar_planes hace lo mismo con un historial mucho mayor)
+    def test_consultas_filtradas_usan_indices(self):
+        verificar_planes.cargar({'libros': 300, 'usuarios': 60, 'prestamos': 3000, 'reservas': 600, 'semilla': 0})
+
+        planes = verificar_planes.capturar()
+
+        self.assertTrue(any(plan['peticion'].startswith('api reservas') for plan in planes))
+        recorridos = [
+            f"{plan['peticion']}: {' / '.join(plan['plan'])}"
+            for plan in planes if plan['filtrada'] and plan['recorridos']
+        ]
+        self.assertEqual(recorridos, [])
+
+
+class MigracionIndiceTests(TestCase):
+    # La migración 0003 lleva su propia copia del tokenizador: debe seguir indexando
+    # igual que gestion/busqueda.py mientras este no cambie a propósito
+    def test_tokenizador_de_la_migracion(self):
+        migracion = importlib.import_module('gestion.migrations.0003_termino_busqueda')
+        for titulo, autor in (
+            ('Cien años de soledad', 'Gabriel García Márquez'),
+            ('El año del diluvio', 'Eduardo Mendoza'),
+            ('Pingüinos: 2ª edición', 'Anónimo'),
+            ('', None),
+        ):
+            with self.subTest(titulo=titulo):
+                self.assertEqual(dict(migracion.terminos_libro(titulo, autor)), busqueda.terminos_libro(titulo, autor))
+
+
+class BusquedaTests(TestCase):
+    # Índice invertido del catálogo (gestion/busqueda.py), mantenido por la señal post_save
+    @classmethod
+    def setUpTestData(cls):
+        cls.soledad = Libro.objects.create(titulo='Cien años de soledad', autor='Gabriel García Márquez', año_publicacion=1967)
+        cls.amor = Libro.objects.create(titulo='El amor en los tiempos del cólera', autor='Gabriel García Márquez', año_publicacion=1985)
+        cls.garcia = Libro.objects.create(titulo='García', autor='Anónimo', año_publicacion=2000)
+
+    def ids(self, consulta):
+        return list(busqueda.buscar_libros(consulta).values_list('pk', flat=True))
+
+    def test_sin_tildes_ni_mayusculas_y_por_prefijo(self):
+        self.assertEqual(self.ids('COLERA'), [self.amor.pk])
+        self.assertEqual(self.ids('sole'), [self.soledad.pk])
+        self.assertEqual(self.ids('años'), [self.soledad.pk])
+        self.assertEqual(self.ids('anos'), [])
+
+    def test_todas_las_palabras_y_titulo_primero(self):
+        self.assertEqual(self.ids('garcia marquez amor'), [self.amor.pk])
+        # El título pesa más que el autor
+        self.assertEqual(self.ids('garcia')[0], self.garcia.pk)
+
+    def test_indice_sigue_a_los_cambios(self):
+        Libro.objects.get(pk=self.garcia.pk).delete()
+        libro = Libro.objects.get(pk=self.soledad.pk)
+        libro.titulo = 'Crónica de una muerte anunciada'
+        libro.save()
+
+        self.assertEqual(self.ids('cronica'), [self.soledad.pk])
+        self.assertEqual(self.ids('soledad'), [])
+        # Misma relevancia: desempata el título
+        self.assertEqual(self.ids('garcia'), [self.soledad.pk, self.amor.pk])
+
+
+class PaginacionCursorTests(TestCase):
+    # Listados de la API por cursor (gestion/paginacion.py): recorrer todas las páginas
+    # por el enlace `siguiente` devuelve cada fila una sola vez
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = Usuario.objects.create_user('admin', 'admin@biblioteca.test', 'x', rol='admin', is_staff=True)
+        # Mismos términos en todos los títulos: la búsqueda empata en relevancia
+        cls.libros = [
+            Libro.objects.create(titulo=f'Tomo {i}', autor='Autor', año_publicacion=1900 + i, cantidad_stock=1).pk
+            for i in range(11)
+        ]
+        for i in range(6):
+            Usuario.objects.create_user(f'lector{i}', f'lector{i}@biblioteca.test', 'x')
+
+    def setUp(self):
+        self.cliente = APIClient()
+        self.cliente.force_authenticate(self.admin)
+
+    def recorrer(self, url, clave):
+        vistos, paginas = [], 0
+        while url:
+            datos = self.cliente.get(url).json()
+            self.assertLessEqual(len(datos[clave]), 4)
+            vistos += [fila['id'] for fila in datos[clave]]
+            url, paginas = datos['siguiente'], paginas + 1
+        return vistos, paginas
+
+    def test_libros(self):
+        vistos, paginas = self.recorrer('/api/libros/?tamano=4', 'libros')
+
+        self.assertEqual(vistos, self.libros)
+        self.assertEqual(paginas, 3)
+
+    def test_busqueda_con_empates(self):
+        vistos, _ = self.recorrer('/api/libros/?tamano=4&buscar=tomo', 'libros')
+
+        self.assertEqual(sorted(vistos), self.libros)
+        self.assertEqual(len(vistos), len(set(vistos)))
+
+    def test_usuarios(self):
+        vistos, _ = self.recorrer('/api/usuarios/?tamano=4', 'usuarios')
+
+        self.assertEqual(vistos, list(Usuario.objects.order_by('pk').values_list('pk', flat=True)))
+
+    def test_modos_de_conteo(self):
+        exacto = self.cliente.get('/api/libros/?tamano=4&conteo=exacto').json()
+        sin_conteo = self.cliente.get('/api/libros/?tamano=4&conteo=no').json()
+
+        self.assertEqual((exacto['total'], exacto['mensaje']), (11, 'Se encontraron 11 libros'))
+        self.assertEqual((sin_conteo['total'], sin_conteo['mensaje']), (None, 'Se muestran 4 libros'))
+
+
+class ImportacionTests(TestCase):
+    # manage.py importar_libros (gestion/importacion.py)
+    @classmethod
+    def setUpTestData(cls):
+        cls.existente = Libro.objects.create(titulo='Rayuela', autor='Julio Cortázar', año_publicacion=1963, cantidad_stock=2)
+
+    def importar(self, nombre, contenido, *argumentos):
+        with tempfile.TemporaryDirectory() as directorio:
+            ruta = os.path.join(directorio, nombre)
+            with open(ruta, 'w', encoding='utf-8') as archivo:
+                archivo.write(contenido)
+            rechazados = os.path.join(directorio, 'rechazados.csv')
+            call_command('importar_libros', ruta, '--lote', '2', '--rechazados', rechazados, *argumentos, stdout=io.StringIO())
+            with open(rechazados, encoding='utf-8') as archivo:
+                return list(csv.reader(archivo))[1:]
+
+    def test_csv_crea_actualiza_y_rechaza(self):
+        rechazados = self.importar('libros.csv', (
+            'titulo,autor,año_publicacion,cantidad_stock\n'
+            'Rayuela,Julio Cortázar,1963,5\n'
+            'Ficciones,Jorge Luis Borges,1944,3\n'
+            'Sin año,Anónimo,,1\n'
+            'Ficciones,Jorge Luis Borges,1944,4\n'
+            'El Aleph,Jorge Luis Borges,1949,\n'
+        ))
+
+        self.assertEqual(Libro.objects.get(pk=self.existente.pk).cantidad_stock, 5)
+        # La última aparición de un libro repetido es la que vale
+        self.assertEqual(Libro.objects.get(titulo='Ficciones').cantidad_stock, 4)
+        self.assertEqual(Libro.objects.get(titulo='El Aleph').cantidad_stock, 0)
+        self.assertEqual([linea for linea, _ in rechazados], ['4'])
+        # Los libros nuevos entran en el índice de búsqueda
+        self.assertEqual(busqueda.buscar_libros('aleph').get().titulo, 'El Aleph')
+
+    def test_jsonl_sumando_stock(self):
+        rechazados = self.importar('libros.jsonl', (
+            '{"titulo": "Rayuela", "autor": "Julio Cortázar", "año_publicacion": 1963, "cantidad_stock": 1}\n'
+            'no es json\n'
+            '\n'
+            '{"titulo": "Rayuela", "autor": "Julio Cortázar", "año_publicacion": 1963, "cantidad_stock": 2}\n'
+        ), '--sumar-stock')
+
+        self.assertEqual(Libro.objects.get(pk=self.existente.pk).cantidad_stock, 5)
+        self.assertEqual(Libro.objects.count(), 1)
+        self.assertEqual([linea for linea, _ in rechazados], ['2'])
+
+
+class ExportacionTests(TestCase):
+    # /historial-prestamos/exportar/ y gestion/exportacion.py, con parte del historial archivado
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = Usuario.objects.create_user('admin', 'admin@biblioteca.test', 'x', rol='admin')
+        cls.lector = Usuario.objects.create_user('lector', 'lector@biblioteca.test', 'x')
+        cls.otro = Usuario.objects.create_user('otro', 'otro@biblioteca.test', 'x')
+        libro = Libro.objects.create(titulo='Pedro Páramo', autor='Juan Rulfo', año_publicacion=1955, cantidad_stock=3)
+        inicio = timezone.make_aware(datetime.datetime(2024, 1, 1, 12))
+        for dia in range(6):
+            fecha = inicio + datetime.timedelta(days=dia)
+            Prestamo.objects.create(
+                usuario=cls.lector if dia % 2 else cls.otro, libro=libro, fecha_prestamo=fecha,
+                devuelto=dia < 5, fecha_devolucion=fecha if dia < 5 else None,
+            )
+        # Los préstamos de los dos primeros días pasan al archivo
+        archivado.archivar_lote(inicio + datetime.timedelta(days=1, hours=1))
+        cls.ids = sorted([
+            *Prestamo.objects.values_list('pk', flat=True), *PrestamoArchivado.objects.values_list('pk', flat=True),
+        ])
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def exportar(self, **parametros):
+        respuesta = self.client.get(reverse('historial-prestamos-exportar'), parametros)
+        self.assertEqual(respuesta.status_code, 200)
+        return b''.join(respuesta.streaming_content).decode()
+
+    def test_csv_con_los_archivados_en_orden_de_id(self):
+        self.assertEqual(PrestamoArchivado.objects.count(), 2)
+
+        filas = list(csv.DictReader(io.StringIO(self.exportar())))
+
+        self.assertEqual([int(fila['id']) for fila in filas], self.ids)
+        self.assertEqual(filas[0]['libro_titulo'], 'Pedro Páramo')
+        self.assertEqual([fila['devuelto'] for fila in filas[-2:]], ['True', 'False'])
+
+    def test_ndjson_con_filtros(self):
+        texto = self.exportar(formato='ndjson', usuario=self.lector.pk, desde='2024-01-02', hasta='2024-01-04')
+
+        filas = [json.loads(linea) for linea in texto.splitlines()]
+        self.assertEqual([fila['fecha_prestamo'][:10] for fila in filas], ['2024-01-02', '2024-01-04'])
+        self.assertEqual({fila['usuario_username'] for fila in filas}, {'lector'})
+
+    def test_lotes_pequenos(self):
+        lineas = list(exportacion.exportar(exportacion.filtrar_prestamos(), 'csv', tamano_lote=2))
+
+        self.assertEqual([int(linea.split(',')[0]) for linea in lineas[1:]], self.ids)
+
+    def test_parametros_no_validos_y_permisos(self):
+        url = reverse('historial-prestamos-exportar')
+        self.assertEqual(self.client.get(url, {'formato': 'xml'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'desde': '2024-13-01'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'usuario': 'abc'}).status_code, 400)
+
+        self.client.force_login(self.lector)
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+
+class PeticionesCondicionalesTests(TestCase):
+    # ETag / Last-Modified de /api/libros/ (gestion/versiones.py)
+    @classmethod
+    def setUpTestData(cls):
+        cls.lector = Usuario.objects.create_user('lector', 'lector@biblioteca.test', 'x')
+        cls.admin = Usuario.objects.create_user('admin', 'admin@biblioteca.test', 'x', rol='admin', is_staff=True)
+        cls.libro = Libro.objects.create(titulo='Aura', autor='Carlos Fuentes', año_publicacion=1962, cantidad_stock=2)
+
+    def setUp(self):
+        self.cliente = APIClient()
+
+    def test_listado_304_sin_consultar_los_libros(self):
+        respuesta = self.cliente.get('/api/libros/')
+        etag = respuesta['ETag']
+        self.assertIn('no-cache', respuesta['Cache-Control'])
+
+        # Solo se lee la versión del catálogo
+        with self.assertNumQueries(1):
+            respuesta = self.cliente.get('/api/libros/', HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(respuesta.status_code, 304)
+        self.assertEqual(respuesta['ETag'], etag)
+        self.assertEqual(respuesta.content, b'')
+
+    def test_un_prestamo_cambia_el_etag(self):
+        listado = self.cliente.get('/api/libros/')['ETag']
+        detalle = self.cliente.get(f'/api/libros/{self.libro.pk}/')['ETag']
+
+        prestamos.prestar_libro(self.lector, self.libro.pk)
+
+        respuesta = self.cliente.get('/api/libros/', HTTP_IF_NONE_MATCH=listado)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertNotEqual(respuesta['ETag'], listado)
+        respuesta = self.cliente.get(f'/api/libros/{self.libro.pk}/', HTTP_IF_NONE_MATCH=detalle)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta.json()['libro']['cantidad_stock'], 1)
+
+    def test_detalle_tras_editar(self):
+        respuesta = self.cliente.get(f'/api/libros/{self.libro.pk}/')
+        etag = respuesta['ETag']
+        self.assertEqual(self.cliente.get(f'/api/libros/{self.libro.pk}/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(
+            self.cliente.get(f'/api/libros/{self.libro.pk}/', HTTP_IF_MODIFIED_SINCE=respuesta['Last-Modified']).status_code,
+            304,
+        )
+
+        self.cliente.force_authenticate(self.admin)
+        self.cliente.patch(f'/api/libros/{self.libro.pk}/', {'titulo': 'Aura (edición anotada)'}, format='json')
+
+        respuesta = self.cliente.get(f'/api/libros/{self.libro.pk}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertNotEqual(respuesta['ETag'], etag)
+
+
+class ApiAsincronaTests(TestCase):
+    # Las vistas async (gestion/vistas_async.py) responden lo mismo que los viewsets
+    @classmethod
+    def setUpTestData(cls):
+        cls.lector = Usuario.objects.create_user('lector', 'lector@biblioteca.test', 'x')
+        cls.libros = [
+            Libro.objects.create(titulo=f'Novela {i}', autor='Elena Garro', año_publicacion=1960 + i, cantidad_stock=2)
+            for i in range(3)
+        ]
+        prestamos.prestar_libro(cls.lector, cls.libros[1].pk)
+
+    def setUp(self):
+        self.cliente = APIClient()
+        self.cliente.force_authenticate(self.lector)
+        self.vistas = {patron.name: patron.callback for patron in vistas_async.envolver(router.urls) if hasattr(patron, 'name')}
+
+    def asincrona(self, nombre, url, usuario=None, **kwargs):
+        peticion = RequestFactory().get(url)
+        if usuario is None:
+            return async_to_sync(self.vistas[nombre])(peticion, **kwargs)
+        # Con usuario se llama a la vista sin el envoltorio que autentica
+        return async_to_sync(vistas_async.VISTAS[nombre])(peticion, usuario, **kwargs)
+
+    def test_listado_y_detalle_anonimos(self):
+        for nombre, url, kwargs in (
+            ('libro-list', '/api/libros/?tamano=2', {}),
+            ('libro-detail', f'/api/libros/{self.libros[0].pk}/', {'pk': self.libros[0].pk}),
+        ):
+            with self.subTest(nombre=nombre):
+                respuesta = self.asincrona(nombre, url, **kwargs)
+                sincrona = APIClient().get(url)
+                self.assertEqual(respuesta.status_code, 200)
+                self.assertEqual(json.loads(respuesta.content), sincrona.json())
+                self.assertEqual(respuesta['ETag'], sincrona['ETag'])
+
+    def test_304_y_404(self):
+        etag = self.asincrona('libro-list', '/api/libros/')['ETag']
+        peticion = RequestFactory().get('/api/libros/', HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(async_to_sync(self.vistas['libro-list'])(peticion).status_code, 304)
+        self.assertEqual(self.asincrona('libro-detail', '/api/libros/0/', pk=0).status_code, 404)
+
+    def test_mis_libros(self):
+        url = f'/api/usuarios/{self.lector.pk}/mis_libros/'
+
+        respuesta = self.asincrona('usuario-mis-libros', url, self.lector, pk=self.lector.pk)
+
+        self.assertEqual(json.loads(respuesta.content), self.cliente.get(url).json())
+        self.assertEqual([libro['id'] for libro in json.loads(respuesta.content)['libros']], [self.libros[1].pk])
+
+    def test_sin_autenticar(self):
+        url = f'/api/usuarios/{self.lector.pk}/mis_libros/'
+
+        self.assertEqual(self.asincrona('usuario-mis-libros', url, pk=self.lector.pk).status_code, 403)
+
+
+class SerializacionRapidaTests(TestCase):
+    # La ruta rápida de los listados (gestion/serializacion.py y gestion/renderizadores.py)
+    # produce lo mismo que los serializers y que el JSONRenderer de DRF
+    @classmethod
+    def setUpTestData(cls):
+        cls.lector = Usuario.objects.create_user('lector', 'lector@biblioteca.test', 'x')
+        cls.libros = [
+            Libro.objects.create(titulo=f'Poemas {i} «ñ»\u2028', autor='Gabriela Mistral', año_publicacion=1922 + i, cantidad_stock=3)
+            for i in range(3)
+        ]
+        for libro in cls.libros[:2]:
+            prestamos.prestar_libro(cls.lector, libro.pk)
+
+    def test_libros_como_el_serializer(self):
+        filas = Libro.objects.order_by('pk').values('pk', *serializacion.CAMPOS_LIBRO)
+
+        self.assertEqual(serializacion.filas_libros(filas), LibroSerializer(Libro.objects.order_by('pk'), many=True).data)
+
+    def test_usuarios_como_el_serializer(self):
+        filas = Usuario.objects.order_by('pk').values('pk', *serializacion.CAMPOS_USUARIO)
+
+        rapidas = serializacion.filas_usuarios(filas)
+
+        self.assertEqual(rapidas, UsuarioSerializer(Usuario.objects.order_by('pk'), many=True).data)
+        self.assertEqual(rapidas[-1]['libros_prestados'], [libro.pk for libro in self.libros[:2]])
+
+    def test_json_identico_al_de_drf(self):
+        datos = {
+            'libros': LibroSerializer(Libro.objects.all(), many=True).data,
+            'fecha': timezone.now(),
+            'decimal': decimal.Decimal('1.50'),
+            1: None,
+        }
+
+        self.assertEqual(renderizadores.a_json(datos), JSONRenderer().render(datos))
+
+
+class EscenariosCargaTests(LiveServerTestCase):
+    # Los recorridos de `benchmark carga` (gestion/benchmarks/carga.py) contra un servidor
+    # real: cada paso debe responder lo esperado, o el benchmark solo mediría errores
+    # Un solo usuario virtual: el servidor de pruebas comparte la conexión SQLite en memoria
+    # entre sus hilos, así que las peticiones simultáneas no serían representativas
+    def test_cada_escenario_completa_recorridos(self):
+        opciones = {'libros': 30, 'usuarios': 5, 'prestamos': 40, 'usuarios_virtuales': 1, 'semilla': 0}
+        datos = carga._preparar_datos(opciones)
+        url = urllib.parse.urlsplit(self.live_server_url)
+
+        for escenario in carga.ESCENARIOS:
+            with self.subTest(escenario=escenario):
+                resultado = ejecutar_usuarios(
+                    url.hostname, url.port, carga._flujos(escenario, datos, opciones), duracion=1, calentamiento=0,
+                )
+                self.assertEqual({paso['paso']: paso['errores'] for paso in resultado['pasos'] if paso['errores']}, {})
+                self.assertGreater(resultado['flujos'][0]['recorridos'], 0)
+
+
+class GeneracionTests(TestCase):
+    # manage.py generar_datos (gestion/generacion.py) deja los datos como si cada préstamo
+    # se hubiera hecho por el servicio
+    def generar(self):
+        return generacion.generar(libros=40, usuarios=15, prestamos=400, semilla=3, tamano_lote=64)
+
+    def huella(self):
+        # Las fechas se calculan desde timezone.now(), así que comparo lo demás
+        return sorted(
+            Prestamo.objects.values_list('libro__titulo', 'usuario__username', 'devuelto')
+        ) + sorted(Libro.objects.values_list('titulo', 'autor', 'año_publicacion', 'cantidad_stock'))
+
+    def test_datos_consistentes(self):
+        resumen = self.generar()
+
+        self.assertEqual(Prestamo.objects.count(), 400)
+        self.assertEqual(Prestamo.objects.filter(devuelto=False).count(), resumen['activos'])
+        self.assertGreater(resumen['activos'], 0)
+        self.assertFalse(Libro.objects.filter(cantidad_stock__lt=0).exists())
+        self.assertEqual(contadores.verificar(), {'libro': 0, 'usuario': 0, 'global': False})
+        self.assertEqual(analitica.verificar(), {'dias': 0, 'libros_mes': 0})
+
+    def test_misma_semilla_mismos_datos(self):
+        self.generar()
+        primera = self.huella()
+        Prestamo.objects.all().delete()
+        Libro.objects.all().delete()
+        Usuario.objects.filter(username__startswith='gen3_').delete()
+
+        self.generar()
+
+        self.assertEqual(self.huella(), primera)
+
+
+class PrestamosActivosTests(TestCase):
+    # Los libros prestados se leen de los préstamos sin devolver, igual en la web y en la API
+    @classmethod
+    def setUpTestData(cls):
+        cls.lector = Usuario.objects.create_user('lector', 'lector@biblioteca.test', 'clave1234')
+        cls.libros = [
+            Libro.objects.create(titulo=f'Cuentos {i}', autor='Horacio Quiroga', año_publicacion=1917, cantidad_stock=2)
+            for i in range(3)
+        ]
+
+    def setUp(self):
+        self.web = Client()
+        self.web.force_login(self.lector)
+        self.api = APIClient()
+        self.api.force_authenticate(self.lector)
+
+    def prestados(self):
+        web = list(self.web.get(reverse('prestamos-listas')).context['libros'])
+        api = [libro['id'] for libro in self.api.get(f'/api/usuarios/{self.lector.pk}/mis_libros/').json()['libros']]
+        self.assertEqual([libro.pk for libro in web], api)
+        self.assertEqual(list(self.lector.libros_prestados.values_list('pk', flat=True)), api)
+        return api
+
+    def test_prestar_por_la_web_y_devolver_por_la_api(self):
+        for libro in self.libros[:2]:
+            self.web.post(reverse('prestamo-create', args=[libro.pk]))
+
+        self.assertEqual(self.prestados(), [self.libros[0].pk, self.libros[1].pk])
+
+        respuesta = self.api.post(f'/api/usuarios/{self.lector.pk}/devolver_libro/', {'libro_id': self.libros[0].pk}, format='json')
+
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(self.prestados(), [self.libros[1].pk])
+        # El préstamo devuelto sigue en el historial; solo hay una fila por préstamo
+        self.assertEqual(Prestamo.objects.filter(usuario=self.lector).count(), 2)
+
+    def test_un_prestamo_por_la_api_sale_en_la_web(self):
+        self.api.post(f'/api/usuarios/{self.lector.pk}/prestar_libro/', {'libro_id': self.libros[2].pk}, format='json')
+
+        self.assertEqual(self.prestados(), [self.libros[2].pk])
+
+        self.web.post(reverse('prestamo-devolucion', args=[self.libros[2].pk]))
+
+        self.assertEqual(self.prestados(), [])
+        self.assertTrue(Prestamo.objects.get(usuario=self.lector, libro=self.libros[2]).devuelto)
+
+
+class RevocacionTokensTests(TestCase):
+    # Tokens JWT con el rol del usuario y su versión (gestion/autenticacion.py): cambiar el
+    # rol o borrar el usuario desde la administración web revoca los que ya tenía
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = Usuario.objects.create_user('admin', 'admin@biblioteca.test', 'x', rol='admin', is_staff=True)
+        cls.lector = Usuario.objects.create_user('lector', 'lector@biblioteca.test', 'clave1234')
+
+    def setUp(self):
+        cache.clear()
+        self.web = Client()
+        self.web.force_login(self.admin)
+        respuesta = self.client.post('/api/token/', {'username': 'lector', 'password': 'clave1234'})
+        self.tokens = respuesta.json()
+
+    def autenticar(self, acceso):
+        peticion = RequestFactory().get('/api/libros/', HTTP_AUTHORIZATION=f'Bearer {acceso}')
+        return autenticacion.JWTSinEstado().authenticate(peticion)[0]
+
+    def refrescar(self):
+        return self.client.post('/api/token/refresh/', {'refresh': self.tokens['refresh']})
+
+    def administrar(self, **datos):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.web.post(reverse('administrar-usuarios'), {'usuario_id': self.lector.pk, **datos})
+
+    def test_permisos_desde_el_token(self):
+        self.autenticar(self.tokens['access'])
+
+        # Con la versión en caché no se lee el usuario
+        with self.assertNumQueries(0):
+            usuario = self.autenticar(self.tokens['access'])
+
+        self.assertEqual((usuario.id, usuario.username, usuario.rol), (self.lector.pk, 'lector', 'regular'))
+        self.assertFalse(usuario.is_admin or usuario.is_staff)
+        self.assertEqual(self.refrescar().status_code, 200)
+
+    def test_cambio_de_rol_revoca_los_tokens(self):
+        self.autenticar(self.tokens['access'])
+
+        self.administrar(accion='cambiar_rol', nuevo_rol='admin')
+
+        with self.assertRaises(InvalidToken):
+            self.autenticar(self.tokens['access'])
+        self.assertEqual(self.refrescar().status_code, 401)
+        # Los tokens nuevos llevan el rol nuevo
+        nuevos = self.client.post('/api/token/', {'username': 'lector', 'password': 'clave1234'}).json()
+        self.assertTrue(self.autenticar(nuevos['access']).is_admin)
+
+    def test_borrar_el_usuario_revoca_los_tokens(self):
+        self.autenticar(self.tokens['access'])
+
+        self.administrar(accion='eliminar')
+
+        self.assertFalse(Usuario.objects.filter(pk=self.lector.pk).exists())
+        with self.assertRaises(InvalidToken):
+            self.autenticar(self.tokens['access'])
+        self.assertEqual(self.refrescar().status_code, 401)
+
+    def test_otros_cambios_no_revocan(self):
+        Usuario.objects.filter(pk=self.lector.pk).update(email='nuevo@biblioteca.test')
+        lector = Usuario.objects.get(pk=self.lector.pk)
+        lector.first_name = 'Lectora'
+        lector.save()
+
+        self.assertEqual(self.autenticar(self.tokens['access']).id, self.lector.pk)
+
+    def test_historial_propio_sin_leer_el_usuario(self):
+        # request.user.pk sale del token y se compara con el id de la URL
+        usuario = self.autenticar(self.tokens['access'])
+
+        self.assertEqual(usuario.pk, self.lector.pk)
+        self.assertTrue(views.puede_ver_historial(usuario, self.lector))
+        self.assertFalse(views.puede_ver_historial(usuario, self.admin))
+
+
+@override_settings(
+    SESION_EN_CACHE={'ACTIVA': True, 'USUARIO_SEGUNDOS': 60},
+    SESSION_ENGINE='django.contrib.sessions.backends.cached_db',
+)
+class SesionEnCacheTests(TestCase):
+    # Con SESION_EN_CACHE la sesión y el usuario de la web salen de la caché
+    # (gestion/autenticacion.py) y cualquier guardado del usuario los invalida
+    @classmethod
+    def setUpTestData(cls):
+        cls.lector = Usuario.objects.create_user('lector', 'lector@biblioteca.test', 'clave1234')
+
+    def setUp(self):
+        cache.clear()
+        self.web = Client()
+        self.web.post(reverse('login'), {'username': 'lector', 'password': 'clave1234'})
+
+    def pagina(self):
+        # Devuelve la respuesta y las tablas de autenticación que ha leído
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.web.get(reverse('mis-reservas'))
+        tablas = {
+            tabla for tabla in ('django_session', 'gestion_usuario')
+            for consulta in consultas if f'FROM "{tabla}"' in consulta['sql']
+        }
+        return respuesta, tablas
+
+    def guardar(self, **campos):
+        with self.captureOnCommitCallbacks(execute=True):
+            lector = Usuario.objects.get(pk=self.lector.pk)
+            for campo, valor in campos.items():
+                setattr(lector, campo, valor)
+            lector.save()
+
+    def test_sin_consultas_de_autenticacion_con_la_cache_caliente(self):
+        self.pagina()
+
+        respuesta, tablas = self.pagina()
+
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(tablas, set())
+
+    def test_cambio_de_rol_se_ve_en_la_siguiente_pagina(self):
+        self.pagina()
+
+        self.guardar(rol='admin')
+
+        respuesta, tablas = self.pagina()
+        self.assertEqual(tablas, {'gestion_usuario'})
+        self.assertTrue(respuesta.wsgi_request.user.is_admin)
+        self.assertEqual(self.pagina()[1], set())
+
+    def test_cambio_de_contrasena_cierra_la_sesion(self):
+        self.pagina()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            lector = Usuario.objects.get(pk=self.lector.pk)
+            lector.set_password('otra1234')
+            lector.save()
+
+        respuesta, _ = self.pagina()
+        self.assertEqual(respuesta.status_code, 302)
+        self.assertIn(reverse('login'), respuesta['Location'])
+
+    def test_usuario_borrado_y_cierre_de_sesion(self):
+        self.pagina()
+        otro = Client()
+        otro.post(reverse('login'), {'username': 'lector', 'password': 'clave1234'})
+
+        self.web.post(reverse('logout'))
+
+        self.assertEqual(self.pagina()[0].status_code, 302)
+        with self.captureOnCommitCallbacks(execute=True):
+            Usuario.objects.filter(pk=self.lector.pk).delete()
+        self.assertEqual(otro.get(reverse('mis-reservas')).status_code, 302)
+
+
+class AutocompletadoTests(TestCase):
+    # Sugerencias del índice de prefijos en memoria (gestion/autocompletado.py), con su
+    # archivo en un directorio temporal y una revisión de cambios en cada petición
+    @classmethod
+    def setUpTestData(cls):
+        cls.libros = [
+            Libro.objects.create(titulo=titulo, autor=autor, año_publicacion=año, cantidad_stock=1, prestamos_totales=prestados)
+            for titulo, autor, año, prestados in (
+                ('Cien años de soledad', 'Gabriel García Márquez', 1967, 5),
+                ('Crónica de una muerte anunciada', 'Gabriel García Márquez', 1981, 9),
+                ('La ciudad y los perros', 'Mario Vargas Llosa', 1963, 2),
+                ('Ciencia ficción', 'Isaac Asimov', 1951, 0),
+            )
+        ]
+
+    def setUp(self):
+        directorio = tempfile.mkdtemp(prefix='biblioteca_autocompletado_')
+        ajustes = {'DIRECTORIO': directorio, 'REFRESCO_S': 0, 'MARGEN_S': 10, 'MAX_CAMBIOS': 100}
+        self.addCleanup(shutil.rmtree, directorio)
+        configuracion = override_settings(AUTOCOMPLETADO=ajustes)
+        configuracion.enable()
+        self.addCleanup(configuracion.disable)
+        # Cada prueba empieza como un worker recién arrancado
+        estado = mock.patch.object(autocompletado, '_estado', None)
+        estado.start()
+        self.addCleanup(estado.stop)
+
+    def sugerir(self, q, **parametros):
+        respuesta = self.client.get('/api/libros/autocompletar/', {'q': q, **parametros})
+        self.assertEqual(respuesta.status_code, 200)
+        return respuesta.json()
+
+    def titulos(self, q):
+        return [sugerencia['titulo'] for sugerencia in self.sugerir(q)['titulos']]
+
+    def test_prefijos_de_cualquier_palabra_por_popularidad(self):
+        datos = self.sugerir('gar')
+
+        self.assertEqual(self.titulos('ci'), ['Cien años de soledad', 'La ciudad y los perros', 'Ciencia ficción'])
+        self.assertEqual(self.titulos('CIEN'), ['Cien años de soledad', 'Ciencia ficción'])
+        # Un espacio cierra la palabra; las palabras vacías no se indexan
+        self.assertEqual(self.titulos('cien '), ['Cien años de soledad'])
+        self.assertEqual(self.titulos('de'), [])
+        self.assertEqual(datos['titulos'], [])
+        self.assertEqual(datos['autores'], [{'autor': 'Gabriel García Márquez', 'libros': 2}])
+        self.assertEqual(len(self.sugerir('c', limite=1)['titulos']), 1)
+
+    def test_parametros(self):
+        self.assertEqual(self.sugerir(''), {'q': '', 'titulos': [], 'autores': []})
+        self.assertEqual(len(self.sugerir('c', limite=500)['titulos']), 4)
+        respuesta = self.client.get('/api/libros/autocompletar/', {'q': 'c', 'limite': 'x'})
+        self.assertEqual(respuesta.status_code, 400)
+
+    def test_cambios_sin_reconstruir(self):
+        self.titulos('ci')
+
+        with mock.patch.object(autocompletado, 'reconstruir', side_effect=AssertionError('reconstruido')):
+            libro = Libro.objects.get(pk=self.libros[3].pk)
+            libro.titulo = 'Yo, robot'
+            libro.save()
+            self.libros[2].delete()
+            Libro.objects.create(titulo='Ciudades invisibles', autor='Italo Calvino', año_publicacion=1972, cantidad_stock=1)
+
+            self.assertEqual(self.titulos('ci'), ['Cien años de soledad', 'Ciudades invisibles'])
+            self.assertEqual(self.titulos('robot'), ['Yo, robot'])
+            self.assertEqual(self.sugerir('vargas')['autores'], [])
+
+    def test_otro_proceso_carga_el_archivo(self):
+        self.titulos('ci')
+        self.assertTrue(os.path.exists(autocompletado.ruta_archivo()))
+
+        with mock.patch.object(autocompletado, '_estado', None), \
+                mock.patch.object(autocompletado, 'construir', side_effect=AssertionError('construido')):
+            self.assertEqual(self.titulos('cr'), ['Crónica de una muerte anunciada'])
+
+
+class FacetasTests(TestCase):
+    # Filtros y facetas del listado de libros de la API (gestion/facetas.py)
+    @classmethod
+    def setUpTestData(cls):
+        for titulo, autor, año, stock in (
+            ('Ficciones', 'Jorge Luis Borges', 1944, 2),
+            ('El Aleph', 'Jorge Luis Borges', 1949, 0),
+            ('El hacedor', 'Jorge Luis Borges', 1960, 1),
+            ('Rayuela', 'Julio Cortázar', 1963, 0),
+            ('Bestiario', 'Julio Cortázar', 1951, 3),
+            ('Pedro Páramo', 'Juan Rulfo', 1955, 1),
+        ):
+            Libro.objects.create(titulo=titulo, autor=autor, año_publicacion=año, cantidad_stock=stock)
+
+    def setUp(self):
+        cache.clear()
+
+    def listado(self, **parametros):
+        respuesta = self.client.get('/api/libros/', {'facetas': 'true', **parametros})
+        self.assertEqual(respuesta.status_code, 200)
+        datos = respuesta.json()
+        return sorted(libro['titulo'] for libro in datos['libros']), datos['facetas']
+
+    def test_sin_filtros(self):
+        titulos, facetas = self.listado()
+
+        self.assertEqual(len(titulos), 6)
+        self.assertEqual(facetas['autor'], [
+            {'autor': 'Jorge Luis Borges', 'libros': 3},
+            {'autor': 'Julio Cortázar', 'libros': 2},
+            {'autor': 'Juan Rulfo', 'libros': 1},
+        ])
+        self.assertEqual(facetas['decada'], [{'decada': 1940, 'libros': 2}, {'decada': 1950, 'libros': 2}, {'decada': 1960, 'libros': 2}])
+        self.assertEqual(facetas['disponible'], {'disponibles': 4, 'no_disponibles': 2})
+
+    def test_cada_faceta_ignora_su_propio_filtro(self):
+        titulos, facetas = self.listado(autor='Julio Cortázar', disponible='true')
+
+        self.assertEqual(titulos, ['Bestiario'])
+        # Los demás autores siguen apareciendo con sus libros disponibles
+        self.assertEqual(facetas['autor'], [
+            {'autor': 'Jorge Luis Borges', 'libros': 2},
+            {'autor': 'Juan Rulfo', 'libros': 1},
+            {'autor': 'Julio Cortázar', 'libros': 1},
+        ])
+        self.assertEqual(facetas['decada'], [{'decada': 1950, 'libros': 1}])
+        self.assertEqual(facetas['disponible'], {'disponibles': 1, 'no_disponibles': 1})
+
+    def test_años_autores_repetidos_y_busqueda(self):
+        titulos, facetas = self.listado(**{'año_desde': '1950', 'año_hasta': '1960', 'autor': ['Juan Rulfo', 'Jorge Luis Borges']})
+        self.assertEqual(titulos, ['El hacedor', 'Pedro Páramo'])
+
+        titulos, facetas = self.listado(buscar='el')
+        self.assertEqual(titulos, ['El Aleph', 'El hacedor'])
+        self.assertEqual(facetas['autor'], [{'autor': 'Jorge Luis Borges', 'libros': 2}])
+
+    def test_recuentos_en_cache_hasta_que_cambia_el_catalogo(self):
+        self.listado()
+        with self.assertNumQueries(3):
+            # Versión del catálogo, página y total; las facetas salen de la caché
+            self.client.get('/api/libros/', {'facetas': 'true'})
+
+        libro = Libro.objects.get(titulo='Rayuela')
+        libro.cantidad_stock = 4
+        libro.save()
+
+        self.assertEqual(self.listado()[1]['disponible'], {'disponibles': 5, 'no_disponibles': 1})
+
+    def test_filtros_no_validos(self):
+        for parametros, campo in (
+            ({'año_desde': 'mil'}, 'año_desde'),
+            ({'año_desde': '1970', 'año_hasta': '1960'}, 'año_hasta'),
+            ({'disponible': 'quizá'}, 'disponible'),
+        ):
+            with self.subTest(parametros=parametros):
+                respuesta = self.client.get('/api/libros/', parametros)
+                self.assertEqual(respuesta.status_code, 400)
+                self.assertEqual(list(respuesta.json()['errores']), [campo])
+
+
+class AnaliticaTests(TestCase):
+    # Resúmenes de préstamos que mantiene el servicio (gestion/analitica.py) y
+    # GET /api/analitica/, que los lee sin recorrer el historial
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = Usuario.objects.create_user('admin', 'admin@biblioteca.test', 'x', rol='admin', is_staff=True)
+        cls.lectores = [Usuario.objects.create_user(f'lector{i}', f'lector{i}@biblioteca.test', 'x') for i in range(3)]
+        cls.libros = [
+            Libro.objects.create(titulo=f'Odas {i}', autor='Pablo Neruda', año_publicacion=1954, cantidad_stock=5)
+            for i in range(3)
+        ]
+
+    def setUp(self):
+        self.cliente = APIClient()
+        self.cliente.force_authenticate(self.admin)
+        # lector0 y lector1 piden el libro 0, lector2 el 1; lector0 devuelve el suyo
+        for lector, libro in ((0, 0), (1, 0), (2, 1)):
+            prestamos.prestar_libro(self.lectores[lector], self.libros[libro].pk)
+        prestamos.devolver_libro(self.lectores[0], self.libros[0].pk)
+
+    def assertSinDesviaciones(self):
+        self.assertEqual(analitica.verificar(), {'dias': 0, 'libros_mes': 0})
+
+    def test_resumen_de_la_api(self):
+        respuesta = self.cliente.get('/api/analitica/', {'dias': 7, 'limite': 5})
+
+        self.assertEqual(respuesta.status_code, 200)
+        datos = respuesta.json()
+        self.assertEqual(len(datos['por_dia']), 7)
+        self.assertEqual(datos['por_dia'][-1]['dia'], timezone.localdate().isoformat())
+        self.assertEqual(
+            {clave: datos['totales'][clave] for clave in ('prestamos', 'devoluciones', 'activos', 'historicos')},
+            {'prestamos': 3, 'devoluciones': 1, 'activos': 2, 'historicos': 3},
+        )
+        self.assertEqual(datos['mes'], f'{timezone.localdate():%Y-%m}')
+        self.assertEqual(
+            [(libro['id'], libro['prestamos']) for libro in datos['libros_mas_prestados']],
+            [(self.libros[0].pk, 2), (self.libros[1].pk, 1)],
+        )
+        self.assertEqual(datos['vencidos']['total'], 0)
+        self.assertSinDesviaciones()
+
+    def test_vencidos_y_reconstruccion(self):
+        # Un préstamo abierto de hace un mes: los resúmenes no lo sabían hasta reconstruir
+        hace_un_mes = timezone.now() - datetime.timedelta(days=30)
+        Prestamo.objects.filter(usuario=self.lectores[2]).update(fecha_prestamo=hace_un_mes)
+        self.assertEqual(analitica.verificar()['dias'], 2)
+
+        analitica.reconstruir()
+
+        self.assertSinDesviaciones()
+        datos = self.cliente.get('/api/analitica/', {'dias': 60}).json()
+        self.assertEqual(datos['totales']['prestamos'], 3)
+        self.assertEqual(datos['vencidos']['total'], 1)
+        self.assertEqual(datos['vencidos']['mas_antiguos'][0]['usuario'], 'lector2')
+
+    def test_borrar_descuenta_sus_prestamos(self):
+        self.lectores[1].delete()
+        self.libros[1].delete()
+
+        self.assertSinDesviaciones()
+        datos = self.cliente.get('/api/analitica/').json()
+        self.assertEqual((datos['totales']['prestamos'], datos['totales']['devoluciones']), (1, 1))
+        self.assertEqual([(libro['id'], libro['prestamos']) for libro in datos['libros_mas_prestados']], [(self.libros[0].pk, 1)])
+
+    def test_permisos_y_parametros(self):
+        lector = APIClient()
+        lector.force_authenticate(self.lectores[0])
+        self.assertEqual(lector.get('/api/analitica/').status_code, 403)
+
+        for parametros in ({'dias': '0'}, {'dias': '1000'}, {'limite': 'x'}, {'mes': '2024-13'}):
+            with self.subTest(parametros=parametros):
+                respuesta = self.cliente.get('/api/analitica/', parametros)
+                self.assertEqual(respuesta.status_code, 400)
+                self.assertEqual(list(respuesta.json()['errores']), list(parametros))
+
+
+class ArchivadoTests(TestCase):
+    # manage.py archivar_prestamos (gestion/archivado.py) mueve los devueltos antiguos a
+    # PrestamoArchivado sin cambiar contadores ni resúmenes, y las páginas de historial
+    # los vuelven a unir con ?completo=1
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = Usuario.objects.create_user('admin', 'admin@biblioteca.test', 'x', rol='admin', is_staff=True)
+        cls.lector = Usuario.objects.create_user('lector', 'lector@biblioteca.test', 'x')
+        cls.libros = [
+            Libro.objects.create(titulo=f'Residencia {i}', autor='Pablo Neruda', año_publicacion=1935, cantidad_stock=1)
+            for i in range(6)
+        ]
+        for libro in cls.libros:
+            prestamos.prestar_libro(cls.lector, libro.pk)
+        # Los cinco primeros se devolvieron hace más de un año, uno por mes; el último sigue activo
+        for i, libro in enumerate(cls.libros[:5]):
+            prestamos.devolver_libro(cls.lector, libro.pk)
+            devolucion = timezone.now() - datetime.timedelta(days=400 + 30 * i)
+            Prestamo.objects.filter(libro=libro).update(
+                fecha_prestamo=devolucion - datetime.timedelta(days=10), fecha_devolucion=devolucion,
+            )
+        analitica.reconstruir()
+        cls.ids = list(Prestamo.objects.order_by('-fecha_prestamo').values_list('pk', flat=True))
+
+    def assertSinDesviaciones(self):
+        self.assertEqual(contadores.verificar(), {'libro': 0, 'usuario': 0, 'global': False})
+        self.assertEqual(analitica.verificar(), {'dias': 0, 'libros_mes': 0})
+
+    def test_archivar_por_lotes(self):
+        self.assertEqual(archivado.pendientes(), 5)
+
+        resultado = archivado.archivar(tamano_lote=2)
+
+        self.assertEqual((resultado['lotes'], resultado['movidos']), (3, 5))
+        self.assertEqual(list(Prestamo.objects.values_list('libro_id', 'devuelto')), [(self.libros[5].pk, False)])
+        self.assertEqual(sorted(PrestamoArchivado.objects.values_list('pk', flat=True)), sorted(self.ids[1:]))
+        self.assertEqual(archivado.pendientes(), 0)
+        self.assertEqual(archivado.archivar()['movidos'], 0)
+        self.assertSinDesviaciones()
+
+    def test_retomar_y_comando(self):
+        salida = io.StringIO()
+        call_command('archivar_prestamos', lote=2, max_lotes=1, stdout=salida)
+        ultimo_id = int(salida.getvalue().split('--desde-id ')[1])
+        self.assertEqual(PrestamoArchivado.objects.count(), 2)
+
+        call_command('archivar_prestamos', lote=2, desde_id=ultimo_id, stdout=io.StringIO())
+
+        self.assertEqual(PrestamoArchivado.objects.count(), 5)
+        self.assertSinDesviaciones()
+
+    @override_settings(ARCHIVADO={**settings.ARCHIVADO, 'PAGINA_HISTORIAL': 2})
+    def test_historial_completo_en_la_web(self):
+        archivado.archivar(dias=450)
+        self.assertEqual(PrestamoArchivado.objects.count(), 3)
+        web = Client()
+
+        for usuario, nombre in ((self.lector, 'mi-historial-prestamos'), (self.admin, 'historial-prestamos')):
+            with self.subTest(pagina=nombre):
+                web.force_login(usuario)
+                url = reverse(nombre)
+                self.assertEqual([p.pk for p in web.get(url).context['prestamos']], self.ids[:3])
+
+                vistos, parametros = [], {'completo': '1'}
+                while True:
+                    contexto = web.get(url, parametros).context
+                    vistos += [p.pk for p in contexto['prestamos']]
+                    if not contexto['siguiente']:
+                        break
+                    parametros['antes'] = contexto['siguiente']
+                self.assertEqual(vistos, self.ids)
+                self.assertEqual(web.get(url, {'completo': '1', 'antes': 'x'}).status_code, 400)
+
+
+class PerfilesBaseDatosTests(TestCase):
+    # DB_PERFIL se lee al importar los settings: cada caso los carga en otro proceso
+    SCRIPT = (
+        'import json, django\n'
+        'from django.conf import settings\n'
+        'django.setup()\n'
+        'from django.db import connection\n'
+        'datos = {"opciones": settings.DATABASES["default"].get("OPTIONS", {}),'
+        ' "conn_max_age": settings.DATABASES["default"]["CONN_MAX_AGE"]}\n'
+        'if connection.vendor == "sqlite":\n'
+        '    with connection.cursor() as cursor:\n'
+        '        for pragma in ("journal_mode", "synchronous", "cache_size", "busy_timeout"):\n'
+        '            datos[pragma] = cursor.execute(f"PRAGMA {pragma}").fetchone()[0]\n'
+        'print(json.dumps(datos))\n'
+    )
+
+    def cargar(self, **entorno):
+        directorio = tempfile.mkdtemp(prefix='biblioteca_perfil_')
+        self.addCleanup(shutil.rmtree, directorio)
+        variables = {clave: valor for clave, valor in os.environ.items() if clave not in ('DATABASE_URL', 'DB_PERFIL')}
+        variables.update(DJANGO_SETTINGS_MODULE='biblioteca.settings', SQLITE_RUTA=os.path.join(directorio, 'db.sqlite3'), **entorno)
+        proceso = subprocess.run(
+            [sys.executable, '-c', self.SCRIPT], env=variables, cwd=settings.BASE_DIR, capture_output=True, text=True,
+        )
+        return proceso.returncode, proceso.stdout, proceso.stderr
+
+    def datos(self, **entorno):
+        codigo, salida, errores = self.cargar(**entorno)
+        self.assertEqual(codigo, 0, errores)
+        return json.loads(salida)
+
+    def test_sqlite_basico(self):
+        datos = self.datos()
+
+        self.assertEqual(datos['opciones'], {})
+        self.assertEqual(datos['journal_mode'], 'delete')
+
+    def test_sqlite_concurrente(self):
+        datos = self.datos(DB_PERFIL='concurrente', SQLITE_SYNCHRONOUS='full', SQLITE_CACHE_MB='8', SQLITE_ESPERA_S='3')
+
+        self.assertEqual(datos['opciones']['transaction_mode'], 'IMMEDIATE')
+        # synchronous=FULL es 2; el timeout de sqlite3 es la espera ante bloqueos
+        self.assertEqual(
+            (datos['journal_mode'], datos['synchronous'], datos['cache_size'], datos['busy_timeout']),
+            ('wal', 2, -8 * 1024, 3000),
+        )
+
+    def test_postgresql_concurrente_con_pool(self):
+        # Solo se leen los settings (no se abre ninguna conexión): no hace falta un servidor
+        datos = self.datos(DB_PERFIL='concurrente', DATABASE_URL='postgres://u:p@db.test:5432/biblioteca', DB_POOL_MAX='4')
+        basico = self.datos(DATABASE_URL='postgres://u:p@db.test:5432/biblioteca')
+
+        self.assertEqual(datos['opciones']['pool'], {'min_size': 2, 'max_size': 4, 'timeout': 10.0})
+        self.assertEqual(datos['conn_max_age'], 0)
+        self.assertNotIn('pool', basico['opciones'])
+        self.assertEqual(basico['conn_max_age'], 600)
+
+    def test_valores_no_validos(self):
+        for entorno in ({'DB_PERFIL': 'rapido'}, {'SQLITE_SYNCHRONOUS': 'a veces'}):
+            with self.subTest(entorno=entorno):
+                codigo, _, errores = self.cargar(**entorno)
+                self.assertNotEqual(codigo, 0)
+                self.assertIn('ImproperlyConfigured', errores)
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from . import views
@@ -14,10 +15,20 @@ router = DefaultRouter()
 #   - /api/usuarios/{id}/prestar_libro/
 #   - /api/usuarios/{id}/devolver_libro/
 #   - /api/usuarios/{id}/mis_libros/
+#   - /api/usuarios/{id}/prestamos/
+# - /api/analitica/ (solo lectura, administradores)
 router.register(r'libros', views.LibroViewSet)
 router.register(r'usuarios', views.UsuarioViewSet)
+router.register(r'analitica', views.AnaliticaViewSet, basename='analitica')
+
+# Con API_ASINCRONA las lecturas más frecuentes se atienden con las vistas async
+# de gestion/vistas_async.py; el resto de cada ruta sigue llegando al viewset
+rutas_api = router.urls
+if settings.API_ASINCRONA:
+    from .vistas_async import envolver
+    rutas_api = envolver(rutas_api)
 
 # Definición de rutas de la API
 urlpatterns = [
-    path('', include(router.urls)),  # Inclusión de rutas generadas
-]
\ No newline at end of file
+    path('', include(rutas_api)),  # Inclusión de rutas generadas
+]
@@ -0,0 +1,72 @@
+import random
+
+from django.db.models import F, Max, Sum
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+from .models import VersionCatalogo
+
+# Versiones de libros y del catálogo para las peticiones condicionales de la API
+# - Cada libro tiene version (entero que solo crece) y actualizado (fecha del último cambio)
+# - El catálogo tiene una versión global repartida en fragmentos (VersionCatalogo)
+# Los guardados con save()/delete() las actualizan desde gestion/signals.py; los UPDATE
+# masivos (préstamos, importación) incluyen al_modificar_libro() en el propio UPDATE
+# y llaman a incrementar_catalogo() dentro de su transacción
+
+FRAGMENTOS = 8
+
+
+def al_modificar_libro():
+    # Expresiones para incluir en cualquier UPDATE que cambie datos visibles de un libro
+    return {'version': F('version') + 1, 'actualizado': timezone.now()}
+
+
+def incrementar_catalogo():
+    fragmento = random.randrange(FRAGMENTOS)
+    actualizados = VersionCatalogo.objects.filter(fragmento=fragmento).update(
+        version=F('version') + 1,
+        actualizado=timezone.now(),
+    )
+    if not actualizados:
+        VersionCatalogo.objects.get_or_create(fragmento=fragmento)
+        incrementar_catalogo()
+
+
+def version_catalogo():
+    # Devuelve (versión, fecha del último cambio); como mucho FRAGMENTOS filas
+    datos = VersionCatalogo.objects.aggregate(version=Sum('version'), actualizado=Max('actualizado'))
+    return datos['version'] or 0, datos['actualizado']
+
+
+def _ultima_modificacion(actualizado):
+    return int(actualizado.timestamp()) if actualizado else None
+
+
+def respuesta_condicional(request, etag, actualizado, construir):
+    # Si el cliente ya tiene esta versión (If-None-Match / If-Modified-Since) devuelvo
+    # 304 sin llamar a construir(), que es lo que serializa la respuesta
+    ultima_modificacion = _ultima_modificacion(actualizado)
+    respuesta = get_conditional_response(request, etag=etag, last_modified=ultima_modificacion)
+    if respuesta is None:
+        respuesta = construir()
+    return _validadores(respuesta, etag, ultima_modificacion)
+
+
+async def arespuesta_condicional(request, etag, actualizado, construir):
+    # Variante asíncrona: construir es una corrutina que solo se espera si no hay 304
+    ultima_modificacion = _ultima_modificacion(actualizado)
+    respuesta = get_conditional_response(request, etag=etag, last_modified=ultima_modificacion)
+    if respuesta is None:
+        respuesta = await construir()
+    return _validadores(respuesta, etag, ultima_modificacion)
+
+
+def _validadores(respuesta, etag, ultima_modificacion):
+    if 200 <= respuesta.status_code < 300 or respuesta.status_code == 304:
+        respuesta['ETag'] = etag
+        if ultima_modificacion is not None:
+            respuesta['Last-Modified'] = http_date(ultima_modificacion)
+        # no-cache: el cliente puede guardar la respuesta pero debe revalidarla siempre
+        patch_cache_control(respuesta, no_cache=True)
+    return respuesta
@@ -1,17 +1,84 @@
 from rest_framework import viewsets, permissions, status
 from rest_framework.response import Response
 from rest_framework.decorators import action
-from .models import Libro, Usuario
-from .serializers import LibroSerializer, UsuarioSerializer
+from rest_framework.utils.urls import replace_query_param
+from .busqueda import buscar_libros
+from .models import Libro, Prestamo, PrestamoArchivado, Reserva, Usuario
+from .paginacion import PaginacionCursor, PaginacionHistorial
+from . import analitica, archivado, autocompletado, facetas, prestamos, reservas, serializacion, versiones
+from .prestamos import ResultadoPrestamo
+from .reservas import ResultadoReserva
+from .serializers import (
+    LibroSerializer, LoteLibrosSerializer, LotePrestamosSerializer, PrestamoSerializer, ReservaSerializer,
+    UsuarioSerializer,
+)
+from django.conf import settings
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
 
+# Mensajes por elemento para las respuestas de los endpoints por lotes
+MENSAJES_LOTE = {
+    ResultadoPrestamo.OK: 'Operación realizada',
+    ResultadoPrestamo.SIN_STOCK: 'No hay ejemplares disponibles',
+    ResultadoPrestamo.YA_PRESTADO: 'El usuario ya tiene prestado este libro',
+    ResultadoPrestamo.NO_PRESTADO: 'El usuario no tiene prestado este libro',
+    ResultadoPrestamo.NO_EXISTE: 'El libro no existe',
+    ResultadoPrestamo.USUARIO_NO_EXISTE: 'El usuario no existe',
+    ResultadoPrestamo.ROL_NO_PERMITIDO: 'Solo usuarios regulares pueden prestar libros',
+    ResultadoPrestamo.CANCELADO: 'No aplicado: el lote se canceló',
+}
+
+# Respuestas de reservar y cancelar_reserva que no son un éxito
+ERRORES_RESERVA = {
+    ResultadoReserva.NO_EXISTE: ('El libro no existe', status.HTTP_404_NOT_FOUND),
+    ResultadoReserva.HAY_STOCK: ('Hay ejemplares disponibles: pide el préstamo directamente', status.HTTP_400_BAD_REQUEST),
+    ResultadoReserva.YA_PRESTADO: ('El usuario ya tiene prestado este libro', status.HTTP_400_BAD_REQUEST),
+    ResultadoReserva.YA_RESERVADO: ('El usuario ya tiene una reserva abierta de este libro', status.HTTP_400_BAD_REQUEST),
+    ResultadoReserva.NO_RESERVADO: ('El usuario no tiene una reserva abierta de este libro', status.HTTP_400_BAD_REQUEST),
+}
+
+# Listado de GET /api/libros/ para LibroViewSet.list y su versión asíncrona
+# (gestion/vistas_async.py), que solo lo ejecuta en un hilo; request es un Request de DRF
+# - Paginado por cursor: el coste de cada página no depende del tamaño del catálogo ni
+#   de lo profunda que sea la página
+# - ?buscar= usa el índice de búsqueda, con la misma relevancia que el buscador de la web
+# - Filtros ?autor=, ?año_desde=, ?año_hasta= y ?disponible=, y con ?facetas=true los
+#   recuentos por autor, década y disponibilidad (gestion/facetas.py)
+# - Cualquier cambio en un libro cambia la versión del catálogo, así que un cliente con
+#   la versión vigente recibe 304 sin tocar la tabla de libros
+# Devuelve (etag, actualizado, datos): datos() lee y serializa la página, y solo se llama
+# si no hay 304. Con filtros no válidos devuelve (None, None, cuerpo del error 400)
+def listado_libros(request, formato):
+    filtros, errores = facetas.leer_filtros(request.query_params)
+    if errores:
+        return None, None, {'mensaje': 'Filtros no válidos', 'errores': errores}
+    version, actualizado = versiones.version_catalogo()
+    etag = f'"catalogo-{version}-{formato}"'
+
+    # La página se lee con .values() y se serializa con la ruta rápida (gestion/serializacion.py)
+    def datos():
+        base = Libro.objects.all()
+        consulta = request.query_params.get('buscar', '')
+        if consulta:
+            base = buscar_libros(consulta, base)
+        paginador = PaginacionCursor()
+        page = paginador.paginate_queryset(
+            facetas.filtrar(base, filtros).values('pk', *serializacion.CAMPOS_LIBRO), request,
+        )
+        resultado = paginador.datos_respuesta(serializacion.filas_libros(page), 'libros', 'libros')
+        if request.query_params.get('facetas', '').lower() in facetas.VERDADERO:
+            resultado['facetas'] = facetas.contar_en_cache(version, base, filtros, consulta)
+        return resultado
+
+    return etag, actualizado, datos
+
 # ViewSet para la gestión de libros a través de la API
 # Proporciona operaciones CRUD completas para el modelo Libro
 class LibroViewSet(viewsets.ModelViewSet):
     queryset = Libro.objects.all()  # Consulta base de libros
     serializer_class = LibroSerializer  # Serializer para transformación de datos
+    pagination_class = PaginacionCursor  # Paginación por cursor en el listado
     
     def get_permissions(self):
         # Configuración de permisos basada en la acción
@@ -73,30 +140,49 @@ class LibroViewSet(viewsets.ModelViewSet):
         }, status=status.HTTP_200_OK)
     
     def list(self, request, *args, **kwargs):
-        queryset = self.filter_queryset(self.get_queryset())
-        serializer = self.get_serializer(queryset, many=True)
-        return Response({
-            'mensaje': f'Se encontraron {len(queryset)} libros',
-            'libros': serializer.data
-        })
+        # Lo arma listado_libros(), el mismo que usa la versión asíncrona
+        etag, actualizado, datos = listado_libros(request, request.accepted_renderer.format)
+        if etag is None:
+            return Response(datos, status=status.HTTP_400_BAD_REQUEST)
+        return versiones.respuesta_condicional(request, etag, actualizado, lambda: Response(datos()))
     
     def retrieve(self, request, *args, **kwargs):
         instance = self.get_object()
-        serializer = self.get_serializer(instance)
-        return Response({
-            'mensaje': f'Detalles del libro "{instance.titulo}"',
-            'libro': serializer.data
-        })
+        etag = f'"libro-{instance.pk}-{instance.version}-{request.accepted_renderer.format}"'
+        
+        def construir():
+            serializer = self.get_serializer(instance)
+            return Response({
+                'mensaje': f'Detalles del libro "{instance.titulo}"',
+                'libro': serializer.data
+            })
+        
+        return versiones.respuesta_condicional(request, etag, instance.actualizado, construir)
+    
+    # GET /api/libros/autocompletar/?q=cien&limite=8
+    # Sugerencias de títulos y autores para la caja de búsqueda, servidas desde el índice
+    # de prefijos en memoria (gestion/autocompletado.py); solo consulta la base de datos
+    # en la revisión periódica de cambios de cada worker
+    @action(detail=False, methods=['get'])
+    def autocompletar(self, request):
+        texto = request.query_params.get('q', '')[:100]
+        try:
+            limite = min(max(int(request.query_params.get('limite', 8)), 1), 20)
+        except ValueError:
+            return Response({'mensaje': 'limite debe ser un número entero'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'q': texto, **autocompletado.sugerencias(texto, limite)})
 
 # ViewSet para gestionar usuarios y operaciones relacionadas
 # Incluye endpoints adicionales para préstamos y devoluciones
 class UsuarioViewSet(viewsets.ModelViewSet):
     queryset = User.objects.all()  # Consulta base de usuarios
     serializer_class = UsuarioSerializer  # Serializer para transformación
+    pagination_class = PaginacionCursor  # Paginación por cursor en el listado
     
     def get_permissions(self):
         # Solo los admins pueden gestionar usuarios, excepto ver detalles propios
-        if self.action in ['create', 'update', 'partial_update', 'destroy', 'list']:
+        # Los lotes con varios usuarios también quedan reservados a administradores
+        if self.action in ['create', 'update', 'partial_update', 'destroy', 'list', 'prestar_lote', 'devolver_lote']:
             permission_classes = [permissions.IsAuthenticated, permissions.IsAdminUser]
         else:
             permission_classes = [permissions.IsAuthenticated]
@@ -152,12 +238,11 @@ class UsuarioViewSet(viewsets.ModelViewSet):
         }, status=status.HTTP_200_OK)
     
     def list(self, request, *args, **kwargs):
+        # Misma ruta rápida que el listado de libros; los libros prestados de toda la
+        # página llegan en una sola consulta en lugar de una por usuario
         queryset = self.filter_queryset(self.get_queryset())
-        serializer = self.get_serializer(queryset, many=True)
-        return Response({
-            'mensaje': f'Se encontraron {len(queryset)} usuarios',
-            'usuarios': serializer.data
-        })
+        page = self.paginate_queryset(queryset.values('pk', *serializacion.CAMPOS_USUARIO))
+        return self.paginator.respuesta(serializacion.filas_usuarios(page), 'usuarios', 'usuarios')
     
     def retrieve(self, request, *args, **kwargs):
         instance = self.get_object()
@@ -173,8 +258,6 @@ class UsuarioViewSet(viewsets.ModelViewSet):
     def prestar_libro(self, request, pk=None):
         usuario = self.get_object()  # Obtiene el usuario
         
-        libro_id = request.data.get('libro_id')  # Obtiene ID del libro
-        
         # Validación de rol de usuario
         # Implementé esta restricción para mantener coherencia con los permisos web
         if usuario.rol != 'regular':
@@ -185,48 +268,38 @@ class UsuarioViewSet(viewsets.ModelViewSet):
       
         # Validación de parámetros
         # Importante asegurar que recibimos los datos necesarios para procesar
-        if not libro_id:
-            return Response(
-                {'mensaje': 'Se requiere libro_id'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
+        # El id llega como número en JSON y como texto en un formulario
+        libro_id, error = leer_libro_id(request.data)
+        if error:
+            return error
         
-        # Validación de existencia del libro
-        # Manejo específico para obtener un error más descriptivo
-        try:
-            libro = Libro.objects.get(id=libro_id)
-        except Libro.DoesNotExist:
+        # Procesamiento del préstamo con el servicio compartido (gestion/prestamos.py)
+        # Stock, duplicados e historial se resuelven en una única transacción, así que
+        # dos peticiones simultáneas nunca pueden dejar el stock en negativo
+        resultado = prestamos.prestar_libro(usuario, libro_id)
+        
+        if resultado.estado == ResultadoPrestamo.NO_EXISTE:
             return Response(
                 {'mensaje': f'El libro con ID {libro_id} no existe'},
                 status=status.HTTP_404_NOT_FOUND
             )
         
-        # Validación de disponibilidad
-        # Verifico stock antes de procesar para evitar préstamos imposibles
-        if libro.cantidad_stock <= 0:
+        if resultado.estado == ResultadoPrestamo.SIN_STOCK:
             return Response(
-                {'mensaje': f'No hay ejemplares disponibles del libro "{libro.titulo}"'},
+                {'mensaje': f'No hay ejemplares disponibles del libro "{resultado.libro.titulo}"'},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Validación de préstamo duplicado
-        # Evito que un usuario intente prestar el mismo libro múltiples veces
-        if libro in usuario.libros_prestados.all():
+        if resultado.estado == ResultadoPrestamo.YA_PRESTADO:
             return Response(
-                {'mensaje': f'Ya tienes prestado el libro "{libro.titulo}"'},
+                {'mensaje': f'Ya tienes prestado el libro "{resultado.libro.titulo}"'},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Procesamiento del préstamo
-        # Actualizo la relación y disminuyo el stock - operación atómica
-        usuario.libros_prestados.add(libro)
-        libro.cantidad_stock -= 1
-        libro.save()
-        
         return Response(
             {
-                'mensaje': f'Libro "{libro.titulo}" prestado exitosamente a {usuario.username}',
-                'libro': LibroSerializer(libro).data
+                'mensaje': f'Libro "{resultado.libro.titulo}" prestado exitosamente a {usuario.username}',
+                'libro': LibroSerializer(resultado.libro).data
             },
             status=status.HTTP_200_OK
         )
@@ -236,60 +309,304 @@ class UsuarioViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['post'])
     def devolver_libro(self, request, pk=None):
         usuario = self.get_object()  # Obtiene el usuario
-        libro_id = request.data.get('libro_id')  # Obtiene ID del libro
         
         # Validación de parámetros
         # Mismo patrón de validación que en préstamo para mantener consistencia
-        if not libro_id:
-            return Response(
-                {'mensaje': 'Se requiere libro_id'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
+        libro_id, error = leer_libro_id(request.data)
+        if error:
+            return error
         
-        # Validación de existencia del libro
-        # Manejo consistente con el endpoint de préstamo
-        try:
-            libro = Libro.objects.get(id=libro_id)
-        except Libro.DoesNotExist:
+        # Procesamiento de la devolución con el servicio compartido
+        # La comprobación de posesión y la devolución son la misma sentencia
+        resultado = prestamos.devolver_libro(usuario, libro_id)
+        
+        if resultado.estado == ResultadoPrestamo.NO_EXISTE:
             return Response(
                 {'mensaje': f'El libro con ID {libro_id} no existe'},
                 status=status.HTTP_404_NOT_FOUND
             )
         
-        # Validación de posesión del libro
-        # Verifico que el usuario realmente tenga el libro prestado
-        if libro not in usuario.libros_prestados.all():
+        if resultado.estado == ResultadoPrestamo.NO_PRESTADO:
             return Response(
-                {'mensaje': f'No tienes prestado el libro "{libro.titulo}"'},
+                {'mensaje': f'No tienes prestado el libro "{resultado.libro.titulo}"'},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Procesamiento de la devolución
-        # Actualizo la relación y aumento el stock - operación atómica
-        usuario.libros_prestados.remove(libro)
-        libro.cantidad_stock += 1
-        libro.save()
-        
         return Response(
             {
-                'mensaje': f'Libro "{libro.titulo}" devuelto exitosamente por {usuario.username}',
-                'libro': LibroSerializer(libro).data
+                'mensaje': f'Libro "{resultado.libro.titulo}" devuelto exitosamente por {usuario.username}',
+                'libro': LibroSerializer(resultado.libro).data
             },
             status=status.HTTP_200_OK
         )
     
     
+    # Endpoints para prestar o devolver varios libros en una sola petición
+    # POST /api/usuarios/{id}/prestar_libros/   {"libro_ids": [1, 2, 3], "max_fallos": 0}
+    # POST /api/usuarios/{id}/devolver_libros/  {"libro_ids": [1, 2, 3]}
+    # Todo el lote se resuelve con un número fijo de consultas en una única transacción
+    @action(detail=True, methods=['post'])
+    def prestar_libros(self, request, pk=None):
+        usuario = self.get_object()
+        
+        # Misma restricción de rol que en el préstamo individual
+        if usuario.rol != 'regular':
+            return Response(
+                {'mensaje': 'Solo usuarios regulares pueden prestar libros'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        serializer = LoteLibrosSerializer(data=request.data)
+        if not serializer.is_valid():
+            return self._error_lote(serializer)
+        pares = [(usuario.pk, libro_id) for libro_id in serializer.validated_data['libro_ids']]
+        max_fallos = self._max_fallos(serializer)
+        resultado = prestamos.prestar_lote(pares, max_fallos)
+        return self._respuesta_lote(resultado, max_fallos, 'prestaron')
+    
+    @action(detail=True, methods=['post'])
+    def devolver_libros(self, request, pk=None):
+        usuario = self.get_object()
+        serializer = LoteLibrosSerializer(data=request.data)
+        if not serializer.is_valid():
+            return self._error_lote(serializer)
+        pares = [(usuario.pk, libro_id) for libro_id in serializer.validated_data['libro_ids']]
+        max_fallos = self._max_fallos(serializer)
+        resultado = prestamos.devolver_lote(pares, max_fallos)
+        return self._respuesta_lote(resultado, max_fallos, 'devolvieron')
+    
+    # Variante administrativa para varios usuarios a la vez (mostrador de préstamos)
+    # POST /api/usuarios/prestar_lote/
+    #   {"prestamos": [{"usuario_id": 2, "libro_id": 5}, ...], "max_fallos": 0}
+    # POST /api/usuarios/devolver_lote/ con el mismo formato
+    @action(detail=False, methods=['post'])
+    def prestar_lote(self, request):
+        serializer = LotePrestamosSerializer(data=request.data)
+        if not serializer.is_valid():
+            return self._error_lote(serializer)
+        pares = [(item['usuario_id'], item['libro_id']) for item in serializer.validated_data['prestamos']]
+        max_fallos = self._max_fallos(serializer)
+        resultado = prestamos.prestar_lote(pares, max_fallos)
+        return self._respuesta_lote(resultado, max_fallos, 'prestaron')
+    
+    @action(detail=False, methods=['post'])
+    def devolver_lote(self, request):
+        serializer = LotePrestamosSerializer(data=request.data)
+        if not serializer.is_valid():
+            return self._error_lote(serializer)
+        pares = [(item['usuario_id'], item['libro_id']) for item in serializer.validated_data['prestamos']]
+        max_fallos = self._max_fallos(serializer)
+        resultado = prestamos.devolver_lote(pares, max_fallos)
+        return self._respuesta_lote(resultado, max_fallos, 'devolvieron')
+    
+    def _max_fallos(self, serializer):
+        # El límite de la petición tiene prioridad sobre el configurado en settings
+        if 'max_fallos' in serializer.validated_data:
+            return serializer.validated_data['max_fallos']
+        return settings.LOTES_PRESTAMO['MAX_FALLOS']
+    
+    def _error_lote(self, serializer):
+        return Response({
+            'mensaje': 'Error en los datos del lote',
+            'errores': serializer.errors
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    def _respuesta_lote(self, resultado, max_fallos, verbo):
+        # Informo el resultado de cada elemento para que el cliente sepa qué reintentar
+        resultados = [
+            {**item, 'mensaje': MENSAJES_LOTE[item['estado']]}
+            for item in resultado.items
+        ]
+        if resultado.cancelado:
+            return Response({
+                'mensaje': f'Lote cancelado: fallaron {resultado.fallos} elementos y el máximo permitido es {max_fallos}',
+                'exitosos': 0,
+                'fallos': resultado.fallos,
+                'cancelado': True,
+                'resultados': resultados
+            }, status=status.HTTP_400_BAD_REQUEST)
+        return Response({
+            'mensaje': f'Se {verbo} {resultado.exitosos} de {len(resultados)} libros',
+            'exitosos': resultado.exitosos,
+            'fallos': resultado.fallos,
+            'cancelado': False,
+            'resultados': resultados
+        }, status=status.HTTP_200_OK)
+    
     # Endpoint para consultar libros prestados
     # GET /api/usuarios/{id}/mis_libros/
     @action(detail=True, methods=['get'])
     def mis_libros(self, request, pk=None):
         usuario = self.get_object()  # Obtiene el usuario
-        libros = usuario.libros_prestados.all()  # Obtiene sus libros
-        serializer = LibroSerializer(libros, many=True)  # Serializa la colección
+        # Obtiene sus libros como filas, ya con la forma de LibroSerializer
+        libros = list(usuario.libros_prestados.values(*serializacion.CAMPOS_LIBRO))
         
         # Devuelvo lista completa de libros prestados con todos sus detalles
         # Este endpoint es muy útil para apps móviles que necesitan mostrar esta info
         return Response({
-            'mensaje': f'Se encontraron {libros.count()} libros prestados a {usuario.username}',
-            'libros': serializer.data
-        })
\ No newline at end of file
+            'mensaje': f'Se encontraron {len(libros)} libros prestados a {usuario.username}',
+            'libros': libros
+        })
+    
+    # Endpoint para consultar el historial de préstamos de un usuario
+    # GET /api/usuarios/{id}/prestamos/  (?completo=1 incluye los préstamos archivados)
+    # Solo lo ve el propio usuario o un administrador; paginado por cursor, más recientes primero
+    @action(detail=True, methods=['get'])
+    def prestamos(self, request, pk=None):
+        usuario = self.get_object()
+        if not puede_ver_historial(request.user, usuario):
+            return Response(
+                {'mensaje': 'No tienes permiso para ver el historial de este usuario'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        datos, codigo = pagina_historial_api(request, usuario)
+        return Response(datos, status=codigo)
+    
+    # Endpoints de la lista de espera (gestion/reservas.py)
+    # POST /api/usuarios/{id}/reservar/          {"libro_id": 5}
+    # POST /api/usuarios/{id}/cancelar_reserva/  {"libro_id": 5}
+    # GET  /api/usuarios/{id}/reservas/
+    # En lugar de consultar el stock una y otra vez, el cliente reserva y el ejemplar
+    # devuelto le queda apartado; la reserva muestra su puesto en la cola y cuándo vence
+    @action(detail=True, methods=['post'])
+    def reservar(self, request, pk=None):
+        usuario = self.get_object()
+        if not puede_ver_historial(request.user, usuario):
+            return Response(
+                {'mensaje': 'No tienes permiso para reservar en nombre de este usuario'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        if usuario.rol != 'regular':
+            return Response(
+                {'mensaje': 'Solo usuarios regulares pueden reservar libros'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        libro_id, error = leer_libro_id(request.data)
+        if error:
+            return error
+        resultado = reservas.reservar(usuario, libro_id)
+        if not resultado.ok:
+            mensaje, codigo = ERRORES_RESERVA[resultado.estado]
+            return Response({'mensaje': mensaje}, status=codigo)
+        reserva = reservas.con_posicion(Reserva.objects.filter(pk=resultado.reserva.pk).select_related('libro')).get()
+        return Response({
+            'mensaje': f'Reserva creada: tienes {reserva.delante} reservas delante',
+            'reserva': ReservaSerializer(reserva).data
+        }, status=status.HTTP_201_CREATED)
+    
+    @action(detail=True, methods=['post'])
+    def cancelar_reserva(self, request, pk=None):
+        usuario = self.get_object()
+        if not puede_ver_historial(request.user, usuario):
+            return Response(
+                {'mensaje': 'No tienes permiso para cancelar reservas de este usuario'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        libro_id, error = leer_libro_id(request.data)
+        if error:
+            return error
+        resultado = reservas.cancelar(usuario, libro_id)
+        if not resultado.ok:
+            mensaje, codigo = ERRORES_RESERVA[resultado.estado]
+            return Response({'mensaje': mensaje}, status=codigo)
+        return Response({'mensaje': 'Reserva cancelada'}, status=status.HTTP_200_OK)
+    
+    @action(detail=True, methods=['get'])
+    def reservas(self, request, pk=None):
+        usuario = self.get_object()
+        if not puede_ver_historial(request.user, usuario):
+            return Response(
+                {'mensaje': 'No tienes permiso para ver las reservas de este usuario'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        # Solo las abiertas: las resueltas ya no cambian y se quedan en el historial de la web
+        abiertas = reservas.reservas_usuario(usuario.pk).filter(estado__in=reservas.ABIERTAS)
+        serializer = ReservaSerializer(abiertas, many=True)
+        return Response({
+            'mensaje': f'{len(serializer.data)} reservas abiertas de {usuario.username}',
+            'reservas': serializer.data
+        })
+
+
+def leer_libro_id(datos):
+    # libro_id del cuerpo (JSON o formulario) como entero: los servicios y la analítica
+    # indexan por el id numérico, así que '1' y 1 deben llegar igual
+    # Devuelve (libro_id, None) o (None, respuesta 400)
+    valor = datos.get('libro_id')
+    if valor in (None, ''):
+        return None, Response({'mensaje': 'Se requiere libro_id'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        libro_id = int(valor)
+    except (TypeError, ValueError):
+        libro_id = 0
+    if isinstance(valor, bool) or libro_id <= 0:
+        return None, Response(
+            {'mensaje': 'libro_id debe ser un id numérico'}, status=status.HTTP_400_BAD_REQUEST
+        )
+    return libro_id, None
+
+
+def puede_ver_historial(solicitante, usuario):
+    # Compartida con gestion/vistas_async.py
+    return solicitante.pk == usuario.pk or solicitante.is_staff or solicitante.is_admin
+
+
+def historial_usuario(usuario_id, tabla=Prestamo):
+    # Solo las columnas que devuelve PrestamoSerializer, con el título en el mismo JOIN
+    # tabla es Prestamo (activos y devueltos recientes) o PrestamoArchivado
+    return tabla.objects.filter(usuario_id=usuario_id).select_related('libro').only(
+        'fecha_prestamo', 'fecha_devolucion', 'devuelto', 'libro__titulo',
+    )
+
+
+def pagina_historial_api(request, usuario):
+    # Página de GET /api/usuarios/{id}/prestamos/ para la vista síncrona y la asíncrona
+    # (gestion/vistas_async.py); request es un Request de DRF. Devuelve (datos, código)
+    # - Por defecto solo lee Prestamo, con la paginación por cursor de siempre
+    # - Con ?completo=1 añade los préstamos archivados (gestion/archivado.py): cada página
+    #   lee como mucho tamaño + 1 filas de cada tabla tras el cursor ?antes= y las mezcla
+    # `completo` indica en la respuesta si el archivo está incluido
+    nombre = f'préstamos de {usuario.username}'
+    paginador = PaginacionHistorial()
+    if request.query_params.get('completo') != '1':
+        pagina = paginador.paginate_queryset(historial_usuario(usuario.pk), request)
+        datos = paginador.datos_respuesta(PrestamoSerializer(pagina, many=True).data, 'prestamos', nombre)
+        return {**datos, 'completo': False}, status.HTTP_200_OK
+    antes = request.query_params.get('antes')
+    try:
+        antes = archivado.leer_cursor(antes) if antes else None
+    except ValueError:
+        return {'mensaje': "El parámetro 'antes' no es un cursor válido"}, status.HTTP_400_BAD_REQUEST
+    pagina, siguiente = archivado.pagina_historial(
+        [historial_usuario(usuario.pk, tabla) for tabla in archivado.TABLAS], paginador.get_page_size(request), antes,
+    )
+    return {
+        'mensaje': f'Se muestran {len(pagina)} {nombre}',
+        'prestamos': PrestamoSerializer(pagina, many=True).data,
+        'total': None,
+        'siguiente': siguiente and replace_query_param(request.build_absolute_uri(), 'antes', siguiente),
+        'anterior': None,
+        'completo': True,
+    }, status.HTTP_200_OK
+
+
+# ViewSet de solo lectura con la analítica de préstamos para administradores
+# GET /api/analitica/?dias=30&mes=AAAA-MM&limite=10
+# Se sirve desde los resúmenes que mantiene el servicio de préstamos (gestion/analitica.py):
+# el coste no depende del tamaño del historial
+class AnaliticaViewSet(viewsets.ViewSet):
+    permission_classes = [permissions.IsAuthenticated, permissions.IsAdminUser]
+    
+    def list(self, request):
+        opciones, errores = analitica.leer_parametros(request.query_params)
+        if errores:
+            return Response({
+                'mensaje': 'Parámetros no válidos',
+                'errores': errores
+            }, status=status.HTTP_400_BAD_REQUEST)
+        datos = analitica.resumen(**opciones)
+        datos['mes'] = f"{datos['mes']:%Y-%m}"
+        return Response({
+            'mensaje': f"Analítica de préstamos del {datos['desde']:%d/%m/%Y} al {datos['hasta']:%d/%m/%Y}",
+            **datos
+        })
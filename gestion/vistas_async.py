@@ -0,0 +1,175 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.http import HttpResponse
+from django.urls import URLPattern
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from . import serializacion, versiones
+from .models import Libro
+from .renderizadores import a_json
+from .serializers import LibroSerializer
+from .views import listado_libros, pagina_historial_api, puede_ver_historial
+
+User = get_user_model()
+
+# Camino de lectura asíncrono de la API para servir el proyecto con un servidor ASGI
+# - Las lecturas más frecuentes (listado y detalle de libros, mis_libros e historial
+#   de préstamos) se atienden con vistas async y el ORM asíncrono de Django, así que
+#   un worker no queda bloqueado mientras espera a la base de datos o al cliente
+# - Escrituras, la API navegable y cualquier otra cosa se delegan a los viewsets de
+#   gestion/views.py, que siguen siendo la referencia: mismas rutas, permisos y respuestas
+# - La paginación por cursor de DRF es síncrona; el listado y el historial la ejecutan
+#   en un solo salto a un hilo (sync_to_async), que es lo mismo que hace internamente
+#   el ORM asíncrono con los motores actuales. El listado reutiliza listado_libros() de
+#   gestion/views.py: un salto para la versión del catálogo y otro para la página
+# Se activa con API_ASINCRONA=True (por defecto en biblioteca/asgi.py), ver gestion/urls.py
+
+_METODOS_LECTURA = ('GET', 'HEAD')
+
+
+def _json(datos, status=200):
+    # Mismos bytes que el renderizador JSON de la API (gestion/renderizadores.py)
+    return HttpResponse(a_json(datos), status=status, content_type='application/json')
+
+
+def _pide_json(request, kwargs):
+    # La API navegable (text/html) y los formatos distintos de JSON los sirve DRF
+    formato = kwargs.get('format') or request.GET.get(api_settings.URL_FORMAT_OVERRIDE)
+    if formato:
+        return formato == 'json'
+    return 'text/html' not in request.headers.get('Accept', '')
+
+
+def _autenticar_sincrono(request):
+    autenticadores = [clase() for clase in api_settings.DEFAULT_AUTHENTICATION_CLASSES]
+    return Request(request, authenticators=autenticadores).user
+
+
+async def _autenticar(request):
+    # Mismos autenticadores que DRF (sesión, básica y JWT); sin credenciales ni cookie
+    # de sesión el usuario es anónimo y no hace falta salir del bucle de eventos
+    if 'Authorization' not in request.headers and settings.SESSION_COOKIE_NAME not in request.COOKIES:
+        return AnonymousUser()
+    return await sync_to_async(_autenticar_sincrono)(request)
+
+
+def _error(excepcion):
+    # Igual que DRF: con la sesión como primer autenticador no hay cabecera
+    # WWW-Authenticate, así que los fallos de autenticación se responden con 403
+    status = excepcion.status_code
+    if isinstance(excepcion, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+        status = 403
+    datos = excepcion.detail if isinstance(excepcion.detail, (list, dict)) else {'detail': excepcion.detail}
+    return _json(datos, status=status)
+
+
+async def _buscar(queryset, pk):
+    # Devuelve (instancia, None) o (None, respuesta 404) con los mismos mensajes que
+    # get_object_or_404 en los viewsets
+    try:
+        instancia = await queryset.filter(pk=pk).afirst()
+    except (TypeError, ValueError):
+        return None, _error(exceptions.NotFound())
+    if instancia is None:
+        mensaje = f'No {queryset.model._meta.object_name} matches the given query.'
+        return None, _error(exceptions.NotFound(mensaje))
+    return instancia, None
+
+
+# GET /api/libros/ (lo arma listado_libros, el mismo que LibroViewSet.list)
+async def libros(request, usuario):
+    etag, actualizado, datos = await sync_to_async(listado_libros)(Request(request), 'json')
+    if etag is None:
+        return _json(datos, status=400)
+
+    async def construir():
+        return _json(await sync_to_async(datos)())
+
+    return await versiones.arespuesta_condicional(request, etag, actualizado, construir)
+
+
+# GET /api/libros/{id}/ (mismo ETag que LibroViewSet.retrieve)
+async def libro(request, usuario, pk):
+    instancia, no_encontrado = await _buscar(Libro.objects.all(), pk)
+    if no_encontrado:
+        return no_encontrado
+    etag = f'"libro-{instancia.pk}-{instancia.version}-json"'
+
+    async def construir():
+        return _json({
+            'mensaje': f'Detalles del libro "{instancia.titulo}"',
+            'libro': LibroSerializer(instancia).data,
+        })
+
+    return await versiones.arespuesta_condicional(request, etag, instancia.actualizado, construir)
+
+
+# GET /api/usuarios/{id}/mis_libros/
+async def mis_libros(request, usuario, pk):
+    if not usuario.is_authenticated:
+        return _error(exceptions.NotAuthenticated())
+    dueno, no_encontrado = await _buscar(User.objects.only('username'), pk)
+    if no_encontrado:
+        return no_encontrado
+    libros_prestados = [
+        libro async for libro in dueno.libros_prestados.values(*serializacion.CAMPOS_LIBRO)
+    ]
+    return _json({
+        'mensaje': f'Se encontraron {len(libros_prestados)} libros prestados a {dueno.username}',
+        'libros': libros_prestados,
+    })
+
+
+# GET /api/usuarios/{id}/prestamos/ (lo arma pagina_historial_api, igual que el viewset)
+async def prestamos(request, usuario, pk):
+    if not usuario.is_authenticated:
+        return _error(exceptions.NotAuthenticated())
+    dueno, no_encontrado = await _buscar(User.objects.only('username'), pk)
+    if no_encontrado:
+        return no_encontrado
+    if not puede_ver_historial(usuario, dueno):
+        return _json({'mensaje': 'No tienes permiso para ver el historial de este usuario'}, status=403)
+
+    datos, codigo = await sync_to_async(pagina_historial_api)(Request(request), dueno)
+    return _json(datos, status=codigo)
+
+
+# Nombre de la ruta generada por el router -> vista asíncrona que la atiende
+VISTAS = {
+    'libro-list': libros,
+    'libro-detail': libro,
+    'usuario-mis-libros': mis_libros,
+    'usuario-prestamos': prestamos,
+}
+
+
+def _asincrona(servir, vista_sincrona):
+    delegar = sync_to_async(vista_sincrona)
+
+    async def vista(request, *args, **kwargs):
+        if request.method not in _METODOS_LECTURA or not _pide_json(request, kwargs):
+            return await delegar(request, *args, **kwargs)
+        kwargs.pop('format', None)
+        try:
+            usuario = await _autenticar(request)
+        except exceptions.APIException as excepcion:
+            return _error(excepcion)
+        return await servir(request, usuario, *args, **kwargs)
+
+    # Los viewsets de DRF están exentos de CSRF (la sesión lo comprueba por su cuenta)
+    return csrf_exempt(vista)
+
+
+def envolver(patrones):
+    # Sustituye las vistas de las rutas de VISTAS, incluidas sus variantes con sufijo
+    # de formato, y deja intactas las demás
+    return [
+        URLPattern(patron.pattern, _asincrona(VISTAS[patron.name], patron.callback), patron.default_args, patron.name)
+        if isinstance(patron, URLPattern) and patron.name in VISTAS else patron
+        for patron in patrones
+    ]
@@ -0,0 +1,30 @@
+import hashlib
+
+from django.core.cache import cache
+
+from gestion.versiones import version_catalogo
+
+# Caché de las páginas públicas del catálogo (listado y búsquedas)
+# Las claves incluyen la versión del catálogo, que cambia con cualquier escritura de un
+# libro (gestion/versiones.py). Una entrada nunca queda desactualizada: tras un cambio
+# simplemente deja de pedirse y el backend la descarta cuando necesita espacio
+# Solo se guarda la parte común a todos los visitantes; lo que depende del usuario
+# (botones de préstamo, acciones de administrador, mensajes, CSRF) se renderiza siempre
+
+
+def clave(nombre, version, *partes):
+    # Resumo las partes variables para que la clave sea válida en cualquier backend
+    resumen = hashlib.sha1('\x1f'.join(str(parte) for parte in partes).encode()).hexdigest()
+    return f'catalogo:{nombre}:v{version}:{resumen}'
+
+
+def obtener_o_calcular(nombre, partes, calcular):
+    # Leo la versión ANTES de calcular: si un cambio llega mientras calculo, el valor
+    # queda guardado con la versión anterior y nunca se sirve como actual
+    version, _ = version_catalogo()
+    entrada = clave(nombre, version, *partes)
+    valor = cache.get(entrada)
+    if valor is None:
+        valor = calcular()
+        cache.set(entrada, valor, timeout=None)
+    return valor
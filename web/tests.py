@@ -0,0 +1,47 @@
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+
+from gestion.busqueda import MAX_TERMINOS_CONSULTA
+from gestion.models import Libro
+
+# Caché del catálogo (web/cache_catalogo.py) vista desde las páginas públicas
+
+
+class CacheCatalogoTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.libro = Libro.objects.create(titulo='La sombra del viento', autor='Carlos Ruiz Zafón', año_publicacion=2001, cantidad_stock=1)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_busqueda_en_cache_solo_lee_la_version(self):
+        self.client.get(reverse('libros-lista'), {'buscar': 'Sombra VIENTO'})
+
+        # Mismos términos en otro orden y sin tildes ni mayúsculas: la misma entrada
+        with self.assertNumQueries(1):
+            respuesta = self.client.get(reverse('libros-lista'), {'buscar': 'viento sombra'})
+        self.assertContains(respuesta, 'La sombra del viento')
+
+    def test_terminos_de_mas_no_cambian_la_clave(self):
+        # buscar_libros ignora los términos a partir de MAX_TERMINOS_CONSULTA y la clave también
+        terminos = ['sombra'] + [f'relleno{i}' for i in range(MAX_TERMINOS_CONSULTA - 1)]
+        self.client.get(reverse('libros-lista'), {'buscar': ' '.join(terminos)})
+
+        with self.assertNumQueries(1):
+            self.client.get(reverse('libros-lista'), {'buscar': ' '.join(terminos + ['otro', 'mas'])})
+
+    def test_cambio_de_libro_invalida_la_entrada(self):
+        self.client.get(reverse('libros-lista'))
+        Libro.objects.get(pk=self.libro.pk).delete()
+
+        respuesta = self.client.get(reverse('libros-lista'))
+
+        self.assertNotContains(respuesta, 'La sombra del viento')
+
+    def test_detalle_sin_cache(self):
+        # Una sola consulta por clave primaria, sin leer la versión del catálogo
+        with self.assertNumQueries(1):
+            respuesta = self.client.get(reverse('libros-detalles', args=[self.libro.pk]))
+        self.assertContains(respuesta, 'La sombra del viento')
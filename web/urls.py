@@ -17,7 +17,12 @@ urlpatterns = [
     path('mis-prestamos/', views.PrestamoListView.as_view(), name='prestamos-listas'),  # Préstamos del usuario
     path('libros/<int:pk>/prestar/', views.PrestamoCreateView.as_view(), name='prestamo-create'),  # Solicitar préstamo
     path('libros/<int:pk>/devolver/', views.PrestamoDevolucionView.as_view(), name='prestamo-devolucion'),  # Devolución
+    path('libros/<int:pk>/reservar/', views.ReservaCreateView.as_view(), name='reserva-create'),  # Entrar en la lista de espera
+    path('libros/<int:pk>/cancelar-reserva/', views.ReservaCancelarView.as_view(), name='reserva-cancelar'),  # Salir de la lista de espera
+    path('mis-reservas/', views.MisReservasView.as_view(), name='mis-reservas'),  # Reservas del usuario
     path('historial-prestamos/', views.HistorialPrestamosView.as_view(), name='historial-prestamos'),  # Historial (admin)
+    path('historial-prestamos/exportar/', views.HistorialPrestamosExportView.as_view(), name='historial-prestamos-exportar'),  # Exportación CSV/NDJSON (admin)
+    path('historial-prestamos/analitica/', views.AnaliticaPrestamosView.as_view(), name='analitica-prestamos'),  # Analítica de préstamos (admin)
     path('mi-historial-prestamos/', views.MiHistorialPrestamosView.as_view(), name='mi-historial-prestamos'),  # Historial personal
     path('administrar-usuarios/', views.AdministrarUsuariosView.as_view(), name='administrar-usuarios'),  # Gestión de usuarios (admin)
     path('usuarios/<int:pk>/eliminar/', views.UsuarioDeleteView.as_view(), name='usuario-delete'),  # Eliminación de usuario (admin)
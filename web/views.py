@@ -1,13 +1,23 @@
-from django.views.generic import ListView, DetailView, CreateView, UpdateView, View
+from django.views.generic import ListView, DetailView, CreateView, UpdateView, TemplateView, View
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.urls import reverse_lazy
 from django.shortcuts import get_object_or_404, redirect, render
+from django.template.loader import render_to_string
 from django.contrib import messages
 from django.contrib.auth import login, logout
 from django.contrib.auth.views import LoginView
-from django.utils import timezone
-from django.db.models import Q
-from gestion.models import Libro, Usuario, Prestamo
+from django.conf import settings
+from django.core.exceptions import BadRequest
+from django.http import Http404, HttpResponseBadRequest, StreamingHttpResponse
+from django.utils.dateparse import parse_date
+from gestion import analitica, archivado, prestamos, reservas
+from gestion.contadores import estadisticas_globales
+from gestion.exportacion import FORMATOS as FORMATOS_EXPORTACION, exportar, filtrar_prestamos
+from gestion.busqueda import buscar_libros, terminos_consulta
+from gestion.prestamos import ResultadoPrestamo
+from gestion.reservas import ResultadoReserva
+from gestion.models import Libro, Usuario, Prestamo, PrestamoArchivado
+from . import cache_catalogo
 from .forms import RegistroUsuarioForm
 
 # Vista principal para mostrar libros.
@@ -20,12 +30,11 @@ class LibroListView(ListView):
     def get_queryset(self):
         # Implementé un buscador que filtra por título o autor, muy útil
         # cuando tenemos muchos libros y el usuario necesita encontrar uno específico
+        # La búsqueda usa el índice invertido de gestion.busqueda (sin tildes ni
+        # mayúsculas) y ordena los resultados por relevancia
         query = self.request.GET.get('buscar', '')
         if query:
-            return Libro.objects.filter(
-                Q(titulo__icontains=query) | 
-                Q(autor__icontains=query)
-            )
+            return buscar_libros(query)
         return Libro.objects.all()
     
     def get_context_data(self, **kwargs):
@@ -33,7 +42,26 @@ class LibroListView(ListView):
         # el valor en la caja de búsqueda después de filtrar
         context = super().get_context_data(**kwargs)
         context['query'] = self.request.GET.get('buscar', '')
+        context['catalogo'] = self.catalogo_en_cache(context['query'])
         return context
+    
+    def catalogo_en_cache(self, query):
+        # Las tarjetas se guardan en la caché del catálogo por consulta normalizada
+        # (mismos términos = mismos resultados) y por tipo de visitante, porque los
+        # administradores ven botones extra; la consulta solo se ejecuta si no hay entrada
+        es_admin = getattr(self.request.user, 'is_admin', False)
+        # terminos_consulta ya recorta a MAX_TERMINOS_CONSULTA, igual que buscar_libros:
+        # los términos de más no cambian los resultados y tampoco la clave
+        partes = ['busqueda', ' '.join(sorted(terminos_consulta(query)))] if query else ['todos']
+        
+        def renderizar():
+            libros = list(self.object_list)
+            return {
+                'cantidad': len(libros),
+                'html': render_to_string('web/libros_tarjetas.html', {'libros': libros, 'es_admin': es_admin}),
+            }
+        
+        return cache_catalogo.obtener_o_calcular('listado', partes + [es_admin], renderizar)
 
 # Vista para mostrar los detalles de un libro específico
 # Incluye información sobre disponibilidad actual
@@ -41,14 +69,20 @@ class LibroDetailView(DetailView):
     model = Libro
     template_name = 'web/libros_detalles.html'
     
+    # Sin caché del catálogo: el libro sale de una consulta por clave primaria, más barata
+    # que leer la versión del catálogo, y casi toda la página depende del usuario
+    
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        libro = self.get_object()
         
-        # Cuento los préstamos activos para mostrar disponibilidad real
+        # Uso el contador del libro para mostrar disponibilidad real sin contar el historial
         # Esto es importante para que el usuario sepa si puede pedir el libro
-        prestamos_activos = Prestamo.objects.filter(libro=libro, devuelto=False).count()
-        context['prestamos_activos'] = prestamos_activos
+        context['prestamos_activos'] = self.object.prestamos_activos
+        
+        # La reserva abierta del lector con su puesto en la cola: fuera de la caché del
+        # catálogo porque es de cada usuario
+        if self.request.user.is_authenticated and not self.request.user.is_admin:
+            context['reserva'] = reservas.reserva_abierta(self.request.user.pk, self.object.pk)
         
         return context
 
@@ -95,79 +129,120 @@ class PrestamoListView(LoginRequiredMixin, ListView):
     context_object_name = 'libros'
 
     def get_queryset(self):
-        # Accedo directamente a los libros prestados del usuario a través de la relación ManyToMany
-        # Esto simplifica mucho el código y aprovecha bien las relaciones del modelo
-        return self.request.user.libros_prestados.all()
+        # Los libros prestados salen de los préstamos sin devolver del usuario
+        # Solo cargo las columnas que muestra la tarjeta del libro
+        return self.request.user.libros_prestados.only('titulo', 'autor', 'año_publicacion')
 
 # Vista para gestionar el préstamo de un libro
 # Incluye validaciones de disponibilidad y estado
 class PrestamoCreateView(LoginRequiredMixin, View):
     def post(self, request, pk):
-        libro = get_object_or_404(Libro, pk=pk)
-        usuario = request.user
+        # El servicio compartido con la API descuenta el stock con una sentencia
+        # condicional dentro de una transacción, así que nunca quedan ejemplares negativos
+        resultado = prestamos.prestar_libro(request.user, pk)
+        
+        if resultado.estado == ResultadoPrestamo.NO_EXISTE:
+            raise Http404("El libro no existe")
         
         # Verifico la disponibilidad de ejemplares antes de procesar el préstamo
         # Esto evita problemas de inventario negativo
-        if libro.cantidad_stock <= 0:
-            messages.error(request, "No hay ejemplares disponibles de este libro.")
+        if resultado.estado == ResultadoPrestamo.SIN_STOCK:
+            messages.error(request, "No hay ejemplares disponibles de este libro. Puedes reservarlo y se te apartará el primero que se devuelva.")
             return redirect('libros-detalles', pk=pk)
         
         # Evito préstamos duplicados para el mismo usuario
         # Un control importante para mantener la integridad de los datos
-        if libro in usuario.libros_prestados.all():
+        if resultado.estado == ResultadoPrestamo.YA_PRESTADO:
             messages.warning(request, "Ya tienes este libro prestado.")
             return redirect('libros-detalles', pk=pk)
         
-        # Realizo el préstamo y actualizo el inventario
-        # Esta operación debe ser atómica para mantener la consistencia
-        usuario.libros_prestados.add(libro)
-        libro.cantidad_stock -= 1
-        libro.save()
-        
-        # Registro en el historial para tener trazabilidad
-        # Este registro es crucial para auditorías y estadísticas
-        Prestamo.objects.create(
-            libro=libro,
-            usuario=usuario
-        )
-        
-        messages.success(request, f"Libro '{libro.titulo}' prestado exitosamente.")
+        messages.success(request, f"Libro '{resultado.libro.titulo}' prestado exitosamente.")
         return redirect('prestamos-listas')
 
 # Vista para procesar la devolución de un libro
 # Actualiza el estado del préstamo y el inventario
 class PrestamoDevolucionView(LoginRequiredMixin, View):
     def post(self, request, pk):
-        libro = get_object_or_404(Libro, pk=pk)
-        usuario = request.user
+        # La devolución, el inventario y el historial se actualizan juntos
+        # en el servicio compartido para mantener sincronizados los tres estados
+        resultado = prestamos.devolver_libro(request.user, pk)
+        
+        if resultado.estado == ResultadoPrestamo.NO_EXISTE:
+            raise Http404("El libro no existe")
         
         # Verifico que el usuario tenga efectivamente el libro
         # Esta validación es importante para evitar inconsistencias
-        if libro not in usuario.libros_prestados.all():
+        if resultado.estado == ResultadoPrestamo.NO_PRESTADO:
             messages.error(request, "No tienes este libro prestado.")
             return redirect('prestamos-listas')
         
-        # Proceso la devolución actualizando la relación y el inventario
-        # Es importante mantener sincronizados estos dos estados
-        usuario.libros_prestados.remove(libro)
-        libro.cantidad_stock += 1
-        libro.save()
+        messages.success(request, f"Libro '{resultado.libro.titulo}' devuelto exitosamente.")
+        return redirect('prestamos-listas')
+
+# Vistas de la lista de espera (gestion/reservas.py)
+# Reservar un libro agotado sustituye a volver a mirar la ficha hasta que haya stock:
+# el ejemplar devuelto se aparta para el primero de la cola y aparece en Mis Reservas
+class ReservaCreateView(LoginRequiredMixin, View):
+    def post(self, request, pk):
+        # Misma regla que los préstamos: los administradores no piden libros
+        if request.user.is_admin:
+            messages.error(request, "Solo los usuarios regulares pueden reservar libros.")
+            return redirect('libros-detalles', pk=pk)
         
-        # Actualizo el registro histórico para completar el ciclo del préstamo
-        # Usamos first() porque solo debería haber un préstamo activo por libro y usuario
-        prestamo = Prestamo.objects.filter(
-            libro=libro,
-            usuario=usuario,
-            devuelto=False
-        ).first()
+        resultado = reservas.reservar(request.user, pk)
         
-        if prestamo:
-            prestamo.devuelto = True
-            prestamo.fecha_devolucion = timezone.now()
-            prestamo.save()
+        if resultado.estado == ResultadoReserva.NO_EXISTE:
+            raise Http404("El libro no existe")
         
-        messages.success(request, f"Libro '{libro.titulo}' devuelto exitosamente.")
-        return redirect('prestamos-listas')
+        if resultado.estado == ResultadoReserva.HAY_STOCK:
+            messages.info(request, "Hay ejemplares disponibles: puedes pedir el préstamo directamente.")
+        elif resultado.estado == ResultadoReserva.YA_PRESTADO:
+            messages.warning(request, "Ya tienes este libro prestado.")
+        elif resultado.estado == ResultadoReserva.YA_RESERVADO:
+            messages.warning(request, "Ya tienes una reserva de este libro.")
+        else:
+            messages.success(request, "Reserva creada: te apartaremos el primer ejemplar que se devuelva.")
+        return redirect('libros-detalles', pk=pk)
+
+class ReservaCancelarView(LoginRequiredMixin, View):
+    def post(self, request, pk):
+        resultado = reservas.cancelar(request.user, pk)
+        
+        if resultado.estado == ResultadoReserva.NO_EXISTE:
+            raise Http404("El libro no existe")
+        
+        if resultado.estado == ResultadoReserva.NO_RESERVADO:
+            messages.error(request, "No tienes una reserva abierta de este libro.")
+        else:
+            messages.success(request, "Reserva cancelada.")
+        return redirect('mis-reservas')
+
+# Reservas del usuario: las abiertas con su puesto en la cola y las últimas resueltas
+class MisReservasView(LoginRequiredMixin, TemplateView):
+    template_name = 'web/mis_reservas.html'
+    max_resueltas = 20  # Las resueltas solo se muestran como referencia
+    
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        todas = reservas.reservas_usuario(self.request.user.pk)
+        context['abiertas'] = list(todas.filter(estado__in=reservas.ABIERTAS))
+        context['resueltas'] = list(todas.exclude(estado__in=reservas.ABIERTAS)[:self.max_resueltas])
+        return context
+
+# Con ?completo=1 las páginas de historial añaden los préstamos archivados
+# (gestion/archivado.py); sin él solo leen Prestamo: activos y devueltos recientes
+def pide_historial_completo(request):
+    return request.GET.get('completo') == '1'
+
+# Página del historial completo que sigue al cursor ?antes=; cada página lee como mucho
+# PAGINA_HISTORIAL + 1 filas de cada tabla, así que el archivo nunca se carga entero
+def pagina_historial_completo(request, consultas):
+    antes = request.GET.get('antes')
+    try:
+        antes = archivado.leer_cursor(antes) if antes else None
+    except ValueError:
+        raise BadRequest("El parámetro 'antes' no es un cursor válido")
+    return archivado.pagina_historial(consultas, settings.ARCHIVADO['PAGINA_HISTORIAL'], antes)
 
 # Vista administrativa para ver el historial de préstamos
 # Muestra estadísticas y todos los registros de préstamos
@@ -181,12 +256,99 @@ class HistorialPrestamosView(LoginRequiredMixin, UserPassesTestMixin, ListView):
         # Este tipo de datos es sensible y requiere control de acceso
         return self.request.user.is_admin
     
+    def get_queryset(self):
+        # Traigo libro y usuario en la misma consulta (JOIN) en lugar de una consulta por fila
+        # y solo las columnas que pinta la tabla del historial
+        # Con el historial completo, la misma consulta sobre el archivo y las dos se mezclan
+        # de página en página
+        columnas = ('fecha_prestamo', 'fecha_devolucion', 'devuelto', 'libro__titulo', 'usuario__username')
+        recientes = Prestamo.objects.select_related('libro', 'usuario').only(*columnas)
+        self.siguiente = None
+        if not pide_historial_completo(self.request):
+            return recientes
+        pagina, self.siguiente = pagina_historial_completo(
+            self.request, [recientes, PrestamoArchivado.objects.select_related('libro', 'usuario').only(*columnas)],
+        )
+        return pagina
+    
     def get_context_data(self, **kwargs):
         # Añado contadores para estadísticas que ayudan en la toma de decisiones
         # Me gusta tener métricas a simple vista en el panel de administración
+        # Los contadores globales se leen de unas pocas filas, no del historial completo
+        context = super().get_context_data(**kwargs)
+        estadisticas = estadisticas_globales()
+        context['prestamos_totales'] = estadisticas['totales']
+        context['prestamos_activos'] = estadisticas['activos']
+        context['prestamos_devueltos'] = estadisticas['devueltos']
+        context['completo'] = pide_historial_completo(self.request)
+        context['siguiente'] = self.siguiente
+        return context
+
+# Vista para exportar el historial de préstamos completo para auditorías
+# Devuelve CSV o NDJSON en streaming: las filas se envían a medida que se leen por lotes
+# Filtros opcionales: ?formato=csv|ndjson&desde=AAAA-MM-DD&hasta=AAAA-MM-DD&usuario=id&libro=id
+class HistorialPrestamosExportView(LoginRequiredMixin, UserPassesTestMixin, View):
+    def test_func(self):
+        return self.request.user.is_admin
+    
+    def get(self, request):
+        formato = request.GET.get('formato', 'csv')
+        if formato not in FORMATOS_EXPORTACION:
+            return HttpResponseBadRequest("Formato no válido. Usa 'csv' o 'ndjson'")
+        
+        filtros = {}
+        for campo in ('desde', 'hasta'):
+            valor = request.GET.get(campo)
+            if valor:
+                try:
+                    filtros[campo] = parse_date(valor)
+                except ValueError:
+                    filtros[campo] = None
+                if filtros[campo] is None:
+                    return HttpResponseBadRequest(f"Fecha '{campo}' no válida. Usa el formato AAAA-MM-DD")
+        for campo in ('usuario', 'libro'):
+            valor = request.GET.get(campo)
+            if valor:
+                if not valor.isdigit():
+                    return HttpResponseBadRequest(f"El parámetro '{campo}' debe ser un id numérico")
+                filtros[f'{campo}_id'] = int(valor)
+        
+        prestamos = filtrar_prestamos(**filtros)
+        respuesta = StreamingHttpResponse(
+            exportar(prestamos, formato),
+            content_type='text/csv; charset=utf-8' if formato == 'csv' else 'application/x-ndjson; charset=utf-8',
+        )
+        respuesta['Content-Disposition'] = f'attachment; filename="historial_prestamos.{formato}"'
+        return respuesta
+
+# Vista de analítica de préstamos para administradores: préstamos por día, libros más
+# prestados del mes, duración media y vencidos
+# Se lee de los resúmenes de gestion/analitica.py, así que no recorre el historial
+# Parámetros opcionales: ?dias=30&mes=AAAA-MM&limite=10 (los mismos que /api/analitica/)
+class AnaliticaPrestamosView(LoginRequiredMixin, UserPassesTestMixin, TemplateView):
+    template_name = 'web/analitica_prestamos.html'
+    
+    def test_func(self):
+        return self.request.user.is_admin
+    
+    def get(self, request, *args, **kwargs):
+        opciones, errores = analitica.leer_parametros(request.GET)
+        if errores:
+            campo, mensajes = next(iter(errores.items()))
+            return HttpResponseBadRequest(f"Parámetro '{campo}' no válido: {mensajes[0]}")
+        self.opciones = opciones
+        return super().get(request, *args, **kwargs)
+    
+    def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['prestamos_activos'] = Prestamo.objects.filter(devuelto=False).count()
-        context['prestamos_devueltos'] = Prestamo.objects.filter(devuelto=True).count()
+        datos = analitica.resumen(**self.opciones)
+        # La barra más larga de la serie diaria ocupa todo el ancho
+        maximo = max((dia['prestamos'] for dia in datos['por_dia']), default=0) or 1
+        for dia in datos['por_dia']:
+            dia['porcentaje'] = round(dia['prestamos'] * 100 / maximo)
+        context['analitica'] = datos
+        context['dias'] = self.opciones['dias']
+        context['sin_resumenes'] = analitica.sin_resumenes()
         return context
 
 # Vista para que un usuario vea su historial personal de préstamos
@@ -199,20 +361,32 @@ class MiHistorialPrestamosView(LoginRequiredMixin, ListView):
     def get_queryset(self):
         # Filtro préstamos por el usuario actual para mostrar solo su actividad
         # Ordenados por fecha para ver primero los más recientes
-        return Prestamo.objects.filter(usuario=self.request.user).order_by('-fecha_prestamo')
+        # El libro viene en el mismo JOIN para no hacer una consulta por tarjeta
+        # Con ?completo=1 se añaden sus préstamos archivados, ya en el mismo orden y
+        # de página en página
+        consultas = [
+            tabla.objects.filter(usuario=self.request.user)
+            .select_related('libro')
+            .only('fecha_prestamo', 'fecha_devolucion', 'devuelto', 'libro__titulo', 'libro__autor')
+            .order_by('-fecha_prestamo')
+            for tabla in (Prestamo, PrestamoArchivado)
+        ]
+        self.siguiente = None
+        if not pide_historial_completo(self.request):
+            return consultas[0]
+        pagina, self.siguiente = pagina_historial_completo(self.request, consultas)
+        return pagina
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         # Añado contadores personales para que el usuario vea su actividad de un vistazo
         # Esto mejora significativamente la experiencia de usuario
-        context['prestamos_activos'] = Prestamo.objects.filter(
-            usuario=self.request.user, 
-            devuelto=False
-        ).count()
-        context['prestamos_devueltos'] = Prestamo.objects.filter(
-            usuario=self.request.user,
-            devuelto=True
-        ).count()
+        # Salen de los contadores del usuario, así que no se recorre su historial
+        usuario = self.request.user
+        context['prestamos_activos'] = usuario.prestamos_activos
+        context['prestamos_devueltos'] = usuario.prestamos_totales - usuario.prestamos_activos
+        context['completo'] = pide_historial_completo(self.request)
+        context['siguiente'] = self.siguiente
         return context
 
 # Vista para eliminar libros con verificaciones de seguridad
@@ -312,7 +486,8 @@ class AdministrarUsuariosView(LoginRequiredMixin, UserPassesTestMixin, ListView)
     def get_queryset(self):
         # Me aseguro de obtener la lista actualizada después de eliminar un usuario
         # Esto evita mostrar datos obsoletos después de cambios
-        return Usuario.objects.all()
+        # Solo cargo los campos que muestra la tarjeta de cada usuario (sin contraseña, etc.)
+        return Usuario.objects.only('username', 'email', 'rol', 'date_joined').order_by('pk')
     
     def post(self, request):
         # Identifico la acción a realizar según los parámetros del formulario
@@ -339,6 +514,7 @@ class AdministrarUsuariosView(LoginRequiredMixin, UserPassesTestMixin, ListView)
                 nuevo_rol = request.POST.get('nuevo_rol')
                 if nuevo_rol in dict(Usuario.ROLES).keys():
                     usuario.rol = nuevo_rol
+                    # Al guardar el nuevo rol se revocan sus tokens JWT (gestion/signals.py)
                     usuario.save()
                     messages.success(request, f"Rol de usuario {usuario.username} actualizado a {dict(Usuario.ROLES)[nuevo_rol]}")
                     